@@ -1,14 +1,21 @@
 import cProfile
+import hmac
 import pstats
 import time
 import json
 from datetime import datetime
 import logging
-from io import StringIO
 from functools import wraps
 from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+from vitals_data_retrieving.vitals_data_retrieving_metrics import metrics_registry, summarize_histogram, \
+    MULTIPROCESS_DIR
 from opencensus.ext.azure.log_exporter import AzureLogHandler
-from flask import Blueprint, Response
+from flask import Blueprint, Response, jsonify, request
+from user_metrics_tracker import user_tracker
+from sampling_profiler import sampling_profiler, profiler_settings
+from vitals_data_retrieving.vitals_data_retrieving_memory import memory_tracker
+from vitals_data_retrieving.data_consumption_tools.Entities.WriteBehind import write_behind_stats
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import scheduler_stats
 import os
 
 # Configurar logging
@@ -21,10 +28,17 @@ if os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING'):
         connection_string=os.environ['APPLICATIONINSIGHTS_CONNECTION_STRING']
     ))
 
+# Métricas Prometheus (en modo multiproceso se expone el valor más reciente de los workers vivos)
+algorithm_time_gauge = Gauge('algorithm_execution_time_seconds', 'Execution time per algorithm', ['method'],
+                             multiprocess_mode='livemostrecent')
+algorithm_success_gauge = Gauge('algorithm_success', 'Success rate per algorithm', ['method'],
+                                multiprocess_mode='livemostrecent')
+
 class RealAlgorithmProfiler:
     def __init__(self):
         self.results = {}
-        self.profiler = cProfile.Profile()
+        # Con cprofile_enabled=False solo se mide el tiempo (modo de bajo coste para tráfico real)
+        self.cprofile_enabled = os.environ.get('PROFILER_CPROFILE', 'true').lower() in ('1', 'true', 'yes')
         
     def profile_method(self, method_name):
         #"""Decorador para profilear métodos específicos"""
@@ -33,7 +47,14 @@ class RealAlgorithmProfiler:
             def wrapper(*args, **kwargs):
                 print(f"🔍 Profileando: {method_name}")
                 
-                self.profiler.enable()
+                # Un Profile por llamada: las estadísticas no se acumulan entre llamadas ni se mezclan entre hilos
+                call_profiler = cProfile.Profile() if self.cprofile_enabled else None
+                if call_profiler is not None:
+                    try:
+                        call_profiler.enable()
+                    except ValueError:
+                        # Otro profiler ya está activo (p. ej. sys.monitoring en Python 3.12+): solo se mide el tiempo
+                        call_profiler = None
                 start_time = time.time()
                 
                 try:
@@ -46,16 +67,11 @@ class RealAlgorithmProfiler:
                     success = False
                     logger.error(f"Error en {method_name}: {e}")
                 
-                self.profiler.disable()
-                
-                # Obtener estadísticas de profiling
-                s = StringIO()
-                ps = pstats.Stats(self.profiler, stream=s)
-                ps.strip_dirs().sort_stats('cumulative')
-                profile_stats = s.getvalue()
-                
-                # Extraer métricas clave
-                stats_summary = self._extract_profile_metrics(profile_stats)
+                if call_profiler is not None:
+                    call_profiler.disable()
+                    stats_summary = self._extract_profile_metrics(pstats.Stats(call_profiler))
+                else:
+                    stats_summary = {}
                 
                 # Guardar resultados
                 self.results[method_name] = {
@@ -70,53 +86,50 @@ class RealAlgorithmProfiler:
                     'profile_summary': stats_summary,
                     'error': str(e) if not success else None
                 }
+                # Se publica al registrar el resultado para que el scrape de cualquier worker lo vea
+                algorithm_time_gauge.labels(method_name).set(execution_time)
+                algorithm_success_gauge.labels(method_name).set(1 if success else 0)
                 
                 print(f"✅ {method_name}: {execution_time:.4f}s | Success: {success}")
                 return result
             return wrapper
         return decorator
     
-    def _extract_profile_metrics(self, profile_output):
-        #"""Extrae métricas clave del output de profiling"""
-        lines = profile_output.split('\n')
+    def _extract_profile_metrics(self, stats):
+        #"""Extrae métricas clave de pstats.Stats leyendo su diccionario, sin renderizar ni parsear texto"""
+        # stats.stats: (archivo, línea, función) -> (llamadas primitivas, llamadas, tiempo propio, tiempo acumulado, ...)
+        entries = stats.stats
         metrics = {
-            'total_calls': 0,
-            'primitive_calls': 0,
-            'total_time': 0,
-            'cumulative_time': 0,
+            'total_calls': sum(nc for _, nc, _, _, _ in entries.values()),
+            'primitive_calls': sum(cc for cc, _, _, _, _ in entries.values()),
+            'total_time': stats.total_tt,
+            'cumulative_time': max((ct for _, _, _, ct, _ in entries.values()), default=0),
             'top_functions': []
         }
         
-        for line in lines:
-            if 'function calls' in line:
-                # Ejemplo: "123456 function calls (12345 primitive calls) in 0.890 seconds"
-                parts = line.split()
-                if len(parts) >= 6:
-                    metrics['total_calls'] = int(parts[0])
-                    metrics['primitive_calls'] = int(parts[3])
-                    metrics['total_time'] = float(parts[-2])
-            elif line.strip() and not line.startswith('Ordered by') and 'ncalls' not in line:
-                # Líneas de funciones individuales
-                parts = line.split()
-                if len(parts) >= 5:
-                    try:
-                        func_info = {
-                            'calls': parts[0],
-                            'total_time': float(parts[3]),
-                            'per_call': float(parts[4]),
-                            'function_name': ' '.join(parts[5:])
-                        }
-                        metrics['top_functions'].append(func_info)
-                    except (ValueError, IndexError):
-                        continue
-        
-        # Mantener solo top 10 funciones
-        metrics['top_functions'] = metrics['top_functions'][:10]
+        # Top 10 funciones por tiempo acumulado
+        top = sorted(entries.items(), key=lambda item: item[1][3], reverse=True)[:10]
+        for (filename, line, function_name), (cc, nc, tt, ct, _) in top:
+            metrics['top_functions'].append({
+                'calls': nc if cc == nc else f"{nc}/{cc}",
+                'total_time': tt,
+                'cumulative_time': ct,
+                'per_call': ct / cc if cc else 0,
+                'function_name': f"{os.path.basename(filename)}:{line}({function_name})"
+            })
         return metrics
 
 # Instancia global del profiler
 profiler = RealAlgorithmProfiler()
 
+
+def apply_cprofile_settings(settings, previous):
+    if 'cprofile' in settings:
+        profiler.cprofile_enabled = bool(settings['cprofile'])
+
+
+profiler_settings.on_change(apply_cprofile_settings)
+
 # Importar y profilear las clases REALES de tu proyecto
 try:
     from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.FitbitDataRetriever import FitbitDataRetriever
@@ -224,32 +237,27 @@ def analyze_service_initialization():
     return init_services()
 
 def analyze_memory_usage():
-    #"""Analiza uso de memoria de los algoritmos"""
-    import psutil
-    import os
+    #"""Analiza las asignaciones de memoria del parseo/serialización de payloads intradía reales con tracemalloc"""
+    from mock_fitbit_server import render_payload
+    from vitals_data_retrieving.vitals_data_retrieving_memory import memory_tracker
     
     @profiler.profile_method("memory_usage_analysis")
     def memory_analysis():
-        process = psutil.Process(os.getpid())
-        
-        # Medir memoria antes
-        memory_before = process.memory_info().rss / 1024 / 1024  # MB
-        
-        # Ejecutar algunas operaciones
-        operations = []
-        for i in range(1000):
-            operations.append({"data": "test" * 100, "index": i})
-        
-        # Medir memoria después
-        memory_after = process.memory_info().rss / 1024 / 1024  # MB
-        memory_increase = memory_after - memory_before
-        
-        return {
-            "memory_before_mb": memory_before,
-            "memory_after_mb": memory_after,
-            "memory_increase_mb": memory_increase,
-            "operations_count": len(operations)
-        }
+        was_enabled = memory_tracker.enabled
+        memory_tracker.enable()
+        try:
+            # Payload de ritmo cardiaco de un día completo (86.400 puntos), como lo devuelve Fitbit
+            raw_payload = render_payload('heart_rate', 42, '2024-01-15', '1sec')
+            for _ in range(3):
+                with memory_tracker.track('analysis:json_parse:heart_rate'):
+                    payload = json.loads(raw_payload)
+                with memory_tracker.track('analysis:json_serialize:heart_rate'):
+                    json.dumps(payload)
+            report = memory_tracker.report()
+            return {label: stats for label, stats in report['labels'].items() if label.startswith('analysis:')}
+        finally:
+            if not was_enabled:
+                memory_tracker.disable()
     
     return memory_analysis()
 
@@ -324,15 +332,6 @@ def main():
     print("🎯 REAL ALGORITHM PERFORMANCE ANALYSIS - SMIEAE")
     print("=" * 70)
     
-    # Instalar psutil si no está disponible
-    try:
-        import psutil
-    except ImportError:
-        print("Instalando psutil para análisis de memoria...")
-        import subprocess
-        subprocess.check_call(['pip', 'install', 'psutil'])
-        import psutil
-    
     # Ejecutar análisis de diferentes componentes
     print("\n1. 🚀 ANALIZANDO COMPONENTES DEL PROYECTO...")
     
@@ -387,13 +386,133 @@ def main():
 if __name__ == "__main__":
     main()
 
-# Métricas Prometheus
-algorithm_time_gauge = Gauge('algorithm_execution_time_seconds', 'Execution time per algorithm', ['method'])
-algorithm_success_gauge = Gauge('algorithm_success', 'Success rate per algorithm', ['method'])
-
 @performance_bp.route('/performance_metrics')
 def get_performance_metrics():
-    for method, data in profiler.results.items():
-        algorithm_time_gauge.labels(method).set(data['execution_time'])
-        algorithm_success_gauge.labels(method).set(1 if data['success'] else 0)
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
\ No newline at end of file
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+@performance_bp.route('/user_operations')
+def get_user_operations():
+    # Resumen en streaming por operación y últimas operaciones del buffer circular.
+    # Con varios workers el resumen sale del histograma agregado; las operaciones recientes son las de este worker
+    limit = request.args.get('limit', 100, type=int)
+    if MULTIPROCESS_DIR:
+        summary = summarize_histogram('vitals_user_operation_duration_seconds', 'operation', 'success')
+    else:
+        summary = user_tracker.summary()
+    return jsonify({
+        'summary': summary,
+        'aggregated_workers': bool(MULTIPROCESS_DIR),
+        'worker_pid': os.getpid(),
+        'recent_operations': user_tracker.recent(limit)
+    })
+
+
+def admin_required(view):
+    #"""Protege los endpoints de administración con el token PROFILER_ADMIN_TOKEN (cabecera X-Admin-Token)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_token = os.environ.get('PROFILER_ADMIN_TOKEN')
+        if not admin_token:
+            return jsonify({"error": "Admin endpoints are disabled, PROFILER_ADMIN_TOKEN is not set"}), 403
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+            return jsonify({"error": "Invalid admin token"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@performance_bp.route('/profiler', methods=['GET'])
+@admin_required
+def get_profiler_status():
+    # El muestreo y las pilas son de este worker; los ajustes publicados se aplican en todos
+    profiler_settings.sync()
+    return jsonify({
+        'sampling': sampling_profiler.status(),
+        'cprofile_enabled': profiler.cprofile_enabled,
+        'shared_settings': profiler_settings.current(),
+        'worker_pid': os.getpid()
+    })
+
+@performance_bp.route('/profiler', methods=['POST'])
+@admin_required
+def configure_profiler():
+    # Activa/desactiva en caliente el muestreo y el cProfile por llamada: {"sampling": true, "hz": 100, "cprofile": false}
+    # Los ajustes se publican para todos los workers, que los aplican en su siguiente petición
+    data = request.get_json(silent=True) or {}
+    hz = data.get('hz')
+    if hz is not None and (not isinstance(hz, (int, float)) or not 1 <= hz <= 1000):
+        return jsonify({"error": "hz must be a number between 1 and 1000"}), 400
+    updates = {key: data[key] for key in ('hz',) if data.get(key) is not None}
+    if isinstance(data.get('sampling'), bool):
+        updates['sampling'] = data['sampling']
+    if 'cprofile' in data:
+        updates['cprofile'] = bool(data['cprofile'])
+    if data.get('reset'):
+        updates['reset'] = profiler_settings.read().get('reset', 0) + 1
+    profiler_settings.publish(updates)
+    return get_profiler_status()
+
+@performance_bp.route('/profiler/flamegraph')
+@admin_required
+def get_flamegraph():
+    # Pilas colapsadas de este worker (flamegraph.pl, speedscope); ?endpoint= filtra por endpoint
+    collapsed = sampling_profiler.collapsed(request.args.get('endpoint'))
+    return Response(collapsed, mimetype='text/plain')
+
+@performance_bp.route('/memory', methods=['GET'])
+@admin_required
+def get_memory_report():
+    # Memoria neta y pico por bloque instrumentado (make_data_query, decode_data, parseo JSON, bucles batch, requests)
+    return jsonify({**memory_tracker.report(), 'worker_pid': os.getpid()})
+
+@performance_bp.route('/memory', methods=['POST'])
+@admin_required
+def configure_memory_tracking():
+    # Activa/desactiva tracemalloc en caliente: {"enabled": true, "frames": 10, "snapshot_every": 0, "baseline": true}
+    data = request.get_json(silent=True) or {}
+    frames = data.get('frames')
+    if frames is not None and (not isinstance(frames, int) or not 1 <= frames <= 100):
+        return jsonify({"error": "frames must be an integer between 1 and 100"}), 400
+    snapshot_every = data.get('snapshot_every')
+    if snapshot_every is not None and (not isinstance(snapshot_every, int) or snapshot_every < 0):
+        return jsonify({"error": "snapshot_every must be a non-negative integer"}), 400
+    if data.get('reset'):
+        memory_tracker.reset()
+    if data.get('enabled') is True:
+        memory_tracker.enable(frames, snapshot_every)
+    elif data.get('enabled') is False:
+        memory_tracker.disable()
+    # Baseline para comparar después con /memory/snapshot?since_baseline=1 (p. ej. al empezar el batch nocturno)
+    if data.get('baseline') and not memory_tracker.take_baseline():
+        return jsonify({"error": "Memory tracking is disabled"}), 409
+    return get_memory_report()
+
+@performance_bp.route('/memory/snapshot')
+@admin_required
+def get_memory_snapshot():
+    # Mayores sitios de asignación vivos del worker (o los que más crecieron desde el baseline con since_baseline=1);
+    # ?group_by=lineno|filename|traceback&limit=20. Bloquea el worker unos segundos con heaps grandes
+    group_by = request.args.get('group_by', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({"error": "group_by must be lineno, filename or traceback"}), 400
+    if not memory_tracker.enabled:
+        return jsonify({"error": "Memory tracking is disabled"}), 409
+    limit = request.args.get('limit', 20, type=int)
+    since_baseline = request.args.get('since_baseline', '').lower() in ('1', 'true', 'yes')
+    return jsonify({
+        'top_allocations': memory_tracker.top_allocations(limit, group_by, since_baseline),
+        'since_baseline': since_baseline,
+        'worker_pid': os.getpid()
+    })
+
+@performance_bp.route('/write_behind')
+def get_write_behind_stats():
+    # Documentos de vitales pendientes de escribir en la base de datos y escritos/fallidos por este worker
+    # (el agregado de todos los workers está en vitals_write_behind_* de /performance_metrics)
+    return jsonify({**write_behind_stats(), 'worker_pid': os.getpid()})
+
+
+@performance_bp.route('/scheduler')
+def get_scheduler_stats():
+    # Llamadas a Fitbit y a la base de datos en curso y en espera por clase de prioridad en este worker, y usuarios
+    # cuyo lote se aplaza por estar cerca del límite de peticiones (el tiempo de espera está en
+    # vitals_scheduler_wait_seconds de /performance_metrics)
+    return jsonify({**scheduler_stats(), 'worker_pid': os.getpid()})
\ No newline at end of file
@@ -1,12 +1,20 @@
 from vitals_data_retrieving.vitals_data_retrieving_controller import vitals_data_retrieving_api
+from vitals_data_retrieving.vitals_data_retrieving_metrics import register_request_metrics
+from vitals_data_retrieving.vitals_data_retrieving_memory import register_memory_tracking
+from vitals_data_retrieving.vitals_data_retrieving_tracing import register_tracing
 from flask import Flask, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 from algorithm_profiler import performance_bp
+from sampling_profiler import register_sampling_profiler
 import os
 import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
 app = Flask(__name__)
+register_tracing(app)
+register_request_metrics(app)
+register_sampling_profiler(app)
+register_memory_tracking(app)
 app.register_blueprint(performance_bp, url_prefix='/metrics')
 cors = CORS(app, resources={r"/vitals_data_retrieving/*": {"origins": "*"}})
 
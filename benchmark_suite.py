@@ -0,0 +1,307 @@
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Suite de benchmarks de los caminos críticos reales (consulta a Fitbit, cifrado de tokens, base de datos de vitales
+# y la ingesta diaria completa) contra el mock local de Fitbit. Compara con un baseline guardado y marca como
+# regresión cualquier benchmark cuya mediana empeore más que el umbral.
+#
+#   python benchmark_suite.py                    # ejecuta y compara con benchmark_baseline.json
+#   python benchmark_suite.py --save-baseline    # ejecuta y guarda el resultado como nuevo baseline
+#   python benchmark_suite.py --storage sqlite   # benchmarks de base de datos sobre SQLite (memory, sqlite o mongo)
+#
+# Con --storage mongo los benchmarks de base de datos usan un MongoDB local (BENCHMARK_CONNECTION_STRING, por defecto
+# mongodb://localhost:27017) y una base de datos propia que se borra al terminar; si no se indica --storage se usa
+# MongoDB cuando hay servidor y el backend en memoria cuando no. SQLite usa un fichero temporal.
+
+DEFAULT_THRESHOLD = float(os.environ.get('BENCHMARK_REGRESSION_THRESHOLD', 0.10))
+BENCHMARK_DATE = '2024-01-15'
+ALL_SCOPES = ["sleep", "heart_rate", "heart_rate_variability", "breathing_rate", "spO2", "activity"]
+
+# Variables que leen las clases del servicio; se fijan antes de importarlas para no tocar datos reales
+os.environ.setdefault('CIPHER_KEY', base64.b64encode(os.urandom(32)).decode())
+os.environ['CONNECTION_STRING'] = os.environ.get('BENCHMARK_CONNECTION_STRING', 'mongodb://localhost:27017')
+os.environ['DATABASE_NAME'] = os.environ.get('BENCHMARK_DATABASE_NAME', 'vitals_benchmark')
+os.environ['COLLECTION_NAME'] = 'benchmark_users'
+os.environ['VITALS_COLLECTION'] = 'benchmark_vitals'
+os.environ['BATCH_COLLECTION'] = 'benchmark_batch_runs'
+os.environ['BATCH_CHECKPOINTS_COLLECTION'] = 'benchmark_batch_checkpoints'
+
+import pymongo  # noqa: E402
+from flask import Flask  # noqa: E402
+from mock_fitbit_server import MockFitbitServer, render_payload  # noqa: E402
+from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import prepare_data, decode_data  # noqa: E402
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import users_database, vitals_database, \
+    batch_database  # noqa: E402
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import identity_map  # noqa: E402
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.FitbitDataRetriever import \
+    FitbitDataRetriever  # noqa: E402
+
+
+class BenchmarkCase:
+    """Un benchmark: setup (no medido) antes de cada repetición, la función medida y un teardown opcional."""
+
+    def __init__(self, name, function, setup=None, teardown=None, warmup=2, repeat=10, operations=1):
+        self.name = name
+        self.function = function
+        self.setup = setup
+        self.teardown = teardown
+        self.warmup = warmup
+        self.repeat = repeat
+        self.operations = operations
+
+    def run(self):
+        timings = []
+        for iteration in range(self.warmup + self.repeat):
+            state = self.setup() if self.setup else None
+            start = time.perf_counter()
+            self.function(state) if self.setup else self.function()
+            elapsed = time.perf_counter() - start
+            if self.teardown:
+                self.teardown(state)
+            if iteration >= self.warmup:
+                timings.append(elapsed)
+        return summarize(timings, self.operations)
+
+
+def summarize(timings, operations):
+    ordered = sorted(timings)
+    quartiles = statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    median = statistics.median(ordered)
+    return {
+        'runs': len(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': statistics.fmean(ordered),
+        'median': median,
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'iqr': quartiles[2] - quartiles[0],
+        'p95': ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        'operations': operations,
+        'median_per_operation': median / operations
+    }
+
+
+def mongo_available():
+    try:
+        client = pymongo.MongoClient(os.environ['CONNECTION_STRING'], serverSelectionTimeoutMS=1000)
+        client.server_info()
+        return client
+    except pymongo.errors.PyMongoError:
+        return None
+
+
+def build_cases(mock_url, storage, user_counts, repeat):
+    app = Flask(__name__)
+    retriever = FitbitDataRetriever(mock_url)
+    cases = []
+
+    # make_data_query con N scopes (sin almacenamiento): petición, parseo y serialización de la respuesta
+    for scope_count in (1, 3, len(ALL_SCOPES)):
+        scope = ALL_SCOPES[:scope_count]
+
+        def query(scope=scope):
+            with app.app_context():
+                _, status = retriever.make_data_query('benchmark-user', 'benchmark-token', BENCHMARK_DATE, scope)
+            assert status == 200, f"make_data_query answered {status}"
+
+        cases.append(BenchmarkCase(f"make_data_query[scopes={scope_count}]", query, repeat=repeat))
+
+    # Cifrado/descifrado de tokens por lotes
+    for batch_size in (10, 100, 1000):
+        user_ids = [f"benchmark-user-{i}" for i in range(batch_size)]
+        documents = []
+        for user_id in user_ids:
+            hashed_id, token, refresh_token = prepare_data(user_id, f"token-{user_id}", f"refresh-{user_id}")
+            documents.append({'_id': hashed_id, 'token': token, 'refresh_token': refresh_token})
+
+        def prepare_batch(user_ids=user_ids):
+            for user_id in user_ids:
+                prepare_data(user_id, f"token-{user_id}", f"refresh-{user_id}")
+
+        def decode_batch(documents=documents):
+            for document in documents:
+                decode_data(document)
+
+        cases.append(BenchmarkCase(f"prepare_data[batch={batch_size}]", prepare_batch, repeat=repeat,
+                                   operations=batch_size))
+        cases.append(BenchmarkCase(f"decode_data[batch={batch_size}]", decode_batch, repeat=repeat,
+                                   operations=batch_size))
+
+    if storage is None:
+        return cases
+
+    # Los repositorios de MongoDB no saben vaciarse: se vacían sus colecciones (de la base de datos propia de los
+    # benchmarks) con un cliente aparte; los de memoria y SQLite lo hacen con delete_all_documents
+    database = None
+    if storage == 'mongo':
+        database = pymongo.MongoClient(os.environ['CONNECTION_STRING'])[os.environ['DATABASE_NAME']]
+        database[os.environ['VITALS_COLLECTION']].create_index([('user_id', 1), ('date', 1)])
+
+    def wipe(repository, *collections):
+        if database is None:
+            repository.delete_all_documents()
+            return
+        for collection in collections:
+            database[os.environ[collection]].delete_many({})
+
+    payload = {scope: json.loads(render_payload(scope, 42, BENCHMARK_DATE, *levels))
+               for scope, levels in (('sleep', ()), ('heart_rate', ('1sec',)), ('heart_rate_variability', ()),
+                                     ('breathing_rate', ()), ('spO2', ()), ('activity', ('1min',)))}
+    users = users_database()
+    vitals = vitals_database()
+
+    # Inserción y lectura de un día completo (≈86.400 puntos de ritmo cardiaco)
+    def empty_vitals():
+        wipe(vitals, 'VITALS_COLLECTION')
+        return identity_map.key_for('benchmark-insert')
+
+    cases.append(BenchmarkCase(
+        f"vitals_db[{storage}].insert_document[full_day]",
+        lambda user_key: vitals.insert_document(user_key, BENCHMARK_DATE, payload),
+        setup=empty_vitals, repeat=repeat))
+
+    # El benchmark de inserción vacía la colección, así que el documento de lectura se crea al preparar cada lectura
+    def stored_day():
+        user_key = identity_map.key_for('benchmark-read')
+        if vitals.read_user_day(user_key, BENCHMARK_DATE, ['breathing_rate'])[1] is None:
+            vitals.insert_document(user_key, BENCHMARK_DATE, payload)
+        return user_key
+
+    for scope in (['breathing_rate'], ['heart_rate'], None):
+        label = ','.join(scope) if scope else 'all'
+
+        def read_day(user_key, scope=scope):
+            response_code, data = vitals.read_user_day(user_key, BENCHMARK_DATE, scope)
+            assert data, f"read_user_day answered {response_code}"
+
+        cases.append(BenchmarkCase(f"vitals_db[{storage}].read_user_day[scope={label}]", read_day, setup=stored_day,
+                                   repeat=repeat))
+
+    # Ingesta diaria completa: usuarios en la base de datos, datos desde el mock y almacenamiento. Se borran los
+    # leases de la ejecución anterior para que cada repetición vuelva a procesar todos los shards
+    for user_count in user_counts:
+        def seed_users(user_count=user_count):
+            wipe(users, 'COLLECTION_NAME')
+            wipe(vitals, 'VITALS_COLLECTION')
+            wipe(batch_database(), 'BATCH_COLLECTION', 'BATCH_CHECKPOINTS_COLLECTION')
+            for i in range(user_count):
+                users.insert_document(f"daily-user-{i}", f"token-{i}", f"refresh-{i}")
+
+        def daily(_):
+            with app.app_context():
+                _, status = retriever.get_daily_vitals_data(BENCHMARK_DATE)
+            assert status == 200, f"get_daily_vitals_data answered {status}"
+
+        cases.append(BenchmarkCase(f"get_daily_vitals_data[{storage},users={user_count}]", daily, setup=seed_users,
+                                   warmup=1, repeat=max(1, repeat // (1 + user_count // 100)),
+                                   operations=user_count))
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Compara las medianas con el baseline; devuelve las regresiones encontradas."""
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            stats['change'] = None
+            continue
+        change = stats['median'] / reference['median'] - 1
+        stats['change'] = change
+        # Se exige que también el mínimo empeore para no marcar ruido de una ejecución puntual
+        if change > threshold and stats['min'] > reference['min'] * (1 + threshold / 2):
+            regressions.append({'benchmark': name, 'baseline_median': reference['median'],
+                                'median': stats['median'], 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de los caminos críticos del servicio")
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--save-baseline', action='store_true', help="Guarda los resultados como nuevo baseline")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Empeoramiento relativo de la mediana que se considera regresión (0.10 = 10%%)")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--filter', help="Solo benchmarks cuyo nombre contenga este texto")
+    parser.add_argument('--mock-latency-ms', type=float, default=0,
+                        help="Latencia simulada de Fitbit (0 mide solo el coste propio del servicio)")
+    parser.add_argument('--storage', choices=('mongo', 'sqlite', 'memory'),
+                        help="Backend de almacenamiento (por defecto mongo si hay servidor, memory si no)")
+    args = parser.parse_args()
+
+    mongo_client = mongo_available() if args.storage in (None, 'mongo') else None
+    storage = args.storage or ('mongo' if mongo_client is not None else 'memory')
+    if storage == 'mongo' and mongo_client is None:
+        print(f"⚠️ MongoDB no disponible en {os.environ['CONNECTION_STRING']}: se omiten los benchmarks de base de datos")
+        storage = None
+    elif storage == 'sqlite':
+        sqlite_dir = tempfile.TemporaryDirectory()
+        os.environ['SQLITE_PATH'] = os.path.join(sqlite_dir.name, 'benchmark.db')
+    if storage:
+        os.environ['STORAGE_BACKEND'] = storage
+        print(f"🗄️  Almacenamiento: {storage}")
+
+    results = {}
+    with MockFitbitServer(latency_ms=args.mock_latency_ms, rate_limit=10 ** 9) as mock:
+        try:
+            for case in build_cases(mock.url, storage, args.users, args.repeat):
+                if args.filter and args.filter not in case.name:
+                    continue
+                print(f"⏱️  {case.name} ...", end=' ', flush=True)
+                results[case.name] = case.run()
+                print(f"mediana {results[case.name]['median'] * 1000:.2f} ms "
+                      f"(±{results[case.name]['iqr'] * 1000:.2f} IQR)")
+        finally:
+            if mongo_client is not None:
+                mongo_client.drop_database(os.environ['DATABASE_NAME'])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'threshold': args.threshold,
+        'storage': storage,
+        'baseline': args.baseline if baseline else None,
+        'results': results,
+        'regressions': regressions
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "=" * 88)
+    print(f"{'Benchmark':<58}{'Mediana (ms)':>15}{'vs baseline':>15}")
+    print("=" * 88)
+    for name, stats in results.items():
+        change = f"{stats['change'] * 100:+.1f}%" if stats.get('change') is not None else 'nuevo'
+        print(f"{name:<58}{stats['median'] * 1000:>15.2f}{change:>15}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'timestamp': report['timestamp'], 'python': report['python'], 'results': results}, f, indent=2)
+        print(f"\n💾 Baseline guardado en {args.baseline}")
+
+    if regressions:
+        print(f"\n🔴 {len(regressions)} REGRESIONES (umbral {args.threshold * 100:.0f}%):")
+        for regression in regressions:
+            print(f"   {regression['benchmark']}: {regression['change'] * 100:+.1f}%")
+        return 1
+    print("\n🟢 Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import argparse
+import sys
+import time
+
+from vitals_data_retrieving.vitals_data_retrieving_export import VitalsExporter, METRICS
+
+# Exporta los vitales guardados a un dataset Parquet para análisis (una fila por muestra, columnas tipadas y
+# comprimidas), particionado por métrica y fecha. Solo se exportan los días nuevos: el manifiesto _manifest.json del
+# directorio de salida guarda los días ya exportados. El día en curso no se exporta porque aún se está descargando.
+#
+#   python export_vitals.py                                   # días pendientes, con el backend de STORAGE_BACKEND
+#   python export_vitals.py --dates 2024-01-15 --force        # vuelve a exportar un día, reemplazando sus ficheros
+#   python export_vitals.py --metrics heart_rate hrv          # solo algunas métricas
+#
+# Lectura desde pandas: pd.read_parquet('vitals_export/metric=heart_rate', filters=[('date', '>=', '2024-01-01')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta los vitales guardados a Parquet")
+    parser.add_argument('--output', help="Directorio del dataset (por defecto EXPORT_PATH o vitals_export)")
+    parser.add_argument('--dates', nargs='+', help="Días a exportar en formato YYYY-MM-DD (por defecto los pendientes)")
+    parser.add_argument('--force', action='store_true', help="Exporta de nuevo los días ya exportados")
+    parser.add_argument('--metrics', nargs='+', choices=list(METRICS), help="Métricas a exportar (por defecto todas)")
+    parser.add_argument('--compression', help="Códec de compresión de Parquet (por defecto EXPORT_COMPRESSION o zstd)")
+    args = parser.parse_args()
+
+    exporter = VitalsExporter(args.output, metrics=args.metrics, compression=args.compression)
+    dates = args.dates or exporter.pending_dates()
+    if not dates:
+        print(f"🟢 No hay días pendientes de exportar en {exporter.root}")
+        return 0
+
+    print(f"📦 Exportando {len(dates)} días a {exporter.root}")
+    start = time.perf_counter()
+    summary = {}
+    for date in dates:
+        summary.update(exporter.export([date], force=args.force))
+        if date in summary:
+            rows = sum(summary[date]['rows'].values())
+            print(f"   {date}: {summary[date]['documents']} documentos, {rows} filas")
+        else:
+            print(f"   {date}: ya exportado (usa --force para reemplazarlo)")
+    print(f"\n✅ {len(summary)} días exportados en {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
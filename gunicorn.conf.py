@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+
+# Configuración de gunicorn: gunicorn --config gunicorn.conf.py app:app
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+# Las métricas de prometheus_client se escriben en ficheros mmap compartidos para que cualquier worker que atienda
+# el scrape devuelva la suma de todos. La variable debe existir antes de que los workers importen prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'vitals_prometheus_multiproc'))
+
+
+def on_starting(server):
+    # Los ficheros de una ejecución anterior sumarían valores de procesos que ya no existen
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    # Los ajustes del profiler de una ejecución anterior no se heredan
+    from sampling_profiler import PROFILER_STATE_FILE
+    if os.path.exists(PROFILER_STATE_FILE):
+        os.remove(PROFILER_STATE_FILE)
+
+
+def child_exit(server, worker):
+    # Los gauges 'live*' de un worker muerto dejan de contarse
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,12 @@
 import requests
+import queue
+import threading
 import time
 import json
 import bson
 from datetime import datetime
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 import os
 
 def convert_objectid(obj):
@@ -16,9 +19,91 @@ def convert_objectid(obj):
         return [convert_objectid(i) for i in obj]
     return obj
 
+class MetricsWriter:
+    """
+    Escritor en segundo plano de métricas hacia MongoDB.
+
+    record_metric solo encola la métrica (sin esperar a la BD); un hilo la agrupa y la guarda con insert_many cuando
+    se juntan batch_size métricas o pasan flush_interval segundos. La cola está acotada: si la BD va lenta y se llena,
+    las métricas nuevas se descartan y se cuentan en 'dropped' en lugar de frenar las peticiones que se miden.
+    """
+
+    _STOP = object()
+
+    def __init__(self, collection, batch_size=500, flush_interval=2.0, max_queue=10000):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._drop_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, metric):
+        try:
+            self._queue.put_nowait(metric)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            # Copias: insert_many añade _id a los documentos y las métricas originales siguen en el reporte
+            self.collection.insert_many([dict(metric) for metric in batch], ordered=False)
+            self.written += len(batch)
+        except PyMongoError as e:
+            self.failed += len(batch)
+            print(f" Error guardando {len(batch)} métricas en MongoDB: {e}")
+
+    def close(self, timeout=30):
+        """Guarda las métricas pendientes y detiene el hilo."""
+        if not self._thread.is_alive():
+            return
+        # put bloqueante: el centinela no se puede descartar aunque la cola esté llena
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'failed': self.failed,
+                'pending': self._queue.qsize()}
+
+
 class LiveMetricsCollector:
-    def __init__(self, azure_url):
+    def __init__(self, azure_url, pool_size=10, timeout=10, verbose=True, batch_size=500, flush_interval=2.0,
+                 max_queue=10000):
         self.azure_url = azure_url
+        self.timeout = timeout
+        self.verbose = verbose
+        # Sesión compartida: reutiliza conexiones (keep-alive) en lugar de abrir una por petición
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # record_metric puede llamarse desde varios hilos (load_generator.py)
+        self._metrics_lock = threading.Lock()
         self.metrics = {
             'start_time': datetime.now().isoformat(),
             'requests': [],
@@ -30,6 +115,7 @@ class LiveMetricsCollector:
         db_name = os.getenv("DATABASE_NAME") or os.getenv("MONGODB_DB_NAME") or "vitals_db"
         self.mongo_client = None
         self.mongo_db = None
+        self.writer = None
         self.mongo_collection_name = os.getenv("COLLECTION_NAME") or "metrics_user_live"
 
         if conn_str:
@@ -38,6 +124,8 @@ class LiveMetricsCollector:
                     # Forzar server_info para validar conexión
                     self.mongo_client.server_info()
                     self.mongo_db = self.mongo_client[db_name]
+                    self.writer = MetricsWriter(self.mongo_db[self.mongo_collection_name], batch_size=batch_size,
+                                                flush_interval=flush_interval, max_queue=max_queue)
                 except Exception as e:
                     print(f"⚠️ No se pudo conectar a MongoDB/CosmosDB al iniciar: {e}")
                     self.mongo_client = None
@@ -67,103 +155,53 @@ class LiveMetricsCollector:
     
     def test_get_user_info(self, user_id):
         #Test endpoint get_user_info
-        start_time = time.time()
-        try:
-            response = requests.post(
-                f"{self.azure_url}/vitals_data_retrieving/get_user_info",
-                json={"user_id": user_id},
-                timeout=10
-            )
-            execution_time = time.time() - start_time
-            
-            self.record_metric(
-                user_id=user_id,
-                operation='get_user_info',
-                execution_time=execution_time,
-                success=response.status_code == 200,
-                status_code=response.status_code
-            )
-            
-            print(f"   ✅ get_user_info: {execution_time:.3f}s - Status: {response.status_code}")
-            
-        except Exception as e:
-            execution_time = time.time() - start_time
-            self.record_metric(
-                user_id=user_id,
-                operation='get_user_info',
-                execution_time=execution_time,
-                success=False,
-                error=str(e)
-            )
-            print(f"   ❌ get_user_info: Error - {e}")
+        return self._timed_request(user_id, 'get_user_info', 'POST', '/vitals_data_retrieving/get_user_info',
+                                   json={"user_id": user_id})
     
     def test_get_vitals_data(self, user_id):
         #Test endpoint get_vitals_data
-        start_time = time.time()
-        try:
-            response = requests.post(
-                f"{self.azure_url}/vitals_data_retrieving/get_vitals_data",
-                json={
-                    "user_id": user_id,
-                    "date": "2024-01-15",
-                    "scope": ["heart_rate", "sleep"],
-                    "db_storage": False
-                },
-                timeout=10
-            )
-            execution_time = time.time() - start_time
-            
-            self.record_metric(
-                user_id=user_id,
-                operation='get_vitals_data',
-                execution_time=execution_time,
-                success=response.status_code == 200,
-                status_code=response.status_code
-            )
-            
-            print(f"   ✅ get_vitals_data: {execution_time:.3f}s - Status: {response.status_code}")
-            
-        except Exception as e:
-            execution_time = time.time() - start_time
-            self.record_metric(
-                user_id=user_id,
-                operation='get_vitals_data',
-                execution_time=execution_time,
-                success=False,
-                error=str(e)
-            )
-            print(f"   ❌ get_vitals_data: Error - {e}")
+        return self._timed_request(user_id, 'get_vitals_data', 'POST', '/vitals_data_retrieving/get_vitals_data',
+                                   json={
+                                       "user_id": user_id,
+                                       "date": "2024-01-15",
+                                       "scope": ["heart_rate", "sleep"],
+                                       "db_storage": False
+                                   })
     
     def test_connect_to_api(self, user_id):
         #Test endpoint connect_to_api
-        start_time = time.time()
+        return self._timed_request(user_id, 'connect_to_api', 'GET', '/vitals_data_retrieving/connect_to_api')
+    
+    def _timed_request(self, user_id, operation, method, path, json=None):
+        #Ejecuta una petición con la sesión compartida, la mide y registra la métrica
+        start_time = time.perf_counter()
         try:
-            response = requests.get(
-                f"{self.azure_url}/vitals_data_retrieving/connect_to_api",
-                timeout=10
-            )
-            execution_time = time.time() - start_time
+            response = self.session.request(method, f"{self.azure_url}{path}", json=json, timeout=self.timeout)
+            execution_time = time.perf_counter() - start_time
             
-            self.record_metric(
+            metric = self.record_metric(
                 user_id=user_id,
-                operation='connect_to_api',
+                operation=operation,
                 execution_time=execution_time,
                 success=response.status_code == 200,
                 status_code=response.status_code
             )
             
-            print(f"   ✅ connect_to_api: {execution_time:.3f}s - Status: {response.status_code}")
+            if self.verbose:
+                print(f"   ✅ {operation}: {execution_time:.3f}s - Status: {response.status_code}")
             
         except Exception as e:
-            execution_time = time.time() - start_time
-            self.record_metric(
+            execution_time = time.perf_counter() - start_time
+            metric = self.record_metric(
                 user_id=user_id,
-                operation='connect_to_api',
+                operation=operation,
                 execution_time=execution_time,
                 success=False,
                 error=str(e)
             )
-            print(f"   ❌ connect_to_api: Error - {e}")
+            if self.verbose:
+                print(f"   ❌ {operation}: Error - {e}")
+        return metric
     
     def record_metric(self, user_id, operation, execution_time, success, status_code=None, error=None):
         #Registra métricas individuales
@@ -177,32 +215,39 @@ class LiveMetricsCollector:
             'error': error
         }
         
-        self.metrics['requests'].append(metric)
-        
-        # Actualizar actividad por usuario
-        if user_id not in self.metrics['user_activity']:
-            self.metrics['user_activity'][user_id] = {
-                'operations': 0,
-                'total_time': 0,
-                'successful_operations': 0
-            }
-        
-        user_activity = self.metrics['user_activity'][user_id]
-        user_activity['operations'] += 1
-        user_activity['total_time'] += execution_time
-        
-        if success:
-            user_activity['successful_operations'] += 1
+        with self._metrics_lock:
+            self.metrics['requests'].append(metric)
+            
+            # Actualizar actividad por usuario
+            if user_id not in self.metrics['user_activity']:
+                self.metrics['user_activity'][user_id] = {
+                    'operations': 0,
+                    'total_time': 0,
+                    'successful_operations': 0
+                }
+            
+            user_activity = self.metrics['user_activity'][user_id]
+            user_activity['operations'] += 1
+            user_activity['total_time'] += execution_time
+            
+            if success:
+                user_activity['successful_operations'] += 1
         
-        #Intentar guardar en MongoDB sino log
-        if self.mongo_db:
-            try:
-                col = self.mongo_db[self.mongo_collection_name]
-                col.insert_one(metric)
-            except Exception as e:
-                print(f" Error guardando métrica en MongoDB: {e}")
-        else:
-            pass 
+        #Encolar para guardar en MongoDB en segundo plano (no se espera a la BD en el camino medido)
+        if self.writer is not None:
+            self.writer.submit(metric)
+        return metric
+
+    def close(self):
+        #Guarda las métricas pendientes en MongoDB y cierra conexiones
+        if self.writer is not None:
+            self.writer.close()
+            stats = self.writer.stats()
+            if stats['dropped'] or stats['failed']:
+                print(f"⚠️ Métricas no guardadas en MongoDB: {stats['dropped']} descartadas, {stats['failed']} con error")
+        self.session.close()
+        if self.mongo_client is not None:
+            self.mongo_client.close()
 
     def generate_live_report(self):
         #Generar reporte en tiempo real
@@ -230,6 +275,7 @@ class LiveMetricsCollector:
                 'requests_per_second': total_requests / ((datetime.now() - datetime.fromisoformat(self.metrics['start_time'])).total_seconds() or 1)
             },
             'user_activity': self.metrics['user_activity'],
+            'persistence': self.writer.stats() if self.writer is not None else None,
             'detailed_requests': self.metrics['requests'][-100:]  # Últimas 100 requests
         }
         
@@ -252,6 +298,7 @@ if __name__ == "__main__":
     collector.simulate_user_activity(3)
     
     # Generar reporte
+    collector.close()
     report = collector.generate_live_report()
     
     print(f"\n📊 REPORTE FINAL:")
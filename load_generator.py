@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from live_user_metrics import LiveMetricsCollector, convert_objectid
+
+# Mezcla por defecto de operaciones (pesos relativos)
+DEFAULT_MIX = {'get_user_info': 3, 'get_vitals_data': 5, 'connect_to_api': 2}
+PERCENTILES = (50, 90, 95, 99)
+
+
+class LoadGenerator:
+    """
+    Generador de carga sobre LiveMetricsCollector.
+
+    Modelo cerrado: virtual_users usuarios concurrentes, cada uno lanza una operación, espera la respuesta y un
+    think time exponencial, y repite. Modelo abierto: las peticiones llegan como un proceso de Poisson a arrival_rate
+    por segundo sin esperar a las anteriores, que es como se comporta el tráfico real frente a un servicio saturado.
+    En ambos modelos la carga sube linealmente durante ramp_up segundos.
+
+    La latencia se mide desde el instante en que la petición debía salir, de modo que la espera por falta de
+    conexiones libres también cuenta (sin "coordinated omission").
+    """
+
+    def __init__(self, collector, virtual_users=10, duration=60, ramp_up=10, model='closed', arrival_rate=None,
+                 think_time=1.0, mix=None, max_concurrency=None):
+        if model not in ('closed', 'open'):
+            raise ValueError("model debe ser 'closed' u 'open'")
+        if model == 'open' and not arrival_rate:
+            raise ValueError("el modelo abierto necesita arrival_rate")
+
+        self.collector = collector
+        self.virtual_users = virtual_users
+        self.duration = duration
+        self.ramp_up = min(ramp_up, duration)
+        self.model = model
+        self.arrival_rate = arrival_rate
+        self.think_time = think_time
+        self.mix = mix or DEFAULT_MIX
+        self.max_concurrency = max_concurrency or virtual_users
+        self.operations = {
+            'get_user_info': collector.test_get_user_info,
+            'get_vitals_data': collector.test_get_vitals_data,
+            'connect_to_api': collector.test_connect_to_api
+        }
+        unknown = set(self.mix) - set(self.operations)
+        if unknown:
+            raise ValueError(f"Operaciones desconocidas en la mezcla: {sorted(unknown)}")
+        self._names = list(self.mix)
+        self._weights = [self.mix[name] for name in self._names]
+        self.samples = []
+
+    def run(self):
+        """Ejecuta la prueba y devuelve el reporte."""
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='virtual-user')
+        self._start = time.perf_counter()
+        self._end = self._start + self.duration
+        try:
+            if self.model == 'closed':
+                await asyncio.gather(*(self._virtual_user(loop, executor, index)
+                                       for index in range(self.virtual_users)))
+            else:
+                await self._open_arrivals(loop, executor)
+        finally:
+            executor.shutdown(wait=True)
+        return self.report()
+
+    def _pick_operation(self):
+        return random.choices(self._names, weights=self._weights)[0]
+
+    async def _request(self, loop, executor, user_id, scheduled_at):
+        operation = self._pick_operation()
+        metric = await loop.run_in_executor(executor, self.operations[operation], user_id)
+        finished_at = time.perf_counter()
+        self.samples.append({
+            'operation': operation,
+            'latency': finished_at - scheduled_at,
+            'service_time': metric['execution_time'],
+            'success': metric['success'],
+            'status_code': metric['status_code'],
+            'finished_at': finished_at - self._start
+        })
+
+    async def _virtual_user(self, loop, executor, index):
+        # Arranque escalonado durante el ramp-up
+        await asyncio.sleep(self.ramp_up * index / self.virtual_users)
+        user_id = f"test_user_{index + 1}"
+        while time.perf_counter() < self._end:
+            await self._request(loop, executor, user_id, time.perf_counter())
+            if self.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.think_time))
+
+    async def _open_arrivals(self, loop, executor):
+        tasks = set()
+        next_arrival = self._start
+        while True:
+            elapsed = next_arrival - self._start
+            # Tasa creciente durante el ramp-up (mínimo 1% para no quedarse esperando al principio)
+            rate = self.arrival_rate * (min(1.0, max(0.01, elapsed / self.ramp_up)) if self.ramp_up else 1.0)
+            next_arrival += random.expovariate(rate)
+            if next_arrival >= self._end:
+                break
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            user_id = f"test_user_{random.randint(1, self.virtual_users)}"
+            task = asyncio.create_task(self._request(loop, executor, user_id, next_arrival))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def report(self):
+        """Throughput, tasa de éxito y percentiles de latencia, globales y por operación."""
+        wall_time = max((sample['finished_at'] for sample in self.samples), default=0) or self.duration
+
+        def summarize(samples):
+            if not samples:
+                return {'requests': 0}
+            latencies = np.array([sample['latency'] for sample in samples])
+            service_times = np.array([sample['service_time'] for sample in samples])
+            successes = sum(1 for sample in samples if sample['success'])
+            status_codes = {}
+            for sample in samples:
+                key = str(sample['status_code'] or 'error')
+                status_codes[key] = status_codes.get(key, 0) + 1
+            return {
+                'requests': len(samples),
+                'throughput_rps': len(samples) / wall_time,
+                'success_rate': successes / len(samples) * 100,
+                'latency': {
+                    'mean': float(latencies.mean()),
+                    'max': float(latencies.max()),
+                    **{f"p{p}": float(value) for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))}
+                },
+                'service_time_p95': float(np.percentile(service_times, 95)),
+                'status_codes': status_codes
+            }
+
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'target': self.collector.azure_url,
+            'config': {
+                'model': self.model,
+                'virtual_users': self.virtual_users,
+                'arrival_rate': self.arrival_rate,
+                'duration_seconds': self.duration,
+                'ramp_up_seconds': self.ramp_up,
+                'think_time_seconds': self.think_time,
+                'max_concurrency': self.max_concurrency,
+                'mix': self.mix
+            },
+            'wall_time_seconds': wall_time,
+            'overall': summarize(self.samples),
+            'per_operation': {
+                name: summarize([sample for sample in self.samples if sample['operation'] == name])
+                for name in self._names
+            }
+        }
+
+
+def parse_mix(value):
+    # "get_user_info=3,get_vitals_data=5,connect_to_api=2"
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generador de carga para el Vitals Data Consumption Service")
+    parser.add_argument('--url', default=os.getenv("AZURE_APP_URL", "http://127.0.0.1:5000"))
+    parser.add_argument('--users', type=int, default=10, help="Usuarios virtuales (modelo cerrado) o pool de IDs")
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--ramp-up', type=float, default=10)
+    parser.add_argument('--model', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--rate', type=float, help="Llegadas por segundo (modelo abierto)")
+    parser.add_argument('--think-time', type=float, default=1.0, help="Think time medio en segundos (modelo cerrado)")
+    parser.add_argument('--concurrency', type=int, help="Peticiones simultáneas máximas (por defecto --users)")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument('--output', default='load_test_report.json')
+    args = parser.parse_args()
+
+    concurrency = args.concurrency or args.users
+    collector = LiveMetricsCollector(args.url, pool_size=concurrency, verbose=False)
+    generator = LoadGenerator(collector, virtual_users=args.users, duration=args.duration, ramp_up=args.ramp_up,
+                              model=args.model, arrival_rate=args.rate, think_time=args.think_time, mix=args.mix,
+                              max_concurrency=concurrency)
+
+    print(f"🎯 PRUEBA DE CARGA ({args.model}) contra {args.url}")
+    print("=" * 60)
+    try:
+        report = generator.run()
+    finally:
+        collector.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(convert_objectid(report), f, indent=2)
+
+    overall = report['overall']
+    print(f"\n📊 RESULTADOS ({report['wall_time_seconds']:.1f}s):")
+    print(f"   📨 Total requests: {overall['requests']}")
+    if overall['requests']:
+        print(f"   🚀 Throughput: {overall['throughput_rps']:.2f} req/s")
+        print(f"   ✅ Tasa de éxito: {overall['success_rate']:.1f}%")
+        latency = overall['latency']
+        print(f"   ⏱️  p50 {latency['p50']:.3f}s | p95 {latency['p95']:.3f}s | p99 {latency['p99']:.3f}s")
+    print(f"\n💾 Reporte guardado en {args.output}")
@@ -0,0 +1,426 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import date as date_type, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+# Servidor local que imita la Web API de Fitbit (endpoints de DataEndpointsEnum + OAuth) para hacer benchmarks
+# reproducibles sin depender de api.fitbit.com. El servicio lo usa con FITBIT_API_BASE_URL=http://127.0.0.1:<puerto>.
+
+DEFAULT_CONFIG = {
+    'latency_ms': float(os.environ.get('MOCK_FITBIT_LATENCY_MS', 50)),       # latencia media añadida
+    'latency_jitter': float(os.environ.get('MOCK_FITBIT_LATENCY_JITTER', 0.3)),  # sigma de la log-normal
+    'error_rate': float(os.environ.get('MOCK_FITBIT_ERROR_RATE', 0)),         # fracción de 500/503
+    'unauthorized_rate': float(os.environ.get('MOCK_FITBIT_UNAUTHORIZED_RATE', 0)),  # fracción de 401
+    'rate_limit': int(os.environ.get('MOCK_FITBIT_RATE_LIMIT', 150)),         # peticiones por token y ventana
+    'rate_limit_window': float(os.environ.get('MOCK_FITBIT_RATE_LIMIT_WINDOW', 3600)),
+    'strict_tokens': os.environ.get('MOCK_FITBIT_STRICT_TOKENS', '').lower() in ('1', 'true', 'yes'),
+    'seed': int(os.environ.get('MOCK_FITBIT_SEED', 42)),
+}
+# Claves de /mock/config que ejecutan una acción en vez de cambiar un ajuste
+CONFIG_ACTIONS = {'reset_rate_limits'}
+
+HEART_RATE_LEVELS = {'1sec': 1, '1min': 60, '5min': 300, '15min': 900}
+STEP_LEVELS = {'1min': 60, '5min': 300, '15min': 900}
+SLEEP_LEVELS = ('wake', 'light', 'deep', 'rem')
+
+
+@lru_cache(maxsize=1)
+def seconds_of_day():
+    # Las 86.400 marcas 'HH:MM:SS' se formatean una sola vez
+    return [f"{second // 3600:02d}:{second % 3600 // 60:02d}:{second % 60:02d}" for second in range(86400)]
+
+
+def rng_for(*parts):
+    # Mismo usuario/fecha/escala -> mismos datos en todas las ejecuciones
+    return np.random.default_rng(zlib.crc32('|'.join(map(str, parts)).encode()))
+
+
+def parse_window(start_time, end_time, interval):
+    start = int(start_time[:2]) * 3600 + int(start_time[3:5]) * 60 if start_time else 0
+    end = int(end_time[:2]) * 3600 + int(end_time[3:5]) * 60 + 59 if end_time else 86399
+    return start // interval, end // interval + 1
+
+
+def heart_rate_payload(seed, date, level, start_time=None, end_time=None):
+    rng = rng_for(seed, 'heart_rate', date)
+    seconds = np.arange(86400)
+    # Ritmo circadiano (mínimo de madrugada), actividad durante el día y ruido
+    circadian = 68 + 10 * np.sin((seconds / 86400 - 0.3) * 2 * np.pi)
+    activity = np.where((seconds > 7 * 3600) & (seconds < 22 * 3600), rng.gamma(1.5, 4, 86400), 0)
+    bpm = np.clip(circadian + activity + rng.normal(0, 2, 86400), 40, 190)
+
+    interval = HEART_RATE_LEVELS[level]
+    values = bpm.reshape(-1, interval).mean(axis=1).round().astype(int)
+    first, last = parse_window(start_time, end_time, interval)
+    times = seconds_of_day()[::interval]
+    dataset = [{'time': times[i], 'value': int(values[i])} for i in range(first, min(last, len(values)))]
+
+    resting = int(np.percentile(bpm, 5))
+    zones = [('Out of Range', 30, 98), ('Fat Burn', 98, 137), ('Cardio', 137, 166), ('Peak', 166, 220)]
+    return {
+        'activities-heart': [{
+            'dateTime': date,
+            'value': {
+                'customHeartRateZones': [],
+                'heartRateZones': [
+                    {'name': name, 'min': low, 'max': high,
+                     'minutes': int(((bpm >= low) & (bpm < high)).sum() // 60),
+                     'caloriesOut': round(float(((bpm >= low) & (bpm < high)).sum()) / 60 * 1.1, 2)}
+                    for name, low, high in zones
+                ],
+                'restingHeartRate': resting
+            }
+        }],
+        'activities-heart-intraday': {
+            'dataset': dataset,
+            'datasetInterval': interval // 60 or 1,
+            'datasetType': 'second' if interval < 60 else 'minute'
+        }
+    }
+
+
+def steps_payload(seed, date, level, start_time=None, end_time=None):
+    rng = rng_for(seed, 'activity', date)
+    minutes = np.arange(1440)
+    awake = (minutes > 7 * 60) & (minutes < 22 * 60)
+    steps = np.where(awake & (rng.random(1440) < 0.35), rng.poisson(45, 1440), 0)
+
+    interval = STEP_LEVELS[level]
+    values = steps.reshape(-1, interval // 60).sum(axis=1)
+    first, last = parse_window(start_time, end_time, interval)
+    times = seconds_of_day()[::interval]
+    dataset = [{'time': times[i], 'value': int(values[i])} for i in range(first, min(last, len(values)))]
+    return {
+        'activities-steps': [{'dateTime': date, 'value': str(int(steps.sum()))}],
+        'activities-steps-intraday': {'dataset': dataset, 'datasetInterval': interval // 60, 'datasetType': 'minute'}
+    }
+
+
+def sleep_window(seed, date):
+    # Sesión principal: empieza la noche anterior entre las 22:30 y las 00:30 y dura 6-9 h
+    rng = rng_for(seed, 'sleep_window', date)
+    start = datetime.fromisoformat(date) - timedelta(minutes=int(rng.integers(-30, 90)))
+    return start, start + timedelta(minutes=int(rng.integers(360, 540)))
+
+
+def sleep_payload(seed, date):
+    rng = rng_for(seed, 'sleep', date)
+    start, end = sleep_window(seed, date)
+    stages, current = [], start
+    transitions = {'wake': [0.1, 0.8, 0.05, 0.05], 'light': [0.1, 0.4, 0.3, 0.2],
+                   'deep': [0.05, 0.6, 0.3, 0.05], 'rem': [0.15, 0.6, 0.05, 0.2]}
+    level = 'wake'
+    while current < end:
+        seconds = min(int(rng.integers(4, 40)) * 60, int((end - current).total_seconds()))
+        stages.append({'dateTime': current.strftime('%Y-%m-%dT%H:%M:%S.000'), 'level': level, 'seconds': seconds})
+        current += timedelta(seconds=seconds)
+        level = SLEEP_LEVELS[rng.choice(4, p=transitions[level])]
+
+    summary = {}
+    for level in SLEEP_LEVELS:
+        level_stages = [stage for stage in stages if stage['level'] == level]
+        summary[level] = {'count': len(level_stages), 'minutes': sum(s['seconds'] for s in level_stages) // 60,
+                          'thirtyDayAvgMinutes': int(rng.integers(20, 200))}
+    time_in_bed = int((end - start).total_seconds() // 60)
+    minutes_awake = summary['wake']['minutes']
+    return {
+        'sleep': [{
+            'dateOfSleep': date,
+            'duration': time_in_bed * 60000,
+            'efficiency': round(100 * (time_in_bed - minutes_awake) / time_in_bed),
+            'startTime': start.strftime('%Y-%m-%dT%H:%M:%S.000'),
+            'endTime': end.strftime('%Y-%m-%dT%H:%M:%S.000'),
+            'isMainSleep': True,
+            'levels': {'data': stages, 'shortData': [], 'summary': summary},
+            'logId': zlib.crc32(f"{seed}{date}".encode()),
+            'logType': 'auto_detected',
+            'minutesAfterWakeup': 0,
+            'minutesAsleep': time_in_bed - minutes_awake,
+            'minutesAwake': minutes_awake,
+            'minutesToFallAsleep': 0,
+            'timeInBed': time_in_bed,
+            'type': 'stages'
+        }],
+        'summary': {
+            'stages': {level: summary[level]['minutes'] for level in ('deep', 'light', 'rem', 'wake')},
+            'totalMinutesAsleep': time_in_bed - minutes_awake,
+            'totalSleepRecords': 1,
+            'totalTimeInBed': time_in_bed
+        }
+    }
+
+
+def hrv_payload(seed, date):
+    # HRV por bloques de 5 minutos durante el sueño principal
+    rng = rng_for(seed, 'hrv', date)
+    start, end = sleep_window(seed, date)
+    count = int((end - start).total_seconds() // 300)
+    rmssd = np.clip(rng.normal(38, 8, count), 10, 120)
+    minutes = [{
+        'minute': (start + timedelta(minutes=5 * i)).strftime('%Y-%m-%dT%H:%M:%S.000'),
+        'value': {'rmssd': round(float(rmssd[i]), 3), 'coverage': round(float(rng.uniform(0.85, 1)), 3),
+                  'hf': round(float(rng.uniform(100, 900)), 3), 'lf': round(float(rng.uniform(100, 1200)), 3)}
+    } for i in range(count)]
+    return {'hrv': [{'minutes': minutes, 'dateTime': date}]}
+
+
+def breathing_rate_payload(seed, date):
+    rng = rng_for(seed, 'br', date)
+    rates = {stage: round(float(rng.normal(15, 1.2)), 1) for stage in ('deep', 'rem', 'light', 'full')}
+    return {'br': [{'value': {f"{stage}SleepSummary": {'breathingRate': rate} for stage, rate in rates.items()},
+                    'dateTime': date}]}
+
+
+def spo2_payload(seed, date):
+    # Un valor por minuto durante el sueño principal
+    rng = rng_for(seed, 'spo2', date)
+    start, end = sleep_window(seed, date)
+    count = int((end - start).total_seconds() // 60)
+    values = np.clip(rng.normal(96, 1.2, count), 88, 100).round(1)
+    return {'dateTime': date, 'minutes': [
+        {'value': float(values[i]), 'minute': (start + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%S')}
+        for i in range(count)
+    ]}
+
+
+@lru_cache(maxsize=128)
+def render_payload(scope, seed, date, level=None, start_time=None, end_time=None):
+    # Se cachea el JSON serializado: el mock no debe ser el cuello de botella del benchmark
+    generators = {
+        'heart_rate': lambda: heart_rate_payload(seed, date, level, start_time, end_time),
+        'activity': lambda: steps_payload(seed, date, level, start_time, end_time),
+        'sleep': lambda: sleep_payload(seed, date),
+        'heart_rate_variability': lambda: hrv_payload(seed, date),
+        'breathing_rate': lambda: breathing_rate_payload(seed, date),
+        'spO2': lambda: spo2_payload(seed, date),
+    }
+    return json.dumps(generators[scope]())
+
+
+def fitbit_error(status, error_type, message):
+    return jsonify({'errors': [{'errorType': error_type, 'message': message}], 'success': False}), status
+
+
+def create_app(config=None):
+    """Crea la app del mock con la configuración dada (ver DEFAULT_CONFIG); se puede cambiar en /mock/config."""
+    app = Flask(__name__)
+    settings = {**DEFAULT_CONFIG, **(config or {})}
+    issued_tokens = set()
+    rate_windows = {}
+    stats = {'requests': 0, 'by_status': {}, 'by_path': {}}
+    lock = threading.Lock()
+    random_source = random.Random(settings['seed'])
+
+    def count(path, status):
+        with lock:
+            stats['requests'] += 1
+            stats['by_status'][str(status)] = stats['by_status'].get(str(status), 0) + 1
+            stats['by_path'][path] = stats['by_path'].get(path, 0) + 1
+
+    def simulate_latency():
+        if settings['latency_ms'] > 0:
+            sigma = settings['latency_jitter']
+            time.sleep(settings['latency_ms'] / 1000 * random.lognormvariate(-sigma ** 2 / 2, sigma))
+
+    def check_request():
+        """Aplica latencia, errores, 401 y límite de peticiones; devuelve la respuesta de error o None."""
+        simulate_latency()
+        authorization = request.headers.get('Authorization', '')
+        token = authorization.removeprefix('Bearer ').strip()
+        if not authorization.startswith('Bearer ') or not token:
+            return fitbit_error(401, 'invalid_token', 'Access token missing')
+        if settings['strict_tokens'] and token not in issued_tokens:
+            return fitbit_error(401, 'invalid_token', f"Access token invalid: {token[:12]}")
+        with lock:
+            roll = random_source.random()
+        if roll < settings['unauthorized_rate']:
+            return fitbit_error(401, 'expired_token', 'Access token expired')
+        if roll < settings['unauthorized_rate'] + settings['error_rate']:
+            status = random_source.choice((500, 503))
+            return fitbit_error(status, 'system', 'Simulated server error')
+
+        # Límite por token, como la API real (150 peticiones/hora por usuario)
+        now = time.time()
+        with lock:
+            window_start, used = rate_windows.get(token, (now, 0))
+            if now - window_start >= settings['rate_limit_window']:
+                window_start, used = now, 0
+            used += 1
+            rate_windows[token] = (window_start, used)
+        reset = int(window_start + settings['rate_limit_window'] - now)
+        request.rate_limit_headers = {
+            'Fitbit-Rate-Limit-Limit': str(settings['rate_limit']),
+            'Fitbit-Rate-Limit-Remaining': str(max(0, settings['rate_limit'] - used)),
+            'Fitbit-Rate-Limit-Reset': str(reset)
+        }
+        if used > settings['rate_limit']:
+            response, status = fitbit_error(429, 'system', 'Too Many Requests')
+            response.headers['Retry-After'] = str(reset)
+            return response, status
+        return None
+
+    def data_response(scope, date, level=None, start_time=None, end_time=None):
+        error = check_request()
+        if error is not None:
+            count(scope, error[1])
+            return error
+        try:
+            date_type.fromisoformat(date)
+        except ValueError:
+            count(scope, 400)
+            return fitbit_error(400, 'validation', f"Invalid date: {date}")
+        body = render_payload(scope, settings['seed'], date, level, start_time, end_time)
+        count(scope, 200)
+        response = Response(body, mimetype='application/json')
+        response.headers.update(request.rate_limit_headers)
+        return response
+
+    @app.route('/oauth2/authorize')
+    def authorize():
+        return jsonify({'authorization': 'mock', 'client_id': request.args.get('client_id')})
+
+    @app.route('/oauth2/token', methods=['POST'])
+    def token():
+        simulate_latency()
+        grant_type = request.form.get('grant_type')
+        if grant_type not in ('authorization_code', 'refresh_token'):
+            count('token', 400)
+            return fitbit_error(400, 'invalid_grant', f"Unsupported grant_type: {grant_type}")
+        access_token, refresh_token = f"mock-access-{uuid.uuid4().hex}", f"mock-refresh-{uuid.uuid4().hex}"
+        with lock:
+            issued_tokens.add(access_token)
+        user_id = f"MOCK{zlib.crc32((request.form.get('code') or request.form.get('refresh_token') or '').encode()):08X}"
+        count('token', 200)
+        return jsonify({
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'expires_in': 28800,
+            'scope': 'activity heartrate sleep oxygen_saturation respiratory_rate profile settings',
+            'token_type': 'Bearer',
+            'user_id': user_id
+        })
+
+    @app.route('/1/user/-/profile.json')
+    def profile():
+        error = check_request()
+        if error is not None:
+            return error
+        return jsonify({'user': {'encodedId': 'MOCKUSER', 'displayName': 'Mock User'}})
+
+    @app.route('/1/user/-/devices.json')
+    def devices():
+        error = check_request()
+        if error is not None:
+            count('user_info', error[1])
+            return error
+        count('user_info', 200)
+        return jsonify([{'battery': 'High', 'batteryLevel': 87, 'deviceVersion': 'Charge 6', 'id': '2900000001',
+                         'lastSyncTime': datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000'), 'type': 'TRACKER'}])
+
+    @app.route('/1.2/user/-/sleep/date/<date>.json')
+    def sleep(date):
+        return data_response('sleep', date)
+
+    @app.route('/1/user/-/activities/heart/date/<date>/1d/<level>.json')
+    @app.route('/1/user/-/activities/heart/date/<date>/1d/<level>/time/<start_time>/<end_time>.json')
+    def heart_rate(date, level, start_time=None, end_time=None):
+        if level not in HEART_RATE_LEVELS:
+            return fitbit_error(400, 'validation', f"Invalid detail level: {level}")
+        return data_response('heart_rate', date, level, start_time, end_time)
+
+    @app.route('/1/user/-/activities/steps/date/<date>/1d/<level>.json')
+    @app.route('/1/user/-/activities/steps/date/<date>/1d/<level>/time/<start_time>/<end_time>.json')
+    def activity(date, level, start_time=None, end_time=None):
+        if level not in STEP_LEVELS:
+            return fitbit_error(400, 'validation', f"Invalid detail level: {level}")
+        return data_response('activity', date, level, start_time, end_time)
+
+    @app.route('/1/user/-/hrv/date/<date>/all.json')
+    def heart_rate_variability(date):
+        return data_response('heart_rate_variability', date)
+
+    @app.route('/1/user/-/br/date/<date>/all.json')
+    def breathing_rate(date):
+        return data_response('breathing_rate', date)
+
+    @app.route('/1/user/-/spo2/date/<date>/all.json')
+    def spo2(date):
+        return data_response('spO2', date)
+
+    @app.route('/mock/config', methods=['GET', 'POST'])
+    def mock_config():
+        # Cambia latencia/errores en caliente durante un benchmark: {"latency_ms": 200, "error_rate": 0.05}
+        # Las acciones (p. ej. {"reset_rate_limits": true}) se ejecutan una vez y no se guardan como ajustes
+        if request.method == 'POST':
+            updates = request.get_json(silent=True) or {}
+            actions = {key: updates.pop(key) for key in CONFIG_ACTIONS & set(updates)}
+            unknown = set(updates) - set(DEFAULT_CONFIG)
+            if unknown:
+                return jsonify({'error': f"Unknown settings: {sorted(unknown)}"}), 400
+            settings.update(updates)
+            if actions.get('reset_rate_limits'):
+                with lock:
+                    rate_windows.clear()
+        return jsonify(settings)
+
+    @app.route('/mock/stats', methods=['GET', 'DELETE'])
+    def mock_stats():
+        with lock:
+            if request.method == 'DELETE':
+                stats.update({'requests': 0, 'by_status': {}, 'by_path': {}})
+                rate_windows.clear()
+            return jsonify(stats)
+
+    return app
+
+
+class MockFitbitServer:
+    """Mock en un hilo de fondo, para benchmarks y scripts: with MockFitbitServer() as server: server.url"""
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        self.app = create_app(config)
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-fitbit', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock local de la Web API de Fitbit")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MOCK_FITBIT_PORT', 5099)))
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_CONFIG['latency_ms'])
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_CONFIG['error_rate'])
+    parser.add_argument('--unauthorized-rate', type=float, default=DEFAULT_CONFIG['unauthorized_rate'])
+    parser.add_argument('--rate-limit', type=int, default=DEFAULT_CONFIG['rate_limit'])
+    parser.add_argument('--strict-tokens', action='store_true', default=DEFAULT_CONFIG['strict_tokens'])
+    args = parser.parse_args()
+
+    mock_app = create_app({'latency_ms': args.latency_ms, 'error_rate': args.error_rate,
+                           'unauthorized_rate': args.unauthorized_rate, 'rate_limit': args.rate_limit,
+                           'strict_tokens': args.strict_tokens})
+    print(f"🧪 Mock Fitbit en http://{args.host}:{args.port} (FITBIT_API_BASE_URL=http://{args.host}:{args.port})")
+    mock_app.run(host=args.host, port=args.port, threaded=True)
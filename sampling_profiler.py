@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import logging
+from collections import Counter
+from flask import Flask, request
+
+logger = logging.getLogger(__name__)
+
+# Frecuencia de muestreo por defecto y presupuesto de overhead (fracción del tiempo de pared usada en muestrear)
+DEFAULT_SAMPLING_HZ = float(os.environ.get('SAMPLING_PROFILER_HZ', 50))
+MAX_OVERHEAD = float(os.environ.get('SAMPLING_PROFILER_MAX_OVERHEAD', 0.02))
+MAX_STACK_DEPTH = int(os.environ.get('SAMPLING_PROFILER_MAX_DEPTH', 64))
+# Límite de pilas distintas por endpoint para que la memoria no crezca sin control con tráfico real
+MAX_STACKS_PER_ENDPOINT = int(os.environ.get('SAMPLING_PROFILER_MAX_STACKS', 5000))
+# Fichero con los ajustes del profiler compartidos por todos los workers de gunicorn
+PROFILER_STATE_FILE = os.environ.get('PROFILER_STATE_FILE',
+                                     os.path.join(tempfile.gettempdir(), 'vitals_profiler_state.json'))
+
+
+class SamplingProfiler:
+    """
+    Profiler estadístico: un hilo toma cada cierto intervalo la pila de los hilos que atienden peticiones y cuenta
+    las pilas colapsadas por endpoint. No instrumenta las llamadas, así que el coste no depende del tráfico.
+    """
+
+    def __init__(self, hz=DEFAULT_SAMPLING_HZ, max_overhead=MAX_OVERHEAD):
+        self.hz = hz
+        self.max_overhead = max_overhead
+        self.interval = 1 / hz
+        self._stacks = {}
+        self._active_threads = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+        self._sampling_time = 0.0
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_rate(self, hz):
+        """Cambia la frecuencia de muestreo, también con el muestreo activo."""
+        self.hz = float(hz)
+        self.interval = 1 / self.hz
+
+    def start(self, hz=None):
+        """Arranca el muestreo (o cambia la frecuencia si ya estaba activo)."""
+        if hz:
+            self.set_rate(hz)
+        if self.running:
+            return
+        self._stop.clear()
+        self._started_at = time.perf_counter()
+        self._sampling_time = 0.0
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler activo a {self.hz:.0f} Hz")
+
+    def stop(self):
+        """Detiene el muestreo conservando las pilas acumuladas."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info("Sampling profiler detenido")
+
+    def reset(self):
+        """Descarta las pilas acumuladas."""
+        with self._lock:
+            self._stacks = {}
+            self.samples = 0
+
+    def bind_thread(self, endpoint):
+        """Asocia el hilo actual al endpoint que está atendiendo; solo se muestrean hilos asociados."""
+        self._active_threads[threading.get_ident()] = endpoint
+
+    def unbind_thread(self):
+        self._active_threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            self._sample()
+            elapsed = time.perf_counter() - start
+            self._sampling_time += elapsed
+            # Si una muestra cuesta más que el presupuesto, se alarga el intervalo en lugar de degradar el servicio
+            self.interval = min(1.0, max(1 / self.hz, elapsed / self.max_overhead))
+
+    def _sample(self):
+        active = dict(self._active_threads)
+        if not active:
+            return
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, endpoint in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = self._collapse(frame)
+                counter = self._stacks.setdefault(endpoint, Counter())
+                if stack in counter or len(counter) < MAX_STACKS_PER_ENDPOINT:
+                    counter[stack] += 1
+                else:
+                    counter['[otras pilas]'] += 1
+                self.samples += 1
+
+    @staticmethod
+    def _collapse(frame):
+        # Formato "collapsed stack" de flamegraph.pl: de la raíz a la hoja, separado por ';'
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def collapsed(self, endpoint=None):
+        """Pilas colapsadas ('endpoint;f1;f2 N' por línea), listas para flamegraph.pl o speedscope."""
+        with self._lock:
+            lines = [
+                f"{name};{stack} {count}"
+                for name, counter in self._stacks.items() if endpoint is None or name == endpoint
+                for stack, count in counter.most_common()
+            ]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def status(self):
+        """Estado del muestreo, incluido el overhead medido."""
+        wall_time = time.perf_counter() - self._started_at if self._started_at else 0
+        with self._lock:
+            per_endpoint = {name: sum(counter.values()) for name, counter in self._stacks.items()}
+        return {
+            'running': self.running,
+            'hz': self.hz,
+            'effective_hz': 1 / self.interval,
+            'samples': self.samples,
+            'samples_per_endpoint': per_endpoint,
+            'overhead': self._sampling_time / wall_time if wall_time else 0,
+            'max_overhead': self.max_overhead
+        }
+
+
+class SharedProfilerSettings:
+    """
+    Ajustes del profiler compartidos por todos los workers: el endpoint de administración los escribe en un fichero y
+    cada worker los aplica en su siguiente petición, así que activar el muestreo o el cProfile no depende del worker
+    que atienda la llamada. Las pilas y los perfiles siguen siendo de cada worker.
+    """
+
+    def __init__(self, path=PROFILER_STATE_FILE):
+        self.path = path
+        self._listeners = []
+        self._applied = None
+        self._lock = threading.Lock()
+
+    def on_change(self, listener):
+        """Registra una función que recibe los ajustes (y los anteriores de este worker) cada vez que cambian."""
+        self._listeners.append(listener)
+
+    def read(self):
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def publish(self, updates):
+        """Guarda los ajustes cambiados para todos los workers y los aplica en este."""
+        with self._lock:
+            settings = {**self.read(), **updates}
+            settings['version'] = settings.get('version', 0) + 1
+            # Escritura atómica: un worker nunca lee un fichero a medias
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, 'w') as state_file:
+                json.dump(settings, state_file)
+            os.replace(temporary, self.path)
+        self.sync()
+        return settings
+
+    def sync(self):
+        """Aplica los ajustes publicados desde la última vez; cuesta un stat por petición si no han cambiado."""
+        try:
+            # os.replace deja un inodo nuevo en cada escritura, aunque dos caigan en la misma marca de tiempo
+            file_stat = os.stat(self.path)
+            stamp = (file_stat.st_ino, file_stat.st_mtime_ns)
+        except OSError:
+            return
+        if self._applied is not None and self._applied[0] == stamp:
+            return
+        with self._lock:
+            if self._applied is not None and self._applied[0] == stamp:
+                return
+            settings = self.read()
+            previous = self._applied[1] if self._applied is not None else {}
+            self._applied = (stamp, settings)
+        for listener in self._listeners:
+            listener(settings, previous)
+
+    def current(self):
+        return self._applied[1] if self._applied is not None else {}
+
+
+# Instancias globales: el sampler es uno por worker, los ajustes se comparten entre todos
+sampling_profiler = SamplingProfiler()
+profiler_settings = SharedProfilerSettings()
+
+
+def apply_sampling_settings(settings, previous):
+    if settings.get('reset', 0) != previous.get('reset', 0):
+        sampling_profiler.reset()
+    if settings.get('sampling') is True:
+        sampling_profiler.start(settings.get('hz'))
+    elif settings.get('sampling') is False:
+        sampling_profiler.stop()
+        if settings.get('hz'):
+            sampling_profiler.set_rate(settings['hz'])
+    elif settings.get('hz'):
+        sampling_profiler.set_rate(settings['hz'])
+
+
+profiler_settings.on_change(apply_sampling_settings)
+
+
+def register_sampling_profiler(app: Flask):
+    """Marca qué endpoint atiende cada hilo para que las muestras se agreguen por endpoint."""
+    @app.before_request
+    def bind_sampling_thread():
+        profiler_settings.sync()
+        if sampling_profiler.running:
+            sampling_profiler.bind_thread(request.endpoint or 'unknown')
+
+    @app.teardown_request
+    def unbind_sampling_thread(exception=None):
+        sampling_profiler.unbind_thread()
+
+    if os.environ.get('SAMPLING_PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes'):
+        sampling_profiler.start()
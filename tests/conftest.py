@@ -0,0 +1,31 @@
+import base64
+import os
+
+import pytest
+
+# Variables read when the service modules are imported; set before importing them so that no real data is touched
+os.environ.setdefault('CIPHER_KEY', base64.b64encode(os.urandom(32)).decode())
+os.environ['STORAGE_BACKEND'] = 'memory'
+
+from vitals_data_retrieving.data_consumption_tools.Entities.MemoryDataBase import MemoryVitalsDataBase, \
+    MemoryBatchRunsDataBase  # noqa: E402
+from vitals_data_retrieving.data_consumption_tools.Entities.SQLiteDataBase import SQLiteVitalsDataBase, \
+    SQLiteBatchRunsDataBase  # noqa: E402
+
+BACKENDS = ['memory', 'sqlite']
+
+
+@pytest.fixture(params=BACKENDS)
+def vitals_repository(request, tmp_path):
+    """Vitals repository of each embedded backend, empty and private to the test"""
+    if request.param == 'memory':
+        return MemoryVitalsDataBase()
+    return SQLiteVitalsDataBase(str(tmp_path / 'vitals.db'))
+
+
+@pytest.fixture(params=BACKENDS)
+def batch_repository(request, tmp_path):
+    """Batch runs repository of each embedded backend, empty and private to the test"""
+    if request.param == 'memory':
+        return MemoryBatchRunsDataBase()
+    return SQLiteBatchRunsDataBase(str(tmp_path / 'vitals.db'))
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+
+from vitals_data_retrieving.data_consumption_tools.Entities.ChangeDetection import write_changed_scopes
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import fetch_status
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+
+USER_ID = 'a' * 64
+DATE = '2024-01-15'
+FETCHED_AT = datetime(2024, 1, 16, 6, tzinfo=timezone.utc)
+DATA = {"sleep": [{"minutesAsleep": 420}], "spO2": {"value": {"avg": 96.5}}}
+
+
+def document(data, statuses, previous=None):
+    return {"user_id": USER_ID, "date": DATE, "data": data,
+            "scope_status": fetch_status(statuses, FETCHED_AT, previous)}
+
+
+def test_scopes_are_written_and_projected(vitals_repository):
+    assert write_changed_scopes(vitals_repository, [document(DATA, {"sleep": 200, "spO2": 200})]) == \
+        ResponseCode.SUCCESS
+    assert vitals_repository.read_user_day(USER_ID, DATE) == (ResponseCode.SUCCESS, DATA)
+    assert vitals_repository.read_user_day(USER_ID, DATE, ['spO2']) == (ResponseCode.SUCCESS, {"spO2": DATA["spO2"]})
+    assert vitals_repository.read_user_day(USER_ID, '2024-01-16')[0] == ResponseCode.ERROR_NOT_FOUND
+
+
+def test_failed_scope_keeps_the_stored_data_and_counts_attempts(vitals_repository):
+    write_changed_scopes(vitals_repository, [document(DATA, {"sleep": 200, "spO2": 200})])
+    previous = vitals_repository.read_scope_status([DATE])[1][0]["scope_status"]
+
+    error = {"sleep": DATA["sleep"], "spO2": {"error": "Too Many Requests"}}
+    write_changed_scopes(vitals_repository, [document(error, {"sleep": 200, "spO2": 429}, previous)])
+    previous = vitals_repository.read_scope_status([DATE])[1][0]["scope_status"]
+    write_changed_scopes(vitals_repository, [document(error, {"sleep": 200, "spO2": 429}, previous)])
+
+    assert vitals_repository.read_user_day(USER_ID, DATE) == (ResponseCode.SUCCESS, DATA)
+    _, documents = vitals_repository.read_scope_status([DATE])
+    assert [(document["user_id"], document["date"]) for document in documents] == [(USER_ID, DATE)]
+    scope_status = documents[0]["scope_status"]
+    assert (scope_status["sleep"]["status"], scope_status["sleep"]["attempts"]) == (200, 0)
+    assert (scope_status["spO2"]["status"], scope_status["spO2"]["attempts"]) == (429, 2)
+
+
+def test_delete_all_documents_empties_the_repository(vitals_repository):
+    write_changed_scopes(vitals_repository, [document(DATA, {"sleep": 200, "spO2": 200})])
+    assert vitals_repository.delete_all_documents() == ResponseCode.SUCCESS
+    assert vitals_repository.read_user_day(USER_ID, DATE)[0] == ResponseCode.ERROR_NOT_FOUND
+    assert vitals_repository.read_scope_status([DATE])[0] == ResponseCode.ERROR_NOT_FOUND
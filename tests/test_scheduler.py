@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import Priority, PriorityScheduler
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.005)
+
+
+class Holder:
+    """Thread holding a slot of a scheduler until released, recording when it got it"""
+
+    def __init__(self, scheduler, priority, order=None, name=None):
+        self.release = threading.Event()
+        self.granted = threading.Event()
+        self.thread = threading.Thread(target=self._hold, args=(scheduler, priority, order, name), daemon=True)
+        self.thread.start()
+
+    def _hold(self, scheduler, priority, order, name):
+        with scheduler.slot(priority):
+            if order is not None:
+                order.append(name)
+            self.granted.set()
+            self.release.wait(5)
+
+    def done(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def test_batch_slots_are_capped_below_the_slots():
+    assert PriorityScheduler('test', 4, 10).batch_slots == 3
+    assert PriorityScheduler('test', 4, 0).batch_slots == 1
+    assert PriorityScheduler('test', 1, 1).batch_slots == 1
+
+
+def test_batch_calls_never_hold_more_than_batch_slots():
+    scheduler = PriorityScheduler('test', 4, 2)
+    batch = [Holder(scheduler, Priority.BATCH) for _ in range(5)]
+    wait_until(lambda: scheduler.stats()['batch']['waiting'] == 3)
+    assert scheduler.stats()['batch']['running'] == 2
+
+    # The slots batch work cannot take are free for interactive calls right away
+    interactive = [Holder(scheduler, Priority.INTERACTIVE) for _ in range(2)]
+    for holder in interactive:
+        assert holder.granted.wait(1)
+    assert scheduler.stats()['interactive']['running'] == 2
+
+    for holder in batch + interactive:
+        holder.done()
+    assert scheduler.stats()['batch']['served'] == 5
+
+
+def test_freed_slot_goes_to_interactive_before_earlier_batch():
+    scheduler = PriorityScheduler('test', 2, 1)
+    order = []
+    first = Holder(scheduler, Priority.INTERACTIVE)
+    second = Holder(scheduler, Priority.INTERACTIVE)
+    assert first.granted.wait(1) and second.granted.wait(1)
+
+    waiters = [Holder(scheduler, Priority.BATCH, order, 'batch')]
+    wait_until(lambda: scheduler.stats()['batch']['waiting'] == 1)
+    waiters.append(Holder(scheduler, Priority.INTERACTIVE, order, 'interactive'))
+    wait_until(lambda: scheduler.stats()['interactive']['waiting'] == 1)
+
+    first.done()
+    wait_until(lambda: order == ['interactive'])
+    assert scheduler.stats()['batch']['waiting'] == 1
+
+    second.done()
+    wait_until(lambda: order == ['interactive', 'batch'])
+    for holder in waiters:
+        holder.done()
+
+
+def test_slot_timeout_leaves_no_waiter():
+    scheduler = PriorityScheduler('test', 1, 1)
+    holder = Holder(scheduler, Priority.INTERACTIVE)
+    assert holder.granted.wait(1)
+    with pytest.raises(TimeoutError):
+        with scheduler.slot(Priority.INTERACTIVE, timeout=0.05):
+            pass
+    assert scheduler.stats()['interactive']['waiting'] == 0
+    holder.done()
+    assert scheduler.stats()['interactive']['running'] == 0
+
+
+def test_async_slots_share_the_queue_with_threads():
+    scheduler = PriorityScheduler('test', 1, 1)
+    order = []
+
+    async def call(priority, name):
+        async with scheduler.async_slot(priority):
+            order.append(name)
+
+    async def main():
+        holder = Holder(scheduler, Priority.INTERACTIVE)
+        assert holder.granted.wait(1)
+        batch = asyncio.ensure_future(call(Priority.BATCH, 'batch'))
+        await asyncio.sleep(0.05)
+        interactive = asyncio.ensure_future(call(Priority.INTERACTIVE, 'interactive'))
+        await asyncio.sleep(0.05)
+        holder.done()
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(main())
+    assert order == ['interactive', 'batch']
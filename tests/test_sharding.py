@@ -0,0 +1,59 @@
+import time
+
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.Sharding import claim_shards
+
+RUN_ID = 'daily_vitals:fitbit:2024-01-15'
+
+
+def test_duplicate_claim_is_rejected(batch_repository):
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-a', 60) == ResponseCode.SUCCESS
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-b', 60) == ResponseCode.ERROR_DUPLICATE_KEY
+    # The owner renews its own lease, and other shards or runs are independent
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-a', 60) == ResponseCode.SUCCESS
+    assert batch_repository.claim_shard(RUN_ID, 1, 'node-b', 60) == ResponseCode.SUCCESS
+    assert batch_repository.claim_shard('other-run', 0, 'node-b', 60) == ResponseCode.SUCCESS
+
+
+def test_expired_lease_is_taken_over(batch_repository):
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-a', 0.01) == ResponseCode.SUCCESS
+    time.sleep(0.02)
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-b', 60) == ResponseCode.SUCCESS
+    # The node that lost the lease can no longer complete the shard
+    assert batch_repository.complete_shard(RUN_ID, 0, 'node-a') == ResponseCode.ERROR_NOT_FOUND
+    assert batch_repository.complete_shard(RUN_ID, 0, 'node-b') == ResponseCode.SUCCESS
+
+
+def test_completed_shard_is_not_claimed_again(batch_repository):
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-a', 0.01) == ResponseCode.SUCCESS
+    assert batch_repository.complete_shard(RUN_ID, 0, 'node-a') == ResponseCode.SUCCESS
+    time.sleep(0.02)
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-b', 60) == ResponseCode.ERROR_DUPLICATE_KEY
+    assert batch_repository.claim_shard(RUN_ID, 0, 'node-a', 60) == ResponseCode.ERROR_DUPLICATE_KEY
+
+    _, shards = batch_repository.read_shards(RUN_ID)
+    assert [(shard["shard"], shard["owner"], shard["completed"]) for shard in shards] == [(0, 'node-a', True)]
+
+
+def test_nodes_share_the_shards_without_repeating_them(batch_repository):
+    first = list(claim_shards(RUN_ID, shard_count=4, lease_seconds=60, owner='node-a',
+                              repository=batch_repository))
+    assert sorted(lease.shard for lease in first) == [0, 1, 2, 3]
+    assert list(claim_shards(RUN_ID, shard_count=4, lease_seconds=60, owner='node-b',
+                             repository=batch_repository)) == []
+
+    # A completed shard stays done, a released one is claimed right away by the next node
+    assert first[0].complete()
+    assert first[1].release()
+    taken_over = list(claim_shards(RUN_ID, shard_count=4, lease_seconds=60, owner='node-b',
+                                   repository=batch_repository))
+    assert [lease.shard for lease in taken_over] == [first[1].shard]
+    assert not first[1].complete()
+
+
+def test_checkpoints_replace_the_previous_outcome(batch_repository):
+    assert batch_repository.record_checkpoints(RUN_ID, {'user-a': 500, 'user-b': 200}) == ResponseCode.SUCCESS
+    assert batch_repository.record_checkpoints(RUN_ID, {'user-a': 200}) == ResponseCode.SUCCESS
+    _, checkpoints = batch_repository.read_checkpoints(RUN_ID, ['user-a', 'user-b', 'user-c'])
+    assert checkpoints == {'user-a': 200, 'user-b': 200}
+    assert batch_repository.read_checkpoints('other-run', ['user-a']) == (ResponseCode.SUCCESS, {})
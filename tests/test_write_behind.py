@@ -0,0 +1,114 @@
+import json
+import os
+import time
+
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.WriteBehind import LOCK_SUFFIX, SPILL_SUFFIX, \
+    WriteBehindBuffer, WriteTracker, track_writes, untrack_writes
+
+USER_ID = 'a' * 64
+DATE = '2024-01-15'
+SLEEP = {"sleep": [{"dateOfSleep": DATE, "minutesAsleep": 420}]}
+
+
+class FailingRepository:
+    """Repository whose writes fail while failing is set, and otherwise go to the wrapped repository"""
+
+    def __init__(self, repository, failing=False):
+        self.repository = repository
+        self.failing = failing
+
+    def update_scopes(self, documents):
+        if self.failing:
+            return ResponseCode.ERROR_UNKNOWN
+        return self.repository.update_scopes(documents)
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+
+def journal(spill_dir):
+    return sorted(name for name in os.listdir(spill_dir) if name.endswith(SPILL_SUFFIX))
+
+
+def new_buffer(repository, spill_dir=''):
+    return WriteBehindBuffer(repository=lambda: repository, batch_size=4, max_attempts=1, submit_timeout=1,
+                             spill_dir=str(spill_dir))
+
+
+def test_documents_are_written_in_the_background(vitals_repository):
+    buffer = new_buffer(vitals_repository)
+    assert buffer.submit(USER_ID, DATE, SLEEP) == ResponseCode.SUCCESS
+    assert buffer.flush(5)
+    assert vitals_repository.read_user_day(USER_ID, DATE) == (ResponseCode.SUCCESS, SLEEP)
+    assert buffer.close(5)
+    assert buffer.stats()['written'] == 1
+
+
+def test_journal_of_a_crashed_process_is_replayed(vitals_repository, tmp_path):
+    # A process that died leaves its journal entries and its (no longer locked) lock file behind
+    owner = 'f' * 32
+    (tmp_path / (owner + LOCK_SUFFIX)).touch()
+    document = {"user_id": USER_ID, "date": DATE, "data": SLEEP, "scope_status": {}}
+    (tmp_path / f"{time.time_ns()}-{owner}-0{SPILL_SUFFIX}").write_text(json.dumps(document))
+
+    buffer = new_buffer(vitals_repository, tmp_path)
+    assert buffer.flush(5)
+    assert buffer.stats()['recovered'] == 1
+    assert vitals_repository.read_user_day(USER_ID, DATE) == (ResponseCode.SUCCESS, SLEEP)
+    assert journal(tmp_path) == []
+    assert not (tmp_path / (owner + LOCK_SUFFIX)).exists()
+    buffer.close(5)
+
+
+def test_failed_writes_stay_journaled_until_the_next_process(vitals_repository, tmp_path):
+    failing = FailingRepository(vitals_repository, failing=True)
+    first = new_buffer(failing, tmp_path)
+    first.submit(USER_ID, DATE, SLEEP)
+    assert first.flush(5)
+    assert first.stats()['failed'] == 1
+    assert len(journal(tmp_path)) == 1
+
+    # The entries of a running process are left to it
+    other = new_buffer(vitals_repository, tmp_path)
+    assert other.stats()['recovered'] == 0
+    assert len(journal(tmp_path)) == 1
+    other.close(5)
+
+    first.close(5)
+    replay = new_buffer(vitals_repository, tmp_path)
+    assert replay.flush(5)
+    assert replay.stats()['recovered'] == 1
+    assert vitals_repository.read_user_day(USER_ID, DATE) == (ResponseCode.SUCCESS, SLEEP)
+    assert journal(tmp_path) == []
+    replay.close(5)
+
+
+def test_tracker_only_counts_the_writes_submitted_under_it(vitals_repository, tmp_path):
+    for spill_dir in ('', tmp_path):
+        failing = FailingRepository(vitals_repository, failing=True)
+        buffer = new_buffer(failing, spill_dir)
+        tracker = WriteTracker()
+
+        # A failed write outside the tracker (e.g. an interactive request during a daily run)
+        buffer.submit('b' * 64, DATE, SLEEP)
+        assert buffer.flush(5)
+        failing.failing = False
+        token = track_writes(tracker)
+        try:
+            buffer.submit(USER_ID, DATE, SLEEP)
+        finally:
+            untrack_writes(token)
+        assert tracker.wait(5)
+        assert tracker.failed == 0
+
+        failing.failing = True
+        token = track_writes(tracker)
+        try:
+            buffer.submit('c' * 64, DATE, SLEEP)
+        finally:
+            untrack_writes(token)
+        assert tracker.wait(5)
+        assert tracker.failed == 1
+        assert buffer.stats()['failed'] == 2
+        buffer.close(5)
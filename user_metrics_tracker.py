@@ -1,36 +1,173 @@
 import time
+import math
+import os
+import threading
+import itertools
 import logging
+from array import array
 from functools import wraps
+from prometheus_client import Histogram
+from vitals_data_retrieving.vitals_data_retrieving_metrics import LATENCY_BUCKETS
 
 logger = logging.getLogger(__name__)
 
-class UserMetricsTracker:
+# Capacidad del buffer circular: la memoria queda fija sin importar cuánto viva el worker
+DEFAULT_CAPACITY = int(os.environ.get('USER_METRICS_CAPACITY', 10000))
+
+# Copia de cada registro en Prometheus: en modo multiproceso se agrega entre todos los workers de gunicorn
+user_operation_latency = Histogram(
+    'vitals_user_operation_duration_seconds', 'Duration of the tracked user operations',
+    ['operation', 'success'], buckets=LATENCY_BUCKETS)
+
+
+class QuantileSketch:
+    """Sketch de cuantiles con buckets logarítmicos (error relativo acotado, memoria acotada)."""
+    __slots__ = ('gamma', 'log_gamma', 'buckets', 'zero_count')
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+
+    def add(self, value):
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q, count):
+        """Devuelve el cuantil q (0-1) de los valores agregados."""
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Punto medio del bucket [gamma^(i-1), gamma^i]
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class OperationStats:
+    """Agregados en streaming de una operación."""
+    __slots__ = ('count', 'successes', 'total', 'minimum', 'maximum', 'sketch')
+
     def __init__(self):
-        self.operations = []
+        self.count = 0
+        self.successes = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self.sketch = QuantileSketch()
+
+    def add(self, duration, success):
+        self.count += 1
+        self.successes += success
+        self.total += duration
+        self.minimum = min(self.minimum, duration)
+        self.maximum = max(self.maximum, duration)
+        self.sketch.add(duration)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "success_rate": self.successes / self.count * 100 if self.count else 0,
+            "avg_duration": self.total / self.count if self.count else 0,
+            "min_duration": self.minimum if self.count else 0,
+            "max_duration": self.maximum,
+            "p50_duration": self.sketch.quantile(0.50, self.count),
+            "p95_duration": self.sketch.quantile(0.95, self.count),
+            "p99_duration": self.sketch.quantile(0.99, self.count),
+        }
+
+
+class UserMetricsTracker:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        # Registros compactos en arrays preasignados (timestamp, duración, éxito, operación)
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._durations = array('d', bytes(8 * capacity))
+        self._successes = array('B', bytes(capacity))
+        self._operation_ids = array('H', bytes(2 * capacity))
+        # next() sobre itertools.count es atómico en CPython: cada hilo reserva su propio slot sin lock
+        self._sequence = itertools.count()
+        self._written = 0
+        self._operation_names = []
+        self._operation_index = {}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _operation_id(self, operation_name):
+        operation_id = self._operation_index.get(operation_name)
+        if operation_id is None:
+            with self._stats_lock:
+                operation_id = self._operation_index.get(operation_name)
+                if operation_id is None:
+                    operation_id = len(self._operation_names)
+                    self._operation_names.append(operation_name)
+                    self._stats[operation_name] = OperationStats()
+                    self._operation_index[operation_name] = operation_id
+        return operation_id
+
+    def record(self, operation_name, duration, success, timestamp=None):
+        """Registra una operación en el buffer circular y actualiza sus agregados."""
+        operation_id = self._operation_id(operation_name)
+        sequence = next(self._sequence)
+        slot = sequence % self.capacity
+        self._timestamps[slot] = timestamp if timestamp is not None else time.time()
+        self._durations[slot] = duration
+        self._successes[slot] = 1 if success else 0
+        self._operation_ids[slot] = operation_id
+        self._written = max(self._written, sequence + 1)
+
+        with self._stats_lock:
+            self._stats[operation_name].add(duration, 1 if success else 0)
+        user_operation_latency.labels(operation=operation_name, success=str(bool(success))).observe(duration)
+
+    def recent(self, limit=100):
+        """Devuelve las últimas operaciones registradas (como máximo la capacidad del buffer)."""
+        written = self._written
+        count = min(limit, written, self.capacity)
+        operations = []
+        for sequence in range(written - count, written):
+            slot = sequence % self.capacity
+            operations.append({
+                "operation": self._operation_names[self._operation_ids[slot]],
+                "duration": self._durations[slot],
+                "success": bool(self._successes[slot]),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._timestamps[slot]))
+            })
+        return operations
+
+    def summary(self):
+        """Resumen por operación: conteo, tasa de éxito, min/max/promedio y p50/p95/p99."""
+        with self._stats_lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
 
     def track_user_operation(self, operation_name):
         """Decorador para registrar operación del usuario."""
         def decorator(func):
             @wraps(func)
             def wrapper(*args, **kwargs):
-                start_time = time.time()
+                start_time = time.perf_counter()
                 try:
                     result = func(*args, **kwargs)
-                    success = True
+                    # Las vistas capturan sus errores y devuelven (respuesta, status)
+                    status = result[1] if isinstance(result, tuple) and len(result) > 1 else 200
+                    success = int(status) < 400
                 except Exception as e:
                     logger.error(f"Error en {operation_name}: {e}")
                     result = ({"error": str(e)}, 500)
                     success = False
-                duration = time.time() - start_time
-                self.operations.append({
-                    "operation": operation_name,
-                    "duration": duration,
-                    "success": success,
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                })
+                self.record(operation_name, time.perf_counter() - start_time, success)
                 return result
             wrapper.__name__ = f"{func.__name__}_{operation_name}"
             return wrapper
         return decorator
 
-user_tracker = UserMetricsTracker()
\ No newline at end of file
+user_tracker = UserMetricsTracker()
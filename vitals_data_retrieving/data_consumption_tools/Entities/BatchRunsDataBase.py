@@ -0,0 +1,145 @@
+from .DataBase import BatchRunsRepository
+from .ResponseCode import ResponseCode
+from .Resilience import mongo_call, mongo_client_options, CircuitOpenError, DeadlineExceededError
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import os
+import pymongo
+
+
+class BatchRunsDataBase(BatchRunsRepository):
+    def __init__(self):
+        """
+        Initialize the MongoDB/CosmosDB collections of the batch run leases (BATCH_COLLECTION, or batch_runs) and
+        checkpoints (BATCH_CHECKPOINTS_COLLECTION, or batch_checkpoints)
+        """
+        if os.path.exists('.env'):
+            load_dotenv()
+        connection_string = os.environ.get('CONNECTION_STRING')
+        database_name = os.environ.get('DATABASE_NAME')
+        collection_name = os.environ.get('BATCH_COLLECTION', 'batch_runs')
+        checkpoints_collection_name = os.environ.get('BATCH_CHECKPOINTS_COLLECTION', 'batch_checkpoints')
+
+        client = pymongo.MongoClient(connection_string, **mongo_client_options())
+        self.collection_name = collection_name
+        try:
+            with mongo_call(collection_name, 'server_info'):
+                client.server_info()
+        except (pymongo.errors.ServerSelectionTimeoutError, CircuitOpenError, DeadlineExceededError):
+            raise TimeoutError("Invalid API for MongoDB connection string or timed out when attempting to connect")
+
+        database = client[database_name]
+        self.collection = database[collection_name]
+        self.checkpoints_collection_name = checkpoints_collection_name
+        self.checkpoints_collection = database[checkpoints_collection_name]
+
+    def claim_shard(self, run_id, shard, owner, lease_seconds) -> ResponseCode:
+        """
+        Claim the lease of a shard, or renew it if the owner already holds it
+
+        The lease document is upserted only if it is free: when another node holds a live lease or the shard is
+        completed, the filter does not match and the insert of the existing ID is rejected as a duplicate key.
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the claiming node
+        :param lease_seconds: float: Seconds the lease lasts unless renewed
+        :return: ResponseCode: SUCCESS if the owner holds the lease, ERROR_DUPLICATE_KEY if another node holds it or
+            the shard is completed
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            with mongo_call(self.collection_name, 'update_one'):
+                self.collection.update_one(
+                    {"_id": f"{run_id}:{shard}", "completed": False,
+                     "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                    {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds)},
+                     "$setOnInsert": {"run_id": run_id, "shard": shard}},
+                    upsert=True)
+            return ResponseCode.SUCCESS
+        except pymongo.errors.DuplicateKeyError:
+            return ResponseCode.ERROR_DUPLICATE_KEY
+        except Exception as e:
+            print(f"Error claiming shard: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def complete_shard(self, run_id, shard, owner) -> ResponseCode:
+        """
+        Mark a shard as completed, so that it is not claimed again
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the node holding the lease
+        :return: ResponseCode: SUCCESS, or ERROR_NOT_FOUND if the owner no longer holds the lease
+        """
+        try:
+            with mongo_call(self.collection_name, 'update_one'):
+                result = self.collection.update_one(
+                    {"_id": f"{run_id}:{shard}", "owner": owner}, {"$set": {"completed": True}})
+            return ResponseCode.SUCCESS if result.matched_count else ResponseCode.ERROR_NOT_FOUND
+        except Exception as e:
+            print(f"Error completing shard: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_shards(self, run_id) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the leases of the shards of a run claimed so far
+
+        :param run_id: str: Run ID
+        :return: tuple[ResponseCode, list[dict]]: Response code and leases (expires_at in ISO 8601), ordered by shard
+        """
+        try:
+            with mongo_call(self.collection_name, 'find'):
+                documents = list(self.collection.find({"run_id": run_id}, {"_id": 0}).sort("shard", 1))
+            for document in documents:
+                # MongoDB returns naive datetimes in UTC
+                document["expires_at"] = document["expires_at"].replace(tzinfo=timezone.utc).isoformat()
+            return ResponseCode.SUCCESS, documents
+        except Exception as e:
+            print(f"Error reading shards: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def record_checkpoints(self, run_id, checkpoints) -> ResponseCode:
+        """
+        Record the outcome of several users of a run, replacing the previous one
+
+        :param run_id: str: Run ID
+        :param checkpoints: dict: HTTP status keyed by user ID (hashed)
+        :return: ResponseCode: Response code
+        """
+        if not checkpoints:
+            return ResponseCode.SUCCESS
+        now = datetime.now(timezone.utc)
+        operations = [
+            pymongo.UpdateOne(
+                {"_id": f"{run_id}:{user_id}"},
+                {"$set": {"run_id": run_id, "user_id": user_id, "status": int(status), "updated_at": now}},
+                upsert=True)
+            for user_id, status in checkpoints.items()
+        ]
+        try:
+            with mongo_call(self.checkpoints_collection_name, 'bulk_write'):
+                self.checkpoints_collection.bulk_write(operations, ordered=False)
+            return ResponseCode.SUCCESS
+        except Exception as e:
+            print(f"Error recording checkpoints: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_checkpoints(self, run_id, user_ids) -> tuple[ResponseCode, dict]:
+        """
+        Return the recorded outcome of several users of a run
+
+        :param run_id: str: Run ID
+        :param user_ids: list[str]: User IDs (hashed)
+        :return: tuple[ResponseCode, dict]: Response code and HTTP status keyed by user ID, for the users recorded
+        """
+        if not user_ids:
+            return ResponseCode.SUCCESS, {}
+        try:
+            with mongo_call(self.checkpoints_collection_name, 'find'):
+                documents = list(self.checkpoints_collection.find(
+                    {"_id": {"$in": [f"{run_id}:{user_id}" for user_id in user_ids]}}, {"user_id": 1, "status": 1}))
+            return ResponseCode.SUCCESS, {document["user_id"]: document["status"] for document in documents}
+        except Exception as e:
+            print(f"Error reading checkpoints: {e}")
+            return ResponseCode.ERROR_UNKNOWN, {}
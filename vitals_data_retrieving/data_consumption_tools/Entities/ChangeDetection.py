@@ -0,0 +1,80 @@
+from .DataBase import VitalsRepository
+from .ResponseCode import ResponseCode
+from .UserIdentity import as_document_id
+from vitals_data_retrieving.vitals_data_retrieving_metrics import scope_writes
+from http import HTTPStatus
+import hashlib
+import json
+
+
+def scope_fingerprint(payload) -> str:
+    """
+    Compute the content fingerprint of a scope payload
+
+    The payload is canonicalized (sorted keys, no whitespace) before hashing, so the same data returned by Fitbit
+    with its keys in another order has the same fingerprint.
+
+    :param payload: Scope payload
+    :return: str: Hexadecimal BLAKE2b digest (128 bits)
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def is_error_payload(payload) -> bool:
+    """
+    Check whether a scope payload is the error message left by a failed fetch
+
+    :param payload: Scope payload
+    :return: bool: True for an error message
+    """
+    return isinstance(payload, dict) and 'error' in payload
+
+
+def write_changed_scopes(repository: VitalsRepository, documents: list[dict]) -> ResponseCode:
+    """
+    Store the data of several users and dates, writing only the scopes whose content changed
+
+    The fingerprints of the stored scopes are read with a single query and each scope of the new data is compared
+    with them: unchanged scopes are skipped, and the error message of a failed fetch is never stored as data (the
+    failure is recorded in the fetch status instead). The remaining scopes and the fetch status are written with a
+    single bulk update, so re-running the ingestion of a date only writes what Fitbit returned differently.
+
+    :param repository: VitalsRepository: Repository to write to
+    :param documents: list[dict]: Documents with user_id (UserKey, or hashed User ID), date ('YYYY-MM-DD'), data and
+        optionally scope_status (see Freshness.fetch_status)
+    :return: ResponseCode: Response code
+    """
+    keys = [(as_document_id(document["user_id"]), document["date"]) for document in documents]
+    response_code, stored = repository.read_fingerprints(keys)
+    if response_code == ResponseCode.ERROR_UNKNOWN:
+        return response_code
+
+    updates = []
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+    for key, document in zip(keys, documents):
+        previous = stored.get(key, {})
+        scope_status = document.get("scope_status", {})
+        data, fingerprints = {}, {}
+        for element, payload in document["data"].items():
+            if is_error_payload(payload) or scope_status.get(element, {}).get("status", HTTPStatus.OK) != HTTPStatus.OK:
+                counts['failed'] += 1
+                continue
+            fingerprint = scope_fingerprint(payload)
+            if previous.get(element) == fingerprint:
+                counts['unchanged'] += 1
+                continue
+            data[element] = payload
+            fingerprints[element] = fingerprint
+        counts['written'] += len(data)
+        # A document is created even when every scope failed, so that the failures can be repaired later
+        if data or scope_status or key not in stored:
+            updates.append({"user_id": key[0], "date": key[1], "data": data, "fingerprints": fingerprints,
+                            "scope_status": scope_status})
+
+    response_code = repository.update_scopes(updates) if updates else ResponseCode.SUCCESS
+    if response_code == ResponseCode.SUCCESS:
+        for outcome, count in counts.items():
+            if count:
+                scope_writes.labels(outcome=outcome).inc(count)
+    return response_code
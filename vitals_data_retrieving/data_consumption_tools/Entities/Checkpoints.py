@@ -0,0 +1,90 @@
+from __future__ import annotations
+from .DataBase import BatchRunsRepository
+from .ResponseCode import ResponseCode
+from .Storage import batch_database
+from dotenv import load_dotenv
+from http import HTTPStatus
+from typing import Callable
+import logging
+import os
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Users processed between two checkpoint writes: at most this many are processed again after a crash
+BATCH_CHECKPOINT_INTERVAL = int(os.environ.get('BATCH_CHECKPOINT_INTERVAL', 10))
+
+
+def succeeded(status) -> bool:
+    """
+    Whether the recorded outcome of a user is a success
+
+    :param status: int | None: HTTP status (None when nothing was recorded)
+    :return: bool: True for a 2xx status
+    """
+    return status is not None and 200 <= status < 300
+
+
+class RunCheckpoints:
+    def __init__(self, run_id: str, repository: BatchRunsRepository = None, interval: int = None,
+                 flush: Callable[[], bool] = None):
+        """
+        Initialize the per-user checkpoints of a batch run
+
+        The outcome of each user is buffered and written every interval users, so that a restarted or repeated run
+        can skip the users that succeeded (any 2xx status, e.g. daily vitals with some failed scopes, which are
+        tracked per scope instead). Users that failed are processed again.
+
+        :param run_id: str: Run ID, the same for every attempt of the run (e.g. "daily_vitals:2024-01-15")
+        :param repository: BatchRunsRepository: Checkpoints repository (defaults to the one of the storage backend)
+        :param interval: int: Users between two checkpoint writes (defaults to BATCH_CHECKPOINT_INTERVAL)
+        :param flush: Callable[[], bool]: Called before each write, so that a user is only checkpointed once its
+            work is durable (e.g. its writes left a write-behind buffer). It returns False when part of that work
+            could not be stored, and the buffered users are then recorded as failed
+        """
+        self.run_id = run_id
+        self.repository = repository or batch_database()
+        self.interval = max(1, interval or BATCH_CHECKPOINT_INTERVAL)
+        self.flush = flush
+        self.failed = 0
+        self._buffer = {}
+
+    def pending(self, user_ids: list[str]) -> list[str]:
+        """
+        Users of the run that have not succeeded yet
+
+        :param user_ids: list[str]: User IDs (hashed)
+        :return: list[str]: User IDs without a successful checkpoint, in the given order. Every user when the
+            checkpoints cannot be read
+        """
+        response_code, checkpoints = self.repository.read_checkpoints(self.run_id, user_ids)
+        if response_code != ResponseCode.SUCCESS:
+            logger.warning(f"Checkpoints of {self.run_id} could not be read, processing every user")
+            return list(user_ids)
+        return [user_id for user_id in user_ids if not succeeded(checkpoints.get(user_id))]
+
+    def record(self, user_id: str, status: HTTPStatus) -> None:
+        """
+        Record the outcome of a user, writing the buffered checkpoints every interval users
+
+        :param user_id: str: User ID (hashed)
+        :param status: HTTPStatus: Outcome of the user
+        """
+        self._buffer[user_id] = status
+        if len(self._buffer) >= self.interval:
+            self.commit()
+
+    def commit(self) -> None:
+        """
+        Write the buffered checkpoints
+        """
+        if not self._buffer:
+            return
+        checkpoints, self._buffer = self._buffer, {}
+        if self.flush is not None and not self.flush():
+            checkpoints = dict.fromkeys(checkpoints, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.failed += sum(1 for status in checkpoints.values() if not succeeded(status))
+        if self.repository.record_checkpoints(self.run_id, checkpoints) != ResponseCode.SUCCESS:
+            logger.warning(f"Checkpoints of {len(checkpoints)} users of {self.run_id} could not be recorded")
@@ -1,6 +1,7 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
+from vitals_data_retrieving.vitals_data_retrieving_tracing import traced
 from dotenv import load_dotenv
 import os
 import base64
@@ -26,6 +27,7 @@ class DataCipher:
         self.CIPHER_KEY = base64.b64decode(os.environ.get('CIPHER_KEY'))
         self.BLOCK_SIZE = 16
 
+    @traced('cipher.encrypt')
     def encrypt(self, plaintext) -> bytes:
         """
         Encrypt a plaintext string using AES-256 encryption
@@ -49,6 +51,7 @@ class DataCipher:
 
         return iv + ciphertext  # Prepend IV to ciphertext for later decryption
 
+    @traced('cipher.decrypt')
     def decrypt(self, ciphertext) -> str:
         """
         Decrypt a ciphertext string using AES-256 decryption
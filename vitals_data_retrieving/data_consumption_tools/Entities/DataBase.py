@@ -1,17 +1,29 @@
 from .ResponseCode import ResponseCode
 from abc import ABCMeta, abstractmethod
+from typing import Iterator
 
+# Device type of the users stored before it was recorded
+DEFAULT_DEVICE_TYPE = "fitbit"
 
-class DataBase(metaclass=ABCMeta):
+
+class UsersRepository(metaclass=ABCMeta):
+    """
+    Storage of the users, their wearable device type and their (ciphered) device API tokens
+
+    Documents have the shape {"_id": hashed User ID, "token": encoded token, "refresh_token": encoded refresh token,
+    "device_type": device type}, as expected by decode_data. Documents stored without device type belong to
+    DEFAULT_DEVICE_TYPE.
+    """
 
     @abstractmethod
-    def insert_document(self, document_id, token, refresh_token) -> ResponseCode:
+    def insert_document(self, document_id, token, refresh_token, device_type=DEFAULT_DEVICE_TYPE) -> ResponseCode:
         """
         Insert a document with the specified ID, token, and refresh token
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key, or raw User ID to be hashed
         :param token: str: Token
         :param refresh_token: str: Refresh token
+        :param device_type: str: Device type of the user, selecting the retriever that serves it
         :return: ResponseCode: Response code
         """
         pass
@@ -21,17 +33,27 @@ class DataBase(metaclass=ABCMeta):
         """
         Return the contents of the document containing document_id
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
         """
         pass
 
+    @abstractmethod
+    def read_documents(self, document_ids) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the documents whose ID is in document_ids with a single query
+
+        :param document_ids: list[UserKey | str]: User keys or document IDs (hashed User IDs)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents found
+        """
+        pass
+
     @abstractmethod
     def update_document(self, document_id, new_token, new_refresh_token) -> ResponseCode:
         """
         Update the token and refresh token in the document containing document_id
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :param new_token: str: New token
         :param new_refresh_token: str: New refresh token
         :return: ResponseCode: Response code
@@ -41,9 +63,9 @@ class DataBase(metaclass=ABCMeta):
     @abstractmethod
     def delete_document(self, document_id) -> ResponseCode:
         """
-        Delete the document containing document_id from the collection
+        Delete the document containing document_id
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :return: ResponseCode: Response code
         """
         pass
@@ -51,8 +73,224 @@ class DataBase(metaclass=ABCMeta):
     @abstractmethod
     def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
         """
-        Retrieve and return all documents from the collection
+        Retrieve and return all documents
 
         :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
         """
         pass
+
+
+class VitalsRepository(metaclass=ABCMeta):
+    """
+    Storage of the vitals data fetched for a user and date
+
+    Documents have the shape {"_id": document ID, "user_id": hashed User ID, "date": 'YYYY-MM-DD', "data": data keyed
+    by scope, "fingerprints": content hash keyed by scope, "scope_status": status and time of the last fetch keyed by
+    scope}. Only successfully fetched scopes are kept in data. Several documents may exist for the same user and date;
+    reads and scope updates use the first one stored.
+    """
+
+    @abstractmethod
+    def insert_document(self, user_id, date, data) -> ResponseCode:
+        """
+        Insert the data of a user for a given date
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param data: dict: Data keyed by scope
+        :return: ResponseCode: Response code
+        """
+        pass
+
+    @abstractmethod
+    def insert_documents(self, documents) -> ResponseCode:
+        """
+        Insert the data of several users and dates with a single bulk write
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD') and data
+        :return: ResponseCode: Response code
+        """
+        pass
+
+    @abstractmethod
+    def read_fingerprints(self, keys) -> tuple[ResponseCode, dict]:
+        """
+        Return the fingerprints of the stored scopes of several users and dates with a single query
+
+        :param keys: list[tuple[str, str]]: (User ID (hashed), date in 'YYYY-MM-DD' format) pairs
+        :return: tuple[ResponseCode, dict]: Response code and fingerprints keyed by scope, keyed by (User ID, date),
+            for the pairs that have a stored document
+        """
+        pass
+
+    @abstractmethod
+    def update_scopes(self, documents) -> ResponseCode:
+        """
+        Set some scopes of several users and dates with a single bulk write, creating the documents that do not exist
+
+        Only the given scopes are written: the other scopes of a stored document are left untouched.
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD'), data (scopes to
+            set), fingerprints (fingerprint of each of those scopes) and optionally scope_status (fetch status of
+            each fetched scope, see Freshness.fetch_status)
+        :return: ResponseCode: Response code
+        """
+        pass
+
+    @abstractmethod
+    def read_scope_status(self, dates) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the fetch status of the scopes of every user for several dates, without reading the data
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and
+            scope_status, empty for documents stored before the status was tracked)
+        """
+        pass
+
+    @abstractmethod
+    def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the contents of the document containing document_id
+
+        :param document_id: Document ID
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
+        """
+        pass
+
+    @abstractmethod
+    def read_user_day(self, user_id, date, scope=None) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the stored data of a user for a given date, reading only the requested scopes
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and data keyed by scope
+        """
+        pass
+
+    @abstractmethod
+    def read_user_days(self, user_ids, dates, scope=None) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the stored documents of several users and dates with a single query, reading only the requested scopes
+
+        :param user_ids: list[UserKey | str]: User keys or User IDs (hashed)
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and data)
+        """
+        pass
+
+    @abstractmethod
+    def read_dates(self) -> tuple[ResponseCode, list[str]]:
+        """
+        Return the dates that have stored documents
+
+        :return: tuple[ResponseCode, list[str]]: Response code and dates in 'YYYY-MM-DD' format, in ascending order
+        """
+        pass
+
+    @abstractmethod
+    def stream_documents(self, dates, scope=None) -> Iterator[dict]:
+        """
+        Iterate over the stored documents of several dates without loading them all in memory, reading only the
+        requested scopes
+
+        Documents are yielded date by date, in the order of dates, and in insertion order within a date. Errors are
+        raised rather than ending the iteration, so that a partial read is never taken as complete.
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: Iterator[dict]: Documents (_id, user_id, date and data)
+        """
+        pass
+
+    @abstractmethod
+    def delete_document(self, document_id) -> ResponseCode:
+        """
+        Delete the document containing document_id
+
+        :param document_id: Document ID
+        :return: ResponseCode: Response code
+        """
+        pass
+
+    @abstractmethod
+    def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
+        """
+        Retrieve and return all documents
+
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
+        """
+        pass
+
+
+class BatchRunsRepository(metaclass=ABCMeta):
+    """
+    Storage of the coordination state of the batch runs shared by several nodes
+
+    A run (e.g. the daily vitals of a date) splits its users into shards. Each shard is processed by the node holding
+    its lease, {"run_id": run ID, "shard": shard number, "owner": node ID, "expires_at": UTC time, "completed": bool}.
+    A lease that is not renewed before it expires (e.g. because its node crashed) can be claimed by another node.
+    The outcome of each user is kept as a checkpoint, {"run_id": run ID, "user_id": hashed User ID, "status": HTTP
+    status}, so that a restarted or repeated run only processes the users that did not succeed.
+    """
+
+    @abstractmethod
+    def claim_shard(self, run_id, shard, owner, lease_seconds) -> ResponseCode:
+        """
+        Claim the lease of a shard, or renew it if the owner already holds it
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the claiming node
+        :param lease_seconds: float: Seconds the lease lasts unless renewed
+        :return: ResponseCode: SUCCESS if the owner holds the lease, ERROR_DUPLICATE_KEY if another node holds it or
+            the shard is completed
+        """
+        pass
+
+    @abstractmethod
+    def complete_shard(self, run_id, shard, owner) -> ResponseCode:
+        """
+        Mark a shard as completed, so that it is not claimed again
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the node holding the lease
+        :return: ResponseCode: SUCCESS, or ERROR_NOT_FOUND if the owner no longer holds the lease
+        """
+        pass
+
+    @abstractmethod
+    def read_shards(self, run_id) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the leases of the shards of a run claimed so far
+
+        :param run_id: str: Run ID
+        :return: tuple[ResponseCode, list[dict]]: Response code and leases (expires_at in ISO 8601), ordered by shard
+        """
+        pass
+
+    @abstractmethod
+    def record_checkpoints(self, run_id, checkpoints) -> ResponseCode:
+        """
+        Record the outcome of several users of a run, replacing the previous one
+
+        :param run_id: str: Run ID
+        :param checkpoints: dict: HTTP status keyed by user ID (hashed)
+        :return: ResponseCode: Response code
+        """
+        pass
+
+    @abstractmethod
+    def read_checkpoints(self, run_id, user_ids) -> tuple[ResponseCode, dict]:
+        """
+        Return the recorded outcome of several users of a run
+
+        :param run_id: str: Run ID
+        :param user_ids: list[str]: User IDs (hashed)
+        :return: tuple[ResponseCode, dict]: Response code and HTTP status keyed by user ID, for the users recorded
+        """
+        pass
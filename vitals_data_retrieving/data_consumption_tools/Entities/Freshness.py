@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from http import HTTPStatus
+import os
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Hours from the start of a date after which the data of a scope no longer changes. Intraday series keep growing until
+# the end of the day and are synced later; sleep and the metrics measured during sleep (HRV, breathing rate, SpO2)
+# belong to the night ending on the date and are finalized once the user syncs in the morning. The margins cover
+# the offset between the users' time zone and UTC.
+SCOPE_FINAL_AFTER_HOURS = {
+    "heart_rate": 30,
+    "activity": 30,
+    "sleep": 18,
+    "heart_rate_variability": 18,
+    "breathing_rate": 18,
+    "spO2": 18,
+}
+
+# A scope is not fetched again more often than this. The interval doubles with each consecutive failed fetch, up to
+# REPAIR_MAX_INTERVAL_MINUTES, so that a scope that keeps failing does not use up the rate limit on every run
+REPAIR_MIN_INTERVAL_MINUTES = float(os.environ.get('REPAIR_MIN_INTERVAL_MINUTES', 60))
+REPAIR_MAX_INTERVAL_MINUTES = float(os.environ.get('REPAIR_MAX_INTERVAL_MINUTES', 24 * 60))
+
+
+def fetch_status(statuses: dict, fetched_at: datetime = None, previous: dict = None) -> dict:
+    """
+    Build the per-scope fetch status stored with the vitals of a user-day
+
+    :param statuses: dict: HTTP status of the last fetch of each scope
+    :param fetched_at: datetime: Time of the fetch (defaults to now)
+    :param previous: dict: Stored fetch status keyed by scope, to count the consecutive failed fetches
+    :return: dict: {"status": HTTP status, "fetched_at": ISO 8601 UTC time, "attempts": consecutive failed fetches}
+        keyed by scope
+    """
+    fetched_at = (fetched_at or datetime.now(timezone.utc)).isoformat()
+    previous = previous or {}
+    return {element: {"status": int(status), "fetched_at": fetched_at,
+                      "attempts": 0 if status == HTTPStatus.OK else _attempts(previous.get(element)) + 1}
+            for element, status in statuses.items()}
+
+
+def _attempts(status: dict | None) -> int:
+    # Statuses stored before the attempts were counted hold a single failed fetch
+    if status is None or status.get("status") == HTTPStatus.OK:
+        return 0
+    return status.get("attempts") or 1
+
+
+def final_after(element: str, date: str) -> datetime:
+    """
+    Time after which the data of a scope for a date no longer changes
+
+    :param element: str: Scope
+    :param date: str: Date in 'YYYY-MM-DD' format
+    :return: datetime: UTC time
+    """
+    start = datetime.fromisoformat(date).replace(tzinfo=timezone.utc)
+    return start + timedelta(hours=SCOPE_FINAL_AFTER_HOURS.get(element, 30))
+
+
+def scopes_to_repair(date: str, scope_status: dict, scope: list[str], now: datetime = None) -> list[str]:
+    """
+    Select the scopes of a stored user-day that have to be fetched again
+
+    A scope is repaired when it was never fetched, when its last fetch failed or when it was fetched before its data
+    was final, and not in the last REPAIR_MIN_INTERVAL_MINUTES (doubled for each consecutive failed fetch). A scope
+    the API reported as not found is never repaired.
+
+    :param date: str: Date in 'YYYY-MM-DD' format
+    :param scope_status: dict: Stored fetch status keyed by scope (see fetch_status)
+    :param scope: list[str]: Scopes to check
+    :param now: datetime: Current UTC time (defaults to now)
+    :return: list[str]: Scopes to fetch again
+    """
+    now = now or datetime.now(timezone.utc)
+    repairs = []
+    for element in scope:
+        status = scope_status.get(element)
+        if status is None:
+            repairs.append(element)
+            continue
+        if status.get("status") == HTTPStatus.NOT_FOUND:
+            continue
+        fetched_at = datetime.fromisoformat(status["fetched_at"])
+        if status.get("status") == HTTPStatus.OK and fetched_at >= final_after(element, date):
+            continue
+        interval = min(REPAIR_MIN_INTERVAL_MINUTES * 2 ** max(_attempts(status) - 1, 0), REPAIR_MAX_INTERVAL_MINUTES)
+        if now - fetched_at >= timedelta(minutes=interval):
+            repairs.append(element)
+    return repairs
@@ -0,0 +1,415 @@
+from .DataBase import UsersRepository, VitalsRepository, BatchRunsRepository, DEFAULT_DEVICE_TYPE
+from .ResponseCode import ResponseCode
+from .UsersDataBase import prepare_data
+from .UserIdentity import as_document_id
+from datetime import datetime, timezone
+from typing import Iterator
+import itertools
+import threading
+import time
+
+
+class MemoryUsersDataBase(UsersRepository):
+    def __init__(self):
+        """
+        Initialize an in-process users store, for benchmarks and tests (the data is lost when the process exits)
+        """
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def insert_document(self, document_id, token, refresh_token, device_type=DEFAULT_DEVICE_TYPE) -> ResponseCode:
+        """
+        Insert a document with the specified ID, token, and refresh token
+
+        :param document_id: UserKey | str: User key, or raw User ID to be hashed
+        :param token: str: Token
+        :param refresh_token: str: Refresh token
+        :param device_type: str: Device type of the user
+        :return: ResponseCode: Response code
+        """
+        hashed_id, encoded_token, encoded_refresh_token = prepare_data(document_id, token, refresh_token)
+        with self._lock:
+            if hashed_id in self._documents:
+                return ResponseCode.ERROR_DUPLICATE_KEY
+            self._documents[hashed_id] = {
+                "_id": hashed_id,
+                "token": encoded_token,
+                "refresh_token": encoded_refresh_token,
+                "device_type": device_type
+            }
+        return ResponseCode.SUCCESS
+
+    def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the contents of the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
+        """
+        document = self._documents.get(as_document_id(document_id))
+        if document:
+            return ResponseCode.SUCCESS, dict(document)
+        return ResponseCode.ERROR_NOT_FOUND, None
+
+    def read_documents(self, document_ids) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the documents whose ID is in document_ids
+
+        :param document_ids: list[UserKey | str]: User keys or document IDs (hashed User IDs)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents found
+        """
+        documents = [dict(self._documents[document_id]) for document_id in map(as_document_id, document_ids)
+                     if document_id in self._documents]
+        return (ResponseCode.SUCCESS if documents else ResponseCode.ERROR_NOT_FOUND), documents
+
+    def update_document(self, document_id, new_token, new_refresh_token) -> ResponseCode:
+        """
+        Update the token and refresh token in the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :param new_token: str: New token
+        :param new_refresh_token: str: New refresh token
+        :return: ResponseCode: Response code
+        """
+        _, encoded_token, encoded_refresh_token = prepare_data(None, new_token, new_refresh_token)
+        with self._lock:
+            document = self._documents.get(as_document_id(document_id))
+            if document is None:
+                return ResponseCode.ERROR_NOT_FOUND
+            document.update(token=encoded_token, refresh_token=encoded_refresh_token)
+        return ResponseCode.SUCCESS
+
+    def delete_document(self, document_id) -> ResponseCode:
+        """
+        Delete the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            if self._documents.pop(as_document_id(document_id), None) is None:
+                return ResponseCode.ERROR_NOT_FOUND
+        return ResponseCode.SUCCESS
+
+    def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
+        """
+        Retrieve and return all documents
+
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
+        """
+        with self._lock:
+            documents = [dict(document) for document in self._documents.values()]
+        return (ResponseCode.SUCCESS if documents else ResponseCode.ERROR_NOT_FOUND), documents
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every document (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            self._documents.clear()
+        return ResponseCode.SUCCESS
+
+
+class MemoryVitalsDataBase(VitalsRepository):
+    def __init__(self):
+        """
+        Initialize an in-process vitals store, for benchmarks and tests (the data is lost when the process exits)
+
+        The data is stored by reference, not copied: callers must not modify it after inserting it or reading it.
+        """
+        self._documents = {}
+        self._by_user_day = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def insert_document(self, user_id, date, data) -> ResponseCode:
+        """
+        Insert the data of a user for a given date
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param data: dict: Data keyed by scope
+        :return: ResponseCode: Response code
+        """
+        document = {"_id": next(self._ids), "user_id": as_document_id(user_id), "date": date, "data": data}
+        with self._lock:
+            self._documents[document["_id"]] = document
+            # Reads return the first document stored for a user and date, as find_one does
+            self._by_user_day.setdefault((document["user_id"], date), document)
+        return ResponseCode.SUCCESS
+
+    def insert_documents(self, documents) -> ResponseCode:
+        """
+        Insert the data of several users and dates
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD') and data
+        :return: ResponseCode: Response code
+        """
+        for document in documents:
+            self.insert_document(document["user_id"], document["date"], document["data"])
+        return ResponseCode.SUCCESS
+
+    def read_fingerprints(self, keys) -> tuple[ResponseCode, dict]:
+        """
+        Return the fingerprints of the stored scopes of several users and dates
+
+        :param keys: list[tuple[str, str]]: (User ID (hashed), date in 'YYYY-MM-DD' format) pairs
+        :return: tuple[ResponseCode, dict]: Response code and fingerprints keyed by scope, keyed by (User ID, date),
+            for the pairs that have a stored document
+        """
+        fingerprints = {}
+        with self._lock:
+            for user_id, date in keys:
+                document = self._by_user_day.get((as_document_id(user_id), date))
+                if document is not None:
+                    fingerprints[(document["user_id"], date)] = dict(document.get("fingerprints", {}))
+        return (ResponseCode.SUCCESS if fingerprints else ResponseCode.ERROR_NOT_FOUND), fingerprints
+
+    def update_scopes(self, documents) -> ResponseCode:
+        """
+        Set some scopes of several users and dates, creating the documents that do not exist
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD'), data (scopes to
+            set), fingerprints (fingerprint of each of those scopes) and optionally scope_status (fetch status of
+            each fetched scope)
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            for document in documents:
+                key = (as_document_id(document["user_id"]), document["date"])
+                stored = self._by_user_day.get(key)
+                if stored is None:
+                    stored = {"_id": next(self._ids), "user_id": key[0], "date": key[1], "data": {}}
+                    self._documents[stored["_id"]] = stored
+                    self._by_user_day[key] = stored
+                # Copied on write, so that the documents already handed to readers are not modified
+                stored["data"] = {**stored["data"], **document["data"]}
+                stored["fingerprints"] = {**stored.get("fingerprints", {}), **document["fingerprints"]}
+                stored["scope_status"] = {**stored.get("scope_status", {}), **document.get("scope_status", {})}
+        return ResponseCode.SUCCESS
+
+    def read_scope_status(self, dates) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the fetch status of the scopes of every user for several dates, without reading the data
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and
+            scope_status, empty for documents stored before the status was tracked)
+        """
+        dates = set(dates)
+        with self._lock:
+            documents = [{"user_id": user_id, "date": date, "scope_status": dict(document.get("scope_status", {}))}
+                         for (user_id, date), document in self._by_user_day.items() if date in dates]
+        return (ResponseCode.SUCCESS if documents else ResponseCode.ERROR_NOT_FOUND), documents
+
+    def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the contents of the document containing document_id
+
+        :param document_id: int: Document ID
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
+        """
+        document = self._documents.get(document_id)
+        if document:
+            return ResponseCode.SUCCESS, dict(document)
+        return ResponseCode.ERROR_NOT_FOUND, None
+
+    @staticmethod
+    def _project(data: dict, scope) -> dict:
+        return {element: data[element] for element in scope if element in data} if scope else dict(data)
+
+    def read_user_day(self, user_id, date, scope=None) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the stored data of a user for a given date, reading only the requested scopes
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and data keyed by scope
+        """
+        document = self._by_user_day.get((as_document_id(user_id), date))
+        if document is None:
+            return ResponseCode.ERROR_NOT_FOUND, None
+        return ResponseCode.SUCCESS, self._project(document["data"], scope)
+
+    def read_user_days(self, user_ids, dates, scope=None) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the stored documents of several users and dates, reading only the requested scopes
+
+        :param user_ids: list[UserKey | str]: User keys or User IDs (hashed)
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and data)
+        """
+        documents = []
+        for user_id in map(as_document_id, user_ids):
+            for date in dates:
+                document = self._by_user_day.get((user_id, date))
+                if document is not None:
+                    documents.append({"user_id": user_id, "date": date,
+                                      "data": self._project(document["data"], scope)})
+        return (ResponseCode.SUCCESS if documents else ResponseCode.ERROR_NOT_FOUND), documents
+
+    def read_dates(self) -> tuple[ResponseCode, list[str]]:
+        """
+        Return the dates that have stored documents
+
+        :return: tuple[ResponseCode, list[str]]: Response code and dates in 'YYYY-MM-DD' format, in ascending order
+        """
+        with self._lock:
+            dates = sorted({document["date"] for document in self._documents.values()})
+        return (ResponseCode.SUCCESS if dates else ResponseCode.ERROR_NOT_FOUND), dates
+
+    def stream_documents(self, dates, scope=None) -> Iterator[dict]:
+        """
+        Iterate over the stored documents of several dates, reading only the requested scopes
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: Iterator[dict]: Documents (_id, user_id, date and data)
+        """
+        for date in dates:
+            with self._lock:
+                documents = [document for document in self._documents.values() if document["date"] == date]
+            for document in documents:
+                yield {"_id": document["_id"], "user_id": document["user_id"], "date": date,
+                       "data": self._project(document["data"], scope)}
+
+    def delete_document(self, document_id) -> ResponseCode:
+        """
+        Delete the document containing document_id
+
+        :param document_id: int: Document ID
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            document = self._documents.pop(document_id, None)
+            if document is None:
+                return ResponseCode.ERROR_NOT_FOUND
+            key = (document["user_id"], document["date"])
+            if self._by_user_day.get(key) is document:
+                del self._by_user_day[key]
+                remaining = [other for other in self._documents.values()
+                             if (other["user_id"], other["date"]) == key]
+                if remaining:
+                    self._by_user_day[key] = min(remaining, key=lambda other: other["_id"])
+        return ResponseCode.SUCCESS
+
+    def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
+        """
+        Retrieve and return all documents
+
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
+        """
+        with self._lock:
+            documents = [dict(document) for document in self._documents.values()]
+        return (ResponseCode.SUCCESS if documents else ResponseCode.ERROR_NOT_FOUND), documents
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every document (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            self._documents.clear()
+            self._by_user_day.clear()
+        return ResponseCode.SUCCESS
+
+
+class MemoryBatchRunsDataBase(BatchRunsRepository):
+    def __init__(self):
+        """
+        Initialize an in-process store of the batch run leases, for benchmarks and tests (only coordinates the
+        threads of the process)
+        """
+        self._leases = {}
+        self._checkpoints = {}
+        self._lock = threading.Lock()
+
+    def claim_shard(self, run_id, shard, owner, lease_seconds) -> ResponseCode:
+        """
+        Claim the lease of a shard, or renew it if the owner already holds it
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the claiming node
+        :param lease_seconds: float: Seconds the lease lasts unless renewed
+        :return: ResponseCode: SUCCESS if the owner holds the lease, ERROR_DUPLICATE_KEY if another node holds it or
+            the shard is completed
+        """
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get((run_id, shard))
+            if lease is not None and (lease["completed"] or (lease["owner"] != owner and lease["expires_at"] > now)):
+                return ResponseCode.ERROR_DUPLICATE_KEY
+            self._leases[(run_id, shard)] = {"run_id": run_id, "shard": shard, "owner": owner,
+                                             "expires_at": now + lease_seconds, "completed": False}
+        return ResponseCode.SUCCESS
+
+    def complete_shard(self, run_id, shard, owner) -> ResponseCode:
+        """
+        Mark a shard as completed, so that it is not claimed again
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the node holding the lease
+        :return: ResponseCode: SUCCESS, or ERROR_NOT_FOUND if the owner no longer holds the lease
+        """
+        with self._lock:
+            lease = self._leases.get((run_id, shard))
+            if lease is None or lease["owner"] != owner:
+                return ResponseCode.ERROR_NOT_FOUND
+            lease["completed"] = True
+        return ResponseCode.SUCCESS
+
+    def read_shards(self, run_id) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the leases of the shards of a run claimed so far
+
+        :param run_id: str: Run ID
+        :return: tuple[ResponseCode, list[dict]]: Response code and leases (expires_at in ISO 8601), ordered by shard
+        """
+        with self._lock:
+            leases = sorted((dict(lease) for lease in self._leases.values() if lease["run_id"] == run_id),
+                            key=lambda lease: lease["shard"])
+        for lease in leases:
+            lease["expires_at"] = datetime.fromtimestamp(lease["expires_at"], timezone.utc).isoformat()
+        return ResponseCode.SUCCESS, leases
+
+    def record_checkpoints(self, run_id, checkpoints) -> ResponseCode:
+        """
+        Record the outcome of several users of a run, replacing the previous one
+
+        :param run_id: str: Run ID
+        :param checkpoints: dict: HTTP status keyed by user ID (hashed)
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            self._checkpoints.update({(run_id, user_id): int(status) for user_id, status in checkpoints.items()})
+        return ResponseCode.SUCCESS
+
+    def read_checkpoints(self, run_id, user_ids) -> tuple[ResponseCode, dict]:
+        """
+        Return the recorded outcome of several users of a run
+
+        :param run_id: str: Run ID
+        :param user_ids: list[str]: User IDs (hashed)
+        :return: tuple[ResponseCode, dict]: Response code and HTTP status keyed by user ID, for the users recorded
+        """
+        with self._lock:
+            return ResponseCode.SUCCESS, {user_id: self._checkpoints[(run_id, user_id)] for user_id in user_ids
+                                          if (run_id, user_id) in self._checkpoints}
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every lease and checkpoint (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        with self._lock:
+            self._leases.clear()
+            self._checkpoints.clear()
+        return ResponseCode.SUCCESS
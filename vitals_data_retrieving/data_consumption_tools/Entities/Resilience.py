@@ -0,0 +1,370 @@
+from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from dotenv import load_dotenv
+import asyncio
+import os
+import random
+import threading
+import time
+import pymongo
+from .Scheduler import database_scheduler
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Absolute monotonic time by which the current request has to be answered, None when it has no deadline
+_deadline: ContextVar[float | None] = ContextVar('request_deadline', default=None)
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+TIMEOUT_MIN_SECONDS = float(os.environ.get('TIMEOUT_MIN_SECONDS', 2))
+TIMEOUT_MAX_SECONDS = float(os.environ.get('TIMEOUT_MAX_SECONDS', 30))
+TIMEOUT_DEFAULT_SECONDS = float(os.environ.get('TIMEOUT_DEFAULT_SECONDS', 10))
+TIMEOUT_PERCENTILE = float(os.environ.get('TIMEOUT_PERCENTILE', 99))
+TIMEOUT_MULTIPLIER = float(os.environ.get('TIMEOUT_MULTIPLIER', 3))
+BACKOFF_BASE_SECONDS = float(os.environ.get('BACKOFF_BASE_SECONDS', 0.5))
+BACKOFF_MAX_SECONDS = float(os.environ.get('BACKOFF_MAX_SECONDS', 8))
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the circuit breaker of its dependency is open
+    """
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when a call is not started because the request deadline has already passed
+    """
+
+
+def set_deadline(seconds: float | None):
+    """
+    Set the deadline of the current request
+
+    :param seconds: float | None: Seconds from now until the deadline, None removes it
+    :return: Token to restore the previous deadline with reset_deadline
+    """
+    return _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def reset_deadline(token) -> None:
+    """
+    Restore the deadline that was active before set_deadline
+
+    :param token: Token returned by set_deadline
+    """
+    _deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """
+    Seconds left until the deadline of the current request
+
+    :return: float | None: Remaining seconds (may be negative), None when there is no deadline
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter
+
+    :param attempt: int: Number of the retry, starting at 0
+    :return: float: Seconds to wait before retrying
+    """
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def sleep_before_retry(attempt: int) -> bool:
+    """
+    Wait the backoff delay of a retry unless it would overrun the request deadline
+
+    :param attempt: int: Number of the retry, starting at 0
+    :return: bool: True if the caller can retry, False if the deadline does not leave time for it
+    """
+    delay = backoff_delay(attempt)
+    remaining = remaining_time()
+    if remaining is not None and remaining <= delay:
+        return False
+    time.sleep(delay)
+    return True
+
+
+async def async_sleep_before_retry(attempt: int) -> bool:
+    """
+    Wait the backoff delay of a retry without blocking the event loop, unless it would overrun the request deadline
+
+    :param attempt: int: Number of the retry, starting at 0
+    :return: bool: True if the caller can retry, False if the deadline does not leave time for it
+    """
+    delay = backoff_delay(attempt)
+    remaining = remaining_time()
+    if remaining is not None and remaining <= delay:
+        return False
+    await asyncio.sleep(delay)
+    return True
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        """
+        Initialize a tracker of the latest latencies of a dependency
+
+        :param window: int: Number of latest samples kept
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """
+        Record the latency of a successful call
+
+        :param seconds: float: Latency in seconds
+        """
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> float | None:
+        """
+        Get a percentile of the recorded latencies
+
+        :param percentile: float: Percentile between 0 and 100
+        :return: float | None: Latency in seconds, None when nothing was recorded
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def timeout(self) -> float:
+        """
+        Timeout derived from the observed latency: a multiple of the configured percentile, within the bounds
+
+        :return: float: Timeout in seconds
+        """
+        with self._lock:
+            enough_samples = len(self._samples) >= 20
+        if not enough_samples:
+            return TIMEOUT_DEFAULT_SECONDS
+        observed = self.percentile(TIMEOUT_PERCENTILE) * TIMEOUT_MULTIPLIER
+        return max(TIMEOUT_MIN_SECONDS, min(TIMEOUT_MAX_SECONDS, observed))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = None, reset_seconds: float = None):
+        """
+        Initialize a circuit breaker
+
+        The circuit opens after failure_threshold consecutive failures and rejects calls until reset_seconds have
+        passed, then lets a single trial call through: its success closes the circuit, its failure opens it again.
+
+        :param failure_threshold: int: Consecutive failures that open the circuit
+        :param reset_seconds: float: Seconds the circuit stays open before a trial call
+        """
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or BREAKER_RESET_SECONDS
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may proceed
+
+        :return: bool: True if the call may proceed
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """
+        Record a successful call
+        """
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        Record a failed call
+        """
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+_breakers: dict = {}
+_trackers: dict = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(key) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a dependency, creating it on first use
+
+    :param key: Dependency key (e.g., a DataEndpointsEnum member or "mongo:users")
+    :return: CircuitBreaker: Circuit breaker
+    """
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker()
+        return _breakers[key]
+
+
+def get_latency_tracker(key) -> LatencyTracker:
+    """
+    Get the latency tracker of a dependency, creating it on first use
+
+    :param key: Dependency key (e.g., a DataEndpointsEnum member or "mongo:users")
+    :return: LatencyTracker: Latency tracker
+    """
+    with _registry_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
+
+
+def call_timeout(key) -> float:
+    """
+    Timeout for the next call to a dependency: the adaptive timeout, capped by the request deadline
+
+    :param key: Dependency key
+    :return: float: Timeout in seconds
+    :raises DeadlineExceededError: If the request deadline has already passed
+    """
+    timeout = get_latency_tracker(key).timeout()
+    remaining = remaining_time()
+    if remaining is not None:
+        if remaining <= 0:
+            raise DeadlineExceededError(f"Request deadline exceeded before calling {key}")
+        timeout = min(timeout, remaining)
+    return timeout
+
+
+@contextmanager
+def guarded_call(key, is_failure=lambda error: True):
+    """
+    Run a call to a dependency behind its circuit breaker, with a deadline-aware adaptive timeout
+
+    :param key: Dependency key
+    :param is_failure: Callable deciding whether an exception raised by the call counts as a dependency failure
+    :return: float: Timeout the call has to use
+    :raises CircuitOpenError: If the circuit of the dependency is open
+    :raises DeadlineExceededError: If the request deadline has already passed
+    """
+    breaker = get_circuit_breaker(key)
+    timeout = call_timeout(key)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {key}")
+
+    start_time = time.monotonic()
+    try:
+        yield timeout
+    except Exception as e:
+        if is_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    get_latency_tracker(key).record(time.monotonic() - start_time)
+
+
+def _is_mongo_failure(error: Exception) -> bool:
+    # Duplicate keys and rejected operations are answers from a healthy server, timeouts are not
+    if isinstance(error, pymongo.errors.DuplicateKeyError):
+        return False
+    if isinstance(error, pymongo.errors.OperationFailure):
+        return error.timeout
+    return True
+
+
+# Hooks wrapping every MongoDB call, such as its latency histogram and trace span. The web layer installs them, so that
+# the entity layer can be imported without it
+_mongo_observers: list = []
+
+
+def observe_mongo_calls(observer) -> None:
+    """
+    Install a hook wrapping every MongoDB call made through mongo_call
+
+    :param observer: Callable[[str, str], ContextManager]: Called with the collection and operation names, returns the
+        context manager the call runs in
+    """
+    _mongo_observers.append(observer)
+
+
+@contextmanager
+def mongo_call(collection_name: str, operation: str, timeout: float = None):
+    """
+    Run a MongoDB operation behind the collection circuit breaker, bounded by the adaptive timeout
+
+    The operation first waits for a slot of the database scheduler, where interactive requests go ahead of batch work.
+
+    :param collection_name: str: Collection name, used as dependency key
+    :param operation: str: Operation name (e.g., "find_one"), used as metrics label
+    :param timeout: float: Fixed timeout for long operations such as full scans (None uses the adaptive timeout)
+    """
+    with ExitStack() as observers:
+        for observer in _mongo_observers:
+            observers.enter_context(observer(collection_name, operation))
+        with database_scheduler.slot(timeout=remaining_time()):
+            with guarded_call(f"mongo:{collection_name}", _is_mongo_failure) as adaptive_timeout:
+                if timeout is not None:
+                    remaining = remaining_time()
+                    timeout = timeout if remaining is None else min(timeout, remaining)
+                with pymongo.timeout(timeout if timeout is not None else adaptive_timeout):
+                    yield
+
+
+def mongo_client_options() -> dict:
+    """
+    Connection options that keep a degraded MongoDB/CosmosDB from blocking request threads for long
+
+    :return: dict: Keyword arguments for pymongo.MongoClient
+    """
+    return {
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    }
+
+
+def breaker_states() -> dict:
+    """
+    Snapshot of the circuit breakers and adaptive timeouts, for monitoring
+
+    :return: dict: State and timeout keyed by dependency name
+    """
+    with _registry_lock:
+        keys = list(_breakers)
+    return {
+        getattr(key, 'name', str(key)): {
+            'state': get_circuit_breaker(key).state,
+            'timeout_seconds': get_latency_tracker(key).timeout()
+        }
+        for key in keys
+    }
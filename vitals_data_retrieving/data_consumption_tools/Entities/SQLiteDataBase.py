@@ -0,0 +1,743 @@
+from .DataBase import UsersRepository, VitalsRepository, BatchRunsRepository, DEFAULT_DEVICE_TYPE
+from .ResponseCode import ResponseCode
+from .UsersDataBase import prepare_data
+from .UserIdentity import as_document_id
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from typing import Iterator
+import json
+import os
+import sqlite3
+import threading
+import time
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+
+class SQLiteConnections:
+    def __init__(self, path: str):
+        """
+        Initialize the connections to an SQLite database file, one per thread
+
+        The database runs in WAL mode, so readers do not block the writer nor each other, with synchronous=NORMAL
+        (a commit is durable once the WAL is checkpointed; a power loss can only drop the latest commits).
+
+        :param path: str: Database file
+        """
+        self.path = path
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, opening it on first use
+
+        :return: sqlite3.Connection: Connection in autocommit mode
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+
+_connections: dict = {}
+_connections_lock = threading.Lock()
+
+
+def get_connections(path: str = None) -> SQLiteConnections:
+    """
+    Get the connections to a database file, shared by every repository of the process
+
+    :param path: str: Database file (defaults to the SQLITE_PATH environment variable, or vitals.db)
+    :return: SQLiteConnections: Per-thread connections
+    """
+    path = path or os.environ.get('SQLITE_PATH', 'vitals.db')
+    with _connections_lock:
+        if path not in _connections:
+            _connections[path] = SQLiteConnections(path)
+        return _connections[path]
+
+
+class SQLiteUsersDataBase(UsersRepository):
+    _COLUMNS = "id, token, refresh_token, device_type"
+
+    def __init__(self, path: str = None):
+        """
+        Initialize the users table of an embedded SQLite database, for single-node deployments and tests
+
+        :param path: str: Database file (defaults to the SQLITE_PATH environment variable, or vitals.db)
+        """
+        self._connections = get_connections(path)
+        connection = self._connections.get()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, token TEXT NOT NULL, refresh_token TEXT NOT NULL, "
+            f"device_type TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE_TYPE}')")
+        # Tables created before the device type was stored get the column, their users keep the default type
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(users)")}
+        if "device_type" not in columns:
+            connection.execute(
+                f"ALTER TABLE users ADD COLUMN device_type TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE_TYPE}'")
+
+    @staticmethod
+    def _document(row) -> dict:
+        return {"_id": row[0], "token": row[1], "refresh_token": row[2], "device_type": row[3]}
+
+    def insert_document(self, document_id, token, refresh_token, device_type=DEFAULT_DEVICE_TYPE) -> ResponseCode:
+        """
+        Insert a document with the specified ID, token, and refresh token
+
+        :param document_id: UserKey | str: User key, or raw User ID to be hashed
+        :param token: str: Token
+        :param refresh_token: str: Refresh token
+        :param device_type: str: Device type of the user
+        :return: ResponseCode: Response code
+        """
+        hashed_id, encoded_token, encoded_refresh_token = prepare_data(document_id, token, refresh_token)
+        try:
+            self._connections.get().execute(
+                "INSERT INTO users (id, token, refresh_token, device_type) VALUES (?, ?, ?, ?)",
+                (hashed_id, encoded_token, encoded_refresh_token, device_type))
+            return ResponseCode.SUCCESS
+        except sqlite3.IntegrityError:
+            return ResponseCode.ERROR_DUPLICATE_KEY
+        except sqlite3.Error as e:
+            print(f"Error inserting document: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the contents of the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
+        """
+        try:
+            row = self._connections.get().execute(
+                f"SELECT {self._COLUMNS} FROM users WHERE id = ?", (as_document_id(document_id),)).fetchone()
+            if row:
+                return ResponseCode.SUCCESS, self._document(row)
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, None
+        except sqlite3.Error as e:
+            print(f"Error reading document: {e}")
+            return ResponseCode.ERROR_UNKNOWN, None
+
+    def read_documents(self, document_ids) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the documents whose ID is in document_ids with a single query
+
+        :param document_ids: list[UserKey | str]: User keys or document IDs (hashed User IDs)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents found
+        """
+        ids = [as_document_id(key) for key in document_ids]
+        try:
+            rows = self._connections.get().execute(
+                f"SELECT {self._COLUMNS} FROM users WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+            if rows:
+                return ResponseCode.SUCCESS, [self._document(row) for row in rows]
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error reading documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def update_document(self, document_id, new_token, new_refresh_token) -> ResponseCode:
+        """
+        Update the token and refresh token in the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :param new_token: str: New token
+        :param new_refresh_token: str: New refresh token
+        :return: ResponseCode: Response code
+        """
+        _, encoded_token, encoded_refresh_token = prepare_data(None, new_token, new_refresh_token)
+        try:
+            cursor = self._connections.get().execute(
+                "UPDATE users SET token = ?, refresh_token = ? WHERE id = ?",
+                (encoded_token, encoded_refresh_token, as_document_id(document_id)))
+            if cursor.rowcount > 0:
+                return ResponseCode.SUCCESS
+            else:
+                return ResponseCode.ERROR_NOT_FOUND
+        except sqlite3.Error as e:
+            print(f"Error updating document: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def delete_document(self, document_id) -> ResponseCode:
+        """
+        Delete the document containing document_id
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
+        :return: ResponseCode: Response code
+        """
+        try:
+            cursor = self._connections.get().execute("DELETE FROM users WHERE id = ?", (as_document_id(document_id),))
+            if cursor.rowcount > 0:
+                return ResponseCode.SUCCESS
+            else:
+                return ResponseCode.ERROR_NOT_FOUND
+        except sqlite3.Error as e:
+            print(f"Error deleting document: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
+        """
+        Retrieve and return all documents
+
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
+        """
+        try:
+            rows = self._connections.get().execute(f"SELECT {self._COLUMNS} FROM users").fetchall()
+            if rows:
+                return ResponseCode.SUCCESS, [self._document(row) for row in rows]
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error getting all documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every document (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        try:
+            self._connections.get().execute("DELETE FROM users")
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error deleting all documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+
+class SQLiteVitalsDataBase(VitalsRepository):
+    def __init__(self, path: str = None):
+        """
+        Initialize the vitals tables of an embedded SQLite database, for single-node deployments and tests
+
+        Each scope of a document is stored in its own row, so reading the small scopes of a day does not decode the
+        large intraday ones.
+
+        :param path: str: Database file (defaults to the SQLITE_PATH environment variable, or vitals.db)
+        """
+        self._connections = get_connections(path)
+        connection = self._connections.get()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS vitals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+            "date TEXT NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS vitals_user_date ON vitals (user_id, date)")
+        connection.execute("CREATE INDEX IF NOT EXISTS vitals_date ON vitals (date)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS vitals_data (vitals_id INTEGER NOT NULL, scope TEXT NOT NULL, "
+            "data TEXT NOT NULL, fingerprint TEXT, PRIMARY KEY (vitals_id, scope)) WITHOUT ROWID")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS vitals_status (vitals_id INTEGER NOT NULL, scope TEXT NOT NULL, "
+            "status INTEGER NOT NULL, fetched_at TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (vitals_id, scope)) WITHOUT ROWID")
+        # Databases created before the scopes were fingerprinted
+        if "fingerprint" not in {row[1] for row in connection.execute("PRAGMA table_info(vitals_data)")}:
+            connection.execute("ALTER TABLE vitals_data ADD COLUMN fingerprint TEXT")
+        # Databases created before the failed fetches were counted
+        if "attempts" not in {row[1] for row in connection.execute("PRAGMA table_info(vitals_status)")}:
+            connection.execute("ALTER TABLE vitals_status ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    @staticmethod
+    def _scope_filter(scope) -> tuple[str, list]:
+        # Condition and parameters restricting the scope rows read
+        if not scope:
+            return "", []
+        return f" AND scope IN ({','.join('?' * len(scope))})", list(scope)
+
+    def _read_data(self, connection, vitals_id: int, scope=None) -> dict:
+        condition, parameters = self._scope_filter(scope)
+        rows = connection.execute(
+            f"SELECT scope, data FROM vitals_data WHERE vitals_id = ?{condition}", [vitals_id] + parameters)
+        return {element: json.loads(data) for element, data in rows}
+
+    def insert_document(self, user_id, date, data) -> ResponseCode:
+        """
+        Insert the data of a user for a given date
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param data: dict: Data keyed by scope
+        :return: ResponseCode: Response code
+        """
+        return self.insert_documents([{"user_id": user_id, "date": date, "data": data}])
+
+    def insert_documents(self, documents) -> ResponseCode:
+        """
+        Insert the data of several users and dates in a single transaction
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD') and data
+        :return: ResponseCode: Response code
+        """
+        # Serialized before taking the write lock, so that other writers are not blocked meanwhile
+        rows = [(as_document_id(document["user_id"]), document["date"],
+                 [(element, json.dumps(payload, separators=(',', ':')))
+                  for element, payload in document["data"].items()])
+                for document in documents]
+        connection = self._connections.get()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, date, scopes in rows:
+                    vitals_id = connection.execute(
+                        "INSERT INTO vitals (user_id, date) VALUES (?, ?)", (user_id, date)).lastrowid
+                    connection.executemany("INSERT INTO vitals_data (vitals_id, scope, data) VALUES (?, ?, ?)",
+                                           [(vitals_id, element, payload) for element, payload in scopes])
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error inserting document: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_fingerprints(self, keys) -> tuple[ResponseCode, dict]:
+        """
+        Return the fingerprints of the stored scopes of several users and dates with a single query
+
+        :param keys: list[tuple[str, str]]: (User ID (hashed), date in 'YYYY-MM-DD' format) pairs
+        :return: tuple[ResponseCode, dict]: Response code and fingerprints keyed by scope, keyed by (User ID, date),
+            for the pairs that have a stored document
+        """
+        keys = {(as_document_id(user_id), date) for user_id, date in keys}
+        ids = list({user_id for user_id, _ in keys})
+        dates = list({date for _, date in keys})
+        try:
+            rows = self._connections.get().execute(
+                f"SELECT v.id, v.user_id, v.date, d.scope, d.fingerprint FROM vitals v "
+                f"LEFT JOIN vitals_data d ON d.vitals_id = v.id "
+                f"WHERE v.user_id IN ({','.join('?' * len(ids))}) AND v.date IN ({','.join('?' * len(dates))}) "
+                f"ORDER BY v.id",
+                ids + dates).fetchall()
+            fingerprints, first_ids = {}, {}
+            for vitals_id, user_id, date, element, fingerprint in rows:
+                key = (user_id, date)
+                # The first document stored is the one read and updated
+                if key not in keys or first_ids.setdefault(key, vitals_id) != vitals_id:
+                    continue
+                fingerprints.setdefault(key, {})
+                if element is not None and fingerprint is not None:
+                    fingerprints[key][element] = fingerprint
+            if fingerprints:
+                return ResponseCode.SUCCESS, fingerprints
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, {}
+        except sqlite3.Error as e:
+            print(f"Error reading fingerprints: {e}")
+            return ResponseCode.ERROR_UNKNOWN, {}
+
+    def update_scopes(self, documents) -> ResponseCode:
+        """
+        Set some scopes of several users and dates in a single transaction, creating the documents that do not exist
+
+        Only the rows of the given scopes are written.
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD'), data (scopes to
+            set), fingerprints (fingerprint of each of those scopes) and optionally scope_status (fetch status of
+            each fetched scope)
+        :return: ResponseCode: Response code
+        """
+        rows = [(as_document_id(document["user_id"]), document["date"],
+                 [(element, json.dumps(payload, separators=(',', ':')), document["fingerprints"].get(element))
+                  for element, payload in document["data"].items()],
+                 [(element, status["status"], status["fetched_at"], status.get("attempts", 0))
+                  for element, status in document.get("scope_status", {}).items()])
+                for document in documents]
+        connection = self._connections.get()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, date, scopes, statuses in rows:
+                    row = connection.execute(
+                        "SELECT id FROM vitals WHERE user_id = ? AND date = ? ORDER BY id LIMIT 1",
+                        (user_id, date)).fetchone()
+                    vitals_id = row[0] if row else connection.execute(
+                        "INSERT INTO vitals (user_id, date) VALUES (?, ?)", (user_id, date)).lastrowid
+                    connection.executemany(
+                        "INSERT INTO vitals_data (vitals_id, scope, data, fingerprint) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (vitals_id, scope) DO UPDATE SET data = excluded.data, "
+                        "fingerprint = excluded.fingerprint",
+                        [(vitals_id, element, payload, fingerprint) for element, payload, fingerprint in scopes])
+                    connection.executemany(
+                        "INSERT INTO vitals_status (vitals_id, scope, status, fetched_at, attempts) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (vitals_id, scope) DO UPDATE SET status = excluded.status, "
+                        "fetched_at = excluded.fetched_at, attempts = excluded.attempts",
+                        [(vitals_id, *status) for status in statuses])
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error updating documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_scope_status(self, dates) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the fetch status of the scopes of every user for several dates, without reading the data
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and
+            scope_status, empty for documents stored before the status was tracked)
+        """
+        dates = list(dates)
+        try:
+            rows = self._connections.get().execute(
+                f"SELECT v.id, v.user_id, v.date, s.scope, s.status, s.fetched_at, s.attempts FROM vitals v "
+                f"LEFT JOIN vitals_status s ON s.vitals_id = v.id "
+                f"WHERE v.date IN ({','.join('?' * len(dates))}) ORDER BY v.id",
+                dates).fetchall()
+            documents, first_ids = {}, {}
+            for vitals_id, user_id, date, element, status, fetched_at, attempts in rows:
+                # The first document stored is the one read and updated
+                if first_ids.setdefault((user_id, date), vitals_id) != vitals_id:
+                    continue
+                document = documents.setdefault(vitals_id, {"user_id": user_id, "date": date, "scope_status": {}})
+                if element is not None:
+                    document["scope_status"][element] = {"status": status, "fetched_at": fetched_at,
+                                                         "attempts": attempts}
+            if documents:
+                return ResponseCode.SUCCESS, list(documents.values())
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error reading scope status: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the contents of the document containing document_id
+
+        :param document_id: int: Document ID
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
+        """
+        connection = self._connections.get()
+        try:
+            row = connection.execute("SELECT id, user_id, date FROM vitals WHERE id = ?", (document_id,)).fetchone()
+            if row:
+                return ResponseCode.SUCCESS, {"_id": row[0], "user_id": row[1], "date": row[2],
+                                              "data": self._read_data(connection, row[0])}
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, None
+        except sqlite3.Error as e:
+            print(f"Error reading document: {e}")
+            return ResponseCode.ERROR_UNKNOWN, None
+
+    def read_user_day(self, user_id, date, scope=None) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the stored data of a user for a given date, reading only the requested scopes
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and data keyed by scope
+        """
+        connection = self._connections.get()
+        try:
+            row = connection.execute(
+                "SELECT id FROM vitals WHERE user_id = ? AND date = ? ORDER BY id LIMIT 1",
+                (as_document_id(user_id), date)).fetchone()
+            if row:
+                return ResponseCode.SUCCESS, self._read_data(connection, row[0], scope)
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, None
+        except sqlite3.Error as e:
+            print(f"Error reading document: {e}")
+            return ResponseCode.ERROR_UNKNOWN, None
+
+    def read_user_days(self, user_ids, dates, scope=None) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the stored documents of several users and dates with a single query, reading only the requested scopes
+
+        :param user_ids: list[UserKey | str]: User keys or User IDs (hashed)
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and data)
+        """
+        ids = [as_document_id(key) for key in user_ids]
+        dates = list(dates)
+        condition, parameters = self._scope_filter(scope)
+        try:
+            rows = self._connections.get().execute(
+                f"SELECT v.id, v.user_id, v.date, d.scope, d.data FROM vitals v "
+                f"LEFT JOIN vitals_data d ON d.vitals_id = v.id{condition} "
+                f"WHERE v.user_id IN ({','.join('?' * len(ids))}) AND v.date IN ({','.join('?' * len(dates))}) "
+                f"ORDER BY v.id",
+                parameters + ids + dates).fetchall()
+            documents = {}
+            for vitals_id, user_id, date, element, data in rows:
+                document = documents.setdefault(vitals_id, {"user_id": user_id, "date": date, "data": {}})
+                if element is not None:
+                    document["data"][element] = json.loads(data)
+            if documents:
+                return ResponseCode.SUCCESS, list(documents.values())
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error reading documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def read_dates(self) -> tuple[ResponseCode, list[str]]:
+        """
+        Return the dates that have stored documents
+
+        :return: tuple[ResponseCode, list[str]]: Response code and dates in 'YYYY-MM-DD' format, in ascending order
+        """
+        try:
+            rows = self._connections.get().execute("SELECT DISTINCT date FROM vitals ORDER BY date").fetchall()
+            if rows:
+                return ResponseCode.SUCCESS, [row[0] for row in rows]
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error reading dates: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def stream_documents(self, dates, scope=None) -> Iterator[dict]:
+        """
+        Iterate over the stored documents of several dates without loading them all in memory, reading only the
+        requested scopes
+
+        Rows are fetched lazily from a single query per date; in WAL mode the read sees a consistent snapshot and does
+        not block the writers.
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: Iterator[dict]: Documents (_id, user_id, date and data)
+        """
+        connection = self._connections.get()
+        condition, parameters = self._scope_filter(scope)
+        for date in dates:
+            document = None
+            for vitals_id, user_id, element, data in connection.execute(
+                    f"SELECT v.id, v.user_id, d.scope, d.data FROM vitals v "
+                    f"LEFT JOIN vitals_data d ON d.vitals_id = v.id{condition} WHERE v.date = ? ORDER BY v.id",
+                    parameters + [date]):
+                if document is None or document["_id"] != vitals_id:
+                    if document is not None:
+                        yield document
+                    document = {"_id": vitals_id, "user_id": user_id, "date": date, "data": {}}
+                if element is not None:
+                    document["data"][element] = json.loads(data)
+            if document is not None:
+                yield document
+
+    def delete_document(self, document_id) -> ResponseCode:
+        """
+        Delete the document containing document_id
+
+        :param document_id: int: Document ID
+        :return: ResponseCode: Response code
+        """
+        connection = self._connections.get()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = connection.execute("DELETE FROM vitals WHERE id = ?", (document_id,)).rowcount
+                connection.execute("DELETE FROM vitals_data WHERE vitals_id = ?", (document_id,))
+                connection.execute("DELETE FROM vitals_status WHERE vitals_id = ?", (document_id,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            if deleted > 0:
+                return ResponseCode.SUCCESS
+            else:
+                return ResponseCode.ERROR_NOT_FOUND
+        except sqlite3.Error as e:
+            print(f"Error deleting document: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def get_all_documents(self) -> tuple[ResponseCode, list[dict]]:
+        """
+        Retrieve and return all documents
+
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
+        """
+        connection = self._connections.get()
+        try:
+            rows = connection.execute("SELECT id, user_id, date FROM vitals ORDER BY id").fetchall()
+            if rows:
+                return ResponseCode.SUCCESS, [{"_id": row[0], "user_id": row[1], "date": row[2],
+                                               "data": self._read_data(connection, row[0])} for row in rows]
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except sqlite3.Error as e:
+            print(f"Error getting all documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every document (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        connection = self._connections.get()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM vitals")
+                connection.execute("DELETE FROM vitals_data")
+                connection.execute("DELETE FROM vitals_status")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error deleting all documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+
+class SQLiteBatchRunsDataBase(BatchRunsRepository):
+    def __init__(self, path: str = None):
+        """
+        Initialize the batch run leases and checkpoints tables of an embedded SQLite database, shared by the processes
+        of a node
+
+        :param path: str: Database file (defaults to the SQLITE_PATH environment variable, or vitals.db)
+        """
+        self._connections = get_connections(path)
+        connection = self._connections.get()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS batch_leases (run_id TEXT NOT NULL, shard INTEGER NOT NULL, "
+            "owner TEXT NOT NULL, expires_at REAL NOT NULL, completed INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (run_id, shard)) WITHOUT ROWID")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS batch_checkpoints (run_id TEXT NOT NULL, user_id TEXT NOT NULL, "
+            "status INTEGER NOT NULL, updated_at TEXT NOT NULL, PRIMARY KEY (run_id, user_id)) WITHOUT ROWID")
+
+    def claim_shard(self, run_id, shard, owner, lease_seconds) -> ResponseCode:
+        """
+        Claim the lease of a shard, or renew it if the owner already holds it
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the claiming node
+        :param lease_seconds: float: Seconds the lease lasts unless renewed
+        :return: ResponseCode: SUCCESS if the owner holds the lease, ERROR_DUPLICATE_KEY if another node holds it or
+            the shard is completed
+        """
+        now = time.time()
+        try:
+            # The conflicting row is only updated when the lease is free, otherwise no row changes
+            cursor = self._connections.get().execute(
+                "INSERT INTO batch_leases (run_id, shard, owner, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (run_id, shard) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE completed = 0 AND (owner = excluded.owner OR expires_at <= ?)",
+                (run_id, shard, owner, now + lease_seconds, now))
+            return ResponseCode.SUCCESS if cursor.rowcount else ResponseCode.ERROR_DUPLICATE_KEY
+        except sqlite3.Error as e:
+            print(f"Error claiming shard: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def complete_shard(self, run_id, shard, owner) -> ResponseCode:
+        """
+        Mark a shard as completed, so that it is not claimed again
+
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of the node holding the lease
+        :return: ResponseCode: SUCCESS, or ERROR_NOT_FOUND if the owner no longer holds the lease
+        """
+        try:
+            cursor = self._connections.get().execute(
+                "UPDATE batch_leases SET completed = 1 WHERE run_id = ? AND shard = ? AND owner = ?",
+                (run_id, shard, owner))
+            return ResponseCode.SUCCESS if cursor.rowcount else ResponseCode.ERROR_NOT_FOUND
+        except sqlite3.Error as e:
+            print(f"Error completing shard: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_shards(self, run_id) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the leases of the shards of a run claimed so far
+
+        :param run_id: str: Run ID
+        :return: tuple[ResponseCode, list[dict]]: Response code and leases (expires_at in ISO 8601), ordered by shard
+        """
+        try:
+            rows = self._connections.get().execute(
+                "SELECT shard, owner, expires_at, completed FROM batch_leases WHERE run_id = ? ORDER BY shard",
+                (run_id,)).fetchall()
+            return ResponseCode.SUCCESS, [
+                {"run_id": run_id, "shard": shard, "owner": owner,
+                 "expires_at": datetime.fromtimestamp(expires_at, timezone.utc).isoformat(),
+                 "completed": bool(completed)}
+                for shard, owner, expires_at, completed in rows]
+        except sqlite3.Error as e:
+            print(f"Error reading shards: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def record_checkpoints(self, run_id, checkpoints) -> ResponseCode:
+        """
+        Record the outcome of several users of a run, replacing the previous one
+
+        :param run_id: str: Run ID
+        :param checkpoints: dict: HTTP status keyed by user ID (hashed)
+        :return: ResponseCode: Response code
+        """
+        updated_at = datetime.now(timezone.utc).isoformat()
+        connection = self._connections.get()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO batch_checkpoints (run_id, user_id, status, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(run_id, user_id, int(status), updated_at) for user_id, status in checkpoints.items()])
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error recording checkpoints: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_checkpoints(self, run_id, user_ids) -> tuple[ResponseCode, dict]:
+        """
+        Return the recorded outcome of several users of a run
+
+        :param run_id: str: Run ID
+        :param user_ids: list[str]: User IDs (hashed)
+        :return: tuple[ResponseCode, dict]: Response code and HTTP status keyed by user ID, for the users recorded
+        """
+        user_ids = list(user_ids)
+        checkpoints = {}
+        try:
+            connection = self._connections.get()
+            # In chunks, to stay under the limit of SQL variables
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                checkpoints.update(connection.execute(
+                    f"SELECT user_id, status FROM batch_checkpoints WHERE run_id = ? "
+                    f"AND user_id IN ({','.join('?' * len(chunk))})", [run_id, *chunk]).fetchall())
+            return ResponseCode.SUCCESS, checkpoints
+        except sqlite3.Error as e:
+            print(f"Error reading checkpoints: {e}")
+            return ResponseCode.ERROR_UNKNOWN, {}
+
+    def delete_all_documents(self) -> ResponseCode:
+        """
+        Delete every lease and checkpoint (benchmarks and tests only, not part of the repository interface)
+
+        :return: ResponseCode: Response code
+        """
+        try:
+            self._connections.get().execute("DELETE FROM batch_leases")
+            self._connections.get().execute("DELETE FROM batch_checkpoints")
+            return ResponseCode.SUCCESS
+        except sqlite3.Error as e:
+            print(f"Error deleting all documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
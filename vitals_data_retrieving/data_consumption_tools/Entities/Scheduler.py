@@ -0,0 +1,349 @@
+from __future__ import annotations
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from enum import IntEnum
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Hooks called with the resource, the priority class and the seconds each call waited for its slot, such as the wait
+# histogram. The web layer installs them, so that the entity layer can be imported without it
+_wait_observers: list = []
+
+
+def observe_scheduler_waits(observer) -> None:
+    """
+    Install a hook called with the time each call waited for a slot of a scheduler
+
+    :param observer: Callable[[str, Priority, float], None]: Called with the resource name, the priority class and the
+        seconds waited
+    """
+    _wait_observers.append(observer)
+
+
+FITBIT_SLOTS = int(os.environ.get('SCHEDULER_FITBIT_SLOTS', 8))
+FITBIT_BATCH_SLOTS = int(os.environ.get('SCHEDULER_FITBIT_BATCH_SLOTS', 4))
+DATABASE_SLOTS = int(os.environ.get('SCHEDULER_DATABASE_SLOTS', 16))
+DATABASE_BATCH_SLOTS = int(os.environ.get('SCHEDULER_DATABASE_BATCH_SLOTS', 8))
+# Fitbit requests of each user's hourly quota that batch work leaves to the interactive requests
+BATCH_QUOTA_RESERVE = int(os.environ.get('BATCH_QUOTA_RESERVE', 20))
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of the outbound work, lower values are served first
+    """
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+# Priority class of the work done by the current request or thread
+_priority: ContextVar[Priority] = ContextVar('work_priority', default=Priority.INTERACTIVE)
+
+
+def set_priority(priority: Priority):
+    """
+    Set the priority class of the current request or thread
+
+    :param priority: Priority: Priority class
+    :return: Token to restore the previous priority with reset_priority
+    """
+    return _priority.set(priority)
+
+
+def reset_priority(token) -> None:
+    """
+    Restore the priority class that was active before set_priority
+
+    :param token: Token returned by set_priority
+    """
+    _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    """
+    Priority class of the current request or thread
+
+    :return: Priority: Priority class
+    """
+    return _priority.get()
+
+
+class _AsyncWaiter:
+    """
+    Waiter of a coroutine for a scheduler slot, which may be granted from any thread
+    """
+    __slots__ = ('_loop', '_future', '_set')
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._future = self._loop.create_future()
+        self._set = False
+
+    def set(self) -> None:
+        self._set = True
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def is_set(self) -> bool:
+        return self._set
+
+    async def wait(self, timeout: float | None) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            return self._set
+        return True
+
+
+class PriorityScheduler:
+    def __init__(self, name: str, slots: int, batch_slots: int):
+        """
+        Initialize the scheduler of the concurrent calls to a dependency
+
+        A call runs once it holds one of the slots. Freed slots go to the waiting interactive calls before any
+        waiting batch call (in arrival order within a class), and batch calls never hold more than batch_slots, so
+        the remaining slots are always available to interactive requests and a batch run cannot delay them by more
+        than the call already in progress.
+
+        :param name: str: Dependency name, used as metrics label
+        :param slots: int: Concurrent calls
+        :param batch_slots: int: Concurrent batch calls (at most slots - 1)
+        """
+        self.name = name
+        self.slots = max(1, slots)
+        self.batch_slots = max(1, min(batch_slots, self.slots - 1)) if self.slots > 1 else 1
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._running = {priority: 0 for priority in Priority}
+        self._granted = {priority: 0 for priority in Priority}
+
+    def _can_run(self, priority: Priority) -> bool:
+        if sum(self._running.values()) >= self.slots:
+            return False
+        return priority != Priority.BATCH or self._running[Priority.BATCH] < self.batch_slots
+
+    def _wake_next(self) -> None:
+        # Grant the freed slots in priority order, skipping batch waiters while batch holds its share
+        granted = []
+        for entry in sorted(self._waiters):
+            priority, _, event = entry
+            if self._can_run(priority):
+                self._running[priority] += 1
+                granted.append(entry)
+                event.set()
+        for entry in granted:
+            self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    def _enter(self, priority: Priority, waiter_factory):
+        # Take a free slot right away, or queue a waiter that is set once a slot is granted to it
+        with self._lock:
+            # Waiting calls of the same or a higher priority go first, waiting batch calls do not hold back interactive
+            if (not self._waiters or self._waiters[0][0] > priority) and self._can_run(priority):
+                self._running[priority] += 1
+                return None
+            entry = (priority, next(self._sequence), waiter_factory())
+            heapq.heappush(self._waiters, entry)
+            return entry
+
+    def _abandon(self, entry) -> bool:
+        # Stop waiting: returns True if the slot was granted in the meantime, and is then held by the caller
+        with self._lock:
+            if entry[2].is_set():
+                return True
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            return False
+
+    def _exit(self, priority: Priority) -> None:
+        with self._lock:
+            self._running[priority] -= 1
+            self._granted[priority] += 1
+            self._wake_next()
+
+    def _observe_wait(self, priority: Priority, start_time: float) -> None:
+        waited = time.perf_counter() - start_time
+        for observer in _wait_observers:
+            observer(self.name, priority, waited)
+
+    @contextmanager
+    def slot(self, priority: Priority = None, timeout: float = None):
+        """
+        Hold a slot of the dependency for the duration of a call
+
+        :param priority: Priority: Priority class of the call (None uses the one of the current request)
+        :param timeout: float: Seconds to wait for a slot, usually the time left to the request deadline (None waits
+            until one is free)
+        :raises TimeoutError: If no slot is free within the timeout
+        """
+        priority = current_priority() if priority is None else priority
+        start_time = time.perf_counter()
+
+        entry = self._enter(priority, threading.Event)
+        if entry is not None:
+            if not entry[2].wait(None if timeout is None else max(0.0, timeout)) and not self._abandon(entry):
+                raise TimeoutError(f"No {self.name} slot free within {timeout:.1f} s")
+
+        self._observe_wait(priority, start_time)
+        try:
+            yield
+        finally:
+            self._exit(priority)
+
+    @asynccontextmanager
+    async def async_slot(self, priority: Priority = None, timeout: float = None):
+        """
+        Hold a slot of the dependency for the duration of a coroutine call, waiting for it without blocking the event
+        loop. Coroutines and threads share the same slots and queue.
+
+        :param priority: Priority: Priority class of the call (None uses the one of the current task)
+        :param timeout: float: Seconds to wait for a slot (None waits until one is free)
+        :raises TimeoutError: If no slot is free within the timeout
+        """
+        priority = current_priority() if priority is None else priority
+        start_time = time.perf_counter()
+
+        entry = self._enter(priority, _AsyncWaiter)
+        if entry is not None:
+            try:
+                granted = await entry[2].wait(None if timeout is None else max(0.0, timeout))
+            except BaseException:
+                # A cancelled task gives back the slot it may have been granted while being cancelled
+                if self._abandon(entry):
+                    self._exit(priority)
+                raise
+            if not granted and not self._abandon(entry):
+                raise TimeoutError(f"No {self.name} slot free within {timeout:.1f} s")
+
+        self._observe_wait(priority, start_time)
+        try:
+            yield
+        finally:
+            self._exit(priority)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the scheduler, for monitoring
+
+        :return: dict: Slots, running and waiting calls per priority class and calls served since start
+        """
+        with self._lock:
+            waiting = {priority: 0 for priority in Priority}
+            for priority, _, _ in self._waiters:
+                waiting[priority] += 1
+            return {
+                'slots': self.slots,
+                'batch_slots': self.batch_slots,
+                **{priority.name.lower(): {'running': self._running[priority], 'waiting': waiting[priority],
+                                           'served': self._granted[priority]} for priority in Priority}
+            }
+
+
+class QuotaTracker:
+    def __init__(self, reserve: int = None, remaining_header: str = 'Fitbit-Rate-Limit-Remaining',
+                 reset_header: str = 'Fitbit-Rate-Limit-Reset'):
+        """
+        Initialize the tracker of the device API rate limit of each user
+
+        Fitbit limits the requests per user and hour and reports the remaining requests and the seconds until the
+        window resets in the Fitbit-Rate-Limit-* headers of every response. Other vendors report them in their own
+        headers.
+
+        :param reserve: int: Remaining requests below which batch calls of a user are deferred
+        :param remaining_header: str: Response header with the requests left in the window
+        :param reset_header: str: Response header with the seconds until the window resets
+        """
+        self.reserve = BATCH_QUOTA_RESERVE if reserve is None else reserve
+        self.remaining_header = remaining_header
+        self.reset_header = reset_header
+        self._quota = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id: str, headers) -> None:
+        """
+        Record the quota reported by a device API response
+
+        :param user_id: str: Document ID of the user
+        :param headers: Mapping: Response headers
+        """
+        try:
+            remaining = int(headers[self.remaining_header])
+            resets_at = time.monotonic() + int(headers[self.reset_header])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._lock:
+            self._quota[user_id] = (remaining, resets_at)
+
+    def remaining(self, user_id: str) -> int | None:
+        """
+        Requests left to a user in the current window
+
+        :param user_id: str: Document ID of the user
+        :return: int | None: Remaining requests, None when unknown or the window has reset
+        """
+        with self._lock:
+            remaining, resets_at = self._quota.get(user_id, (None, 0.0))
+            if remaining is not None and time.monotonic() >= resets_at:
+                del self._quota[user_id]
+                return None
+            return remaining
+
+    def allows(self, user_id: str, priority: Priority = None) -> bool:
+        """
+        Check whether a call of a user fits in its quota: interactive calls may use all of it, batch calls leave
+        the reserve untouched
+
+        :param user_id: str: Document ID of the user
+        :param priority: Priority: Priority class of the call (None uses the one of the current request)
+        :return: bool: True if the call may be made
+        """
+        priority = current_priority() if priority is None else priority
+        remaining = self.remaining(user_id)
+        if remaining is None:
+            return True
+        return remaining > (self.reserve if priority == Priority.BATCH else 0)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the tracked quotas, for monitoring
+
+        :return: dict: Users tracked and users whose batch calls are deferred
+        """
+        with self._lock:
+            now = time.monotonic()
+            live = [remaining for remaining, resets_at in self._quota.values() if resets_at > now]
+        return {
+            'reserve': self.reserve,
+            'users': len(live),
+            'batch_deferred_users': sum(1 for remaining in live if remaining <= self.reserve),
+        }
+
+
+fitbit_scheduler = PriorityScheduler('fitbit', FITBIT_SLOTS, FITBIT_BATCH_SLOTS)
+database_scheduler = PriorityScheduler('database', DATABASE_SLOTS, DATABASE_BATCH_SLOTS)
+fitbit_quota = QuotaTracker()
+
+
+def scheduler_stats() -> dict:
+    """
+    Snapshot of the schedulers and the Fitbit quotas of this process, for monitoring
+
+    :return: dict: State keyed by dependency name
+    """
+    return {
+        'fitbit': fitbit_scheduler.stats(),
+        'database': database_scheduler.stats(),
+        'fitbit_quota': fitbit_quota.stats(),
+    }
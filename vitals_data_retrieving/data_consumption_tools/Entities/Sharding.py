@@ -0,0 +1,122 @@
+from __future__ import annotations
+from .DataBase import BatchRunsRepository
+from .ResponseCode import ResponseCode
+from .Storage import batch_database
+from dotenv import load_dotenv
+from typing import Iterator
+import os
+import random
+import socket
+import time
+import uuid
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Shards the users of a batch run are split into: enough for every node to get several, so that the work stays
+# balanced when the nodes run at different speeds
+BATCH_SHARDS = int(os.environ.get('BATCH_SHARDS', 32))
+# Seconds a shard lease lasts without renewal. It is renewed between users, so it has to cover the slowest user
+BATCH_LEASE_SECONDS = float(os.environ.get('BATCH_LEASE_SECONDS', 600))
+
+
+def lease_owner() -> str:
+    """
+    ID of a run of the batch on this node, as lease owner: two runs started together on the same node (or in two
+    workers of the same process tree) get different IDs and share the shards like any two nodes
+
+    :return: str: Host name, PID and a random suffix
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def shard_of(document_id: str, shard_count: int = None) -> int:
+    """
+    Shard of a user: document IDs are SHA-256 hashes, so their leading bits spread the users evenly
+
+    :param document_id: str: Document ID (hashed User ID)
+    :param shard_count: int: Number of shards (defaults to BATCH_SHARDS)
+    :return: int: Shard number
+    """
+    return int(document_id[:8], 16) % (shard_count or BATCH_SHARDS)
+
+
+class ShardLease:
+    def __init__(self, repository: BatchRunsRepository, run_id: str, shard: int, owner: str, lease_seconds: float):
+        """
+        Lease held by this node on a shard of a batch run
+
+        :param repository: BatchRunsRepository: Leases repository
+        :param run_id: str: Run ID
+        :param shard: int: Shard number
+        :param owner: str: ID of this node
+        :param lease_seconds: float: Seconds the lease lasts unless renewed
+        """
+        self.repository = repository
+        self.run_id = run_id
+        self.shard = shard
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self._renewed_at = time.monotonic()
+
+    def keep_alive(self) -> bool:
+        """
+        Renew the lease once half of it has elapsed
+
+        :return: bool: False if the lease was lost (it expired and another node claimed the shard)
+        """
+        if time.monotonic() - self._renewed_at < self.lease_seconds / 2:
+            return True
+        if self.repository.claim_shard(self.run_id, self.shard, self.owner, self.lease_seconds) != \
+                ResponseCode.SUCCESS:
+            return False
+        self._renewed_at = time.monotonic()
+        return True
+
+    def complete(self) -> bool:
+        """
+        Mark the shard as completed
+
+        :return: bool: False if the lease was lost before completing it
+        """
+        return self.repository.complete_shard(self.run_id, self.shard, self.owner) == ResponseCode.SUCCESS
+
+    def release(self) -> bool:
+        """
+        Give the lease up without completing the shard, so that the next run can claim it right away (e.g. to retry
+        the users that failed)
+
+        :return: bool: False if the lease was already lost
+        """
+        # A lease renewed for 0 seconds expires right away
+        return self.repository.claim_shard(self.run_id, self.shard, self.owner, 0) == ResponseCode.SUCCESS
+
+
+def claim_shards(run_id: str, shard_count: int = None, lease_seconds: float = None, owner: str = None,
+                 repository: BatchRunsRepository = None) -> Iterator[ShardLease]:
+    """
+    Claim the free shards of a batch run one at a time
+
+    Every node walks the shards once from a random offset, so that nodes started together do not contend for the
+    same ones. A shard is free when it was never claimed or its lease expired without being completed (its node
+    crashed or hung): shards held by live leases of other nodes are skipped, and an expired one is taken over by the
+    next node that processes the run. The caller processes each yielded shard, calling keep_alive between users and
+    complete (or release) at the end, before the next one is claimed.
+
+    :param run_id: str: Run ID, shared by every node processing the run
+    :param shard_count: int: Number of shards (defaults to BATCH_SHARDS)
+    :param lease_seconds: float: Seconds a lease lasts unless renewed (defaults to BATCH_LEASE_SECONDS)
+    :param owner: str: ID of this node (defaults to a new lease_owner)
+    :param repository: BatchRunsRepository: Leases repository (defaults to the one of the storage backend)
+    :return: Iterator[ShardLease]: Leases of the claimed shards
+    """
+    shard_count = shard_count or BATCH_SHARDS
+    lease_seconds = lease_seconds or BATCH_LEASE_SECONDS
+    owner = owner or lease_owner()
+    repository = repository or batch_database()
+
+    offset = random.randrange(shard_count)
+    for index in range(shard_count):
+        shard = (offset + index) % shard_count
+        if repository.claim_shard(run_id, shard, owner, lease_seconds) == ResponseCode.SUCCESS:
+            yield ShardLease(repository, run_id, shard, owner, lease_seconds)
@@ -0,0 +1,77 @@
+from .DataBase import UsersRepository, VitalsRepository, BatchRunsRepository
+from dotenv import load_dotenv
+import os
+import threading
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+_repositories: dict = {}
+_repositories_lock = threading.Lock()
+
+
+def _backend_classes(backend: str) -> tuple[type, type, type]:
+    # Imported on demand, so that a deployment only loads the backend it uses
+    if backend == 'mongo':
+        from .UsersDataBase import UsersDataBase
+        from .VitalsDataBase import VitalsDataBase
+        from .BatchRunsDataBase import BatchRunsDataBase
+        return UsersDataBase, VitalsDataBase, BatchRunsDataBase
+    if backend == 'sqlite':
+        from .SQLiteDataBase import SQLiteUsersDataBase, SQLiteVitalsDataBase, SQLiteBatchRunsDataBase
+        return SQLiteUsersDataBase, SQLiteVitalsDataBase, SQLiteBatchRunsDataBase
+    if backend == 'memory':
+        from .MemoryDataBase import MemoryUsersDataBase, MemoryVitalsDataBase, MemoryBatchRunsDataBase
+        return MemoryUsersDataBase, MemoryVitalsDataBase, MemoryBatchRunsDataBase
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected 'mongo', 'sqlite' or 'memory'")
+
+
+def storage_backend() -> str:
+    """
+    Get the configured storage backend
+
+    :return: str: 'mongo' (MongoDB/CosmosDB, default), 'sqlite' (embedded, single node) or 'memory' (benchmarks)
+    """
+    return os.environ.get('STORAGE_BACKEND', 'mongo').lower()
+
+
+def _repository(index: int):
+    backend = storage_backend()
+    with _repositories_lock:
+        if backend not in _repositories:
+            _repositories[backend] = [None, None, None]
+        repositories = _repositories[backend]
+        if repositories[index] is None:
+            # Built once per process: the repositories hold the connections (and the data, for 'memory')
+            repositories[index] = _backend_classes(backend)[index]()
+        return repositories[index]
+
+
+def users_database() -> UsersRepository:
+    """
+    Get the users repository of the configured storage backend, shared by the whole process
+
+    :return: UsersRepository: Users repository
+    :raises TimeoutError: If the MongoDB backend cannot connect
+    """
+    return _repository(0)
+
+
+def vitals_database() -> VitalsRepository:
+    """
+    Get the vitals repository of the configured storage backend, shared by the whole process
+
+    :return: VitalsRepository: Vitals repository
+    :raises TimeoutError: If the MongoDB backend cannot connect
+    """
+    return _repository(1)
+
+
+def batch_database() -> BatchRunsRepository:
+    """
+    Get the batch run leases repository of the configured storage backend, shared by the whole process
+
+    :return: BatchRunsRepository: Batch runs repository
+    :raises TimeoutError: If the MongoDB backend cannot connect
+    """
+    return _repository(2)
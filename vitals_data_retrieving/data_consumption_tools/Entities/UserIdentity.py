@@ -0,0 +1,97 @@
+from __future__ import annotations
+from .CryptoUtils import hash_data
+from cachetools import LRUCache
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+import os
+import threading
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+
+@dataclass(frozen=True)
+class UserKey:
+    """
+    Identity of a user in the database
+
+    document_id is the hashed User ID used as document ID. user_id is the raw User ID when it is known; it does not
+    take part in comparisons, so keys built from a raw ID and from a stored document ID are equal.
+    """
+    document_id: str
+    user_id: str | None = field(default=None, compare=False, repr=False)
+
+    @classmethod
+    def from_document_id(cls, document_id: str) -> UserKey:
+        """
+        Build the key of a document ID read from the database (already hashed)
+
+        :param document_id: str: Document ID (hashed User ID)
+        :return: UserKey: User key
+        """
+        return cls(document_id)
+
+    def __str__(self) -> str:
+        return self.document_id
+
+
+def as_document_id(key: UserKey | str) -> str:
+    """
+    Get the document ID of a key, plain strings are taken as document IDs (already hashed)
+
+    :param key: UserKey | str: User key or document ID
+    :return: str: Document ID (hashed User ID)
+    """
+    return key.document_id if isinstance(key, UserKey) else key
+
+
+class UserIdentityMap:
+    def __init__(self, max_size: int = None):
+        """
+        Initialize the memoized mapping from User IDs to user keys
+
+        :param max_size: int: Maximum number of User IDs kept in the cache (least recently used are evicted)
+        """
+        self._cache = LRUCache(maxsize=max_size or int(os.environ.get('USER_KEY_CACHE_SIZE', 10000)))
+        self._lock = threading.Lock()
+
+    def key_for(self, user_id: str) -> UserKey:
+        """
+        Get the key of a User ID, hashing it only the first time it is seen
+
+        :param user_id: str: User ID
+        :return: UserKey: User key
+        """
+        if isinstance(user_id, UserKey):
+            return user_id
+        if not isinstance(user_id, str) or not user_id:
+            raise ValueError("user_id must be a non-empty string")
+
+        with self._lock:
+            key = self._cache.get(user_id)
+        if key is None:
+            key = UserKey(hash_data(user_id), user_id)
+            with self._lock:
+                self._cache[user_id] = key
+        return key
+
+    def keys_for(self, user_ids: list[str]) -> dict[str, UserKey]:
+        """
+        Get the keys of several User IDs, hashing only those not cached yet
+
+        :param user_ids: list[str]: User IDs
+        :return: dict[str, UserKey]: User key keyed by User ID, in the order of user_ids without duplicates
+        """
+        keys = {}
+        with self._lock:
+            for user_id in user_ids:
+                keys[user_id] = self._cache.get(user_id)
+
+        for user_id, key in keys.items():
+            if key is None:
+                keys[user_id] = self.key_for(user_id)
+        return keys
+
+
+# Shared by every request of the process
+identity_map = UserIdentityMap()
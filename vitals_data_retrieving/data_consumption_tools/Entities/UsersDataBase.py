@@ -1,7 +1,10 @@
-from .DataBase import DataBase
+from .DataBase import UsersRepository, DEFAULT_DEVICE_TYPE
 from .ResponseCode import ResponseCode
+from .Resilience import mongo_call, mongo_client_options, CircuitOpenError, DeadlineExceededError, \
+    TIMEOUT_MAX_SECONDS
 from .CryptoUtils import DataCipher
-from .CryptoUtils import hash_data
+from .UserIdentity import UserKey, as_document_id, identity_map
+from vitals_data_retrieving.vitals_data_retrieving_memory import memory_tracker
 from dotenv import load_dotenv
 import os
 import pymongo
@@ -12,15 +15,17 @@ def prepare_data(document_id, token, refresh_token) -> tuple[str, str, str]:
     """
     Prepare the data for insertion into the database
 
-    :param document_id: str: Document ID
+    :param document_id: UserKey | str: User key, or raw User ID to be hashed
     :param token: str: Token
     :param refresh_token: str: Refresh token
     :return: tuple[str, str, str]: Hashed ID, encoded token, encoded refresh token
     """
     cipher = DataCipher()
 
-    if document_id is not None:
-        hashed_id = hash_data(document_id)
+    if isinstance(document_id, UserKey):
+        hashed_id = document_id.document_id
+    elif document_id is not None:
+        hashed_id = identity_map.key_for(document_id).document_id
     else:
         hashed_id = None
 
@@ -33,6 +38,7 @@ def prepare_data(document_id, token, refresh_token) -> tuple[str, str, str]:
     return hashed_id, encoded_token, encoded_refresh_token
 
 
+@memory_tracker.traced('decode_data')
 def decode_data(document) -> dict:
     """
     Decode the data from the database
@@ -51,47 +57,57 @@ def decode_data(document) -> dict:
 
     decoded_document = {
         "user_id": user_id,
+        "user_key": UserKey.from_document_id(user_id),
         "token": token,
-        "refresh_token": refresh_token
+        "refresh_token": refresh_token,
+        "device_type": document.get('device_type') or DEFAULT_DEVICE_TYPE
     }
 
     return decoded_document
 
 
-class UsersDataBase(DataBase):
+class UsersDataBase(UsersRepository):
     def __init__(self):
+        """
+        Initialize the MongoDB/CosmosDB users collection (COLLECTION_NAME)
+        """
         if os.path.exists('.env'):
             load_dotenv()
         connection_string = os.environ.get('CONNECTION_STRING')
         database_name = os.environ.get('DATABASE_NAME')
         collection_name = os.environ.get('COLLECTION_NAME')
 
-        client = pymongo.MongoClient(connection_string)
+        client = pymongo.MongoClient(connection_string, **mongo_client_options())
+        self.collection_name = collection_name
         try:
-            client.server_info()
-        except pymongo.errors.ServerSelectionTimeoutError:
+            with mongo_call(collection_name, 'server_info'):
+                client.server_info()
+        except (pymongo.errors.ServerSelectionTimeoutError, CircuitOpenError, DeadlineExceededError):
             raise TimeoutError("Invalid API for MongoDB connection string or timed out when attempting to connect")
 
         database = client[database_name]
         self.collection = database[collection_name]
 
-    def insert_document(self, document_id, token, refresh_token) -> ResponseCode:
+    def insert_document(self, document_id, token, refresh_token, device_type=DEFAULT_DEVICE_TYPE) -> ResponseCode:
         """
         Insert a document with the specified ID, token, and refresh token
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key, or raw User ID to be hashed
         :param token: str: Token
         :param refresh_token: str: Refresh token
+        :param device_type: str: Device type of the user
         :return: ResponseCode: Response code
         """
         hashed_id, encoded_token, encoded_refresh_token = prepare_data(document_id, token, refresh_token)
 
         try:
-            self.collection.insert_one({
-                "_id": hashed_id,
-                "token": encoded_token,
-                "refresh_token": encoded_refresh_token
-            })
+            with mongo_call(self.collection_name, 'insert_one'):
+                self.collection.insert_one({
+                    "_id": hashed_id,
+                    "token": encoded_token,
+                    "refresh_token": encoded_refresh_token,
+                    "device_type": device_type
+                })
             return ResponseCode.SUCCESS
         except pymongo.errors.DuplicateKeyError:
             return ResponseCode.ERROR_DUPLICATE_KEY
@@ -103,11 +119,12 @@ class UsersDataBase(DataBase):
         """
         Return the contents of the document containing document_id
 
-        :param document_id: str: Document ID (hashed User ID)
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
         """
         try:
-            document = self.collection.find_one({"_id": document_id})
+            with mongo_call(self.collection_name, 'find_one'):
+                document = self.collection.find_one({"_id": as_document_id(document_id)})
             if document:
                 return ResponseCode.SUCCESS, document
             else:
@@ -116,11 +133,30 @@ class UsersDataBase(DataBase):
             print(f"Error reading document: {e}")
             return ResponseCode.ERROR_UNKNOWN, None
 
+    def read_documents(self, document_ids) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the documents whose ID is in document_ids with a single query
+
+        :param document_ids: list[UserKey | str]: User keys or document IDs (hashed User IDs)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents found
+        """
+        try:
+            with mongo_call(self.collection_name, 'find'):
+                documents = list(self.collection.find(
+                    {"_id": {"$in": [as_document_id(key) for key in document_ids]}}))
+            if documents:
+                return ResponseCode.SUCCESS, documents
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except Exception as e:
+            print(f"Error reading documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
     def update_document(self, document_id, new_token, new_refresh_token) -> ResponseCode:
         """
         Update the token and refresh token in the document containing document_id
 
-        :param document_id: str: Document ID (hashed User ID)
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :param new_token: str: New token
         :param new_refresh_token: str: New refresh token
         :return: ResponseCode: Response code
@@ -128,10 +164,11 @@ class UsersDataBase(DataBase):
         _, encoded_token, encoded_refresh_token = prepare_data(None, new_token, new_refresh_token)
 
         try:
-            result = self.collection.update_one(
-                {"_id": document_id},
-                {"$set": {"token": encoded_token, "refresh_token": encoded_refresh_token}}
-            )
+            with mongo_call(self.collection_name, 'update_one'):
+                result = self.collection.update_one(
+                    {"_id": as_document_id(document_id)},
+                    {"$set": {"token": encoded_token, "refresh_token": encoded_refresh_token}}
+                )
             if result.matched_count > 0:
                 return ResponseCode.SUCCESS
             else:
@@ -144,11 +181,12 @@ class UsersDataBase(DataBase):
         """
         Delete the document containing document_id from the collection
 
-        :param document_id: str: Document ID
+        :param document_id: UserKey | str: User key or document ID (hashed User ID)
         :return: ResponseCode: Response code
         """
         try:
-            result = self.collection.delete_one({"_id": document_id})
+            with mongo_call(self.collection_name, 'delete_one'):
+                result = self.collection.delete_one({"_id": as_document_id(document_id)})
             if result.deleted_count > 0:
                 return ResponseCode.SUCCESS
             else:
@@ -164,7 +202,8 @@ class UsersDataBase(DataBase):
         :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
         """
         try:
-            documents = list(self.collection.find({}))
+            with mongo_call(self.collection_name, 'find', TIMEOUT_MAX_SECONDS):
+                documents = list(self.collection.find({}))
             if documents:
                 return ResponseCode.SUCCESS, documents
             else:
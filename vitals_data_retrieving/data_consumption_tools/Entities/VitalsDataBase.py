@@ -1,42 +1,91 @@
-from .DataBase import DataBase
+from .DataBase import VitalsRepository
 from .ResponseCode import ResponseCode
+from .UserIdentity import as_document_id
+from .Resilience import mongo_call, mongo_client_options, CircuitOpenError, DeadlineExceededError, \
+    TIMEOUT_MAX_SECONDS
 from dotenv import load_dotenv
+from typing import Iterator
 import os
 import pymongo
 
+# Error code of MongoDB for a duplicate key, also when building a unique index over duplicate values
+DUPLICATE_KEY_ERROR_CODE = 11000
 
-class VitalsDataBase(DataBase):
+# Documents fetched per query when streaming (a day of 1-second heart rate is a few MB)
+STREAM_BATCH_SIZE = int(os.environ.get('VITALS_STREAM_BATCH_SIZE', 50))
+
+
+class VitalsDataBase(VitalsRepository):
     def __init__(self):
+        """
+        Initialize the MongoDB/CosmosDB vitals collection (VITALS_COLLECTION)
+        """
         if os.path.exists('.env'):
             load_dotenv()
         connection_string = os.environ.get('CONNECTION_STRING')
         database_name = os.environ.get('DATABASE_NAME')
         collection_name = os.environ.get('VITALS_COLLECTION')
 
-        client = pymongo.MongoClient(connection_string)
+        client = pymongo.MongoClient(connection_string, **mongo_client_options())
+        self.collection_name = collection_name
         try:
-            client.server_info()
-        except pymongo.errors.ServerSelectionTimeoutError:
+            with mongo_call(collection_name, 'server_info'):
+                client.server_info()
+        except (pymongo.errors.ServerSelectionTimeoutError, CircuitOpenError, DeadlineExceededError):
             raise TimeoutError("Invalid API for MongoDB connection string or timed out when attempting to connect")
 
         database = client[database_name]
         self.collection = database[collection_name]
+        self._create_user_day_index()
+
+    def _create_user_day_index(self) -> None:
+        """
+        Index the documents by user-day, unique as the primary key of the SQLite backend
+
+        The upserts of update_scopes and the user-day reads find their document through it, and concurrent upserts
+        of the same user-day (two shard owners, a repair overlapping the batch) cannot create a second document.
+        Collections that already hold duplicate user-days get the index without uniqueness, so that lookups are still
+        indexed; the first document stored keeps being the one read and updated.
+
+        Failing to create it is logged and does not fail the construction: the repository works without the index,
+        only slower.
+        """
+        keys = [("user_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)]
+        try:
+            with mongo_call(self.collection_name, 'create_index', TIMEOUT_MAX_SECONDS):
+                self.collection.create_index(keys, name="user_id_date", unique=True)
+            return
+        except pymongo.errors.OperationFailure as e:
+            if e.code != DUPLICATE_KEY_ERROR_CODE:
+                print(f"Error creating the user-day index: {e}")
+                return
+            print(f"Duplicate user-days stored, indexing them without uniqueness: {e}")
+        except Exception as e:
+            print(f"Error creating the user-day index: {e}")
+            return
+
+        try:
+            with mongo_call(self.collection_name, 'create_index', TIMEOUT_MAX_SECONDS):
+                self.collection.create_index(keys, name="user_id_date_lookup")
+        except Exception as e:
+            print(f"Error creating the user-day lookup index: {e}")
 
     def insert_document(self, user_id, date, data) -> ResponseCode:
         """
-        Insert a document with the specified ID, token, and refresh token
+        Insert the data of a user for a given date
 
-        :param user_id: str: User ID (hashed)
-        :param date: str: Date
-        :param data: dict: Data in JSON format
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param data: dict: Data keyed by scope
         :return: ResponseCode: Response code
         """
         try:
-            self.collection.insert_one({
-                "user_id": user_id,
-                "date": date,
-                "data": data
-            })
+            with mongo_call(self.collection_name, 'insert_one'):
+                self.collection.insert_one({
+                    "user_id": as_document_id(user_id),
+                    "date": date,
+                    "data": data
+                })
             return ResponseCode.SUCCESS
         except pymongo.errors.DuplicateKeyError:
             return ResponseCode.ERROR_DUPLICATE_KEY
@@ -44,6 +93,113 @@ class VitalsDataBase(DataBase):
             print(f"Error inserting document: {e}")
             return ResponseCode.ERROR_UNKNOWN
 
+    def insert_documents(self, documents) -> ResponseCode:
+        """
+        Insert the data of several users and dates with a single bulk write
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD') and data
+        :return: ResponseCode: Response code
+        """
+        try:
+            with mongo_call(self.collection_name, 'insert_many', TIMEOUT_MAX_SECONDS):
+                # Unordered: a failed document does not stop the rest of the batch
+                self.collection.insert_many([{
+                    "user_id": as_document_id(document["user_id"]),
+                    "date": document["date"],
+                    "data": document["data"]
+                } for document in documents], ordered=False)
+            return ResponseCode.SUCCESS
+        except Exception as e:
+            print(f"Error inserting documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_fingerprints(self, keys) -> tuple[ResponseCode, dict]:
+        """
+        Return the fingerprints of the stored scopes of several users and dates with a single query
+
+        :param keys: list[tuple[str, str]]: (User ID (hashed), date in 'YYYY-MM-DD' format) pairs
+        :return: tuple[ResponseCode, dict]: Response code and fingerprints keyed by scope, keyed by (User ID, date),
+            for the pairs that have a stored document
+        """
+        keys = {(as_document_id(user_id), date) for user_id, date in keys}
+        query = {"user_id": {"$in": list({user_id for user_id, _ in keys})},
+                 "date": {"$in": list({date for _, date in keys})}}
+        try:
+            with mongo_call(self.collection_name, 'find'):
+                documents = list(self.collection.find(
+                    query, {"user_id": 1, "date": 1, "fingerprints": 1}).sort("_id", 1))
+            fingerprints = {}
+            for document in documents:
+                key = (document["user_id"], document["date"])
+                if key in keys:
+                    # The first document stored is the one read and updated
+                    fingerprints.setdefault(key, document.get("fingerprints", {}))
+            if fingerprints:
+                return ResponseCode.SUCCESS, fingerprints
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, {}
+        except Exception as e:
+            print(f"Error reading fingerprints: {e}")
+            return ResponseCode.ERROR_UNKNOWN, {}
+
+    def update_scopes(self, documents) -> ResponseCode:
+        """
+        Set some scopes of several users and dates with a single bulk write, creating the documents that do not exist
+
+        Each scope is written with a field-level $set, so the unchanged scopes of a stored document are neither sent
+        nor rewritten.
+
+        :param documents: list[dict]: Documents with user_id (hashed User ID), date ('YYYY-MM-DD'), data (scopes to
+            set), fingerprints (fingerprint of each of those scopes) and optionally scope_status (fetch status of
+            each fetched scope)
+        :return: ResponseCode: Response code
+        """
+        operations = []
+        for document in documents:
+            fields = {f"data.{element}": payload for element, payload in document["data"].items()}
+            fields.update({f"fingerprints.{element}": fingerprint
+                           for element, fingerprint in document["fingerprints"].items()})
+            fields.update({f"scope_status.{element}": status
+                           for element, status in document.get("scope_status", {}).items()})
+            operations.append(pymongo.UpdateOne(
+                {"user_id": as_document_id(document["user_id"]), "date": document["date"]}, {"$set": fields},
+                upsert=True))
+        if not operations:
+            return ResponseCode.SUCCESS
+        try:
+            with mongo_call(self.collection_name, 'bulk_write', TIMEOUT_MAX_SECONDS):
+                self.collection.bulk_write(operations, ordered=False)
+            return ResponseCode.SUCCESS
+        except Exception as e:
+            print(f"Error updating documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN
+
+    def read_scope_status(self, dates) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the fetch status of the scopes of every user for several dates, without reading the data
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and
+            scope_status, empty for documents stored before the status was tracked)
+        """
+        try:
+            with mongo_call(self.collection_name, 'find', TIMEOUT_MAX_SECONDS):
+                documents = list(self.collection.find(
+                    {"date": {"$in": list(dates)}}, {"user_id": 1, "date": 1, "scope_status": 1}).sort("_id", 1))
+            statuses = {}
+            for document in documents:
+                # The first document stored is the one read and updated
+                statuses.setdefault((document["user_id"], document["date"]), {
+                    "user_id": document["user_id"], "date": document["date"],
+                    "scope_status": document.get("scope_status", {})})
+            if statuses:
+                return ResponseCode.SUCCESS, list(statuses.values())
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except Exception as e:
+            print(f"Error reading scope status: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
     def read_document(self, document_id) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
         """
         Return the contents of the document containing document_id
@@ -52,7 +208,8 @@ class VitalsDataBase(DataBase):
         :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and document contents
         """
         try:
-            document = self.collection.find_one({"_id": document_id})
+            with mongo_call(self.collection_name, 'find_one'):
+                document = self.collection.find_one({"_id": document_id})
             if document:
                 return ResponseCode.SUCCESS, document
             else:
@@ -61,9 +218,89 @@ class VitalsDataBase(DataBase):
             print(f"Error reading document: {e}")
             return ResponseCode.ERROR_UNKNOWN, None
 
-    def update_document(self, document_id, new_token, new_refresh_token) -> ResponseCode:
-        # Method not implemented
-        pass
+    def read_user_day(self, user_id, date, scope=None) -> tuple[ResponseCode, dict] | tuple[ResponseCode, None]:
+        """
+        Return the stored data of a user for a given date, reading only the requested scopes
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, dict] | tuple[ResponseCode, None]: Response code and data keyed by scope
+        """
+        projection = {f"data.{element}": 1 for element in scope} if scope else {"data": 1}
+        try:
+            with mongo_call(self.collection_name, 'find_one'):
+                document = self.collection.find_one({"user_id": as_document_id(user_id), "date": date}, projection)
+            if document:
+                return ResponseCode.SUCCESS, document.get("data", {})
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, None
+        except Exception as e:
+            print(f"Error reading document: {e}")
+            return ResponseCode.ERROR_UNKNOWN, None
+
+    def read_user_days(self, user_ids, dates, scope=None) -> tuple[ResponseCode, list[dict]]:
+        """
+        Return the stored documents of several users and dates with a single query, reading only the requested scopes
+
+        :param user_ids: list[UserKey | str]: User keys or User IDs (hashed)
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: tuple[ResponseCode, list[dict]]: Response code and list of documents (user_id, date and data)
+        """
+        projection = {"_id": 0, "user_id": 1, "date": 1}
+        projection.update({f"data.{element}": 1 for element in scope} if scope else {"data": 1})
+        query = {"user_id": {"$in": [as_document_id(key) for key in user_ids]}, "date": {"$in": list(dates)}}
+        try:
+            with mongo_call(self.collection_name, 'find'):
+                documents = list(self.collection.find(query, projection))
+            if documents:
+                return ResponseCode.SUCCESS, documents
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except Exception as e:
+            print(f"Error reading documents: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def read_dates(self) -> tuple[ResponseCode, list[str]]:
+        """
+        Return the dates that have stored documents
+
+        :return: tuple[ResponseCode, list[str]]: Response code and dates in 'YYYY-MM-DD' format, in ascending order
+        """
+        try:
+            with mongo_call(self.collection_name, 'distinct', TIMEOUT_MAX_SECONDS):
+                dates = sorted(self.collection.distinct("date"))
+            if dates:
+                return ResponseCode.SUCCESS, dates
+            else:
+                return ResponseCode.ERROR_NOT_FOUND, []
+        except Exception as e:
+            print(f"Error reading dates: {e}")
+            return ResponseCode.ERROR_UNKNOWN, []
+
+    def stream_documents(self, dates, scope=None) -> Iterator[dict]:
+        """
+        Iterate over the stored documents of several dates without loading them all in memory, reading only the
+        requested scopes
+
+        The IDs of a date are read first and the documents are then fetched STREAM_BATCH_SIZE at a time, so that every
+        query stays bounded by its timeout however slow the consumer is.
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: Scopes to read (None reads all of them)
+        :return: Iterator[dict]: Documents (_id, user_id, date and data)
+        """
+        projection = {"user_id": 1, "date": 1}
+        projection.update({f"data.{element}": 1 for element in scope} if scope else {"data": 1})
+        for date in dates:
+            with mongo_call(self.collection_name, 'find', TIMEOUT_MAX_SECONDS):
+                ids = [document["_id"] for document in self.collection.find({"date": date}, {"_id": 1}).sort("_id", 1)]
+            for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                with mongo_call(self.collection_name, 'find'):
+                    documents = list(self.collection.find(
+                        {"_id": {"$in": ids[start:start + STREAM_BATCH_SIZE]}}, projection).sort("_id", 1))
+                yield from documents
 
     def delete_document(self, document_id) -> ResponseCode:
         """
@@ -73,7 +310,8 @@ class VitalsDataBase(DataBase):
         :return: ResponseCode: Response code
         """
         try:
-            result = self.collection.delete_one({"_id": document_id})
+            with mongo_call(self.collection_name, 'delete_one'):
+                result = self.collection.delete_one({"_id": document_id})
             if result.deleted_count > 0:
                 return ResponseCode.SUCCESS
             else:
@@ -89,7 +327,8 @@ class VitalsDataBase(DataBase):
         :return: tuple[ResponseCode, list[dict]]: Response code and list of documents
         """
         try:
-            documents = list(self.collection.find({}))
+            with mongo_call(self.collection_name, 'find', TIMEOUT_MAX_SECONDS):
+                documents = list(self.collection.find({}))
             if documents:
                 return ResponseCode.SUCCESS, documents
             else:
@@ -0,0 +1,517 @@
+from .ChangeDetection import write_changed_scopes
+from .DataBase import VitalsRepository
+from .ResponseCode import ResponseCode
+from .Resilience import sleep_before_retry
+from .Scheduler import Priority, set_priority
+from .Storage import vitals_database
+from .UserIdentity import as_document_id
+from vitals_data_retrieving.vitals_data_retrieving_metrics import write_behind_documents, write_behind_queue_depth
+from collections import deque
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from typing import Callable
+import atexit
+import fcntl
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# A queued document holds a full user-day (tens of MB once parsed for 1-second heart rate), so the queue is short
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 32))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 8))
+WRITE_BEHIND_SUBMIT_TIMEOUT = float(os.environ.get('WRITE_BEHIND_SUBMIT_TIMEOUT', 5))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', 5))
+# Directory where accepted documents are journaled until written (empty disables the spill)
+WRITE_BEHIND_SPILL_DIR = os.environ.get('WRITE_BEHIND_SPILL_DIR', '')
+
+SPILL_SUFFIX = '.json'
+LOCK_SUFFIX = '.lock'
+
+
+class WriteTracker:
+    def __init__(self):
+        """
+        Initialize the outcome of the documents stored by one operation (e.g., a daily run)
+
+        The buffer of the process is shared by every request, so its counters cannot tell which operation a failed
+        write belonged to: the documents stored while a tracker is active (see track_writes) report their outcome to
+        it once written or failed, and the operation waits only for its own documents.
+        """
+        self.pending = 0
+        self.failed = 0
+        self._condition = threading.Condition()
+
+    def _add(self) -> None:
+        with self._condition:
+            self.pending += 1
+
+    def _settle(self, written: bool) -> None:
+        with self._condition:
+            self.pending -= 1
+            if not written:
+                self.failed += 1
+            if self.pending <= 0:
+                self._condition.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until every document stored under the tracker has been written (or has failed)
+
+        :param timeout: float: Maximum seconds to wait (None waits indefinitely)
+        :return: bool: True if none is left to write
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.pending <= 0, timeout)
+
+
+_tracker: ContextVar[WriteTracker | None] = ContextVar('write_tracker', default=None)
+
+
+def track_writes(tracker: WriteTracker):
+    """
+    Report the outcome of the documents stored from now on in the current context (and the tasks and threads it is
+    copied to) to a tracker
+
+    :param tracker: WriteTracker: Tracker
+    :return: Token to restore the previous tracker with untrack_writes
+    """
+    return _tracker.set(tracker)
+
+
+def untrack_writes(token) -> None:
+    """
+    Restore the tracker that was active before track_writes
+
+    :param token: Token returned by track_writes
+    """
+    _tracker.reset(token)
+
+
+def _write_now(repository: VitalsRepository, document: dict, tracker: WriteTracker | None) -> ResponseCode:
+    # Written by the caller, which already counted it in the tracker: the tracker gets the outcome right away
+    response = ResponseCode.ERROR_UNKNOWN
+    try:
+        response = write_changed_scopes(repository, [document])
+        return response
+    finally:
+        if tracker is not None:
+            tracker._settle(response == ResponseCode.SUCCESS)
+
+
+def _try_lock(path: str) -> int | None:
+    """
+    Lock a file exclusively without waiting
+
+    :param path: str: Lock file (created if missing)
+    :return: int | None: Descriptor holding the lock, or None when another process holds it
+    """
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(descriptor)
+        return None
+    return descriptor
+
+
+class WriteBehindBuffer:
+    def __init__(self, repository: Callable[[], VitalsRepository] = vitals_database, queue_size: int = None,
+                 batch_size: int = None, submit_timeout: float = None, max_attempts: int = None,
+                 spill_dir: str = None):
+        """
+        Initialize the buffer that decouples the fetch of the vitals from their write to the database
+
+        Documents are accepted into a bounded in-process queue and a dedicated writer thread drains it with bulk
+        writes of the changed scopes of up to batch_size documents, so the database latency is not added to the fetch
+        and a slow database only grows the batches. When the queue is full, submit waits up to submit_timeout
+        (backpressure) and then writes the document itself rather than losing it.
+
+        With a spill directory, every accepted document is first journaled to a file that is removed once written:
+        documents that do not fit in the queue wait on disk instead of blocking the caller, and the documents left by
+        a crash or a failed write are written again when the buffer of the next process starts.
+
+        :param repository: Callable[[], VitalsRepository]: Getter of the repository to write to
+        :param queue_size: int: Documents held in memory (defaults to WRITE_BEHIND_QUEUE_SIZE)
+        :param batch_size: int: Maximum documents per bulk write (defaults to WRITE_BEHIND_BATCH_SIZE)
+        :param submit_timeout: float: Seconds submit waits for room in the queue (defaults to
+            WRITE_BEHIND_SUBMIT_TIMEOUT)
+        :param max_attempts: int: Attempts to write a batch before giving up (defaults to WRITE_BEHIND_MAX_ATTEMPTS)
+        :param spill_dir: str: Journal directory (defaults to WRITE_BEHIND_SPILL_DIR, empty disables it)
+        """
+        self.repository = repository
+        self.batch_size = batch_size or WRITE_BEHIND_BATCH_SIZE
+        self.submit_timeout = submit_timeout if submit_timeout is not None else WRITE_BEHIND_SUBMIT_TIMEOUT
+        self.max_attempts = max_attempts or WRITE_BEHIND_MAX_ATTEMPTS
+        self.spill_dir = spill_dir if spill_dir is not None else WRITE_BEHIND_SPILL_DIR
+        self._queue = queue.Queue(queue_size or WRITE_BEHIND_QUEUE_SIZE)
+        self._spilled = deque()
+        # Tracker of each journaled document waiting on disk, which only keeps its path
+        self._spilled_trackers = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._counts = {'written': 0, 'failed': 0, 'direct': 0, 'spilled': 0, 'recovered': 0}
+        self._closed = False
+        self._thread = None
+        self._pid = None
+        self._owner = None
+        self._owner_pid = None
+        self._owner_lock = None
+        self._owner_guard = threading.Lock()
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._ensure_owner()
+            recovered = self._claim_orphans()
+            self._spilled.extend(recovered)
+            self._pending = len(recovered)
+            self._counts['recovered'] = len(recovered)
+            write_behind_queue_depth.inc(len(recovered))
+            if recovered:
+                logger.info(f"Write-behind: {len(recovered)} journaled documents will be written again")
+                self._ensure_writer()
+
+    def _ensure_writer(self) -> None:
+        # Started on first use and again in a forked worker, which does not inherit the threads of its parent
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='vitals-write-behind', daemon=True)
+                self._thread.start()
+
+    def _ensure_owner(self) -> str:
+        """
+        Get the token that names the journal entries of this process, holding the lock that proves it is running
+
+        The token is unique per process (PIDs are reused, notably in containers) and its lock file stays locked with
+        flock for the life of the process, so that the kernel releases it when the process dies. A forked worker
+        gets its own token, and closes its copy of the lock of the parent so that it does not keep it alive.
+
+        :return: str: Owner token
+        """
+        if self._owner_pid == os.getpid():
+            return self._owner
+        with self._owner_guard:
+            if self._owner_pid != os.getpid():
+                if self._owner_lock is not None:
+                    os.close(self._owner_lock)
+                owner = uuid.uuid4().hex
+                # Locked before it gets its final name, so that no other process can take a lock file not yet held
+                path = os.path.join(self.spill_dir, owner + LOCK_SUFFIX)
+                self._owner_lock = _try_lock(path + '.tmp')
+                os.rename(path + '.tmp', path)
+                self._owner, self._owner_pid = owner, os.getpid()
+        return self._owner
+
+    def _journal_path(self) -> str:
+        # The name starts with the time, to write the entries in order, and holds the token of the owner process
+        owner = self._ensure_owner()
+        return os.path.join(self.spill_dir, f"{time.time_ns()}-{owner}-{next(self._sequence)}{SPILL_SUFFIX}")
+
+    def _claim_orphans(self) -> list[str]:
+        """
+        Take over the journal entries of the processes that are no longer running
+
+        The directory may be shared by several workers: an owner whose lock file is still locked is running and its
+        entries are left to it. The lock of a dead owner is taken before its entries are renamed to this process, so
+        that only one worker writes them, and its lock file is then removed.
+
+        :return: list[str]: Claimed entries, oldest first
+        """
+        names = sorted(os.listdir(self.spill_dir))
+        locks = {}
+        claimed = []
+        for name in names:
+            if name.endswith(SPILL_SUFFIX):
+                parts = name.split('-')
+                owner = parts[1] if len(parts) > 2 else ''
+            elif name.endswith(LOCK_SUFFIX):
+                owner = name[:-len(LOCK_SUFFIX)]
+            else:
+                continue
+            if owner == self._owner:
+                continue
+            if owner not in locks:
+                locks[owner] = _try_lock(os.path.join(self.spill_dir, owner + LOCK_SUFFIX))
+            if locks[owner] is None or not name.endswith(SPILL_SUFFIX):
+                continue
+            path = self._journal_path()
+            try:
+                os.rename(os.path.join(self.spill_dir, name), path)
+            except FileNotFoundError:
+                continue
+            claimed.append(path)
+
+        for owner, descriptor in locks.items():
+            if descriptor is not None:
+                try:
+                    os.remove(os.path.join(self.spill_dir, owner + LOCK_SUFFIX))
+                except FileNotFoundError:
+                    pass
+                os.close(descriptor)
+        return claimed
+
+    def _journal(self, document: dict) -> str:
+        # Written under a temporary name, so that a crash never leaves a truncated journal entry
+        path = self._journal_path()
+        with open(path + '.tmp', 'w') as file:
+            json.dump(document, file, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+        return path
+
+    def submit(self, user_id, date: str, data: dict, scope_status: dict = None) -> ResponseCode:
+        """
+        Accept the data of a user for a given date, to be written in the background
+
+        The data is stored by reference: callers must not modify it after submitting it.
+
+        :param user_id: UserKey | str: User key or User ID (hashed)
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param data: dict: Data keyed by scope
+        :param scope_status: dict: Fetch status keyed by scope (see Freshness.fetch_status)
+        :return: ResponseCode: SUCCESS once accepted (or written, when the queue stayed full)
+        """
+        document = {"user_id": as_document_id(user_id), "date": date, "data": data, "scope_status": scope_status or {}}
+        tracker = _tracker.get()
+        if tracker is not None:
+            tracker._add()
+        if self._closed:
+            return _write_now(self.repository(), document, tracker)
+        self._ensure_writer()
+
+        if self.spill_dir:
+            try:
+                path = self._journal(document)
+            except OSError:
+                if tracker is not None:
+                    tracker._settle(False)
+                raise
+            with self._condition:
+                self._pending += 1
+            write_behind_queue_depth.inc()
+            try:
+                self._queue.put_nowait((document, path, tracker))
+            except queue.Full:
+                # Only the journal keeps it: the writer reads it back once the queue is drained
+                with self._condition:
+                    self._spilled.append(path)
+                    if tracker is not None:
+                        self._spilled_trackers[path] = tracker
+                    self._counts['spilled'] += 1
+                write_behind_documents.labels(outcome='spilled').inc()
+            return ResponseCode.SUCCESS
+
+        with self._condition:
+            self._pending += 1
+        write_behind_queue_depth.inc()
+        try:
+            self._queue.put((document, None, tracker), timeout=self.submit_timeout)
+            return ResponseCode.SUCCESS
+        except queue.Full:
+            self._done(1)
+            with self._condition:
+                self._counts['direct'] += 1
+            write_behind_documents.labels(outcome='direct').inc()
+            return _write_now(self.repository(), document, tracker)
+
+    def _next_spilled(self):
+        with self._condition:
+            path = self._spilled.popleft() if self._spilled else None
+            tracker = self._spilled_trackers.pop(path, None)
+        if path is None:
+            return None
+        try:
+            with open(path) as file:
+                return json.load(file), path, tracker
+        except (OSError, ValueError) as e:
+            logger.error(f"Write-behind: unreadable journal entry {path} left in place: {e}")
+            self._record('failed', 1)
+            self._done(1)
+            if tracker is not None:
+                tracker._settle(False)
+            return None
+
+    def _next_batch(self) -> list[tuple]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # Journaled documents that did not fit in the queue go after the queued ones
+        while len(batch) < self.batch_size and self._spilled:
+            entry = self._next_spilled()
+            if entry is not None:
+                batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        # The writes are off the request path, so they yield the database to the interactive requests
+        set_priority(Priority.BATCH)
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._closed:
+                return
+
+    def _write(self, batch: list[tuple]) -> None:
+        response = ResponseCode.ERROR_UNKNOWN
+        for attempt in range(self.max_attempts):
+            try:
+                response = write_changed_scopes(self.repository(), [document for document, _, _ in batch])
+            except Exception as e:
+                logger.error(f"Write-behind: bulk write raised {e}")
+                response = ResponseCode.ERROR_UNKNOWN
+            if response == ResponseCode.SUCCESS or attempt == self.max_attempts - 1:
+                break
+            sleep_before_retry(attempt)
+
+        if response == ResponseCode.SUCCESS:
+            for _, path, _ in batch:
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            self._record('written', len(batch))
+        else:
+            kept = ", kept in the journal" if self.spill_dir else ""
+            logger.error(f"Write-behind: {len(batch)} documents could not be written{kept}")
+            self._record('failed', len(batch))
+        self._done(len(batch))
+        for _, _, tracker in batch:
+            if tracker is not None:
+                tracker._settle(response == ResponseCode.SUCCESS)
+
+    def _record(self, outcome: str, count: int) -> None:
+        with self._condition:
+            self._counts[outcome] += count
+        write_behind_documents.labels(outcome=outcome).inc(count)
+
+    def _done(self, count: int) -> None:
+        write_behind_queue_depth.dec(count)
+        with self._condition:
+            self._pending -= count
+            if self._pending <= 0:
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every accepted document has been written (or has failed)
+
+        :param timeout: float: Maximum seconds to wait (None waits indefinitely)
+        :return: bool: True if the buffer was drained in time
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending <= 0, timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Stop accepting documents in the background, write the pending ones and stop the writer
+
+        :param timeout: float: Maximum seconds to wait for the pending documents (None waits indefinitely)
+        :return: bool: True if the buffer was drained in time
+        """
+        self._closed = True
+        drained = self.flush(timeout) if self._thread is not None and self._thread.is_alive() else self._pending <= 0
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        if drained and self._owner_pid == os.getpid():
+            # No more entries are journaled: the ones whose write failed are left to the next process to claim
+            with self._owner_guard:
+                os.remove(os.path.join(self.spill_dir, self._owner + LOCK_SUFFIX))
+                os.close(self._owner_lock)
+                self._owner_lock = self._owner_pid = None
+        return drained
+
+    def stats(self) -> dict:
+        """
+        Counters of the buffer in this process
+
+        :return: dict: Pending documents, documents in the queue and the journal, and documents handled by outcome
+        """
+        with self._condition:
+            return {
+                'enabled': True,
+                'pending': self._pending,
+                'queued': self._queue.qsize(),
+                'spilled_pending': len(self._spilled),
+                'spill_dir': self.spill_dir or None,
+                **self._counts
+            }
+
+
+_buffer: WriteBehindBuffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def write_behind_buffer() -> WriteBehindBuffer:
+    """
+    Get the write-behind buffer of the process, created on first use and drained when the process exits
+
+    :return: WriteBehindBuffer: Buffer
+    """
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer()
+            atexit.register(_buffer.close, WRITE_BEHIND_SUBMIT_TIMEOUT * 6)
+        return _buffer
+
+
+def store_vitals(user_id, date: str, data: dict, scope_status: dict = None) -> ResponseCode:
+    """
+    Store the data of a user for a given date, through the write-behind buffer when WRITE_BEHIND_ENABLED is set
+
+    The outcome of the write is reported to the tracker active in the current context, if any (see track_writes).
+
+    :param user_id: UserKey | str: User key or User ID (hashed)
+    :param date: str: Date in 'YYYY-MM-DD' format
+    :param data: dict: Data keyed by scope (must not be modified afterwards)
+    :param scope_status: dict: Fetch status keyed by scope (see Freshness.fetch_status)
+    :return: ResponseCode: Response code
+    """
+    if not WRITE_BEHIND_ENABLED:
+        tracker = _tracker.get()
+        if tracker is not None:
+            tracker._add()
+        return _write_now(vitals_database(), {
+            "user_id": user_id, "date": date, "data": data, "scope_status": scope_status or {}}, tracker)
+    return write_behind_buffer().submit(user_id, date, data, scope_status)
+
+
+def flush_vitals(timeout: float = None) -> bool:
+    """
+    Wait until the vitals accepted by the write-behind buffer have been written
+
+    :param timeout: float: Maximum seconds to wait (None waits indefinitely)
+    :return: bool: True if nothing is left to write
+    """
+    if not WRITE_BEHIND_ENABLED or _buffer is None:
+        return True
+    return _buffer.flush(timeout)
+
+
+def write_behind_stats() -> dict:
+    """
+    Counters of the write-behind buffer of this process
+
+    :return: dict: Buffer counters ({'enabled': False} when disabled)
+    """
+    if not WRITE_BEHIND_ENABLED:
+        return {'enabled': False}
+    return write_behind_buffer().stats()
@@ -0,0 +1,569 @@
+from __future__ import annotations
+from .AsyncWearableDeviceDataRetriever import AsyncWearableDeviceDataRetriever
+from .AsyncFitbitQueryHandler import AsyncFitbitQueryHandler
+from .FetchEngine import FinalDataCache, get_query_error_message, worth_retrying
+from .BatchOperations import DailyVitalsRun, RepairRun, TokenRefreshRun, batch_results, find_gaps, users_error, \
+    user_not_found
+from .DeviceDataRetriever import get_token_from_database, get_users_from_database, get_tokens_from_database, \
+    get_all_documents, device_type_of
+from .FitbitVendor import fitbit_vendor
+from .DataEndpointsEnum import FITBIT_API_URL
+from .DataView import DataView
+from .SingleFlight import AsyncSingleFlight
+from vitals_data_retrieving.data_consumption_tools.Entities.DataBase import DEFAULT_DEVICE_TYPE
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import users_database, vitals_database
+from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import decode_data
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import as_document_id, identity_map
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import guarded_call, async_sleep_before_retry
+from vitals_data_retrieving.data_consumption_tools.Entities.WriteBehind import store_vitals
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import fitbit_quota
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import fetch_status
+from vitals_data_retrieving.vitals_data_retrieving_metrics import observe_latency, token_refresh_latency
+from vitals_data_retrieving.vitals_data_retrieving_tracing import trace_span, traced
+from http import HTTPStatus
+from dotenv import load_dotenv
+import asyncio
+import base64
+import logging
+import os
+import httpx
+
+logger = logging.getLogger(__name__)
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Connection pool of the Fitbit client of each event loop. HTTP/2 multiplexes the concurrent requests over a few
+# connections; FITBIT_HTTP2=false falls back to HTTP/1.1 with one connection per concurrent request
+FITBIT_HTTP2 = os.environ.get('FITBIT_HTTP2', 'true').lower() == 'true'
+FITBIT_MAX_CONNECTIONS = int(os.environ.get('FITBIT_MAX_CONNECTIONS', 100))
+FITBIT_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('FITBIT_MAX_KEEPALIVE_CONNECTIONS', 20))
+FITBIT_KEEPALIVE_SECONDS = float(os.environ.get('FITBIT_KEEPALIVE_SECONDS', 30))
+
+# Identical concurrent Fitbit fetches and token refreshes of the coroutines of an event loop are executed once
+async_flight_group = AsyncSingleFlight()
+
+
+class AsyncFitbitDataRetriever(AsyncWearableDeviceDataRetriever):
+    def __init__(self, api_base_url: str = None):
+        """
+        Initialize the asynchronous Fitbit data retriever
+
+        The scopes of a user-day are fetched concurrently, and so are the users of the batch operations (up to
+        BATCH_FETCH_WORKERS at a time). The database, whose drivers block, is called from worker threads. The batch
+        operations are the ones of DeviceDataRetriever (see BatchOperations), run as coroutines.
+
+        :param api_base_url: str: Base URL replacing the Fitbit API host for the data, token and authorization
+        requests, e.g. the local mock server (defaults to the FITBIT_API_BASE_URL environment variable)
+        """
+        self.API_BASE_URL = api_base_url or os.environ.get('FITBIT_API_BASE_URL')
+        self.CLIENT_ID = os.environ.get('CLIENT_ID')
+        self.CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
+        self.REDIRECT_URI = os.environ.get('REDIRECT_URI')
+        self.AUTHORIZATION_URL = os.environ.get('AUTHORIZATION_URL')
+        self.TOKEN_URL = os.environ.get('TOKEN_URL')
+        if self.API_BASE_URL:
+            self.API_BASE_URL = self.API_BASE_URL.rstrip('/')
+            self.AUTHORIZATION_URL = f"{self.API_BASE_URL}/oauth2/authorize"
+            self.TOKEN_URL = f"{self.API_BASE_URL}/oauth2/token"
+        self.SCOPE = os.environ.get('SCOPE')
+        self.BATCH_FETCH_WORKERS = int(os.environ.get('BATCH_FETCH_WORKERS', 8))
+        self.DEVICE_TYPE = fitbit_vendor.name
+        self.cache = FinalDataCache()
+        self._clients = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        HTTP client of the running event loop, created on first use: its pooled connections belong to the loop
+
+        :return: httpx.AsyncClient: Client
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=FITBIT_HTTP2,
+                limits=httpx.Limits(max_connections=FITBIT_MAX_CONNECTIONS,
+                                    max_keepalive_connections=FITBIT_MAX_KEEPALIVE_CONNECTIONS,
+                                    keepalive_expiry=FITBIT_KEEPALIVE_SECONDS))
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        """
+        Close the HTTP client of the running event loop and its pooled connections
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def connect_to_api(self) -> str:
+        """
+        Connect to the API by getting the authorization URL
+
+        :arg: None
+        :return: str: Authorization URL
+        """
+        params = {"client_id": self.CLIENT_ID, "response_type": "code", "scope": self.SCOPE}
+        return str(httpx.URL(self.AUTHORIZATION_URL,
+                             params={key: value for key, value in params.items() if value is not None}))
+
+    async def get_access_token(self, authorization_code: str) -> tuple[dict, HTTPStatus]:
+        """
+        Exchange the authorization code for a token pair
+
+        :param authorization_code: str: Authorization code
+        :return: tuple[dict, HTTPStatus]: Token data (with the user ID) and HTTP status code
+        """
+        if not authorization_code:
+            return {"error": "authorization_code missing"}, HTTPStatus.BAD_REQUEST
+        if not self.CLIENT_ID or not self.CLIENT_SECRET or not self.REDIRECT_URI:
+            logger.error("CLIENT_ID/CLIENT_SECRET/REDIRECT_URI missing from the environment")
+            return {"error": "Fitbit client credentials or redirect URI missing"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        api_url = self.API_BASE_URL or FITBIT_API_URL
+        headers = {
+            "Authorization": f"Basic {self.get_authorization_string()}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        payload = {
+            "client_id": self.CLIENT_ID,
+            "grant_type": "authorization_code",
+            "redirect_uri": self.REDIRECT_URI,
+            "code": authorization_code
+        }
+        try:
+            response = await self.client.post(f"{api_url}/oauth2/token", headers=headers, data=payload, timeout=15)
+            try:
+                token_data = response.json()
+            except ValueError:
+                token_data = {"raw_text": response.text}
+
+            if response.status_code != HTTPStatus.OK:
+                logger.error(f"Token exchange failed: {response.status_code} - {token_data}")
+                return {"error": "Token exchange failed", "details": token_data}, HTTPStatus(response.status_code)
+
+            access_token = token_data.get("access_token")
+            user_id = token_data.get("user_id") or token_data.get("user", {}).get("encodedId")
+
+            # The user ID is read from the profile when the token response does not include it
+            if not user_id and access_token:
+                profile_response = await self.client.get(
+                    f"{api_url}/1/user/-/profile.json", headers={"Authorization": f"Bearer {access_token}"},
+                    timeout=10)
+                if profile_response.status_code == HTTPStatus.OK:
+                    user = profile_response.json().get("user", {})
+                    user_id = user.get("encodedId") or user.get("userId") or user.get("id")
+                else:
+                    logger.warning(f"Profile request failed: {profile_response.status_code}")
+
+            if not user_id:
+                logger.error("No user_id after the token exchange")
+                return {"error": "user_id not found after token exchange"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+            return {
+                "user_id": user_id,
+                "access_token": access_token,
+                "refresh_token": token_data.get("refresh_token"),
+                **token_data
+            }, HTTPStatus.OK
+        except httpx.HTTPError as e:
+            logger.exception("Network error during token exchange")
+            return {"error": "network error during token exchange", "details": str(e)}, \
+                HTTPStatus.INTERNAL_SERVER_ERROR
+
+    async def refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Refresh the access token from the API
+
+        Concurrent refreshes of the same user share a single request, so that they do not invalidate each other's
+        refresh token.
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        return await async_flight_group.do(
+            (as_document_id(document_id), "refresh"), self._observed_refresh_access_token, document_id)
+
+    async def renew_token(self, document_id) -> str | None:
+        """
+        Refresh the access token of a user after an unauthorized response and return it
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: str | None: New access token, None if it could not be refreshed
+        """
+        _, status = await self.refresh_access_token(document_id)
+        if status != HTTPStatus.OK:
+            return None
+        token, _ = await asyncio.to_thread(get_token_from_database, document_id)
+        return token
+
+    async def _observed_refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Refresh the access token, observing the latency of the refresh
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        with trace_span('fitbit.refresh_token'), observe_latency(token_refresh_latency) as labels:
+            message, status = await self._refresh_access_token(document_id)
+            labels['status'] = str(status.value)
+        return message, status
+
+    async def _refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Exchange the stored refresh token for a new token pair and store it in the database
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        data_base = users_database()
+
+        response_code, document = await asyncio.to_thread(data_base.read_document, document_id)
+
+        if response_code == ResponseCode.ERROR_NOT_FOUND:
+            return {'error': 'User not found'}, HTTPStatus.NOT_FOUND
+        elif response_code == ResponseCode.ERROR_UNKNOWN:
+            return {'error': 'Unknown error occurred'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        decoded_document = decode_data(document)
+        refresh_token = decoded_document["refresh_token"]
+
+        headers, data = self.get_request_params_for_refresh_token(self.get_authorization_string(), refresh_token)
+        refresh_token_response = await self.make_token_request(headers, data)
+
+        new_access_token = refresh_token_response.get('access_token')
+        new_refresh_token = refresh_token_response.get('refresh_token')
+
+        if not new_access_token or not new_refresh_token:
+            return {'error': 'Failed to refresh token'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        status = await asyncio.to_thread(data_base.update_document, document_id, new_access_token, new_refresh_token)
+
+        if status == ResponseCode.SUCCESS:
+            return {'status': 'Token refreshed successfully'}, HTTPStatus.OK
+        else:
+            return {'error': 'Failed to refresh token'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    @traced('retriever.update_all_tokens')
+    async def update_all_tokens(self, run_id: str = None) -> tuple[dict, HTTPStatus]:
+        """
+        Update all access tokens from the wearable device API in the database, refreshing several users at a time
+
+        The tokens refreshed are checkpointed, so a run restarted with the same run ID only refreshes the rest.
+
+        :param run_id: str: Run ID (defaults to one per device type and UTC hour)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        documents, status = await asyncio.to_thread(get_all_documents, self.DEVICE_TYPE)
+        if status != HTTPStatus.OK:
+            return users_error(status), status
+
+        async def refresh_user(user_key):
+            _, status = await self.refresh_access_token(user_key)
+            return status
+
+        run = await asyncio.to_thread(TokenRefreshRun, documents, self.DEVICE_TYPE, run_id)
+        await run.arun(refresh_user, self.BATCH_FETCH_WORKERS)
+        return run.summary()
+
+    async def get_user_info(self, user_id) -> tuple[dict, HTTPStatus]:
+        """
+        Get user info from the wearable device API
+
+        :param user_id: str: User ID
+        :return: tuple[dict, HTTPStatus]: User info and HTTP status code
+        """
+        user_key = identity_map.key_for(user_id)
+        token, response_code = await asyncio.to_thread(get_token_from_database, user_key)
+
+        if response_code == ResponseCode.ERROR_NOT_FOUND:
+            return {'error': 'User not found'}, HTTPStatus.NOT_FOUND
+
+        return await self.make_data_query(document_id=user_key, token=token, scope=["user_info"])
+
+    async def retrieve_data(
+            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[dict, HTTPStatus]:
+        """
+        Retrieve data from the wearable device by querying the API
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[dict, HTTPStatus]: Data and HTTP status code
+        """
+        user_key = identity_map.key_for(user_id)
+        token, response_code = await asyncio.to_thread(get_token_from_database, user_key)
+
+        if response_code == ResponseCode.ERROR_NOT_FOUND:
+            return {'error': 'User not found'}, HTTPStatus.NOT_FOUND
+
+        return await self.make_data_query(user_key, token, date, scope, db_storage, view)
+
+    @traced('retriever.retrieve_data_batch')
+    async def retrieve_data_batch(
+            self, user_ids: list[str], dates: list[str], scope: list[str], view: DataView = None) \
+            -> tuple[dict, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, reading stored data with a single query and fetching only the
+        missing or failed scopes from the API concurrently
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[dict, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        user_keys = identity_map.keys_for(user_ids)
+        owners = {user_key: user_id for user_id, user_key in user_keys.items()}
+
+        response_code, documents = await asyncio.to_thread(
+            vitals_database().read_user_days, owners.keys(), dates, scope)
+        if response_code == ResponseCode.ERROR_UNKNOWN:
+            return {'error': 'Unknown error occurred'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        user_days, gaps = find_gaps(documents, owners, dates, scope)
+        if gaps:
+            tokens = await asyncio.to_thread(get_tokens_from_database, {user_key for user_key, _ in gaps})
+            limit = asyncio.Semaphore(self.BATCH_FETCH_WORKERS)
+
+            @traced('retriever.fetch_gap')
+            async def fetch_gap(user_key, date, missing):
+                if user_key not in tokens:
+                    return user_not_found(missing)
+                async with limit:
+                    data, _, _ = await self.fetch_scopes(user_key, tokens[user_key], date, missing, view)
+                return data
+
+            fetched = await asyncio.gather(*(fetch_gap(key[0], key[1], missing) for key, missing in gaps.items()))
+            for key, data in zip(gaps, fetched):
+                user_days[key].update(data)
+
+        return batch_results(user_days, owners, dates, scope, view)
+
+    @traced('retriever.get_daily_vitals_data')
+    async def get_daily_vitals_data(self, date, run_id: str = None) -> tuple[dict, HTTPStatus]:
+        """
+        Get daily vitals data from all the Fitbit users stored in the database and store it in the database
+
+        The users of the shards claimed by this node are fetched up to BATCH_FETCH_WORKERS at a time, see
+        DailyVitalsRun.
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID (defaults to one per device type and date)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        documents, status = await asyncio.to_thread(get_all_documents, self.DEVICE_TYPE)
+        if status != HTTPStatus.OK:
+            return users_error(status), status
+
+        async def fetch_user(document):
+            decoded_document = decode_data(document)
+            _, status = await self.make_data_query(
+                document_id=decoded_document["user_key"], token=decoded_document["token"], date=date,
+                scope=fitbit_vendor.daily_scope, db_storage=True)
+            return status
+
+        run = await asyncio.to_thread(DailyVitalsRun, documents, self.DEVICE_TYPE, date, run_id)
+        await run.arun(fetch_user, self.BATCH_FETCH_WORKERS)
+        return await asyncio.to_thread(run.summary)
+
+    def _serves(self, user: dict | None) -> bool:
+        # Users no longer stored are reported by the retriever of the default device only
+        return device_type_of(user) == self.DEVICE_TYPE if user else self.DEVICE_TYPE == DEFAULT_DEVICE_TYPE
+
+    @traced('retriever.repair_vitals_data')
+    async def repair_vitals_data(self, dates: list[str], scope: list[str]) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch again the scopes of the stored user-days whose last fetch failed or returned data that was not final yet,
+        and store them in the database
+
+        Stored documents without fetch status (written before it was tracked) are skipped, since there is no way to
+        tell which of their scopes are complete, and so are the user-days of users of other devices.
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[dict, HTTPStatus]: Repair summary and HTTP status code
+        """
+        response_code, documents = await asyncio.to_thread(vitals_database().read_scope_status, dates)
+        if response_code == ResponseCode.ERROR_UNKNOWN:
+            return {'error': 'Unknown error occurred'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        run = RepairRun(documents, scope)
+        if run.repairs:
+            users = await asyncio.to_thread(get_users_from_database, {user_key for user_key, _ in run.repairs})
+            run.keep(users, self._serves)
+            await run.arun(self.fetch_scopes, self.BATCH_FETCH_WORKERS)
+        return await asyncio.to_thread(run.summary)
+
+    @traced('retriever.make_data_query')
+    async def make_data_query(
+            self, document_id, token: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch the data of every element of the scope from the Fitbit API concurrently, optionally storing it
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID).
+        :param token: str: Access token for the Fitbit API.
+        :param date: date: Date in 'YYYY-MM-DD' format.
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Flag to store data in the database.
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data).
+        :return: tuple[dict, HTTPStatus]: Combined data and HTTP status code.
+        """
+        try:
+            combined_data, successful_operations, statuses = await self.fetch_scopes(
+                document_id, token, date, scope, view if not db_storage else None)
+
+            if db_storage:
+                # Handing the data to the write-behind buffer only blocks while the buffer is full
+                response = await asyncio.to_thread(
+                    store_vitals, document_id, date, combined_data, fetch_status(statuses))
+            else:
+                response = ResponseCode.SUCCESS
+
+            if response == ResponseCode.SUCCESS and (successful_operations == len(scope)):
+                status = HTTPStatus.OK
+            elif successful_operations > 0:
+                status = HTTPStatus.PARTIAL_CONTENT
+            else:
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+            if view:
+                combined_data = view.apply_all(combined_data)
+            return combined_data, status
+
+        except Exception as e:
+            return {'error': f"An error occurred: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    async def fetch_scopes(self, document_id, token: str = None, date: str = None, scope: list[str] = None,
+                           view: DataView = None) -> tuple[dict, int, dict]:
+        """
+        Fetch the raw data of the scope elements from the Fitbit API concurrently, refreshing the token on
+        unauthorized responses
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID).
+        :param token: str: Access token for the Fitbit API.
+        :param date: str: Date in 'YYYY-MM-DD' format.
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: View used to narrow the Fitbit request (None requests the full data).
+        :return: tuple[dict, int, dict]: Data (or error message) keyed by scope, number of successful scopes and HTTP
+            status of each scope.
+        """
+        query_handler = AsyncFitbitQueryHandler(self.client, token, self.API_BASE_URL, as_document_id(document_id))
+
+        results = await asyncio.gather(
+            *(self._fetch_scope(query_handler, document_id, date, element, view) for element in scope))
+
+        combined_data = {}
+        statuses = {}
+        for element, (data, status) in zip(scope, results):
+            combined_data[element] = data
+            statuses[element] = status
+        successful_operations = sum(1 for status in statuses.values() if status == HTTPStatus.OK)
+        return combined_data, successful_operations, statuses
+
+    async def _fetch_scope(self, query_handler: AsyncFitbitQueryHandler, document_id, date: str, element: str,
+                           view: DataView = None) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch the raw data of a scope element, serving it from the cache when final, retrying retryable failures and
+        refreshing the token once unauthorized
+
+        :param query_handler: AsyncFitbitQueryHandler: Handler of the user and its token, shared by the elements of
+            the scope
+        :param document_id: UserKey | str: User key or document ID (hashed User ID).
+        :param date: str: Date in 'YYYY-MM-DD' format.
+        :param element: str: Scope element (e.g., "sleep").
+        :param view: DataView: View used to narrow the Fitbit request (None requests the full data).
+        :return: tuple[dict, HTTPStatus]: Data (or error message) and HTTP status
+        """
+        if element not in fitbit_vendor.endpoints:
+            return {"error": f"Operation {element} not found in {fitbit_vendor.name} endpoints"}, HTTPStatus.NOT_FOUND
+
+        status = None
+        fetch_params = view.fetch_params(element) if view else None
+        request_key = FinalDataCache.key(fitbit_vendor.name, query_handler.user_id, date, element, fetch_params)
+        cached = self.cache.get(request_key)
+        if cached is not None:
+            return cached, HTTPStatus.OK
+
+        with trace_span('retriever.fetch_scope', scope=element) as span:
+            for attempt in range(3):
+                token = query_handler.token
+                response, status = await async_flight_group.do(
+                    request_key, query_handler.fetch_data, element, date, fetch_params, token)
+
+                if status == HTTPStatus.OK:
+                    break
+                elif status == HTTPStatus.UNAUTHORIZED:
+                    # The elements rejected together renew the token once, the others retry with the new one
+                    await query_handler.renew_token(token, lambda: self.renew_token(document_id))
+                elif worth_retrying(status, fitbit_quota, query_handler.user_id):
+                    if not await async_sleep_before_retry(attempt):
+                        break
+                else:
+                    break
+            if span is not None:
+                span.add_attribute('attempts', attempt + 1)
+                span.add_attribute('http.status_code', int(status) if status else None)
+
+        if status != HTTPStatus.OK:
+            return get_query_error_message(element, status), status or HTTPStatus.INTERNAL_SERVER_ERROR
+        self.cache.put(request_key, date, element, response)
+        return response, status
+
+    def get_authorization_string(self) -> str:
+        """
+        Get the authorization string
+
+        :arg: None
+        :return: str: Authorization string
+        """
+        return base64.b64encode(f"{self.CLIENT_ID}:{self.CLIENT_SECRET}".encode('ascii')).decode('ascii')
+
+    def get_request_params_for_refresh_token(self, authorization_string, refresh_token) -> tuple[dict, dict]:
+        """
+        Get the request parameters for the refresh token request
+
+        :param authorization_string: str: Authorization string
+        :param refresh_token: str: Refresh token
+        :return: tuple[dict,dict]: Headers and data
+        """
+        headers = {
+            "authorization": f"Basic {authorization_string}",
+            "accept": "application/json",
+            "accept-locale": "en_US",
+            "accept-language": "metric"
+        }
+
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": self.CLIENT_ID
+        }
+
+        return headers, data
+
+    async def make_token_request(self, headers, data) -> dict:
+        """
+        Make a token request to Fitbit API
+
+        :param headers: dict: Headers for the request
+        :param data: dict: Data for the request
+        :return: dict: Token request response JSON
+        """
+        try:
+            with guarded_call("token") as timeout:
+                token_response = await self.client.post(self.TOKEN_URL, headers=headers, data=data, timeout=timeout)
+                if token_response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                    raise httpx.HTTPStatusError(f"Token endpoint answered {token_response.status_code}",
+                                                request=token_response.request, response=token_response)
+            return token_response.json()
+        except Exception as e:
+            logger.error(f"Token request failed: {e}")
+            return {}
@@ -0,0 +1,101 @@
+from __future__ import annotations
+from .FetchEngine import DeviceServerError, RETRYABLE_STATUSES, is_endpoint_failure
+from .FitbitVendor import fitbit_vendor
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import guarded_call, CircuitOpenError, \
+    DeadlineExceededError, remaining_time
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import fitbit_scheduler, fitbit_quota
+from vitals_data_retrieving.vitals_data_retrieving_metrics import observe_latency, fitbit_latency
+from vitals_data_retrieving.vitals_data_retrieving_tracing import trace_span
+from http import HTTPStatus
+from typing import Awaitable, Callable
+import asyncio
+import httpx
+
+
+def _is_fitbit_failure(error: Exception) -> bool:
+    # As is_endpoint_failure, with the timeouts and connection errors of httpx
+    return is_endpoint_failure(error) or isinstance(error, httpx.TransportError)
+
+
+class AsyncFitbitQueryHandler:
+    def __init__(self, client: httpx.AsyncClient, token: str, base_url: str = None, user_id: str = None):
+        """
+        Initialize the handler of the Fitbit data requests of a user, made as coroutines
+
+        :param client: httpx.AsyncClient: Client whose connection pool is shared by every request of the event loop
+        :param token: str: Access token
+        :param base_url: str: Base URL replacing the Fitbit API host, e.g. a local mock server (None targets the real
+        API)
+        :param user_id: str: Document ID of the user, used to track the rate limit of the user (None does not track it)
+        """
+        self.client = client
+        self.base_url = base_url
+        self.user_id = user_id
+        self.token = token
+        self._token_lock = asyncio.Lock()
+
+    async def renew_token(self, used_token: str, renew: Callable[[], Awaitable[str | None]]) -> None:
+        """
+        Replace the token after an unauthorized response
+
+        Only the first request rejected with the current token renews it: the others rejected with the same token
+        wait for that renewal and retry with the new one.
+
+        :param used_token: str: Token of the rejected request
+        :param renew: Callable[[], Awaitable[str | None]]: Refreshes the token of the user and returns the new one
+            (None if it could not be refreshed)
+        """
+        async with self._token_lock:
+            if self.token == used_token:
+                self.token = await renew() or used_token
+
+    async def fetch_data(self, scope, date=None, fetch_params: dict = None, token: str = None) \
+            -> tuple[dict, HTTPStatus]:
+        """
+        Fetch data based on the given scope element and optional date.
+
+        :param scope: The scope element to fetch data for.
+        :param date: Optional date in 'YYYY-MM-DD' format for endpoints that require it.
+        :param fetch_params: Optional intraday detail level and time window (see DataView.fetch_params).
+        :param token: Optional access token (defaults to the current token of the handler).
+        :return: tuple: The response data and HTTP status code.
+
+        Same scheduling, circuit breaking and rate limiting as FetchEngine.fetch, sharing the circuit breakers of the
+        Fitbit endpoints with it, but waiting for the scheduler slot and the response without blocking the event loop.
+        """
+        try:
+            endpoint_spec = fitbit_vendor.endpoints[scope]
+            if endpoint_spec.requires_date and not date:
+                return {"error": f"Date is required for {scope} operation"}, HTTPStatus.BAD_REQUEST
+            endpoint = fitbit_vendor.build_url(endpoint_spec, date, self.base_url, fetch_params)
+
+            if self.user_id is not None and not fitbit_quota.allows(self.user_id):
+                return {"error": f"Rate limit of the user reached, {scope} data deferred"}, \
+                    HTTPStatus.TOO_MANY_REQUESTS
+
+            with trace_span(f"fitbit.{scope}", scope=scope) as span, \
+                    observe_latency(fitbit_latency, scope=scope) as labels:
+                async with fitbit_scheduler.async_slot(timeout=remaining_time()):
+                    with guarded_call(f"{fitbit_vendor.name}:{scope}", _is_fitbit_failure) as timeout:
+                        response = await self.client.get(
+                            endpoint, headers=fitbit_vendor.headers(token or self.token), timeout=timeout)
+                        status = HTTPStatus(response.status_code)
+                        if self.user_id is not None:
+                            fitbit_quota.record(self.user_id, response.headers)
+                        labels['status'] = str(response.status_code)
+                        if span is not None:
+                            span.add_attribute('http.status_code', response.status_code)
+                            span.add_attribute('http.flavor', response.http_version)
+                        data = response.json()
+                        if status in RETRYABLE_STATUSES:
+                            raise DeviceServerError(data, status)
+            return data, status
+
+        except DeviceServerError as e:
+            return e.data, e.status
+        except CircuitOpenError:
+            return {"error": f"{scope} endpoint is unavailable, try again later"}, HTTPStatus.SERVICE_UNAVAILABLE
+        except (DeadlineExceededError, TimeoutError, httpx.TimeoutException):
+            return {"error": f"Timed out fetching {scope} data"}, HTTPStatus.GATEWAY_TIMEOUT
+        except Exception as e:
+            return {"error": f"An error occurred during data fetch: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
@@ -0,0 +1,109 @@
+from abc import ABCMeta, abstractmethod
+from http import HTTPStatus
+
+
+class AsyncWearableDeviceDataRetriever(metaclass=ABCMeta):
+    """
+    Coroutine counterpart of WearableDeviceDataRetriever. The results are plain data instead of Flask responses, so
+    that they can be produced outside of a request; SyncRetrieverAdapter serves them to the Flask views.
+    """
+
+    @abstractmethod
+    async def connect_to_api(self) -> str:
+        """
+        Connect to the API of the wearable device
+
+        :arg: None
+        :return: str: Authorization string
+        """
+        pass
+
+    @abstractmethod
+    async def get_access_token(self, authorization_code) -> tuple[dict, HTTPStatus]:
+        """
+        Get the access token from the API
+
+        :param authorization_code: str: Authorization code
+        :return: tuple[dict, HTTPStatus]: Token data and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Refresh the access token from the API
+
+        :param document_id: str: Document ID (hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def update_all_tokens(self, run_id=None) -> tuple[dict, HTTPStatus]:
+        """
+        Update all access tokens from the wearable device API in the database, skipping the users already refreshed
+        by the run
+
+        :param run_id: str: Run ID (None uses a default per period)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def get_user_info(self, user_id) -> tuple[dict, HTTPStatus]:
+        """
+        Get user info from the wearable device API
+
+        :param user_id: str: User ID
+        :return: tuple[dict, HTTPStatus]: User info and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def retrieve_data(self, user_id, date, scope, db_storage, view=None) -> tuple[dict, HTTPStatus]:
+        """
+        Retrieve data from the wearable device by querying the API
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[dict, HTTPStatus]: Data and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def retrieve_data_batch(self, user_ids, dates, scope, view=None) -> tuple[dict, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, serving stored data and querying the API only for the gaps
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[dict, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def get_daily_vitals_data(self, date, run_id=None) -> tuple[dict, HTTPStatus]:
+        """
+        Get daily vitals data from all the users stored in the database and store it in the database
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID, shared by the nodes and attempts of the run (None uses a default per date)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    async def repair_vitals_data(self, dates, scope) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch again the stored scopes whose last fetch failed or returned data that was not final yet
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[dict, HTTPStatus]: Repair summary and HTTP status code
+        """
+        pass
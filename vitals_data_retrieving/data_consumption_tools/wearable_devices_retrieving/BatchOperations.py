@@ -0,0 +1,416 @@
+from __future__ import annotations
+from .DataView import DataView
+from vitals_data_retrieving.data_consumption_tools.Entities.ChangeDetection import is_error_payload
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import UserKey
+from vitals_data_retrieving.data_consumption_tools.Entities.WriteBehind import WriteTracker, store_vitals, \
+    track_writes, untrack_writes
+from vitals_data_retrieving.data_consumption_tools.Entities.Sharding import claim_shards, shard_of
+from vitals_data_retrieving.data_consumption_tools.Entities.Checkpoints import RunCheckpoints
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import fetch_status, scopes_to_repair
+from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import decode_data
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Awaitable, Callable
+import asyncio
+
+# The batch operations of the device retrievers, independent of the vendor and of how the API is called: each run
+# takes the fetch of a user as a callable, run one user at a time (run) or as coroutines, up to a number of users at a
+# time (arun). The blocking database calls of arun are made from worker threads.
+
+
+def users_error(status: HTTPStatus) -> dict:
+    """
+    Error message of a batch operation whose users could not be read
+
+    :param status: HTTPStatus: Status returned by get_all_documents
+    :return: dict: Error message
+    """
+    return {'error': 'No users found' if status == HTTPStatus.NOT_FOUND else 'Unknown error occurred'}
+
+
+def user_not_found(scope: list[str]) -> dict:
+    """
+    Data of the scopes of a user that is not stored
+
+    :param scope: list[str]: Scopes
+    :return: dict: Error message keyed by scope
+    """
+    return {element: {'error': 'User not found'} for element in scope}
+
+
+def find_gaps(documents: list[dict], user_keys, dates: list[str], scope: list[str]) -> tuple[dict, dict]:
+    """
+    Sort the stored vitals of a batch by user-day and find the scopes left to fetch
+
+    :param documents: list[dict]: Stored documents (see VitalsRepository.read_user_days)
+    :param user_keys: Iterable[UserKey]: Users of the batch
+    :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+    :param scope: list[str]: Scopes of the batch
+    :return: tuple[dict, dict]: Stored data keyed by (UserKey, date), without the errors of failed fetches, and
+        missing scopes keyed by (UserKey, date)
+    """
+    user_days = {}
+    for document in documents:
+        day = user_days.setdefault((UserKey.from_document_id(document["user_id"]), document["date"]), {})
+        for element, payload in document.get("data", {}).items():
+            if not is_error_payload(payload):
+                day[element] = payload
+
+    gaps = {}
+    for user_key in user_keys:
+        for date in dates:
+            stored = user_days.setdefault((user_key, date), {})
+            missing = [element for element in scope if element not in stored]
+            if missing:
+                gaps[(user_key, date)] = missing
+    return user_days, gaps
+
+
+def batch_results(user_days: dict, owners: dict, dates: list[str], scope: list[str], view: DataView = None) \
+        -> tuple[dict, HTTPStatus]:
+    """
+    Arrange the data of a batch by user ID and date
+
+    :param user_days: dict: Data keyed by (UserKey, date), stored and fetched
+    :param owners: dict: User ID keyed by user key
+    :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+    :param scope: list[str]: Scopes of the batch
+    :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+    :return: tuple[dict, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+    """
+    results = {}
+    failed_scopes = 0
+    for (user_key, date), data in user_days.items():
+        failed_scopes += sum(1 for payload in data.values() if is_error_payload(payload))
+        results.setdefault(owners[user_key], {})[date] = view.apply_all(data) if view else data
+
+    total_scopes = len(owners) * len(dates) * len(scope)
+    if failed_scopes == 0:
+        status = HTTPStatus.OK
+    elif failed_scopes < total_scopes:
+        status = HTTPStatus.PARTIAL_CONTENT
+    else:
+        status = HTTPStatus.INTERNAL_SERVER_ERROR
+    return results, status
+
+
+class TokenRefreshRun:
+    def __init__(self, documents: list[dict], device_type: str, run_id: str = None):
+        """
+        Initialize the refresh of the tokens of every user of a device
+
+        The tokens refreshed are checkpointed, so a run restarted with the same run ID only refreshes the rest.
+
+        :param documents: list[dict]: Stored users of the device
+        :param device_type: str: Device type
+        :param run_id: str: Run ID (defaults to one per device type and UTC hour)
+        """
+        self.checkpoints = RunCheckpoints(
+            run_id or f"update_all_tokens:{device_type}:{datetime.now(timezone.utc):%Y-%m-%dT%H}")
+        pending = set(self.checkpoints.pending([document["_id"] for document in documents]))
+        self.documents = [document for document in documents if document["_id"] in pending]
+        self.updated_tokens = 0
+
+    def _record(self, document_id: str, status: HTTPStatus) -> None:
+        self.checkpoints.record(document_id, status)
+        if status == HTTPStatus.OK:
+            self.updated_tokens += 1
+
+    def run(self, refresh_user: Callable[[UserKey], HTTPStatus]) -> None:
+        """
+        Refresh the tokens one user at a time
+
+        :param refresh_user: Callable[[UserKey], HTTPStatus]: Refreshes the token of a user
+        """
+        for document in self.documents:
+            self._record(document["_id"], refresh_user(decode_data(document)["user_key"]))
+        self.checkpoints.commit()
+
+    async def arun(self, refresh_user: Callable[[UserKey], Awaitable[HTTPStatus]], concurrency: int) -> None:
+        """
+        Refresh the tokens of up to concurrency users at a time
+
+        :param refresh_user: Callable[[UserKey], Awaitable[HTTPStatus]]: Refreshes the token of a user
+        :param concurrency: int: Users refreshed at a time
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def refresh(document):
+            async with limit:
+                return document["_id"], await refresh_user(decode_data(document)["user_key"])
+
+        for next_refresh in asyncio.as_completed([refresh(document) for document in self.documents]):
+            await asyncio.to_thread(self._record, *await next_refresh)
+        await asyncio.to_thread(self.checkpoints.commit)
+
+    def summary(self) -> tuple[dict, HTTPStatus]:
+        """
+        Outcome of the run
+
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        if self.updated_tokens == len(self.documents):
+            return {'status': 'All tokens updated successfully'}, HTTPStatus.OK
+        elif self.updated_tokens == 0:
+            return {'error': 'Failed to update any tokens'}, HTTPStatus.INTERNAL_SERVER_ERROR
+        else:
+            return {'error': 'Some tokens failed to update'}, HTTPStatus.PARTIAL_CONTENT
+
+
+class DailyVitalsRun:
+    def __init__(self, documents: list[dict], device_type: str, date: str, run_id: str = None):
+        """
+        Initialize the fetch of the daily vitals of every user of a device
+
+        The users are split into shards by their document ID and this node only processes the shards it claims a
+        lease on, so any number of nodes triggered for the same date share the work without repeating it. Within a
+        shard, the users whose vitals were fetched and stored are checkpointed: a restarted or repeated run skips
+        them and only fetches the users left or failed. A shard is completed once all its users succeeded (scopes
+        that failed for a user are left to repair_vitals_data).
+
+        :param documents: list[dict]: Stored users of the device
+        :param device_type: str: Device type
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID (defaults to one per device type and date)
+        """
+        self.shards = {}
+        for document in documents:
+            self.shards.setdefault(shard_of(document["_id"]), []).append(document)
+
+        self.total_documents = 0
+        self.successful_operations = 0
+        self.partial_operations = 0
+        self.skipped_documents = 0
+
+        # Outcome of the documents stored by this run only, whatever else the write-behind buffer is writing
+        self.writes = WriteTracker()
+        self._checkpointed_failures = 0
+        self.run_id = run_id or f"daily_vitals:{device_type}:{date}"
+        self.checkpoints = RunCheckpoints(self.run_id, flush=self._stored)
+        self._failed_before = 0
+
+    def _stored(self) -> bool:
+        # The documents are written in the background: users are only checkpointed once they are stored
+        self.writes.wait()
+        failures = self.writes.failed
+        stored_all, self._checkpointed_failures = failures == self._checkpointed_failures, failures
+        return stored_all
+
+    def _start(self, lease) -> list[dict]:
+        # Users of the shard not checkpointed yet
+        users = self.shards.get(lease.shard, [])
+        pending = set(self.checkpoints.pending([document["_id"] for document in users]))
+        self.skipped_documents += len(users) - len(pending)
+        self._failed_before = self.checkpoints.failed
+        return [document for document in users if document["_id"] in pending]
+
+    def _record(self, document_id: str, status: HTTPStatus) -> None:
+        self.total_documents += 1
+        self.checkpoints.record(document_id, status)
+        if status == HTTPStatus.OK:
+            self.successful_operations += 1
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.partial_operations += 1
+
+    def _finish(self, lease, lost: bool) -> None:
+        self.checkpoints.commit()
+        if not lost:
+            # A shard with failed users is left for the next run, which only retries those users
+            if self.checkpoints.failed == self._failed_before:
+                lease.complete()
+            else:
+                lease.release()
+
+    def run(self, fetch_user: Callable[[dict], HTTPStatus]) -> None:
+        """
+        Fetch and store the vitals of the users of the claimed shards, one user at a time
+
+        :param fetch_user: Callable[[dict], HTTPStatus]: Fetches and stores the vitals of a stored user
+        """
+        token = track_writes(self.writes)
+        try:
+            for lease in claim_shards(self.run_id):
+                lost = False
+                for document in self._start(lease):
+                    if not lease.keep_alive():
+                        # The lease expired and another node took the shard over, it fetches the remaining users
+                        lost = True
+                        break
+                    self._record(document["_id"], fetch_user(document))
+                self._finish(lease, lost)
+        finally:
+            untrack_writes(token)
+
+    async def arun(self, fetch_user: Callable[[dict], Awaitable[HTTPStatus]], concurrency: int) -> None:
+        """
+        Fetch and store the vitals of the users of the claimed shards, up to concurrency users at a time
+
+        When the lease of a shard is lost, the users not fetched yet are left to the node that took it over.
+
+        :param fetch_user: Callable[[dict], Awaitable[HTTPStatus]]: Fetches and stores the vitals of a stored user
+        :param concurrency: int: Users fetched at a time
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def fetch(document):
+            async with limit:
+                return document["_id"], await fetch_user(document)
+
+        # The fetch tasks and threads copy the context, and with it the tracker of the run
+        token = track_writes(self.writes)
+        try:
+            leases = claim_shards(self.run_id)
+            while (lease := await asyncio.to_thread(next, leases, None)) is not None:
+                users = await asyncio.to_thread(self._start, lease)
+                lost = False
+                tasks = [asyncio.ensure_future(fetch(document)) for document in users]
+                for next_user in asyncio.as_completed(tasks):
+                    await asyncio.to_thread(self._record, *await next_user)
+                    if not await asyncio.to_thread(lease.keep_alive):
+                        lost = True
+                        break
+                if lost:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                await asyncio.to_thread(self._finish, lease, lost)
+        finally:
+            untrack_writes(token)
+
+    def summary(self) -> tuple[dict, HTTPStatus]:
+        """
+        Outcome of the run, once every document is stored
+
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        self.writes.wait()
+        if self.writes.failed:
+            return {'error': 'Some daily vitals data could not be stored'}, HTTPStatus.PARTIAL_CONTENT
+
+        if self.total_documents == 0:
+            message = 'No users left to fetch' if self.skipped_documents else 'No shards left to process in this run'
+            return {'status': message}, HTTPStatus.OK
+        elif self.successful_operations == self.total_documents:
+            return {'status': 'All daily vitals data fetched successfully'}, HTTPStatus.OK
+        elif self.successful_operations > 0 or self.partial_operations > 0:
+            return {'error': 'Some daily vitals data failed to fetch'}, HTTPStatus.PARTIAL_CONTENT
+        else:
+            return {'error': 'Failed to fetch any daily vitals data'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+class RepairRun:
+    def __init__(self, documents: list[dict], scope: list[str]):
+        """
+        Initialize the repair of the stored user-days whose last fetch failed or returned data that was not final yet
+
+        Stored documents without fetch status (written before it was tracked) are skipped, since there is no way to
+        tell which of their scopes are complete.
+
+        :param documents: list[dict]: Stored fetch status of the user-days (see VitalsRepository.read_scope_status)
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        """
+        self.repairs = {}
+        self.previous = {}
+        self.skipped_user_days = 0
+        for document in documents:
+            if not document["scope_status"]:
+                self.skipped_user_days += 1
+                continue
+            stale = scopes_to_repair(document["date"], document["scope_status"], scope)
+            if stale:
+                key = (UserKey.from_document_id(document["user_id"]), document["date"])
+                self.repairs[key] = stale
+                self.previous[key] = document["scope_status"]
+
+        self.users = {}
+        self.repaired_scopes = 0
+        self.failed_scopes = 0
+        self.writes = WriteTracker()
+
+    def keep(self, users: dict[UserKey, dict], serves: Callable[[dict | None], bool]) -> None:
+        """
+        Only repair the user-days of the users served by a retriever
+
+        :param users: dict[UserKey, dict]: Stored users of the user-days to repair
+        :param serves: Callable[[dict | None], bool]: Whether the retriever serves a user (None for users not stored)
+        """
+        self.users = users
+        self.repairs = {(user_key, date): stale for (user_key, date), stale in self.repairs.items()
+                        if serves(users.get(user_key))}
+
+    def _store(self, user_key: UserKey, date: str, data: dict, statuses: dict) -> None:
+        store_vitals(user_key, date, data, fetch_status(statuses, previous=self.previous[(user_key, date)]))
+
+    def _record(self, stale: list[str], successful_operations: int) -> None:
+        self.repaired_scopes += successful_operations
+        self.failed_scopes += len(stale) - successful_operations
+
+    def run(self, fetch: Callable[[UserKey, str, str, list[str]], tuple[dict, int, dict]]) -> None:
+        """
+        Fetch again and store the stale scopes, one user-day at a time
+
+        :param fetch: Callable[[UserKey, str, str, list[str]], tuple[dict, int, dict]]: Fetches the scopes of a
+            user-day (user key, token, date, scopes), see fetch_scopes
+        """
+        token = track_writes(self.writes)
+        try:
+            for (user_key, date), stale in self.repairs.items():
+                if user_key not in self.users:
+                    self._record(stale, 0)
+                    continue
+                data, successful_operations, statuses = fetch(user_key, self.users[user_key]["token"], date, stale)
+                self._store(user_key, date, data, statuses)
+                self._record(stale, successful_operations)
+        finally:
+            untrack_writes(token)
+
+    async def arun(self, fetch: Callable[[UserKey, str, str, list[str]], Awaitable[tuple[dict, int, dict]]],
+                   concurrency: int) -> None:
+        """
+        Fetch again and store the stale scopes, up to concurrency user-days at a time
+
+        :param fetch: Callable[[UserKey, str, str, list[str]], Awaitable[tuple[dict, int, dict]]]: Fetches the
+            scopes of a user-day (user key, token, date, scopes), see fetch_scopes
+        :param concurrency: int: User-days fetched at a time
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def repair(user_key, date, stale):
+            if user_key not in self.users:
+                self._record(stale, 0)
+                return
+            async with limit:
+                data, successful_operations, statuses = await fetch(
+                    user_key, self.users[user_key]["token"], date, stale)
+            await asyncio.to_thread(self._store, user_key, date, data, statuses)
+            self._record(stale, successful_operations)
+
+        token = track_writes(self.writes)
+        try:
+            await asyncio.gather(*(repair(user_key, date, stale) for (user_key, date), stale in self.repairs.items()))
+        finally:
+            untrack_writes(token)
+
+    def summary(self) -> tuple[dict, HTTPStatus]:
+        """
+        Outcome of the repair, once every document is stored
+
+        :return: tuple[dict, HTTPStatus]: Repair summary and HTTP status code
+        """
+        self.writes.wait()
+        if self.writes.failed:
+            return {'error': 'Some repaired vitals data could not be stored'}, HTTPStatus.PARTIAL_CONTENT
+
+        summary = {
+            'user_days': len(self.repairs),
+            'repaired_scopes': self.repaired_scopes,
+            'failed_scopes': self.failed_scopes,
+            'skipped_user_days': self.skipped_user_days,
+        }
+        if self.failed_scopes == 0:
+            status = HTTPStatus.OK
+        elif self.repaired_scopes > 0:
+            status = HTTPStatus.PARTIAL_CONTENT
+        else:
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+        return summary, status
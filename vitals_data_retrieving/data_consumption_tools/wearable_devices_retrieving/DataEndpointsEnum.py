@@ -1,5 +1,8 @@
 from enum import Enum
 
+# Host of the real Fitbit Web API, replaced by the base URL given to build_url (e.g., a local mock server)
+FITBIT_API_URL = "https://api.fitbit.com"
+
 
 class DataEndpointsEnum(Enum):
     """
@@ -29,3 +32,39 @@ class DataEndpointsEnum(Enum):
     # Get intraday activity time series data (steps) for a specific date. Provides detailed step counts at
     # 1-minute intervals.
     activity = "https://api.fitbit.com/1/user/-/activities/steps/date/{date}/1d/1min.json"
+
+    def build_url(self, date: str = None, detail_level: str = None, start_time: str = None,
+                  end_time: str = None, base_url: str = None) -> str:
+        """
+        Build the request URL for the endpoint, optionally using a coarser intraday detail level and a time window
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param detail_level: str: Intraday detail level (e.g., "1min"), must be one of INTRADAY_DETAIL_LEVELS
+        :param start_time: str: Start of the time window in 'HH:MM' format
+        :param end_time: str: End of the time window in 'HH:MM' format
+        :param base_url: str: Base URL replacing the Fitbit API host (None targets the real API)
+        :return: str: Endpoint URL
+        """
+        endpoint = self.value
+        levels = INTRADAY_DETAIL_LEVELS.get(self.name)
+
+        if levels and (detail_level or (start_time and end_time)):
+            prefix, default_level = endpoint.rsplit('/', 1)
+            detail_level = detail_level or default_level.removesuffix('.json')
+            if detail_level not in levels.values():
+                raise ValueError(f"Detail level {detail_level} not supported for {self.name}")
+            time_window = f"/time/{start_time}/{end_time}" if start_time and end_time else ""
+            endpoint = f"{prefix}/{detail_level}{time_window}.json"
+
+        if "{date}" in endpoint:
+            endpoint = endpoint.format(date=date)
+        if base_url:
+            endpoint = base_url.rstrip('/') + endpoint.removeprefix(FITBIT_API_URL)
+        return endpoint
+
+
+# Intraday detail levels offered by the endpoints that support them, keyed by interval in seconds
+INTRADAY_DETAIL_LEVELS = {
+    DataEndpointsEnum.heart_rate.name: {1: "1sec", 60: "1min", 300: "5min", 900: "15min"},
+    DataEndpointsEnum.activity.name: {60: "1min", 300: "5min", 900: "15min"},
+}
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from .DataEndpointsEnum import INTRADAY_DETAIL_LEVELS
+from typing import NamedTuple
+import numpy as np
+
+
+# Output resolutions supported by the view, in seconds
+RESOLUTIONS = {"1s": 1, "1min": 60, "5min": 300, "hourly": 3600}
+
+
+class SeriesSpec(NamedTuple):
+    """
+    Location of the intraday series inside a scope payload
+
+    path: keys to walk from the payload root to the list of points, "*" walks every element of a list
+    time_key: key of the point timestamp ('HH:MM:SS' or ISO 'YYYY-MM-DDTHH:MM:SS[.fff]')
+    aggregate: "mean" or "sum", how points falling in the same bucket are combined
+    """
+    path: tuple
+    time_key: str
+    aggregate: str
+
+
+INTRADAY_SERIES = {
+    "heart_rate": SeriesSpec(("activities-heart-intraday", "dataset"), "time", "mean"),
+    "activity": SeriesSpec(("activities-steps-intraday", "dataset"), "time", "sum"),
+    "spO2": SeriesSpec(("minutes",), "minute", "mean"),
+    "heart_rate_variability": SeriesSpec(("hrv", "*", "minutes"), "minute", "mean"),
+}
+
+# Metrics that can be selected per scope, mapped to the top-level payload key holding them
+SCOPE_METRICS = {
+    "heart_rate": {"summary": "activities-heart", "intraday": "activities-heart-intraday"},
+    "activity": {"summary": "activities-steps", "intraday": "activities-steps-intraday"},
+    "sleep": {"logs": "sleep", "summary": "summary"},
+    "spO2": {"summary": "dateTime", "intraday": "minutes"},
+}
+
+# Metrics that live as fields of the point values (e.g. {"value": {"rmssd": 10.2, "coverage": 0.9}})
+VALUE_METRICS = {
+    "heart_rate_variability": ("hrv", "*", "minutes"),
+    "breathing_rate": ("br",),
+}
+
+
+def parse_time_of_day(value: str) -> int:
+    """
+    Parse a time of day into seconds since midnight
+
+    :param value: str: Time in 'HH:MM' or 'HH:MM:SS' format
+    :return: int: Seconds since midnight
+    """
+    parts = value.split(':')
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Invalid time of day: {value}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    seconds = int(parts[2]) if len(parts) == 3 else 0
+    if hours > 23 or minutes > 59 or seconds > 59:
+        raise ValueError(f"Invalid time of day: {value}")
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_time_of_day(seconds: int) -> str:
+    """
+    Format seconds since midnight as 'HH:MM:SS'
+
+    :param seconds: int: Seconds since midnight
+    :return: str: Time of day
+    """
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def times_to_seconds(times: list[str]) -> np.ndarray:
+    """
+    Convert a list of 'HH:MM:SS' strings into seconds since midnight without a per-point Python parse
+
+    :param times: list[str]: Times of day, all in 'HH:MM:SS' format
+    :return: np.ndarray: Seconds since midnight
+    """
+    raw = np.frombuffer("".join(times).encode('ascii'), dtype=np.uint8).reshape(-1, 8).astype(np.int32) - 48
+    return (raw[:, 0] * 10 + raw[:, 1]) * 3600 + (raw[:, 3] * 10 + raw[:, 4]) * 60 + raw[:, 6] * 10 + raw[:, 7]
+
+
+def walk_path(payload, path: tuple) -> list:
+    """
+    Collect the containers found at the end of a path inside a payload
+
+    :param payload: dict: Payload to walk
+    :param path: tuple: Keys to walk, "*" walks every element of a list
+    :return: list: Parent containers holding the last key of the path
+    """
+    containers = [payload]
+    for key in path[:-1]:
+        next_containers = []
+        for container in containers:
+            if key == "*" and isinstance(container, list):
+                next_containers.extend(container)
+            elif isinstance(container, dict) and key in container:
+                next_containers.append(container[key])
+        containers = next_containers
+    return [container for container in containers if isinstance(container, dict) and path[-1] in container]
+
+
+class DataView:
+    def __init__(self, resolution: str = None, metrics: dict = None, start_time: str = None, end_time: str = None):
+        """
+        Initialize the view applied to the vitals data returned to the client
+
+        :param resolution: str: Output resolution, one of RESOLUTIONS (None keeps the source resolution)
+        :param metrics: dict: Metrics to keep per scope (e.g., {"heart_rate": ["intraday"]})
+        :param start_time: str: Start of the time window in 'HH:MM[:SS]' format
+        :param end_time: str: End of the time window in 'HH:MM[:SS]' format
+        """
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError(f"Invalid resolution {resolution}, expected one of {list(RESOLUTIONS)}")
+        if metrics is not None and not isinstance(metrics, dict):
+            raise ValueError("metrics must be an object mapping scopes to lists of metrics")
+        if (start_time is None) != (end_time is None):
+            raise ValueError("start_time and end_time must be provided together")
+
+        self.resolution = resolution
+        self.interval = RESOLUTIONS[resolution] if resolution else None
+        self.metrics = metrics or {}
+        self.start_time = start_time
+        self.end_time = end_time
+        self.window = None
+
+        if start_time is not None:
+            self.window = (parse_time_of_day(start_time), parse_time_of_day(end_time))
+            if self.window[0] > self.window[1]:
+                raise ValueError("start_time must not be after end_time")
+
+    @classmethod
+    def from_request(cls, data: dict) -> DataView | None:
+        """
+        Build a view from the request parameters, if any were given
+
+        :param data: dict: Request JSON body
+        :return: DataView | None: View or None when the full data was requested
+        """
+        if not any(data.get(key) is not None for key in ('resolution', 'metrics', 'start_time', 'end_time')):
+            return None
+        return cls(data.get('resolution'), data.get('metrics'), data.get('start_time'), data.get('end_time'))
+
+    def fetch_params(self, scope: str) -> dict:
+        """
+        Get the coarsest Fitbit request parameters that still satisfy the view for the given scope
+
+        :param scope: str: Data scope
+        :return: dict: Keyword arguments for DataEndpointsEnum.build_url
+        """
+        levels = INTRADAY_DETAIL_LEVELS.get(scope)
+        if not levels:
+            return {}
+
+        params = {}
+        if self.interval:
+            # Coarsest level whose buckets nest evenly inside the requested resolution
+            candidates = [interval for interval in levels if self.interval % interval == 0]
+            if candidates:
+                params['detail_level'] = levels[max(candidates)]
+        if self.window:
+            params['start_time'] = self.start_time[:5]
+            params['end_time'] = self.end_time[:5]
+        return params
+
+    def apply(self, scope: str, payload):
+        """
+        Apply the view to a scope payload without modifying the original
+
+        :param scope: str: Data scope
+        :param payload: dict: Scope payload as returned by the API or stored in the database
+        :return: dict: Projected and resampled payload
+        """
+        if not isinstance(payload, dict) or 'error' in payload:
+            return payload
+
+        result = dict(payload)
+        selected = self.metrics.get(scope)
+
+        if selected:
+            aliases = SCOPE_METRICS.get(scope, {})
+            keys = {aliases[metric] for metric in selected if metric in aliases}
+            if keys:
+                result = {key: value for key, value in result.items() if key in keys}
+
+        spec = INTRADAY_SERIES.get(scope)
+        if spec and (self.interval or self.window):
+            result = self._copy_path(result, spec.path)
+            for container in walk_path(result, spec.path):
+                container[spec.path[-1]] = self._resample(container[spec.path[-1]], spec)
+                if 'datasetInterval' in container and self.interval:
+                    container['datasetInterval'] = self.interval // 60 or 1
+                    container['datasetType'] = 'second' if self.interval < 60 else 'minute'
+
+        value_path = VALUE_METRICS.get(scope)
+        if selected and value_path:
+            fields = set(selected)
+            result = self._copy_path(result, value_path)
+            for container in walk_path(result, value_path):
+                container[value_path[-1]] = [
+                    {**point, 'value': {k: v for k, v in point['value'].items() if k in fields}}
+                    if isinstance(point, dict) and isinstance(point.get('value'), dict) else point
+                    for point in container[value_path[-1]]
+                ]
+
+        return result
+
+    def apply_all(self, combined_data: dict) -> dict:
+        """
+        Apply the view to every scope of a combined data dictionary
+
+        :param combined_data: dict: Data keyed by scope
+        :return: dict: Projected and resampled data keyed by scope
+        """
+        return {scope: self.apply(scope, payload) for scope, payload in combined_data.items()}
+
+    def _copy_path(self, payload: dict, path: tuple) -> dict:
+        """
+        Shallow-copy the containers along a path so that they can be rewritten without touching the source
+
+        :param payload: dict: Payload (already a copy at the root level)
+        :param path: tuple: Keys to walk, "*" walks every element of a list
+        :return: dict: Payload with fresh containers along the path
+        """
+        if len(path) <= 1:
+            return payload
+
+        key, rest = path[0], path[1:]
+        if key == "*" and isinstance(payload, list):
+            return [self._copy_path(dict(item), rest) if isinstance(item, dict) else item for item in payload]
+        if isinstance(payload, dict) and key in payload:
+            child = payload[key]
+            if isinstance(child, dict):
+                payload[key] = self._copy_path(dict(child), rest)
+            elif isinstance(child, list):
+                payload[key] = self._copy_path(list(child), rest)
+        return payload
+
+    def _resample(self, points: list, spec: SeriesSpec) -> list:
+        """
+        Filter a series to the time window and aggregate it into buckets of the requested resolution
+
+        :param points: list: Points with a timestamp under spec.time_key and a numeric or dict 'value'
+        :param spec: SeriesSpec: Location and aggregation of the series
+        :return: list: Resampled points
+        """
+        if not points:
+            return points
+
+        timestamps = [point[spec.time_key] for point in points]
+        iso = 'T' in timestamps[0]
+        prefix = timestamps[0][:11] if iso else ""
+        seconds = times_to_seconds([stamp[11:19] for stamp in timestamps] if iso else timestamps)
+
+        mask = np.ones(len(points), dtype=bool)
+        if self.window:
+            mask = (seconds >= self.window[0]) & (seconds <= self.window[1])
+
+        first_value = points[0]['value']
+        fields = list(first_value) if isinstance(first_value, dict) else None
+
+        if not self.interval:
+            return [point for point, keep in zip(points, mask) if keep]
+
+        seconds = seconds[mask]
+        if seconds.size == 0:
+            return []
+        buckets, inverse = np.unique(seconds // self.interval, return_inverse=True)
+
+        def aggregate(values: np.ndarray) -> list:
+            values = values[mask]
+            valid = ~np.isnan(values)
+            sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=buckets.size)
+            counts = np.bincount(inverse, weights=valid, minlength=buckets.size)
+            if spec.aggregate == 'mean':
+                sums = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+            # Buckets without any valid sample are reported as null instead of NaN, which is not valid JSON
+            return [value if count else None for value, count in zip(sums.round(3).tolist(), counts.tolist())]
+
+        if fields is None:
+            series = aggregate(np.fromiter((point['value'] for point in points), dtype=float, count=len(points)))
+        else:
+            columns = {
+                field: aggregate(np.fromiter((point['value'].get(field, np.nan) for point in points),
+                                             dtype=float, count=len(points)))
+                for field in fields
+            }
+            series = [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+        return [
+            {spec.time_key: prefix + format_time_of_day(int(bucket) * self.interval), 'value': value}
+            for bucket, value in zip(buckets.tolist(), series)
+        ]
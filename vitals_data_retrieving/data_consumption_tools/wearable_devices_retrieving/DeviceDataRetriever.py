@@ -0,0 +1,347 @@
+from __future__ import annotations
+from .WearableDeviceDataRetriever import WearableDeviceDataRetriever
+from .FetchEngine import FetchEngine
+from .DataView import DataView
+from .SingleFlight import SingleFlight
+from .BatchOperations import DailyVitalsRun, RepairRun, TokenRefreshRun, batch_results, find_gaps, users_error, \
+    user_not_found
+from vitals_data_retrieving.data_consumption_tools.Entities.DataBase import DEFAULT_DEVICE_TYPE
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import users_database, vitals_database
+from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import decode_data
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import UserKey, as_document_id, identity_map
+from vitals_data_retrieving.data_consumption_tools.Entities.WriteBehind import store_vitals
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import fetch_status
+from vitals_data_retrieving.vitals_data_retrieving_memory import memory_tracker
+from vitals_data_retrieving.vitals_data_retrieving_tracing import traced
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from dotenv import load_dotenv
+from flask import jsonify
+from werkzeug import Response
+import contextvars
+import os
+
+# Shared by every retriever in the process: concurrent token refreshes of the same user (user, "refresh") are
+# executed once
+flight_group = SingleFlight()
+
+
+def device_type_of(document: dict) -> str:
+    """
+    Device type of a stored user
+
+    :param document: dict: User document
+    :return: str: Device type (DEFAULT_DEVICE_TYPE for the users stored before it was recorded)
+    """
+    return document.get("device_type") or DEFAULT_DEVICE_TYPE
+
+
+def get_token_from_database(document_id) -> tuple[str, ResponseCode]:
+    """
+    Get the token from the database
+
+    :param document_id: str: Document ID (hashed User ID)
+    :return: tuple[str, ResponseCode]: Token and response code
+    """
+    data_base = users_database()
+    response_code, document = data_base.read_document(document_id)
+
+    if response_code == ResponseCode.ERROR_NOT_FOUND:
+        return "", response_code
+
+    decoded_document = decode_data(document)
+    return decoded_document["token"], response_code
+
+
+def get_users_from_database(document_ids) -> dict[UserKey, dict]:
+    """
+    Get several users from the database with a single query
+
+    :param document_ids: set[UserKey]: User keys
+    :return: dict[UserKey, dict]: Decoded document keyed by user key, users not found are left out
+    """
+    data_base = users_database()
+    _, documents = data_base.read_documents(document_ids)
+
+    users = {}
+    for document in documents:
+        decoded_document = decode_data(document)
+        users[decoded_document["user_key"]] = decoded_document
+    return users
+
+
+def get_tokens_from_database(document_ids) -> dict[UserKey, str]:
+    """
+    Get the tokens of several users from the database with a single query
+
+    :param document_ids: set[UserKey]: User keys
+    :return: dict[UserKey, str]: Token keyed by user key, users not found are left out
+    """
+    return {user_key: user["token"] for user_key, user in get_users_from_database(document_ids).items()}
+
+
+def get_all_documents(device_type: str = None) -> tuple[list, HTTPStatus]:
+    """
+    Retrieve all documents from the database and handle errors.
+
+    :param device_type: str: Only return the users of this device type (None returns every user)
+    :return: tuple[list, HTTPStatus]: List of documents and HTTP status code
+    """
+    data_base = users_database()
+    response_code, documents = data_base.get_all_documents()
+
+    if response_code == ResponseCode.ERROR_NOT_FOUND:
+        return [], HTTPStatus.NOT_FOUND
+    elif response_code == ResponseCode.ERROR_UNKNOWN:
+        return [], HTTPStatus.INTERNAL_SERVER_ERROR
+
+    if device_type is not None:
+        documents = [document for document in documents if device_type_of(document) == device_type]
+        if not documents:
+            return [], HTTPStatus.NOT_FOUND
+    return documents, HTTPStatus.OK
+
+
+class DeviceDataRetriever(WearableDeviceDataRetriever):
+    def __init__(self, engine: FetchEngine):
+        """
+        Initialize the retriever of the users of a device vendor
+
+        Holds what does not depend on the vendor: the single-user and batch operations, storage, sharding and
+        checkpoints, over the fetch engine of the vendor. A vendor retriever adds its authorization flow and token
+        refresh. Every operation only processes the users stored with the device type of the vendor.
+
+        :param engine: FetchEngine: Engine fetching the scopes from the vendor API
+        """
+        if os.path.exists('.env'):
+            load_dotenv()
+        self.engine = engine
+        self.DEVICE_TYPE = engine.vendor.name
+        self.BATCH_FETCH_WORKERS = int(os.environ.get('BATCH_FETCH_WORKERS', 8))
+
+    @abstractmethod
+    def renew_token(self, document_id) -> str | None:
+        """
+        Refresh the access token of a user after an unauthorized response and return it
+
+        Called from the fetch threads, outside of the application context.
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: str | None: New access token, None if it could not be refreshed
+        """
+        pass
+
+    @traced('retriever.update_all_tokens')
+    @memory_tracker.traced('update_all_tokens')
+    def update_all_tokens(self, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Update all access tokens from the wearable device API in the database
+
+        The tokens refreshed are checkpointed, so a run restarted with the same run ID only refreshes the rest.
+
+        :param run_id: str: Run ID (defaults to one per device type and UTC hour)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        documents, status = get_all_documents(self.DEVICE_TYPE)
+        if status != HTTPStatus.OK:
+            return jsonify(users_error(status)), status
+
+        run = TokenRefreshRun(documents, self.DEVICE_TYPE, run_id)
+        run.run(lambda user_key: self.refresh_access_token(user_key)[1])
+        summary, status = run.summary()
+        return jsonify(summary), status
+
+    def retrieve_data(
+            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data from the wearable device by querying the API
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data and HTTP status code
+        """
+        user_key = identity_map.key_for(user_id)
+        token, response_code = get_token_from_database(user_key)
+
+        if response_code == ResponseCode.ERROR_NOT_FOUND:
+            return jsonify({'error': 'User not found'}), HTTPStatus.NOT_FOUND
+
+        data, status = self.make_data_query(user_key, token, date, scope, db_storage, view)
+        return data, status
+
+    @traced('retriever.retrieve_data_batch')
+    @memory_tracker.traced('retrieve_data_batch')
+    def retrieve_data_batch(
+            self, user_ids: list[str], dates: list[str], scope: list[str], view: DataView = None) \
+            -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, reading stored data with a single query and fetching only the
+        missing or failed scopes from the API concurrently
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        user_keys = identity_map.keys_for(user_ids)
+        owners = {user_key: user_id for user_id, user_key in user_keys.items()}
+
+        response_code, documents = vitals_database().read_user_days(owners.keys(), dates, scope)
+        if response_code == ResponseCode.ERROR_UNKNOWN:
+            return jsonify({'error': 'Unknown error occurred'}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+        user_days, gaps = find_gaps(documents, owners, dates, scope)
+        if gaps:
+            tokens = get_tokens_from_database({user_key for user_key, _ in gaps})
+
+            @traced('retriever.fetch_gap')
+            def fetch_gap(user_key, date, missing):
+                return self.fetch_scopes(user_key, tokens[user_key], date, missing, view)
+
+            with ThreadPoolExecutor(max_workers=self.BATCH_FETCH_WORKERS) as executor:
+                futures = {
+                    # Each task runs in a copy of the request context, so that it keeps the request deadline and its
+                    # spans are children of the request span
+                    key: executor.submit(contextvars.copy_context().run, fetch_gap, key[0], key[1], missing)
+                    for key, missing in gaps.items() if key[0] in tokens
+                }
+                for key, missing in gaps.items():
+                    if key in futures:
+                        data, _, _ = futures[key].result()
+                    else:
+                        data = user_not_found(missing)
+                    user_days[key].update(data)
+
+        results, status = batch_results(user_days, owners, dates, scope, view)
+        return jsonify(results), status
+
+    @traced('retriever.get_daily_vitals_data')
+    @memory_tracker.traced('get_daily_vitals_data')
+    def get_daily_vitals_data(self, date, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Get daily vitals data from all the users of the device stored in the database and store it in the database
+
+        The users of the shards claimed by this node are fetched one at a time, see DailyVitalsRun.
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID (defaults to one per device type and date)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        documents, status = get_all_documents(self.DEVICE_TYPE)
+        if status != HTTPStatus.OK:
+            return jsonify(users_error(status)), status
+
+        scope = self.engine.vendor.daily_scope
+
+        def fetch_user(document):
+            # Net allocations per user that keep growing along the batch point to memory retained across users
+            with memory_tracker.track('get_daily_vitals_data:user'):
+                decoded_document = decode_data(document)
+                _, status = self.make_data_query(
+                    document_id=decoded_document["user_key"], token=decoded_document["token"], date=date,
+                    scope=scope, db_storage=True)
+            return status
+
+        run = DailyVitalsRun(documents, self.DEVICE_TYPE, date, run_id)
+        run.run(fetch_user)
+        summary, status = run.summary()
+        return jsonify(summary), status
+
+    def _serves(self, user: dict | None) -> bool:
+        # Users no longer stored are reported by the retriever of the default device only
+        return device_type_of(user) == self.DEVICE_TYPE if user else self.DEVICE_TYPE == DEFAULT_DEVICE_TYPE
+
+    @traced('retriever.repair_vitals_data')
+    @memory_tracker.traced('repair_vitals_data')
+    def repair_vitals_data(self, dates: list[str], scope: list[str]) -> tuple[Response, HTTPStatus]:
+        """
+        Fetch again the scopes of the stored user-days whose last fetch failed or returned data that was not final yet,
+        and store them in the database
+
+        Stored documents without fetch status (written before it was tracked) are skipped, since there is no way to
+        tell which of their scopes are complete, and so are the user-days of users of other devices.
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[Response, HTTPStatus]: Repair summary and HTTP status code
+        """
+        response_code, documents = vitals_database().read_scope_status(dates)
+        if response_code == ResponseCode.ERROR_UNKNOWN:
+            return jsonify({'error': 'Unknown error occurred'}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+        run = RepairRun(documents, scope)
+        if run.repairs:
+            run.keep(get_users_from_database({user_key for user_key, _ in run.repairs}), self._serves)
+            run.run(self.fetch_scopes)
+        summary, status = run.summary()
+        return jsonify(summary), status
+
+    @traced('retriever.make_data_query')
+    @memory_tracker.traced('make_data_query')
+    def make_data_query(
+            self, document_id, token: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[Response, HTTPStatus]:
+        """
+        Fetches data from the device API for each element in the provided scope.
+
+        When a view is given, the response is projected and resampled. The API request itself uses the coarsest
+        detail level and time window that satisfy the view, unless the full data has to be stored in the database.
+        Stored data is handed to the write-behind buffer, so the response does not wait for the database.
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID).
+        :param token: str: Access token for the device API.
+        :param date: date: Date in 'YYYY-MM-DD' format.
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Flag to store data in the database.
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data).
+        :return: tuple[Response, HTTPStatus]: Combined data and HTTP status code.
+        """
+        try:
+            combined_data, successful_operations, statuses = self.fetch_scopes(
+                document_id, token, date, scope, view if not db_storage else None)
+            total_operations = len(scope)
+
+            if db_storage:
+                response = store_vitals(document_id, date, combined_data, fetch_status(statuses))
+            else:
+                response = ResponseCode.SUCCESS
+
+            if response == ResponseCode.SUCCESS and (successful_operations == total_operations):
+                status = HTTPStatus.OK
+            elif successful_operations > 0:
+                status = HTTPStatus.PARTIAL_CONTENT
+            else:
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+            if view:
+                combined_data = view.apply_all(combined_data)
+            with memory_tracker.track('json_serialize'):
+                response = jsonify(combined_data)
+            return response, status
+
+        except Exception as e:
+            return jsonify({'error': f"An error occurred: {str(e)}"}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+    def fetch_scopes(self, document_id, token: str = None, date: str = None, scope: list[str] = None,
+                     view: DataView = None) -> tuple[dict, int, dict]:
+        """
+        Fetch the raw data of each scope element from the device API, refreshing the token on unauthorized responses
+
+        :param document_id: UserKey | str: User key or document ID (hashed User ID).
+        :param token: str: Access token for the device API.
+        :param date: str: Date in 'YYYY-MM-DD' format.
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: View used to narrow the API request (None requests the full data).
+        :return: tuple[dict, int, dict]: Data (or error message) keyed by scope, number of successful scopes and HTTP
+            status of each scope.
+        """
+        fetch_params = {element: view.fetch_params(element) for element in scope} if view else None
+        return self.engine.fetch_scopes(as_document_id(document_id), token, date, scope, fetch_params,
+                                        lambda: self.renew_token(document_id))
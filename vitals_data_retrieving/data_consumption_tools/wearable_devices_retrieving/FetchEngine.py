@@ -0,0 +1,428 @@
+from __future__ import annotations
+from .SingleFlight import SingleFlight
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import guarded_call, CircuitOpenError, \
+    DeadlineExceededError, remaining_time, sleep_before_retry
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import PriorityScheduler, QuotaTracker
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import final_after
+from vitals_data_retrieving.vitals_data_retrieving_metrics import observe_latency
+from vitals_data_retrieving.vitals_data_retrieving_memory import memory_tracker
+from vitals_data_retrieving.vitals_data_retrieving_tracing import trace_span
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from http import HTTPStatus
+from requests.adapters import HTTPAdapter
+from typing import Callable, NamedTuple
+import contextvars
+import os
+import threading
+import requests
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Pooled connections per device API host, and threads fetching the scopes of the users concurrently
+DEVICE_HTTP_POOL_SIZE = int(os.environ.get('DEVICE_HTTP_POOL_SIZE', 16))
+DEVICE_FETCH_WORKERS = int(os.environ.get('DEVICE_FETCH_WORKERS', 16))
+# Seconds the final data of a user-day is served from memory without asking the device API again (0 disables it)
+DEVICE_CACHE_SECONDS = float(os.environ.get('DEVICE_CACHE_SECONDS', 0))
+DEVICE_CACHE_SIZE = int(os.environ.get('DEVICE_CACHE_SIZE', 256))
+
+# Statuses that count as a failure of the endpoint for its circuit breaker and are worth retrying
+RETRYABLE_STATUSES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                      HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT}
+
+# Identical concurrent fetches (vendor, user, date, scope, request parameters) are executed once
+fetch_flight_group = SingleFlight()
+
+
+class DeviceServerError(Exception):
+    """
+    Raised inside a guarded call when the device API answers with a status that signals a degraded service
+    """
+    def __init__(self, data, status):
+        super().__init__(f"Device API answered {status}")
+        self.data = data
+        self.status = status
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """
+    Whether an exception raised inside the guarded call of an endpoint counts as a failure of the endpoint
+
+    Only server errors, timeouts and connection errors do. The rate limits are per user: a 429 is the answer of a
+    healthy endpoint to a user over its quota, and must not open the circuit for every other user.
+
+    :param error: Exception: Exception raised by the call
+    :return: bool: True if it is recorded as a failure by the circuit breaker of the endpoint
+    """
+    if isinstance(error, DeviceServerError):
+        return error.status >= HTTPStatus.INTERNAL_SERVER_ERROR
+    return isinstance(error, (TimeoutError, requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def worth_retrying(status: HTTPStatus, quota: QuotaTracker, user_id: str) -> bool:
+    """
+    Whether a failed request is retried
+
+    An open circuit (SERVICE_UNAVAILABLE) is not retried, so that load is shed right away, and neither is a request
+    over the rate limit of the user, which only resets hourly.
+
+    :param status: HTTPStatus: Status of the failed request
+    :param quota: QuotaTracker: Rate limit of each user of the vendor
+    :param user_id: str: Document ID of the user
+    :return: bool: True if the request is retried after a backoff
+    """
+    return status in RETRYABLE_STATUSES and status != HTTPStatus.SERVICE_UNAVAILABLE and quota.allows(user_id)
+
+
+def get_query_error_message(operation, status_code) -> dict:
+    """
+    Get the error message for a query
+
+    :param operation: str: Operation
+    :param status_code: HTTPStatus: HTTP status code
+    :return: dict: Error response
+    """
+    if status_code == HTTPStatus.UNAUTHORIZED:
+        return {'error': f'Unauthorized access. User token has no access to {operation} data'}
+    elif status_code == HTTPStatus.BAD_REQUEST:
+        return {'error': f'Bad request. Failed to fetch {operation} data'}
+    else:
+        return {'error': f'An error occurred while fetching {operation} data'}
+
+
+class EndpointSpec(NamedTuple):
+    """
+    Endpoint of a device API serving one scope
+
+    name: scope served (e.g. "sleep")
+    url: URL on the vendor host, with a {date} placeholder ('YYYY-MM-DD') for the endpoints of a date
+    normalize: maps the payload of a successful response onto the Fitbit-shaped payload of the scope that DataView,
+        the stored documents and the exports expect (None keeps it as it is)
+    """
+    name: str
+    url: str
+    normalize: Callable[[dict], dict] | None = None
+
+    @property
+    def requires_date(self) -> bool:
+        return "{date}" in self.url
+
+
+class DeviceVendor:
+    def __init__(self, name: str, api_url: str, endpoints: list[EndpointSpec], daily_scope: list[str],
+                 latency, scheduler: PriorityScheduler, quota: QuotaTracker):
+        """
+        Describe the API of a wearable device vendor, for FetchEngine
+
+        A new device integration provides its endpoints and payload normalizers here and gets the connection pooling,
+        concurrency, scheduling, rate limiting, circuit breaking, retries and caching of the engine.
+
+        :param name: str: Device type, as stored with the users of the device
+        :param api_url: str: Host of the vendor API, replaced by the base URL given to the engine (e.g. a mock)
+        :param endpoints: list[EndpointSpec]: Endpoints, one per scope
+        :param daily_scope: list[str]: Scopes fetched and stored for every user by the daily batch
+        :param latency: Histogram: Latency histogram of the requests, with scope and status labels
+        :param scheduler: PriorityScheduler: Scheduler of the concurrent requests to the vendor
+        :param quota: QuotaTracker: Rate limit of each user, read from the response headers
+        """
+        self.name = name
+        self.api_url = api_url
+        self.endpoints = {endpoint.name: endpoint for endpoint in endpoints}
+        self.daily_scope = daily_scope
+        self.latency = latency
+        self.scheduler = scheduler
+        self.quota = quota
+
+    def build_url(self, endpoint: EndpointSpec, date: str = None, base_url: str = None,
+                  fetch_params: dict = None) -> str:
+        """
+        Build the request URL of an endpoint
+
+        :param endpoint: EndpointSpec: Endpoint
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param base_url: str: Base URL replacing the vendor host (None targets the real API)
+        :param fetch_params: dict: Narrower request for a view (see DataView.fetch_params), ignored unless the vendor
+            supports it
+        :return: str: Endpoint URL
+        """
+        url = endpoint.url.format(date=date) if endpoint.requires_date else endpoint.url
+        if base_url:
+            url = base_url.rstrip('/') + url.removeprefix(self.api_url)
+        return url
+
+    def headers(self, token: str) -> dict:
+        """
+        Request headers of a user
+
+        :param token: str: Access token
+        :return: dict: Headers
+        """
+        return {'Authorization': f'Bearer {token}'}
+
+
+class FinalDataCache:
+    def __init__(self, seconds: float = None, size: int = None):
+        """
+        Initialize the in-memory cache of the final data of the user-day scopes fetched from a device API
+
+        Only final data is cached (see Freshness.final_after): until then a new request may return more of the day.
+
+        :param seconds: float: Seconds an entry is served (defaults to DEVICE_CACHE_SECONDS, 0 disables the cache)
+        :param size: int: User-day scopes cached (defaults to DEVICE_CACHE_SIZE)
+        """
+        seconds = DEVICE_CACHE_SECONDS if seconds is None else seconds
+        self._cache = TTLCache(size or DEVICE_CACHE_SIZE, seconds) if seconds > 0 else None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._cache is not None
+
+    @staticmethod
+    def key(vendor: str, user_id: str, date: str, element: str, fetch_params: dict = None) -> tuple:
+        """
+        Key of a request, also used to execute identical concurrent requests once
+
+        :param vendor: str: Device type
+        :param user_id: str: Document ID of the user
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param element: str: Scope element
+        :param fetch_params: dict: Narrower request (None requests the full data)
+        :return: tuple: Request key
+        """
+        return vendor, user_id, date, element, tuple(sorted((fetch_params or {}).items()))
+
+    def get(self, key: tuple):
+        """
+        Cached payload of a request
+
+        :param key: tuple: Request key
+        :return: dict | None: Payload, None when it is not cached
+        """
+        if self._cache is None:
+            return None
+        with self._lock:
+            return self._cache.get(key)
+
+    def put(self, key: tuple, date: str, element: str, data: dict) -> None:
+        """
+        Cache the payload of a successful request, if the data of the scope is final
+
+        :param key: tuple: Request key
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param element: str: Scope element
+        :param data: dict: Payload
+        """
+        if self._cache is None or not date:
+            return
+        try:
+            if datetime.now(timezone.utc) < final_after(element, date):
+                return
+        except ValueError:
+            return
+        with self._lock:
+            self._cache[key] = data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache) if self._cache is not None else 0
+
+
+class FetchEngine:
+    def __init__(self, vendor: DeviceVendor, base_url: str = None, workers: int = None, pool_size: int = None,
+                 cache_seconds: float = None, cache_size: int = None):
+        """
+        Initialize the engine fetching the scopes of the users of a device vendor
+
+        The scopes of a user-day are fetched concurrently by a pool of threads, over pooled keep-alive connections.
+        Each request waits for a slot of the vendor scheduler, runs behind the circuit breaker of its endpoint with an
+        adaptive, deadline-capped timeout, and is deferred when the user is running out of quota. Identical concurrent
+        requests are executed once, retryable failures are retried with backoff and an unauthorized response renews
+        the token once for every scope of the user.
+
+        :param vendor: DeviceVendor: Vendor API
+        :param base_url: str: Base URL replacing the vendor host, e.g. a local mock server (None targets the real API)
+        :param workers: int: Threads fetching scopes (defaults to DEVICE_FETCH_WORKERS)
+        :param pool_size: int: Pooled connections per host (defaults to DEVICE_HTTP_POOL_SIZE)
+        :param cache_seconds: float: Seconds final data is cached (defaults to DEVICE_CACHE_SECONDS, 0 disables it)
+        :param cache_size: int: User-day scopes cached (defaults to DEVICE_CACHE_SIZE)
+        """
+        self.vendor = vendor
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.workers = workers or DEVICE_FETCH_WORKERS
+        self.pool_size = pool_size or DEVICE_HTTP_POOL_SIZE
+        self.cache = FinalDataCache(cache_seconds, cache_size)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._executor = None
+
+    def _resources(self) -> tuple[requests.Session, ThreadPoolExecutor]:
+        # Created on first use and again in a forked worker, which inherits neither the threads nor, safely, the
+        # sockets of its parent
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix=f"{self.vendor.name}-fetch")
+            return self._session, self._executor
+
+    def fetch(self, user_id: str, token: str, scope: str, date: str = None,
+              fetch_params: dict = None) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch the payload of a scope with a single request
+
+        :param user_id: str: Document ID of the user, used to track the rate limit of the user (None does not track it)
+        :param token: str: Access token
+        :param scope: str: Scope element (e.g., "sleep")
+        :param date: str: Date in 'YYYY-MM-DD' format, for the endpoints that require it
+        :param fetch_params: dict: Intraday detail level and time window (see DataView.fetch_params)
+        :return: tuple[dict, HTTPStatus]: Normalized payload (or error message) and HTTP status code. An open circuit is
+            answered with SERVICE_UNAVAILABLE, a timeout with GATEWAY_TIMEOUT and a batch request of a user whose rate
+            limit is down to the reserve kept for interactive requests with TOO_MANY_REQUESTS, without calling the API
+        """
+        vendor = self.vendor
+        try:
+            endpoint = vendor.endpoints[scope]
+            if endpoint.requires_date and not date:
+                return {"error": f"Date is required for {scope} operation"}, HTTPStatus.BAD_REQUEST
+            url = vendor.build_url(endpoint, date, self.base_url, fetch_params)
+
+            if user_id is not None and not vendor.quota.allows(user_id):
+                return {"error": f"Rate limit of the user reached, {scope} data deferred"}, \
+                    HTTPStatus.TOO_MANY_REQUESTS
+
+            session, _ = self._resources()
+            with trace_span(f"{vendor.name}.{scope}", scope=scope) as span, \
+                    observe_latency(vendor.latency, scope=scope) as labels, \
+                    vendor.scheduler.slot(timeout=remaining_time()):
+                with guarded_call(f"{vendor.name}:{scope}", is_endpoint_failure) as timeout:
+                    response = session.get(url, headers=vendor.headers(token), timeout=timeout)
+                    status = HTTPStatus(response.status_code)
+                    if user_id is not None:
+                        vendor.quota.record(user_id, response.headers)
+                    labels['status'] = str(response.status_code)
+                    if span is not None:
+                        span.add_attribute('http.status_code', response.status_code)
+                    with memory_tracker.track(f"json_parse:{scope}"):
+                        data = response.json()
+                    if status in RETRYABLE_STATUSES:
+                        raise DeviceServerError(data, status)
+            if status == HTTPStatus.OK and endpoint.normalize is not None:
+                data = endpoint.normalize(data)
+            return data, status
+
+        except DeviceServerError as e:
+            return e.data, e.status
+        except CircuitOpenError:
+            return {"error": f"{scope} endpoint is unavailable, try again later"}, HTTPStatus.SERVICE_UNAVAILABLE
+        except (DeadlineExceededError, TimeoutError, requests.exceptions.Timeout):
+            return {"error": f"Timed out fetching {scope} data"}, HTTPStatus.GATEWAY_TIMEOUT
+        except Exception as e:
+            return {"error": f"An error occurred during data fetch: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    def fetch_scopes(self, user_id: str, token: str, date: str = None, scope: list[str] = None,
+                     fetch_params: dict = None, renew_token: Callable[[], str | None] = None) -> tuple[dict, int, dict]:
+        """
+        Fetch the payloads of the elements of a scope concurrently
+
+        :param user_id: str: Document ID of the user
+        :param token: str: Access token
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate")
+        :param fetch_params: dict: Narrower request of each element, keyed by element (None requests the full data)
+        :param renew_token: Callable[[], str | None]: Refreshes the token of the user after an unauthorized response
+            and returns the new access token (None does not refresh it)
+        :return: tuple[dict, int, dict]: Data (or error message) keyed by scope, number of successful scopes and HTTP
+            status of each scope
+        """
+        credentials = {'token': token, 'lock': threading.Lock()}
+        known = [element for element in scope if element in self.vendor.endpoints]
+
+        if len(known) > 1:
+            _, executor = self._resources()
+            # Each element runs in a copy of the caller's context, so that it keeps the request deadline and priority
+            # and its spans are children of the caller's span
+            futures = {
+                element: executor.submit(contextvars.copy_context().run, self._fetch_element, credentials, user_id,
+                                         date, element, (fetch_params or {}).get(element), renew_token)
+                for element in known
+            }
+            results = {element: future.result() for element, future in futures.items()}
+        else:
+            results = {element: self._fetch_element(credentials, user_id, date, element,
+                                                    (fetch_params or {}).get(element), renew_token)
+                       for element in known}
+
+        combined_data = {}
+        statuses = {}
+        for element in scope:
+            if element in results:
+                combined_data[element], statuses[element] = results[element]
+            else:
+                combined_data[element] = {"error": f"Operation {element} not found in {self.vendor.name} endpoints"}
+                statuses[element] = HTTPStatus.NOT_FOUND
+        successful_operations = sum(1 for status in statuses.values() if status == HTTPStatus.OK)
+        return combined_data, successful_operations, statuses
+
+    def _fetch_element(self, credentials: dict, user_id: str, date: str, element: str, fetch_params: dict,
+                       renew_token: Callable[[], str | None]) -> tuple[dict, HTTPStatus]:
+        """
+        Fetch the payload of a scope element, serving it from the cache when final and retrying retryable failures
+
+        :param credentials: dict: Access token shared by the elements of the user, and the lock of its renewal
+        :param user_id: str: Document ID of the user
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param element: str: Scope element
+        :param fetch_params: dict: Narrower request (None requests the full data)
+        :param renew_token: Callable[[], str | None]: Token renewal (None does not refresh it)
+        :return: tuple[dict, HTTPStatus]: Data (or error message) and HTTP status
+        """
+        request_key = FinalDataCache.key(self.vendor.name, user_id, date, element, fetch_params)
+        cached = self.cache.get(request_key)
+        if cached is not None:
+            return cached, HTTPStatus.OK
+
+        status = None
+        with trace_span('retriever.fetch_scope', scope=element) as span:
+            for attempt in range(3):
+                token = credentials['token']
+                response, status = fetch_flight_group.do(
+                    request_key, self.fetch, user_id, token, element, date, fetch_params)
+
+                if status == HTTPStatus.OK:
+                    break
+                elif status == HTTPStatus.UNAUTHORIZED and renew_token is not None:
+                    # The elements rejected together renew the token once, the others retry with the new one
+                    with credentials['lock']:
+                        if credentials['token'] == token:
+                            credentials['token'] = renew_token() or token
+                elif worth_retrying(status, self.vendor.quota, user_id):
+                    if not sleep_before_retry(attempt):
+                        break
+                else:
+                    break
+            if span is not None:
+                span.add_attribute('attempts', attempt + 1)
+                span.add_attribute('http.status_code', int(status) if status else None)
+
+        if status != HTTPStatus.OK:
+            return get_query_error_message(element, status), status or HTTPStatus.INTERNAL_SERVER_ERROR
+        self.cache.put(request_key, date, element, response)
+        return response, status
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the engine, for monitoring
+
+        :return: dict: Vendor, workers, pool size and cached user-day scopes
+        """
+        return {'vendor': self.vendor.name, 'workers': self.workers, 'pool_size': self.pool_size,
+                'cache_enabled': self.cache.enabled, 'cached': len(self.cache)}
@@ -1,11 +1,15 @@
-from .WearableDeviceDataRetriever import WearableDeviceDataRetriever
-from .FitbitQueryHandler import FitbitQueryHandler
-from .DataEndpointsEnum import DataEndpointsEnum
-from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import UsersDataBase
-from vitals_data_retrieving.data_consumption_tools.Entities.VitalsDataBase import VitalsDataBase
+from __future__ import annotations
+from .DeviceDataRetriever import DeviceDataRetriever, flight_group, get_token_from_database
+from .FetchEngine import FetchEngine
+from .FitbitVendor import fitbit_vendor
+from .DataEndpointsEnum import FITBIT_API_URL
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import users_database
 from vitals_data_retrieving.data_consumption_tools.Entities.UsersDataBase import decode_data
 from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
-from vitals_data_retrieving.data_consumption_tools.Entities.CryptoUtils import hash_data
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import as_document_id, identity_map
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import guarded_call
+from vitals_data_retrieving.vitals_data_retrieving_metrics import observe_latency, token_refresh_latency
+from vitals_data_retrieving.vitals_data_retrieving_tracing import trace_span
 from http import HTTPStatus
 from dotenv import load_dotenv
 from flask import jsonify
@@ -16,66 +20,29 @@ import base64
 import logging
 logger = logging.getLogger(__name__)
 
-def get_token_from_database(document_id) -> tuple[str, ResponseCode]:
-    """
-    Get the token from the database
-
-    :param document_id: str: Document ID (hashed User ID)
-    :return: tuple[str, ResponseCode]: Token and response code
-    """
-    data_base = UsersDataBase()
-    response_code, document = data_base.read_document(document_id)
-
-    if response_code == ResponseCode.ERROR_NOT_FOUND:
-        return "", response_code
-
-    decoded_document = decode_data(document)
-    return decoded_document["token"], response_code
-
-
-def get_all_documents() -> tuple[list, HTTPStatus]:
-    """
-    Retrieve all documents from the database and handle errors.
-
-    :return: tuple[list, HTTPStatus]: List of documents and HTTP status code
-    """
-    data_base = UsersDataBase()
-    response_code, documents = data_base.get_all_documents()
-
-    if response_code == ResponseCode.ERROR_NOT_FOUND:
-        return [], HTTPStatus.NOT_FOUND
-    elif response_code == ResponseCode.ERROR_UNKNOWN:
-        return [], HTTPStatus.INTERNAL_SERVER_ERROR
-
-    return documents, HTTPStatus.OK
-
-
-def get_query_error_message(operation, status_code) -> dict:
-    """
-    Get the error message for a query
-
-    :param operation: str: Operation
-    :param status_code: HTTPStatus: HTTP status code
-    :return: dict: Error response
-    """
-    if status_code == HTTPStatus.UNAUTHORIZED:
-        return {'error': f'Unauthorized access. User token has no access to {operation} data'}
-    elif status_code == HTTPStatus.BAD_REQUEST:
-        return {'error': f'Bad request. Failed to fetch {operation} data'}
-    else:
-        return {'error': f'An error occurred while fetching {operation} data'}
 
+class FitbitDataRetriever(DeviceDataRetriever):
+    def __init__(self, api_base_url: str = None):
+        """
+        Initialize the Fitbit data retriever
 
-class FitbitDataRetriever(WearableDeviceDataRetriever):
-    def __init__(self):
+        :param api_base_url: str: Base URL replacing the Fitbit API host for the data, token and authorization
+        requests, e.g. the local mock server (defaults to the FITBIT_API_BASE_URL environment variable)
+        """
         if os.path.exists('.env'):
             load_dotenv()
+        self.API_BASE_URL = api_base_url or os.environ.get('FITBIT_API_BASE_URL')
         self.CLIENT_ID = os.environ.get('CLIENT_ID')
         self.CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
         self.REDIRECT_URI = os.environ.get('REDIRECT_URI')
         self.AUTHORIZATION_URL = os.environ.get('AUTHORIZATION_URL')
         self.TOKEN_URL = os.environ.get('TOKEN_URL')
+        if self.API_BASE_URL:
+            self.API_BASE_URL = self.API_BASE_URL.rstrip('/')
+            self.AUTHORIZATION_URL = f"{self.API_BASE_URL}/oauth2/authorize"
+            self.TOKEN_URL = f"{self.API_BASE_URL}/oauth2/token"
         self.SCOPE = os.environ.get('SCOPE')
+        super().__init__(FetchEngine(fitbit_vendor, self.API_BASE_URL))
 
     def connect_to_api(self) -> str:
         """
@@ -106,7 +73,7 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
                 logger.error("Faltan CLIENT_ID/CLIENT_SECRET/REDIRECT_URI en entorno")
                 return {"error": "Fitbit client credentials or redirect URI missing"}, HTTPStatus.INTERNAL_SERVER_ERROR
 
-            token_url = "https://api.fitbit.com/oauth2/token"
+            token_url = f"{self.API_BASE_URL or FITBIT_API_URL}/oauth2/token"
 
             # Basic auth header (client_id:client_secret) in base64
             auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
@@ -142,7 +109,7 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
 
             # Si no vino user_id, pedir perfil con access_token
             if not user_id and access_token:
-                profile_url = "https://api.fitbit.com/1/user/-/profile.json"
+                profile_url = f"{self.API_BASE_URL or FITBIT_API_URL}/1/user/-/profile.json"
                 logger.info("User_id no provisto en token response, consultando profile endpoint")
                 profile_resp = requests.get(profile_url, headers={"Authorization": f"Bearer {access_token}"}, timeout=10)
                 if profile_resp.status_code == 200:
@@ -178,17 +145,57 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
         """
         Refresh the access token from the API
 
-        :param document_id: str: Document ID (Hashed User ID)
+        Concurrent refreshes of the same user share a single request, so that they do not invalidate each other's
+        refresh token.
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
-        data_base = UsersDataBase()
+        message, status = flight_group.do(
+            (as_document_id(document_id), "refresh"), self._observed_refresh_access_token, document_id)
+        return jsonify(message), status
+
+    def renew_token(self, document_id) -> str | None:
+        """
+        Refresh the access token of a user after an unauthorized response and return it
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: str | None: New access token, None if it could not be refreshed
+        """
+        _, status = flight_group.do(
+            (as_document_id(document_id), "refresh"), self._observed_refresh_access_token, document_id)
+        if status != HTTPStatus.OK:
+            return None
+        token, _ = get_token_from_database(document_id)
+        return token
+
+    def _observed_refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Refresh the access token, observing the latency of the refresh
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        with trace_span('fitbit.refresh_token'), observe_latency(token_refresh_latency) as labels:
+            message, status = self._refresh_access_token(document_id)
+            labels['status'] = str(status.value)
+        return message, status
+
+    def _refresh_access_token(self, document_id) -> tuple[dict, HTTPStatus]:
+        """
+        Exchange the stored refresh token for a new token pair and store it in the database
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[dict, HTTPStatus]: Operation status and HTTP status code
+        """
+        data_base = users_database()
 
         response_code, document = data_base.read_document(document_id)
 
         if response_code == ResponseCode.ERROR_NOT_FOUND:
-            return jsonify({'error': 'User not found'}), HTTPStatus.NOT_FOUND
+            return {'error': 'User not found'}, HTTPStatus.NOT_FOUND
         elif response_code == ResponseCode.ERROR_UNKNOWN:
-            return jsonify({'error': 'Unknown error occurred'}), HTTPStatus.INTERNAL_SERVER_ERROR
+            return {'error': 'Unknown error occurred'}, HTTPStatus.INTERNAL_SERVER_ERROR
 
         decoded_document = decode_data(document)
         refresh_token = decoded_document["refresh_token"]
@@ -200,42 +207,15 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
         new_access_token = refresh_token_response.get('access_token')
         new_refresh_token = refresh_token_response.get('refresh_token')
 
+        if not new_access_token or not new_refresh_token:
+            return {'error': 'Failed to refresh token'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
         status = data_base.update_document(document_id, new_access_token, new_refresh_token)
 
         if status == ResponseCode.SUCCESS:
-            return jsonify({'status': 'Token refreshed successfully'}), HTTPStatus.OK
-        else:
-            return jsonify({'error': 'Failed to refresh token'}), HTTPStatus.INTERNAL_SERVER_ERROR
-
-    def update_all_tokens(self) -> tuple[Response, HTTPStatus]:
-        """
-        Update all access tokens from the wearable device API in the database
-
-        :arg: None
-        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
-        """
-        documents, status = get_all_documents()
-        if status != HTTPStatus.OK:
-            return jsonify(
-                {'error': 'No users found' if status == HTTPStatus.NOT_FOUND else 'Unknown error occurred'}), status
-
-        total_documents = len(documents)
-        updated_tokens = 0
-
-        for document in documents:
-            decoded_document = decode_data(document)
-            user_id = decoded_document["user_id"]
-            _, status = self.refresh_access_token(user_id)
-
-            if status == HTTPStatus.OK:
-                updated_tokens += 1
-
-        if updated_tokens == total_documents:
-            return jsonify({'status': 'All tokens updated successfully'}), HTTPStatus.OK
-        elif updated_tokens == 0:
-            return jsonify({'error': 'Failed to update any tokens'}), HTTPStatus.INTERNAL_SERVER_ERROR
+            return {'status': 'Token refreshed successfully'}, HTTPStatus.OK
         else:
-            return jsonify({'error': 'Some tokens failed to update'}), HTTPStatus.PARTIAL_CONTENT
+            return {'error': 'Failed to refresh token'}, HTTPStatus.INTERNAL_SERVER_ERROR
 
     def get_user_info(self, user_id) -> tuple[Response, HTTPStatus]:
         """
@@ -244,135 +224,15 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
         :param user_id: str: User ID
         :return: tuple[Response, HTTPStatus]: User info and HTTP status code
         """
-        document_id = hash_data(user_id)
-        token, response_code = get_token_from_database(document_id)
-
-        if response_code == ResponseCode.ERROR_NOT_FOUND:
-            return jsonify({'error': 'User not found'}), HTTPStatus.NOT_FOUND
-
-        data, status = self.make_data_query(document_id=document_id, token=token, scope=["user_info"])
-        return data, status
-
-    def retrieve_data(
-            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False) \
-            -> tuple[Response, HTTPStatus]:
-        """
-        Retrieve data from the wearable device by querying the API
-
-        :param user_id: str: User ID
-        :param date: str: Date in 'YYYY-MM-DD' format
-        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
-        :param db_storage: bool: Store data in the database
-        :return: tuple[Response, HTTPStatus]: Data and HTTP status code
-        """
-        document_id = hash_data(user_id)
-        token, response_code = get_token_from_database(document_id)
+        user_key = identity_map.key_for(user_id)
+        token, response_code = get_token_from_database(user_key)
 
         if response_code == ResponseCode.ERROR_NOT_FOUND:
             return jsonify({'error': 'User not found'}), HTTPStatus.NOT_FOUND
 
-        data, status = self.make_data_query(document_id, token, date, scope, db_storage)
+        data, status = self.make_data_query(document_id=user_key, token=token, scope=["user_info"])
         return data, status
 
-    def get_daily_vitals_data(self, date) -> tuple[Response, HTTPStatus]:
-        """
-        Get daily vitals data from all the users stored in the database and store it in the database
-
-        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
-        """
-        documents, status = get_all_documents()
-        if status != HTTPStatus.OK:
-            return jsonify(
-                {'error': 'No users found' if status == HTTPStatus.NOT_FOUND else 'Unknown error occurred'}), status
-
-        total_documents = len(documents)
-        successful_operations = 0
-        partial_operations = 0
-
-        scope = ["sleep", "heart_rate", "heart_rate_variability", "breathing_rate", "spO2", "activity"]
-
-        for document in documents:
-            decoded_document = decode_data(document)
-            user_id = decoded_document["user_id"]
-            token = decoded_document["token"]
-
-            _, status = self.make_data_query(document_id=user_id, token=token, date=date, scope=scope, db_storage=True)
-
-            if status == HTTPStatus.OK:
-                successful_operations += 1
-            if status == HTTPStatus.PARTIAL_CONTENT:
-                partial_operations += 1
-
-        if successful_operations == total_documents:
-            return jsonify({'status': 'All daily vitals data fetched successfully'}), HTTPStatus.OK
-        elif partial_operations > 0:
-            return jsonify({'error': 'Some daily vitals data failed to fetch'}), HTTPStatus.PARTIAL_CONTENT
-        else:
-            return jsonify({'error': 'Failed to fetch any daily vitals data'}), HTTPStatus.INTERNAL_SERVER_ERROR
-
-    def make_data_query(
-            self, document_id, token: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False) \
-            -> tuple[Response, HTTPStatus]:
-        """
-        Fetches data from Fitbit API for each element in the provided scope.
-        Dynamically calls the associated method from FitbitQueryHandler.
-
-        :param document_id: str: Document ID (hashed User ID).
-        :param token: str: Access token for the Fitbit API.
-        :param date: date: Date in 'YYYY-MM-DD' format.
-        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
-        :param db_storage: bool: Flag to store data in the database.
-        :return: tuple[Response, HTTPStatus]: Combined data and HTTP status code.
-        """
-        try:
-            query_handler = FitbitQueryHandler(token)
-
-            combined_data = {}
-
-            successful_operations = 0
-            total_operations = len(scope)
-
-            for element in scope:
-                if element in DataEndpointsEnum.__members__:
-
-                    status = None
-
-                    for _ in range(3):
-                        response, status = query_handler.fetch_data(element, date)
-
-                        if status == HTTPStatus.OK:
-                            combined_data[element] = response
-                            successful_operations += 1
-                            break
-                        elif status == HTTPStatus.UNAUTHORIZED:
-                            self.refresh_access_token(document_id)
-                            new_token, _ = get_token_from_database(document_id)
-                            query_handler.update_token(new_token)
-                        else:
-                            break
-
-                    if status != HTTPStatus.OK:
-                        combined_data[element] = get_query_error_message(element, status)
-                else:
-                    combined_data[element] = {"error": f"Operation {element} not found in FitbitQueryHandler"}
-
-            if db_storage:
-                vitals_database = VitalsDataBase()
-                response = vitals_database.insert_document(document_id, date, combined_data)
-            else:
-                response = ResponseCode.SUCCESS
-
-            if response == ResponseCode.SUCCESS and (successful_operations == total_operations):
-                status = ResponseCode.SUCCESS
-            elif successful_operations > 0:
-                status = HTTPStatus.PARTIAL_CONTENT
-            else:
-                status = HTTPStatus.INTERNAL_SERVER_ERROR
-            return jsonify(combined_data), status
-
-        except Exception as e:
-            return jsonify({'error': f"An error occurred: {str(e)}"}), HTTPStatus.INTERNAL_SERVER_ERROR
-
     def get_authorization_url(self) -> str:
         """
         Get the authorization URL
@@ -455,5 +315,12 @@ class FitbitDataRetriever(WearableDeviceDataRetriever):
         :param data: dict: Data for the request
         :return: dict: Token request response JSON
         """
-        token_response = requests.post(self.TOKEN_URL, headers=headers, data=data)
-        return token_response.json()
+        try:
+            with guarded_call("token") as timeout:
+                token_response = requests.post(self.TOKEN_URL, headers=headers, data=data, timeout=timeout)
+                if token_response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                    raise requests.exceptions.HTTPError(f"Token endpoint answered {token_response.status_code}")
+            return token_response.json()
+        except Exception as e:
+            logger.error(f"Token request failed: {e}")
+            return {}
@@ -0,0 +1,46 @@
+from __future__ import annotations
+from .DataEndpointsEnum import DataEndpointsEnum, FITBIT_API_URL
+from .FetchEngine import DeviceVendor, EndpointSpec
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import fitbit_scheduler, fitbit_quota
+from vitals_data_retrieving.vitals_data_retrieving_metrics import fitbit_latency
+
+
+class FitbitVendor(DeviceVendor):
+    def __init__(self):
+        """
+        Describe the Fitbit Web API: the endpoints of DataEndpointsEnum, whose payloads are the reference shape of
+        every scope
+        """
+        super().__init__(
+            name="fitbit",
+            api_url=FITBIT_API_URL,
+            endpoints=[EndpointSpec(endpoint.name, endpoint.value) for endpoint in DataEndpointsEnum],
+            daily_scope=["sleep", "heart_rate", "heart_rate_variability", "breathing_rate", "spO2", "activity"],
+            latency=fitbit_latency,
+            scheduler=fitbit_scheduler,
+            quota=fitbit_quota)
+
+    def build_url(self, endpoint: EndpointSpec, date: str = None, base_url: str = None,
+                  fetch_params: dict = None) -> str:
+        """
+        Build the request URL of an endpoint, with the intraday detail level and time window of the fetch parameters
+
+        :param endpoint: EndpointSpec: Endpoint
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param base_url: str: Base URL replacing the Fitbit API host (None targets the real API)
+        :param fetch_params: dict: Intraday detail level and time window (see DataView.fetch_params)
+        :return: str: Endpoint URL
+        """
+        return DataEndpointsEnum[endpoint.name].build_url(date, base_url=base_url, **(fetch_params or {}))
+
+    def headers(self, token: str) -> dict:
+        """
+        Request headers of a user
+
+        :param token: str: Access token
+        :return: dict: Headers
+        """
+        return {'Authorization': f'Bearer {token}', 'Accept-Language': 'en_US'}
+
+
+fitbit_vendor = FitbitVendor()
@@ -0,0 +1,280 @@
+from __future__ import annotations
+from .WearableDeviceDataRetriever import WearableDeviceDataRetriever
+from .DeviceDataRetriever import device_type_of, get_users_from_database
+from .DataView import DataView
+from vitals_data_retrieving.data_consumption_tools.Entities.DataBase import DEFAULT_DEVICE_TYPE
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import users_database
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import as_document_id, identity_map
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from flask import jsonify
+from http import HTTPStatus
+from werkzeug import Response
+import os
+import threading
+
+if os.path.exists('.env'):
+    load_dotenv()
+
+# Device type of the users recently served, so that routing a request does not read the user twice
+DEVICE_TYPE_CACHE_SIZE = int(os.environ.get('DEVICE_TYPE_CACHE_SIZE', 4096))
+DEVICE_TYPE_CACHE_SECONDS = float(os.environ.get('DEVICE_TYPE_CACHE_SECONDS', 300))
+
+
+def combine_statuses(statuses: list[HTTPStatus]) -> HTTPStatus:
+    """
+    Status of an operation run for several devices
+
+    Devices without users (NOT_FOUND) are left out, unless no device has any.
+
+    :param statuses: list[HTTPStatus]: Status of each device
+    :return: HTTPStatus: OK if every device succeeded, INTERNAL_SERVER_ERROR if none did, PARTIAL_CONTENT otherwise
+    """
+    statuses = [status for status in statuses if status != HTTPStatus.NOT_FOUND]
+    if not statuses:
+        return HTTPStatus.NOT_FOUND
+    if all(status == HTTPStatus.OK for status in statuses):
+        return HTTPStatus.OK
+    if all(status >= HTTPStatus.BAD_REQUEST for status in statuses):
+        return HTTPStatus.INTERNAL_SERVER_ERROR
+    return HTTPStatus.PARTIAL_CONTENT
+
+
+class RetrieverRegistry(WearableDeviceDataRetriever):
+    def __init__(self, default_device: str = DEFAULT_DEVICE_TYPE):
+        """
+        Initialize the registry of the retrievers of each device type
+
+        Requests of a user are served by the retriever of the device stored with the user, and the operations over
+        every user run once per device type. With a single retriever registered, every call is passed through
+        without reading the device type of the user.
+
+        :param default_device: str: Device type whose retriever handles the authorization flow and the users not found
+        """
+        self.default_device = default_device
+        self._retrievers = {}
+        self._device_types = TTLCache(DEVICE_TYPE_CACHE_SIZE, DEVICE_TYPE_CACHE_SECONDS)
+        self._lock = threading.Lock()
+
+    def register(self, device_type: str, retriever: WearableDeviceDataRetriever) -> RetrieverRegistry:
+        """
+        Register the retriever of a device type
+
+        :param device_type: str: Device type, as stored with the users of the device
+        :param retriever: WearableDeviceDataRetriever: Retriever of the users of the device
+        :return: RetrieverRegistry: The registry, so that registrations can be chained
+        """
+        self._retrievers[device_type] = retriever
+        return self
+
+    def for_device(self, device_type: str) -> WearableDeviceDataRetriever | None:
+        """
+        Retriever of a device type
+
+        :param device_type: str: Device type
+        :return: WearableDeviceDataRetriever | None: Retriever, None if the device type is not registered
+        """
+        return self._retrievers.get(device_type)
+
+    @property
+    def device_types(self) -> list[str]:
+        return list(self._retrievers)
+
+    def _default(self) -> WearableDeviceDataRetriever:
+        return self._retrievers[self.default_device]
+
+    def _device_of(self, user_key) -> str | None:
+        """
+        Device type of a user
+
+        :param user_key: UserKey | str: User key or document ID (Hashed User ID)
+        :return: str | None: Device type, None if the user is not found
+        """
+        document_id = as_document_id(user_key)
+        with self._lock:
+            device_type = self._device_types.get(document_id)
+        if device_type is not None:
+            return device_type
+
+        response_code, document = users_database().read_document(user_key)
+        if response_code != ResponseCode.SUCCESS or not document:
+            return None
+        device_type = device_type_of(document)
+        with self._lock:
+            self._device_types[document_id] = device_type
+        return device_type
+
+    def _for_user(self, user_key) -> tuple[WearableDeviceDataRetriever | None, str]:
+        """
+        Retriever of the device of a user
+
+        :param user_key: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[WearableDeviceDataRetriever | None, str]: Retriever (None if the device type is not registered)
+            and device type. Users not found go to the default retriever, which answers them
+        """
+        if len(self._retrievers) == 1:
+            return self._default(), self.default_device
+        device_type = self._device_of(user_key) or self.default_device
+        return self._retrievers.get(device_type), device_type
+
+    @staticmethod
+    def _unsupported(device_type: str) -> tuple[Response, HTTPStatus]:
+        return jsonify({'error': f'Device {device_type} is not supported'}), HTTPStatus.NOT_IMPLEMENTED
+
+    def _for_all(self, operation) -> tuple[Response, HTTPStatus]:
+        """
+        Run an operation over every user once per device type
+
+        :param operation: Callable[[str, WearableDeviceDataRetriever], tuple[Response, HTTPStatus]]: Operation run
+            with each device type and its retriever
+        :return: tuple[Response, HTTPStatus]: Result of each device keyed by device type, and the combined status
+        """
+        if len(self._retrievers) == 1:
+            return operation(self.default_device, self._default())
+
+        results = {}
+        statuses = []
+        for device_type, retriever in self._retrievers.items():
+            response, status = operation(device_type, retriever)
+            results[device_type] = response.get_json()
+            statuses.append(status)
+        return jsonify({'devices': results}), combine_statuses(statuses)
+
+    def connect_to_api(self) -> str:
+        """
+        Connect to the API of the default device
+
+        :arg: None
+        :return: str: Authorization URL
+        """
+        return self._default().connect_to_api()
+
+    def get_access_token(self, authorization_code: str):
+        """
+        Get the access token from the API of the default device
+
+        :param authorization_code: str: Authorization code
+        :return: tuple[dict, HTTPStatus]: Token data and HTTP status code
+        """
+        return self._default().get_access_token(authorization_code)
+
+    def refresh_access_token(self, document_id) -> tuple[Response, HTTPStatus]:
+        """
+        Refresh the access token of a user from the API of the user's device
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        retriever, device_type = self._for_user(document_id)
+        if retriever is None:
+            return self._unsupported(device_type)
+        return retriever.refresh_access_token(document_id)
+
+    def update_all_tokens(self, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Update the access tokens of every user from the API of each device
+
+        :param run_id: str: Run ID, suffixed with the device type for each device (None uses the default of each)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        return self._for_all(lambda device_type, retriever: retriever.update_all_tokens(
+            self._device_run_id(run_id, device_type)))
+
+    def get_user_info(self, user_id) -> tuple[Response, HTTPStatus]:
+        """
+        Get user info from the API of the user's device
+
+        :param user_id: str: User ID
+        :return: tuple[Response, HTTPStatus]: User info and HTTP status code
+        """
+        retriever, device_type = self._for_user(identity_map.key_for(user_id))
+        if retriever is None:
+            return self._unsupported(device_type)
+        return retriever.get_user_info(user_id)
+
+    def retrieve_data(
+            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data from the API of the user's device
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data and HTTP status code
+        """
+        retriever, device_type = self._for_user(identity_map.key_for(user_id))
+        if retriever is None:
+            return self._unsupported(device_type)
+        return retriever.retrieve_data(user_id, date, scope, db_storage, view)
+
+    def retrieve_data_batch(
+            self, user_ids: list[str], dates: list[str], scope: list[str], view: DataView = None) \
+            -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, each group of users from the retriever of its device
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        if len(self._retrievers) == 1:
+            return self._default().retrieve_data_batch(user_ids, dates, scope, view)
+
+        user_keys = identity_map.keys_for(user_ids)
+        users = get_users_from_database(set(user_keys.values()))
+        groups = {}
+        for user_id, user_key in user_keys.items():
+            # Users not found go to the default retriever, which answers them
+            device_type = device_type_of(users[user_key]) if user_key in users else self.default_device
+            groups.setdefault(device_type, []).append(user_id)
+
+        results = {}
+        statuses = []
+        for device_type, group in groups.items():
+            retriever = self._retrievers.get(device_type)
+            if retriever is None:
+                error = {'error': f'Device {device_type} is not supported'}
+                results.update({user_id: {date: error for date in dates} for user_id in group})
+                statuses.append(HTTPStatus.NOT_IMPLEMENTED)
+                continue
+            response, status = retriever.retrieve_data_batch(group, dates, scope, view)
+            body = response.get_json()
+            if 'error' in body:
+                return response, status
+            results.update(body)
+            statuses.append(status)
+        return jsonify(results), combine_statuses(statuses)
+
+    def get_daily_vitals_data(self, date, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Get daily vitals data from every user of each device and store it in the database
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID, suffixed with the device type for each device (None uses the default of each)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        return self._for_all(lambda device_type, retriever: retriever.get_daily_vitals_data(
+            date, self._device_run_id(run_id, device_type)))
+
+    def repair_vitals_data(self, dates: list[str], scope: list[str]) -> tuple[Response, HTTPStatus]:
+        """
+        Fetch again the stored scopes whose last fetch failed or returned data that was not final yet, each user from
+        the API of the user's device
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[Response, HTTPStatus]: Repair summary and HTTP status code
+        """
+        return self._for_all(lambda device_type, retriever: retriever.repair_vitals_data(dates, scope))
+
+    def _device_run_id(self, run_id: str, device_type: str) -> str | None:
+        # The checkpoints and shard leases of each device are kept apart, the single device keeps the run ID given
+        if run_id is None or len(self._retrievers) == 1:
+            return run_id
+        return f"{run_id}:{device_type}"
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+
+class _Call:
+    """
+    In-flight call shared by every caller of the same key
+    """
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Initialize the single-flight group
+
+        Concurrent calls made with the same key share one execution of the function and its result, calls made
+        after it finished start a new execution.
+        """
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Execute the function unless a call with the same key is already in flight, in which case wait for it
+
+        :param key: Hashable key identifying identical calls
+        :param function: Callable to execute
+        :return: The result of the (possibly shared) call. Exceptions raised by the call are raised to every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """
+        Number of keys with a call currently in flight
+
+        :return: int: Number of in-flight calls
+        """
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        """
+        Initialize the single-flight group of the coroutines of an event loop
+
+        Concurrent calls made with the same key share one execution of the coroutine function and its result, calls
+        made after it finished start a new execution. A caller that is cancelled does not cancel the shared call.
+        """
+        self._calls = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        """
+        Execute the coroutine function unless a call with the same key is already in flight, in which case await it
+
+        :param key: Hashable key identifying identical calls
+        :param function: Coroutine function to execute
+        :return: The result of the (possibly shared) call. Exceptions raised by the call are raised to every caller
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(function(*args, **kwargs))
+            self._calls[key] = call
+
+            def forget(_):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.add_done_callback(forget)
+        return await asyncio.shield(call)
+
+    def in_flight(self) -> int:
+        """
+        Number of keys with a call currently in flight
+
+        :return: int: Number of in-flight calls
+        """
+        return len(self._calls)
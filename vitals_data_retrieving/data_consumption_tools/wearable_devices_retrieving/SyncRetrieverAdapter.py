@@ -0,0 +1,167 @@
+from __future__ import annotations
+from .AsyncWearableDeviceDataRetriever import AsyncWearableDeviceDataRetriever
+from .WearableDeviceDataRetriever import WearableDeviceDataRetriever
+from .DataView import DataView
+from http import HTTPStatus
+from flask import jsonify
+from werkzeug import Response
+import asyncio
+import os
+import threading
+
+
+class EventLoopThread:
+    def __init__(self, name: str = 'retriever-event-loop'):
+        """
+        Initialize an event loop running in a daemon thread, started on first use
+
+        The loop is started again in a forked worker, where the thread of the parent does not exist.
+
+        :param name: str: Thread name
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Event loop of this process, started if needed
+
+        :return: asyncio.AbstractEventLoop: Running event loop
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine):
+        """
+        Run a coroutine in the loop and wait for its result
+
+        The coroutine runs in a copy of the caller's context, so that it keeps the request deadline, priority class
+        and current span.
+
+        :param coroutine: Coroutine to run
+        :return: The result of the coroutine. Exceptions raised by it are raised to the caller
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop()).result()
+
+
+# Shared by every adapter of the process: one loop, and so one connection pool per async retriever
+event_loop_thread = EventLoopThread()
+
+
+class SyncRetrieverAdapter(WearableDeviceDataRetriever):
+    def __init__(self, retriever: AsyncWearableDeviceDataRetriever, loop_thread: EventLoopThread = None):
+        """
+        Serve an asynchronous retriever to the Flask views through the synchronous interface
+
+        Every call runs as a coroutine in a background event loop, while the calling request thread waits for it. The
+        Flask responses are built in the calling thread, inside its application context.
+
+        :param retriever: AsyncWearableDeviceDataRetriever: Asynchronous retriever
+        :param loop_thread: EventLoopThread: Loop the calls run in (defaults to the one of the process)
+        """
+        self.retriever = retriever
+        self.loop_thread = loop_thread or event_loop_thread
+
+    def _respond(self, coroutine) -> tuple[Response, HTTPStatus]:
+        data, status = self.loop_thread.run(coroutine)
+        return jsonify(data), status
+
+    def connect_to_api(self) -> str:
+        """
+        Connect to the API of the wearable device
+
+        :arg: None
+        :return: str: Authorization URL
+        """
+        return self.loop_thread.run(self.retriever.connect_to_api())
+
+    def get_access_token(self, authorization_code) -> tuple[dict, HTTPStatus]:
+        """
+        Get the access token from the API
+
+        :param authorization_code: str: Authorization code
+        :return: tuple[dict, HTTPStatus]: Token data and HTTP status code
+        """
+        return self.loop_thread.run(self.retriever.get_access_token(authorization_code))
+
+    def refresh_access_token(self, document_id) -> tuple[Response, HTTPStatus]:
+        """
+        Refresh the access token from the API
+
+        :param document_id: UserKey | str: User key or document ID (Hashed User ID)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        return self._respond(self.retriever.refresh_access_token(document_id))
+
+    def update_all_tokens(self, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Update all access tokens from the wearable device API in the database
+
+        :param run_id: str: Run ID (None uses a default per period)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        return self._respond(self.retriever.update_all_tokens(run_id))
+
+    def get_user_info(self, user_id) -> tuple[Response, HTTPStatus]:
+        """
+        Get user info from the wearable device API
+
+        :param user_id: str: User ID
+        :return: tuple[Response, HTTPStatus]: User info and HTTP status code
+        """
+        return self._respond(self.retriever.get_user_info(user_id))
+
+    def retrieve_data(
+            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data from the wearable device by querying the API
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data and HTTP status code
+        """
+        return self._respond(self.retriever.retrieve_data(user_id, date, scope, db_storage, view))
+
+    def retrieve_data_batch(
+            self, user_ids: list[str], dates: list[str], scope: list[str], view: DataView = None) \
+            -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, serving stored data and querying the API only for the gaps
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        return self._respond(self.retriever.retrieve_data_batch(user_ids, dates, scope, view))
+
+    def get_daily_vitals_data(self, date, run_id: str = None) -> tuple[Response, HTTPStatus]:
+        """
+        Get daily vitals data from all the users stored in the database and store it in the database
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID (None uses a default per date)
+        :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
+        """
+        return self._respond(self.retriever.get_daily_vitals_data(date, run_id))
+
+    def repair_vitals_data(self, dates: list[str], scope: list[str]) -> tuple[Response, HTTPStatus]:
+        """
+        Fetch again the stored scopes whose last fetch failed or returned data that was not final yet
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[Response, HTTPStatus]: Repair summary and HTTP status code
+        """
+        return self._respond(self.retriever.repair_vitals_data(dates, scope))
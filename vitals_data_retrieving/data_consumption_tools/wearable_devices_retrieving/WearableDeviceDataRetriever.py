@@ -36,11 +36,12 @@ class WearableDeviceDataRetriever(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def update_all_tokens(self) -> tuple[Response, HTTPStatus]:
+    def update_all_tokens(self, run_id=None) -> tuple[Response, HTTPStatus]:
         """
-        Update all access tokens from the wearable device API in the database
+        Update all access tokens from the wearable device API in the database, skipping the users already refreshed
+        by the run
 
-        :arg: None
+        :param run_id: str: Run ID (None uses a default per period)
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
         pass
@@ -56,7 +57,7 @@ class WearableDeviceDataRetriever(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def retrieve_data(self, token, date, scope, db_storage) -> tuple[Response, HTTPStatus]:
+    def retrieve_data(self, token, date, scope, db_storage, view=None) -> tuple[Response, HTTPStatus]:
         """
         Retrieve data from the wearable device by querying the API
 
@@ -64,16 +65,42 @@ class WearableDeviceDataRetriever(metaclass=ABCMeta):
         :param date: str: Date in 'YYYY-MM-DD' format
         :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
         :param db_storage: bool: Store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
         :return: tuple[Response, HTTPStatus]: Data and HTTP status code
         """
         pass
 
     @abstractmethod
-    def get_daily_vitals_data(self, date) -> tuple[Response, HTTPStatus]:
+    def retrieve_data_batch(self, user_ids, dates, scope, view=None) -> tuple[Response, HTTPStatus]:
+        """
+        Retrieve data of several users and dates, serving stored data and querying the API only for the gaps
+
+        :param user_ids: list[str]: User IDs
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        pass
+
+    @abstractmethod
+    def get_daily_vitals_data(self, date, run_id=None) -> tuple[Response, HTTPStatus]:
         """
         Get daily vitals data from all the users stored in the database and store it in the database
 
         :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID, shared by the nodes and attempts of the run (None uses a default per date)
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
         pass
+
+    @abstractmethod
+    def repair_vitals_data(self, dates, scope) -> tuple[Response, HTTPStatus]:
+        """
+        Fetch again the stored scopes whose last fetch failed or returned data that was not final yet
+
+        :param dates: list[str]: Dates in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to check (e.g., "sleep", "heart_rate").
+        :return: tuple[Response, HTTPStatus]: Repair summary and HTTP status code
+        """
+        pass
@@ -1,8 +1,17 @@
 from vitals_data_retrieving.vitals_data_retrieving_service import VitalsDataRetrievingService
 from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.FitbitDataRetriever import \
     FitbitDataRetriever
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.AsyncFitbitDataRetriever import \
+    AsyncFitbitDataRetriever
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.SyncRetrieverAdapter import \
+    SyncRetrieverAdapter
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.RetrieverRegistry import \
+    RetrieverRegistry
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.DataView import DataView
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import set_deadline, reset_deadline
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import Priority, set_priority, reset_priority
 from dotenv import load_dotenv
-from flask import Blueprint, request, redirect, jsonify
+from flask import Blueprint, request, redirect, jsonify, g
 from http import HTTPStatus
 from werkzeug import Response
 from user_metrics_tracker import user_tracker
@@ -13,8 +22,50 @@ logger = logging.getLogger(__name__)
 
 vitals_data_retrieving_api = Blueprint('vitals_data_retrieving_api', __name__)
 
-# Dependencies
-data_retriever = FitbitDataRetriever()
+# Dependencies: each user is served by the retriever of the device stored with the user. FITBIT_ASYNC_CLIENT=true
+# serves the Fitbit users with the asynchronous retriever (concurrent scope fetches over pooled HTTP/2 connections)
+# through its synchronous adapter
+data_retriever = RetrieverRegistry()
+if os.environ.get('FITBIT_ASYNC_CLIENT', 'false').lower() == 'true':
+    data_retriever.register('fitbit', SyncRetrieverAdapter(AsyncFitbitDataRetriever()))
+else:
+    data_retriever.register('fitbit', FitbitDataRetriever())
+
+# Batch endpoints run for as long as they need and behind the interactive requests, every other endpoint gets a
+# deadline
+BATCH_ENDPOINTS = {'get_daily_vitals_data', 'update_all_tokens', 'repair_vitals_data'}
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 25))
+
+
+@vitals_data_retrieving_api.before_request
+def start_request_deadline():
+    """
+    Set the deadline of the request, propagated to the Fitbit and MongoDB calls made while serving it
+
+    Clients may shorten it with the X-Request-Deadline-Ms header (remaining time budget in milliseconds). Batch
+    endpoints have no deadline and run with batch priority instead.
+    """
+    if request.endpoint and request.endpoint.rsplit('.', 1)[-1] in BATCH_ENDPOINTS:
+        g.priority_token = set_priority(Priority.BATCH)
+        return
+    seconds = REQUEST_DEADLINE_SECONDS
+    header = request.headers.get('X-Request-Deadline-Ms')
+    if header and header.isdigit():
+        seconds = min(seconds, int(header) / 1000)
+    g.deadline_token = set_deadline(seconds)
+
+
+@vitals_data_retrieving_api.teardown_request
+def clear_request_deadline(_):
+    """
+    Restore the deadline and priority that were active before the request
+    """
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        reset_deadline(token)
+    token = g.pop('priority_token', None)
+    if token is not None:
+        reset_priority(token)
 
 
 #@vitals_data_retrieving_api.route('/connect_to_api')
@@ -117,19 +168,22 @@ def refresh_token():
     user_id = data.get('user_id')
     service = VitalsDataRetrievingService(data_retriever)
     response, status = service.refresh_access_token(user_id)
-    return jsonify(response), status
+    return response, status
 
 
 @vitals_data_retrieving_api.route('/update_all_tokens', methods=['POST'])
 def update_all_tokens() -> tuple[Response, HTTPStatus]:
     """
     Endpoint to update all access tokens from the wearable device API in the database
+
+    Optional body parameter: run_id, to resume an interrupted run (by default one run per UTC hour)
     :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
 
     Endpoint-> /vitals_data_retrieving/update_all_tokens
     """
+    data = request.get_json(force=True, silent=True) or {}
     service = VitalsDataRetrievingService(data_retriever)
-    response, status = service.update_all_tokens()
+    response, status = service.update_all_tokens(data.get('run_id'))
     return response, status
 
 
@@ -165,6 +219,10 @@ def get_user_info():
 def get_vitals_data():
     """
     Endpoint to get vitals data from the wearable device
+
+    Optional body parameters narrow the payload to what the client displays:
+    resolution ("1s", "1min", "5min" or "hourly"), metrics ({"heart_rate": ["intraday"], ...}),
+    start_time/end_time ('HH:MM[:SS]') and source ("api" or "storage" to read previously stored data)
     :return: tuple[Response, HTTPStatus]: Vitals data and HTTP status code
 
     Endpoint-> /vitals_data_retrieving/get_vitals_data
@@ -183,21 +241,63 @@ def get_vitals_data():
         date = data.get('date')
         scope = data.get('scope')
         db_storage = data.get('db_storage', False)
+        source = data.get('source', 'api')
+
+        try:
+            view = DataView.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), HTTPStatus.BAD_REQUEST
 
         service = VitalsDataRetrievingService(data_retriever)
-        vitals, status = service.get_data_from_wearable_device_api(user_id, date, scope, db_storage)
-        return jsonify(vitals), status
+        if source == 'storage':
+            vitals, status = service.get_stored_vitals_data(user_id, date, scope, view)
+            return jsonify(vitals), status
+
+        vitals, status = service.get_data_from_wearable_device_api(user_id, date, scope, db_storage, view)
+        return vitals, status
     except Exception as e:
         logger.error(f"Error en get_vitals_data: {e}")
         return jsonify({"error": str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+@vitals_data_retrieving_api.route('/get_vitals_data_batch', methods=['POST'])
+@user_tracker.track_user_operation('get_vitals_data_batch')
+def get_vitals_data_batch():
+    """
+    Endpoint to get vitals data of several users over a date range in a single call
+
+    Body parameters: user_ids (list), start_date, end_date ('YYYY-MM-DD'), scope (list) and the optional
+    resolution, metrics and start_time/end_time accepted by get_vitals_data
+    :return: tuple[Response, HTTPStatus]: Vitals data keyed by user ID and date, and HTTP status code
+
+    Endpoint-> /vitals_data_retrieving/get_vitals_data_batch
+    """
+    try:
+        data = request.get_json(force=True)
+
+        try:
+            view = DataView.from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), HTTPStatus.BAD_REQUEST
+
+        service = VitalsDataRetrievingService(data_retriever)
+        vitals, status = service.get_vitals_data_batch(
+            data.get('user_ids'), data.get('start_date'), data.get('end_date'), data.get('scope'), view)
+        return (jsonify(vitals), status) if isinstance(vitals, dict) else (vitals, status)
+    except Exception as e:
+        logger.error(f"Error en get_vitals_data_batch: {e}")
+        return jsonify({"error": str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+
 @vitals_data_retrieving_api.route('/get_daily_vitals_data', methods=['POST'])
 #def get_daily_vitals_data() -> tuple[Response, HTTPStatus]:
 def get_daily_vitals_data():
 
     """
     Endpoint to get daily vitals data from all the users stored in the database and store it in the database
+
+    Body parameters: date ('YYYY-MM-DD') and the optional run_id (by default one run per date: calling it again for
+    the same date resumes the run, fetching only the users left or failed)
     :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
 
     Endpoint-> /vitals_data_retrieving/get_daily_vitals_data
@@ -210,5 +310,26 @@ def get_daily_vitals_data():
     data = request.get_json(force=True)
     date = data.get('date')
     service = VitalsDataRetrievingService(data_retriever)
-    response, status = service.get_daily_vitals_data_from_wearable_device_api(date)
+    response, status = service.get_daily_vitals_data_from_wearable_device_api(date, data.get('run_id'))
     return jsonify(response), status
+
+
+@vitals_data_retrieving_api.route('/repair_vitals_data', methods=['POST'])
+def repair_vitals_data():
+    """
+    Endpoint to fetch again the stored vitals whose last fetch failed or returned data that was not final yet
+
+    Optional body parameters: start_date, end_date ('YYYY-MM-DD', by default the last REPAIR_LOOKBACK_DAYS days)
+    and scope (list, by default all the daily scopes)
+    :return: tuple[Response, HTTPStatus]: Repair summary and HTTP status code
+
+    Endpoint-> /vitals_data_retrieving/repair_vitals_data
+    """
+    try:
+        data = request.get_json(force=True, silent=True) or {}
+        service = VitalsDataRetrievingService(data_retriever)
+        response, status = service.repair_vitals_data(data.get('start_date'), data.get('end_date'), data.get('scope'))
+        return (jsonify(response), status) if isinstance(response, dict) else (response, status)
+    except Exception as e:
+        logger.error(f"Error en repair_vitals_data: {e}")
+        return jsonify({"error": str(e)}), HTTPStatus.INTERNAL_SERVER_ERROR
@@ -0,0 +1,303 @@
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+from .data_consumption_tools.Entities.DataBase import VitalsRepository
+from .data_consumption_tools.Entities.ResponseCode import ResponseCode
+from .data_consumption_tools.Entities.Storage import vitals_database
+from .data_consumption_tools.wearable_devices_retrieving.DataView import INTRADAY_SERIES, parse_time_of_day, \
+    times_to_seconds, walk_path
+import json
+import numpy as np
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+
+# Root directory of the dataset, compression codec and rows buffered per Parquet row group
+EXPORT_PATH = os.environ.get('EXPORT_PATH', 'vitals_export')
+EXPORT_COMPRESSION = os.environ.get('EXPORT_COMPRESSION', 'zstd')
+EXPORT_ROW_GROUP_ROWS = int(os.environ.get('EXPORT_ROW_GROUP_ROWS', 1_000_000))
+
+MANIFEST_FILE = '_manifest.json'
+
+# user_id is dictionary-encoded: a file holds the samples of many users, each one repeated for every sample
+USER_ID_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+class MetricSpec(NamedTuple):
+    """
+    Columnar layout of a metric of the dataset
+
+    scope: scope of the vitals documents holding the metric
+    schema: columns of the metric files, after user_id
+    flatten: function(payload, date) returning the columns of the samples of a user-day, keyed by name
+    """
+    scope: str
+    schema: pa.Schema
+    flatten: Callable[[dict, str], dict]
+
+
+def _iso_timestamps(values: list[str]) -> np.ndarray:
+    # 'YYYY-MM-DDTHH:MM:SS[.fff]' strings; the fraction is always zero in Fitbit data
+    return np.array([value[:19] for value in values], dtype='datetime64[s]')
+
+
+def _day_timestamps(times: list[str], date: str) -> np.ndarray:
+    # 'HH:MM[:SS]' times of the given day
+    if all(len(time) == 8 for time in times):
+        seconds = times_to_seconds(times)
+    else:
+        seconds = np.array([parse_time_of_day(time) for time in times], dtype=np.int64)
+    return np.datetime64(date, 's') + seconds
+
+
+def _points(payload: dict, series: str) -> list[dict]:
+    spec = INTRADAY_SERIES[series]
+    return [point for container in walk_path(payload, spec.path) for point in container[spec.path[-1]]]
+
+
+def _flatten_daily_series(series: str) -> Callable[[dict, str], dict]:
+    def flatten(payload: dict, date: str) -> dict:
+        points = _points(payload, series)
+        return {
+            'timestamp': _day_timestamps([point[INTRADAY_SERIES[series].time_key] for point in points], date),
+            'value': [point.get('value') for point in points]
+        }
+    return flatten
+
+
+def _flatten_spo2(payload: dict, date: str) -> dict:
+    points = _points(payload, 'spO2')
+    return {'timestamp': _iso_timestamps([point['minute'] for point in points]),
+            'value': [point.get('value') for point in points]}
+
+
+def _flatten_hrv(payload: dict, date: str) -> dict:
+    points = _points(payload, 'heart_rate_variability')
+    values = [point.get('value') or {} for point in points]
+    columns = {'timestamp': _iso_timestamps([point['minute'] for point in points])}
+    for field in ('rmssd', 'coverage', 'hf', 'lf'):
+        columns[field] = [value.get(field) for value in values]
+    return columns
+
+
+def _flatten_breathing_rate(payload: dict, date: str) -> dict:
+    # One sample per sleep day, with the breathing rate of each sleep stage
+    entries = [entry for entry in payload.get('br', []) if isinstance(entry, dict)]
+    columns = {'timestamp': np.array([entry.get('dateTime', date) for entry in entries], dtype='datetime64[s]')}
+    for stage in ('deep', 'rem', 'light', 'full'):
+        columns[stage] = [((entry.get('value') or {}).get(f"{stage}SleepSummary") or {}).get('breathingRate')
+                          for entry in entries]
+    return columns
+
+
+def _flatten_sleep(payload: dict, date: str) -> dict:
+    # One sample per sleep stage interval of every sleep log
+    stages, main_sleep = [], []
+    for log in payload.get('sleep', []):
+        data = (log.get('levels') or {}).get('data', [])
+        stages.extend(data)
+        main_sleep.extend([bool(log.get('isMainSleep'))] * len(data))
+    return {'timestamp': _iso_timestamps([stage['dateTime'] for stage in stages]),
+            'level': [stage.get('level') for stage in stages],
+            'seconds': [stage.get('seconds') for stage in stages],
+            'main_sleep': main_sleep}
+
+
+METRICS = {
+    'heart_rate': MetricSpec('heart_rate', pa.schema([('timestamp', pa.timestamp('s')), ('value', pa.int16())]),
+                             _flatten_daily_series('heart_rate')),
+    'steps': MetricSpec('activity', pa.schema([('timestamp', pa.timestamp('s')), ('value', pa.int32())]),
+                        _flatten_daily_series('activity')),
+    'spo2': MetricSpec('spO2', pa.schema([('timestamp', pa.timestamp('s')), ('value', pa.float64())]),
+                       _flatten_spo2),
+    'hrv': MetricSpec('heart_rate_variability', pa.schema([
+        ('timestamp', pa.timestamp('s')), ('rmssd', pa.float64()), ('coverage', pa.float64()), ('hf', pa.float64()),
+        ('lf', pa.float64())]), _flatten_hrv),
+    'breathing_rate': MetricSpec('breathing_rate', pa.schema([
+        ('timestamp', pa.timestamp('s')), ('deep', pa.float64()), ('rem', pa.float64()), ('light', pa.float64()),
+        ('full', pa.float64())]), _flatten_breathing_rate),
+    'sleep': MetricSpec('sleep', pa.schema([
+        ('timestamp', pa.timestamp('s')), ('level', pa.dictionary(pa.int8(), pa.string())), ('seconds', pa.int32()),
+        ('main_sleep', pa.bool_())]), _flatten_sleep),
+}
+
+
+def metric_table(metric: str, user_id: str, payload: dict, date: str) -> pa.Table | None:
+    """
+    Convert the payload of a user-day into the rows of a metric, one per sample
+
+    :param metric: str: Metric name, one of METRICS
+    :param user_id: str: User ID (hashed)
+    :param payload: dict: Payload of the metric scope, as stored in the vitals document
+    :param date: str: Date of the document in 'YYYY-MM-DD' format
+    :return: pa.Table | None: Rows of the metric, None when the payload holds no samples
+    """
+    spec = METRICS[metric]
+    if not isinstance(payload, dict):
+        return None
+    columns = spec.flatten(payload, date)
+    rows = len(columns['timestamp'])
+    if rows == 0:
+        return None
+    arrays = [pa.DictionaryArray.from_arrays(pa.array(np.zeros(rows, dtype=np.int32)), pa.array([user_id]))]
+    for field in spec.schema:
+        values = columns[field.name]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema([('user_id', USER_ID_TYPE)] + list(spec.schema)))
+
+
+class VitalsExporter:
+    def __init__(self, root: str = None, repository: VitalsRepository = None, metrics: list[str] = None,
+                 compression: str = None, row_group_rows: int = None):
+        """
+        Initialize the export of the stored vitals to a Parquet dataset for research analytics
+
+        The dataset is partitioned Hive-style by metric and date (root/metric=heart_rate/date=YYYY-MM-DD/...), with one
+        row per sample and typed columns. Each metric directory is a dataset with its own schema, so that analytics
+        jobs read only the metrics and days they need and load them directly into dataframes (e.g.,
+        pandas.read_parquet(f"{root}/metric=heart_rate", filters=[("date", ">=", "2024-01-01")])).
+
+        A manifest in the root records the exported dates, so that each run only exports the new ones.
+
+        :param root: str: Root directory of the dataset (defaults to the EXPORT_PATH environment variable)
+        :param repository: VitalsRepository: Source of the documents (defaults to the configured storage backend)
+        :param metrics: list[str]: Metrics to export, from METRICS (None exports all of them)
+        :param compression: str: Parquet compression codec (defaults to EXPORT_COMPRESSION, zstd)
+        :param row_group_rows: int: Rows buffered per row group (defaults to EXPORT_ROW_GROUP_ROWS)
+        """
+        unknown = set(metrics or []) - set(METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics {sorted(unknown)}, expected some of {list(METRICS)}")
+        self.root = root or EXPORT_PATH
+        self.repository = repository
+        self.metrics = list(metrics or METRICS)
+        self.compression = compression or EXPORT_COMPRESSION
+        self.row_group_rows = row_group_rows or EXPORT_ROW_GROUP_ROWS
+
+    @property
+    def _repository(self) -> VitalsRepository:
+        return self.repository if self.repository is not None else vitals_database()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def read_manifest(self) -> dict:
+        """
+        Read the manifest of the dataset
+
+        :return: dict: Exported dates, with the documents and rows per metric of each one
+        """
+        try:
+            with open(self._manifest_path()) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'dates': {}}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        # Replaced atomically: an interrupted run leaves the previous manifest
+        temporary_path = self._manifest_path() + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self._manifest_path())
+
+    def pending_dates(self, until: str = None) -> list[str]:
+        """
+        Stored dates that are not exported yet
+
+        :param until: str: Only dates before this one, in 'YYYY-MM-DD' format (defaults to today, still being fetched)
+        :return: list[str]: Dates in ascending order
+        :raises RuntimeError: If the stored dates cannot be read
+        """
+        response_code, dates = self._repository.read_dates()
+        if response_code == ResponseCode.ERROR_UNKNOWN:
+            raise RuntimeError("Could not read the stored dates")
+        until = until or datetime.now().date().isoformat()
+        exported = self.read_manifest()['dates']
+        return [date for date in dates if date < until and date not in exported]
+
+    def export(self, dates: list[str] = None, force: bool = False) -> dict:
+        """
+        Export several dates, recording each one in the manifest once its files are complete
+
+        :param dates: list[str]: Dates to export (None exports the pending dates)
+        :param force: bool: Export again the dates already in the manifest, replacing their files
+        :return: dict: Summary per exported date
+        """
+        os.makedirs(self.root, exist_ok=True)
+        manifest = self.read_manifest()
+        if dates is None:
+            dates = self.pending_dates()
+        elif not force:
+            dates = [date for date in dates if date not in manifest['dates']]
+
+        summary = {}
+        for date in dates:
+            summary[date] = self.export_date(date)
+            # Exporting a subset of the metrics keeps the rows recorded for the others
+            previous_rows = manifest['dates'].get(date, {}).get('rows', {})
+            manifest['dates'][date] = {**summary[date], 'rows': {**previous_rows, **summary[date]['rows']}}
+            self._write_manifest(manifest)
+        return summary
+
+    def export_date(self, date: str) -> dict:
+        """
+        Export the documents of a date, replacing the files of the exported metrics if it was already exported
+
+        Documents are streamed from the repository and their samples written in row groups of row_group_rows, so the
+        memory used does not depend on the number of users. Files are written under a temporary name and renamed
+        once complete. When several documents exist for a user and date, only the first one is exported, as the
+        service reads it.
+
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :return: dict: Documents, rows per metric and export time
+        """
+        partition = f"date={date}"
+        writers, buffers, buffered_rows, rows = {}, {}, {}, {metric: 0 for metric in self.metrics}
+        exported_users = set()
+        documents = 0
+
+        def flush(metric: str) -> None:
+            if not buffers.get(metric):
+                return
+            if metric not in writers:
+                directory = os.path.join(self.root, f"metric={metric}", partition)
+                os.makedirs(directory, exist_ok=True)
+                temporary_path = os.path.join(directory, 'part-0.parquet.tmp')
+                writers[metric] = (pq.ParquetWriter(temporary_path, buffers[metric][0].schema,
+                                                    compression=self.compression), temporary_path)
+            writers[metric][0].write_table(pa.concat_tables(buffers[metric]), row_group_size=self.row_group_rows)
+            buffers[metric], buffered_rows[metric] = [], 0
+
+        # A date exported again must not keep the files of metrics that no longer have samples
+        for metric in self.metrics:
+            if os.path.isdir(os.path.join(self.root, f"metric={metric}", partition)):
+                shutil.rmtree(os.path.join(self.root, f"metric={metric}", partition))
+        scopes = sorted({METRICS[metric].scope for metric in self.metrics})
+        try:
+            for document in self._repository.stream_documents([date], scopes):
+                if document['user_id'] in exported_users:
+                    continue
+                exported_users.add(document['user_id'])
+                documents += 1
+                for metric in self.metrics:
+                    table = metric_table(metric, document['user_id'],
+                                         document.get('data', {}).get(METRICS[metric].scope), date)
+                    if table is None:
+                        continue
+                    buffers.setdefault(metric, []).append(table)
+                    buffered_rows[metric] = buffered_rows.get(metric, 0) + table.num_rows
+                    rows[metric] += table.num_rows
+                    if buffered_rows[metric] >= self.row_group_rows:
+                        flush(metric)
+            for metric in self.metrics:
+                flush(metric)
+        finally:
+            for writer, _ in writers.values():
+                writer.close()
+
+        for _, temporary_path in writers.values():
+            os.replace(temporary_path, temporary_path[:-len('.tmp')])
+        return {'documents': documents, 'rows': rows, 'exported_at': datetime.now(timezone.utc).isoformat()}
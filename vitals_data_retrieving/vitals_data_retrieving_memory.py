@@ -0,0 +1,275 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from flask import Flask, request, g
+import itertools
+import os
+import threading
+import tracemalloc
+
+# Grouping a snapshot is done in Python and takes seconds once a full day of intraday points is alive, holding the
+# GIL meanwhile. Blocks therefore only diff snapshots when sampling is enabled (one call out of SNAPSHOT_EVERY per
+# label, 0 disables it); the on-demand snapshot and baseline diff cover the usual leak hunting.
+SNAPSHOT_EVERY = int(os.environ.get('MEMORY_SNAPSHOT_EVERY', 0))
+TRACEBACK_FRAMES = int(os.environ.get('MEMORY_TRACEBACK_FRAMES', 10))
+TOP_SITES = int(os.environ.get('MEMORY_TOP_SITES', 10))
+
+# Allocations made by tracemalloc, this module and the import machinery are noise in the reports. They are dropped from
+# the grouped statistics rather than with Snapshot.filter_traces, which is much slower on large heaps.
+IGNORED_FILES = {tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>",
+                 "<frozen importlib._bootstrap_external>", "<unknown>"}
+
+
+def _relevant(statistics: list, limit: int) -> list:
+    """
+    Keep the first statistics not allocated by tracemalloc, this module or the import machinery
+
+    :param statistics: list: tracemalloc.Statistic or StatisticDiff, sorted by size
+    :param limit: int: Maximum number of statistics
+    :return: list: Relevant statistics
+    """
+    relevant = []
+    for stat in statistics:
+        if stat.traceback[0].filename not in IGNORED_FILES:
+            relevant.append(stat)
+            if len(relevant) == limit:
+                break
+    return relevant
+
+
+class _LabelStats:
+    __slots__ = ('calls', 'snapshots', 'net_bytes', 'max_net_bytes', 'max_peak_bytes', 'sites')
+
+    def __init__(self):
+        self.calls = 0
+        self.snapshots = 0
+        self.net_bytes = 0
+        self.max_net_bytes = 0
+        self.max_peak_bytes = 0
+        self.sites = Counter()
+
+
+class MemoryTracker:
+    def __init__(self):
+        """
+        Initialize the tracker of the memory allocated by labelled blocks of the ingestion pipeline
+
+        While disabled, tracked blocks only pay an attribute check. While enabled, tracemalloc traces every
+        allocation: each block records the net memory it left allocated and the peak reached while it ran, and, when
+        sampling is enabled, one call out of SNAPSHOT_EVERY also diffs snapshots to find the lines that allocated the
+        most.
+
+        tracemalloc is process-wide, so with concurrent or nested blocks the peak of a block is an upper bound that
+        includes the allocations of the other threads.
+        """
+        self.enabled = False
+        self.snapshot_every = SNAPSHOT_EVERY
+        self._stats = {}
+        self._calls = {}
+        self._active_blocks = 0
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def enable(self, frames: int = None, snapshot_every: int = None) -> None:
+        """
+        Start tracing allocations
+
+        :param frames: int: Frames stored per allocation traceback (more frames, more overhead)
+        :param snapshot_every: int: Diff snapshots in one call out of snapshot_every per label (0 disables it)
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or TRACEBACK_FRAMES)
+        if snapshot_every is not None:
+            self.snapshot_every = snapshot_every
+        self.enabled = True
+
+    def disable(self) -> None:
+        """
+        Stop tracing allocations, releasing the traces and the baseline (the collected statistics are kept)
+        """
+        self.enabled = False
+        self._baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self) -> None:
+        """
+        Discard the collected statistics
+        """
+        with self._lock:
+            self._stats = {}
+            self._calls = {}
+
+    def begin(self, label: str):
+        """
+        Start tracking a block
+
+        :param label: str: Block label (e.g., "make_data_query")
+        :return: Token for end, None when the tracker is disabled
+        """
+        if not self.enabled or not tracemalloc.is_tracing():
+            return None
+        with self._lock:
+            counter = self._calls.setdefault(label, itertools.count())
+            take_snapshot = self.snapshot_every > 0 and next(counter) % self.snapshot_every == 0
+            # The peak can only be reset when no other block is measuring it
+            if self._active_blocks == 0:
+                tracemalloc.reset_peak()
+            self._active_blocks += 1
+        snapshot = tracemalloc.take_snapshot() if take_snapshot else None
+        current, _ = tracemalloc.get_traced_memory()
+        return label, current, snapshot
+
+    def end(self, token) -> None:
+        """
+        Finish tracking a block and record its allocations
+
+        :param token: Token returned by begin
+        """
+        if token is None:
+            return
+        label, start_bytes, before = token
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (start_bytes, start_bytes)
+        top_sites = []
+        if before is not None and tracemalloc.is_tracing():
+            after = tracemalloc.take_snapshot()
+            top_sites = [stat for stat in _relevant(after.compare_to(before, 'lineno'), TOP_SITES)
+                         if stat.size_diff > 0]
+
+        with self._lock:
+            self._active_blocks = max(0, self._active_blocks - 1)
+            stats = self._stats.setdefault(label, _LabelStats())
+            stats.calls += 1
+            stats.net_bytes += current - start_bytes
+            stats.max_net_bytes = max(stats.max_net_bytes, current - start_bytes)
+            stats.max_peak_bytes = max(stats.max_peak_bytes, peak - start_bytes)
+            if before is not None:
+                stats.snapshots += 1
+                for stat in top_sites:
+                    frame = stat.traceback[0]
+                    stats.sites[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+
+    @contextmanager
+    def track(self, label: str):
+        """
+        Track the allocations of a block
+
+        :param label: str: Block label
+        """
+        token = self.begin(label)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def traced(self, label: str):
+        """
+        Decorator tracking the allocations of every call of a function
+
+        :param label: str: Block label
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.track(label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self) -> dict:
+        """
+        Memory statistics per label, with the lines that allocated the most in the sampled calls
+
+        :return: dict: Tracing state and statistics keyed by label
+        """
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._lock:
+            labels = {
+                label: {
+                    'calls': stats.calls,
+                    'sampled_calls': stats.snapshots,
+                    'avg_net_bytes': stats.net_bytes / stats.calls if stats.calls else 0,
+                    'total_net_bytes': stats.net_bytes,
+                    'max_net_bytes': stats.max_net_bytes,
+                    'max_peak_bytes': stats.max_peak_bytes,
+                    'top_sites': [{'site': site, 'bytes': size} for site, size in stats.sites.most_common(TOP_SITES)]
+                }
+                for label, stats in self._stats.items()
+            }
+        return {
+            'enabled': self.enabled,
+            'snapshot_every': self.snapshot_every,
+            'baseline': self._baseline is not None,
+            'traced_current_bytes': current,
+            'traced_peak_bytes': peak,
+            'traceback_frames': tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None,
+            'labels': labels
+        }
+
+    def take_baseline(self) -> bool:
+        """
+        Take the snapshot that later reports are diffed against (e.g., at the start of a nightly batch)
+
+        :return: bool: True if the baseline was taken, False when tracing is disabled
+        """
+        if not tracemalloc.is_tracing():
+            return False
+        self._baseline = tracemalloc.take_snapshot()
+        return True
+
+    def top_allocations(self, limit: int = 20, group_by: str = 'lineno', since_baseline: bool = False) -> list[dict]:
+        """
+        Largest live allocation sites of the process, or the sites that grew the most since the baseline
+
+        Grouping walks every live trace in Python, so this blocks the worker for a few seconds on large heaps.
+
+        :param limit: int: Number of sites
+        :param group_by: str: 'lineno', 'filename' or 'traceback'
+        :param since_baseline: bool: Diff against the baseline snapshot instead of reporting the live sizes
+        :return: list[dict]: Size (or growth), count and location of the sites
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot()
+        if since_baseline and self._baseline is not None:
+            return [
+                {
+                    'bytes': stat.size,
+                    'bytes_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                    'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+                }
+                for stat in _relevant(snapshot.compare_to(self._baseline, group_by), limit)
+            ]
+        return [
+            {
+                'bytes': stat.size,
+                'count': stat.count,
+                'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+            }
+            for stat in _relevant(snapshot.statistics(group_by), limit)
+        ]
+
+
+# Shared by every request of the process
+memory_tracker = MemoryTracker()
+
+
+def register_memory_tracking(app: Flask) -> None:
+    """
+    Track the allocations of every request served by the application while the tracker is enabled
+
+    :param app: Flask: Application
+    """
+    @app.before_request
+    def start_request_memory():
+        g.memory_token = memory_tracker.begin(f"request:{request.endpoint or 'unknown'}")
+
+    @app.teardown_request
+    def finish_request_memory(exception=None):
+        memory_tracker.end(g.pop('memory_token', None))
+
+    if os.environ.get('MEMORY_TRACKING_ENABLED', '').lower() in ('1', 'true', 'yes'):
+        memory_tracker.enable()
@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from flask import Flask, request, g
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, multiprocess
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import observe_mongo_calls
+from vitals_data_retrieving.data_consumption_tools.Entities.Scheduler import observe_scheduler_waits
+import os
+import time
+
+# Under gunicorn every worker writes its samples to this directory, and a scrape aggregates all of them
+# (see gunicorn.conf.py). It must be set before prometheus_client is imported.
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Fitbit intraday requests can take several seconds, so the buckets go further than the prometheus_client default
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+endpoint_latency = Histogram(
+    'vitals_http_request_duration_seconds', 'Latency of the API endpoints',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS)
+
+fitbit_latency = Histogram(
+    'vitals_fitbit_request_duration_seconds', 'Latency of the Fitbit API requests per scope',
+    ['scope', 'status'], buckets=LATENCY_BUCKETS)
+
+mongo_latency = Histogram(
+    'vitals_mongo_operation_duration_seconds', 'Latency of the MongoDB operations',
+    ['collection', 'operation', 'status'], buckets=LATENCY_BUCKETS)
+
+token_refresh_latency = Histogram(
+    'vitals_token_refresh_duration_seconds', 'Latency of the access token refreshes',
+    ['status'], buckets=LATENCY_BUCKETS)
+
+write_behind_documents = Counter(
+    'vitals_write_behind_documents_total', 'Vitals documents handled by the write-behind buffer',
+    ['outcome'])
+
+scope_writes = Counter(
+    'vitals_scope_writes_total', 'Fetched vitals scopes written to the database or skipped by change detection',
+    ['outcome'])
+
+scheduler_wait = Histogram(
+    'vitals_scheduler_wait_seconds', 'Time the outbound calls waited for a slot of their dependency',
+    ['resource', 'priority'], buckets=LATENCY_BUCKETS)
+
+# livesum: the depth of the process is dropped when its worker exits
+write_behind_queue_depth = Gauge(
+    'vitals_write_behind_queue_depth', 'Vitals documents accepted by the write-behind buffer and not written yet',
+    multiprocess_mode='livesum')
+
+
+@contextmanager
+def observe_latency(histogram: Histogram, **labels):
+    """
+    Observe the duration of a block in a histogram
+
+    The labels may be completed inside the block by updating the yielded dict (e.g., with the resulting status).
+    If the block raises and no status was set, the exception class name is used as status.
+
+    :param histogram: Histogram: Histogram to observe
+    :param labels: Initial label values
+    :return: dict: Label values, updatable inside the block
+    """
+    start_time = time.perf_counter()
+    try:
+        yield labels
+    except Exception as e:
+        labels.setdefault('status', type(e).__name__)
+        raise
+    finally:
+        labels.setdefault('status', 'success')
+        histogram.labels(**labels).observe(time.perf_counter() - start_time)
+
+
+# The entity layer reports its MongoDB calls and scheduler waits through these hooks
+observe_mongo_calls(lambda collection_name, operation: observe_latency(
+    mongo_latency, collection=collection_name, operation=operation))
+observe_scheduler_waits(lambda resource, priority, seconds: scheduler_wait.labels(
+    resource=resource, priority=priority.name.lower()).observe(seconds))
+
+
+def register_request_metrics(app: Flask) -> None:
+    """
+    Observe the latency of every endpoint served by the application
+
+    :param app: Flask: Application
+    """
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def observe_request_latency(response):
+        start_time = g.pop('request_start_time', None)
+        if start_time is not None:
+            endpoint_latency.labels(
+                endpoint=request.endpoint or 'unknown', method=request.method, status=str(response.status_code)
+            ).observe(time.perf_counter() - start_time)
+        return response
+
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    Registry to expose on a scrape: the samples of every worker in multiprocess mode, the process registry otherwise
+
+    :return: CollectorRegistry: Registry
+    """
+    if not MULTIPROCESS_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def summarize_histogram(histogram_name: str, group_label: str, success_label: str = None) -> dict:
+    """
+    Summarize a histogram per label value from the registry (aggregated across workers in multiprocess mode)
+
+    Quantiles are interpolated linearly inside the histogram buckets, as histogram_quantile does in PromQL.
+
+    :param histogram_name: str: Histogram name, without the _bucket/_count/_sum suffix
+    :param group_label: str: Label to group by (e.g., "operation")
+    :param success_label: str: Optional label holding "True"/"False", used to compute the success rate
+    :return: dict: Count, success rate, average and p50/p95/p99 keyed by label value
+    """
+    groups = {}
+    for metric in metrics_registry().collect():
+        if metric.name != histogram_name:
+            continue
+        for sample in metric.samples:
+            group = groups.setdefault(sample.labels.get(group_label),
+                                      {'count': 0, 'successes': 0, 'sum': 0, 'buckets': {}})
+            if sample.name.endswith('_bucket'):
+                bound = float(sample.labels['le'])
+                group['buckets'][bound] = group['buckets'].get(bound, 0) + sample.value
+            elif sample.name.endswith('_count'):
+                group['count'] += sample.value
+                if success_label and sample.labels.get(success_label) == 'True':
+                    group['successes'] += sample.value
+            elif sample.name.endswith('_sum'):
+                group['sum'] += sample.value
+
+    def quantile(buckets: dict, count: float, q: float):
+        if not count:
+            return None
+        rank, previous_bound, previous_count = q * count, 0.0, 0.0
+        for bound in sorted(buckets):
+            if buckets[bound] >= rank:
+                if bound == float('inf'):
+                    return previous_bound
+                in_bucket = buckets[bound] - previous_count
+                fraction = (rank - previous_count) / in_bucket if in_bucket else 0
+                return previous_bound + (bound - previous_bound) * fraction
+            previous_bound, previous_count = bound, buckets[bound]
+        return previous_bound
+
+    return {
+        name: {
+            'count': int(group['count']),
+            'success_rate': group['successes'] / group['count'] * 100 if success_label and group['count'] else None,
+            'avg_duration': group['sum'] / group['count'] if group['count'] else 0,
+            'p50_duration': quantile(group['buckets'], group['count'], 0.50),
+            'p95_duration': quantile(group['buckets'], group['count'], 0.95),
+            'p99_duration': quantile(group['buckets'], group['count'], 0.99),
+        }
+        for name, group in groups.items()
+    }
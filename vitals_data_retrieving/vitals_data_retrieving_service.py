@@ -1,8 +1,15 @@
-from vitals_data_retrieving.data_consumption_tools.Entities.CryptoUtils import hash_data
+from vitals_data_retrieving.data_consumption_tools.Entities.UserIdentity import identity_map
+from vitals_data_retrieving.data_consumption_tools.Entities.ResponseCode import ResponseCode
+from vitals_data_retrieving.data_consumption_tools.Entities.Storage import vitals_database
+from vitals_data_retrieving.data_consumption_tools.Entities.Freshness import SCOPE_FINAL_AFTER_HOURS
+from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.DataView import DataView
 from vitals_data_retrieving.data_consumption_tools.wearable_devices_retrieving.WearableDeviceDataRetriever import \
     WearableDeviceDataRetriever
+from vitals_data_retrieving.vitals_data_retrieving_tracing import traced
 from flask import Response
 from http import HTTPStatus
+from datetime import date as Date, timedelta
+import os
 import logging
 logger = logging.getLogger(__name__)
 
@@ -17,6 +24,7 @@ class VitalsDataRetrievingService:
         """
         self.device_data_retriever = device_data_retriever
 
+    @traced('service.get_access_to_api')
     def get_access_to_api(self) -> str:
         """
         Get access to the API of the wearable device
@@ -26,6 +34,7 @@ class VitalsDataRetrievingService:
         """
         return self.device_data_retriever.connect_to_api()
 
+    @traced('service.callback_action')
     def callback_action(self, request) -> tuple[dict, HTTPStatus]:
         """
         Handle the callback from the wearable device API
@@ -56,6 +65,7 @@ class VitalsDataRetrievingService:
             logger.exception("Error guardando tokens")
             return {"error": "db error", "details": str(e)}, HTTPStatus.INTERNAL_SERVER_ERROR
 
+    @traced('service.refresh_access_token')
     def refresh_access_token(self, user_id) -> tuple[Response, HTTPStatus]:
         """
         Refresh the access token from the wearable device API in the database
@@ -63,17 +73,19 @@ class VitalsDataRetrievingService:
         :param user_id: str: User ID
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
-        document_id = hash_data(user_id)
-        return self.device_data_retriever.refresh_access_token(document_id)
+        return self.device_data_retriever.refresh_access_token(identity_map.key_for(user_id))
 
-    def update_all_tokens(self) -> tuple[Response, HTTPStatus]:
+    @traced('service.update_all_tokens')
+    def update_all_tokens(self, run_id: str = None) -> tuple[Response, HTTPStatus]:
         """
         Update all access tokens from the wearable device API in the database
 
+        :param run_id: str: Run ID, to resume an interrupted run (defaults to one per UTC hour)
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
-        return self.device_data_retriever.update_all_tokens()
+        return self.device_data_retriever.update_all_tokens(run_id)
 
+    @traced('service.get_user_info_from_api')
     def get_user_info_from_api(self, user_id) -> tuple[Response, HTTPStatus]:
         """
         Get user info from the wearable device API
@@ -83,9 +95,10 @@ class VitalsDataRetrievingService:
         """
         return self.device_data_retriever.get_user_info(user_id)
 
+    @traced('service.get_data_from_wearable_device_api')
     def get_data_from_wearable_device_api(
-            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False) \
-            -> tuple[Response, HTTPStatus]:
+            self, user_id: str = None, date: str = None, scope: list[str] = None, db_storage: bool = False,
+            view: DataView = None) -> tuple[Response, HTTPStatus]:
         """
         Get data from the wearable device API
 
@@ -93,15 +106,129 @@ class VitalsDataRetrievingService:
         :param date: str: Date in 'YYYY-MM-DD' format
         :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
         :param db_storage: bool: Flag to store data in the database
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
         :return: tuple[Response, HTTPStatus]: Data and HTTP status code
         """
-        return self.device_data_retriever.retrieve_data(user_id, date, scope, db_storage)
+        return self.device_data_retriever.retrieve_data(user_id, date, scope, db_storage, view)
 
-    def get_daily_vitals_data_from_wearable_device_api(self, date) -> tuple[Response, HTTPStatus]:
+    @traced('service.get_stored_vitals_data')
+    def get_stored_vitals_data(
+            self, user_id: str = None, date: str = None, scope: list[str] = None, view: DataView = None) \
+            -> tuple[dict, HTTPStatus]:
+        """
+        Get the vitals data of a user previously stored in the database
+
+        :param user_id: str: User ID
+        :param date: str: Date in 'YYYY-MM-DD' format
+        :param scope: list[str]: List of data scopes to read (None reads all of them)
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[dict, HTTPStatus]: Data and HTTP status code
+        """
+        response_code, data = vitals_database().read_user_day(identity_map.key_for(user_id), date, scope)
+
+        if response_code == ResponseCode.ERROR_NOT_FOUND:
+            return {'error': 'No stored data found for the given user and date'}, HTTPStatus.NOT_FOUND
+        elif response_code == ResponseCode.ERROR_UNKNOWN:
+            return {'error': 'Unknown error occurred'}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+        return (view.apply_all(data) if view else data), HTTPStatus.OK
+
+    @staticmethod
+    def _unknown_scopes(scope: list) -> dict | None:
+        """
+        Check that every element of a scope is a daily scope stored per user and day
+
+        :param scope: list: Requested scope
+        :return: dict | None: Error naming the unknown elements, None if every element is known
+        """
+        unknown = [element for element in scope
+                   if not isinstance(element, str) or element not in SCOPE_FINAL_AFTER_HOURS]
+        if unknown:
+            return {'error': f"Unknown scopes {unknown}, expected some of {list(SCOPE_FINAL_AFTER_HOURS)}"}
+        return None
+
+    @traced('service.get_vitals_data_batch')
+    def get_vitals_data_batch(
+            self, user_ids: list[str] = None, start_date: str = None, end_date: str = None, scope: list[str] = None,
+            view: DataView = None) -> tuple[Response | dict, HTTPStatus]:
+        """
+        Get vitals data of several users over a date range, served from the database and completed from the
+        wearable device API only where data is missing
+
+        :param user_ids: list[str]: User IDs
+        :param start_date: str: First date in 'YYYY-MM-DD' format
+        :param end_date: str: Last date in 'YYYY-MM-DD' format (defaults to start_date)
+        :param scope: list[str]: List of data scopes to query (e.g., "sleep", "heart_rate").
+        :param view: DataView: Resolution, metrics and time window to return (None returns the full data)
+        :return: tuple[Response | dict, HTTPStatus]: Data keyed by user ID and date, and HTTP status code
+        """
+        max_users = int(os.environ.get('BATCH_MAX_USERS', 500))
+        max_days = int(os.environ.get('BATCH_MAX_DAYS', 31))
+
+        if not user_ids or not isinstance(user_ids, list):
+            return {'error': 'user_ids must be a non-empty list'}, HTTPStatus.BAD_REQUEST
+        if not all(isinstance(user_id, str) and user_id for user_id in user_ids):
+            return {'error': 'user_ids must be non-empty strings'}, HTTPStatus.BAD_REQUEST
+        if len(user_ids) > max_users:
+            return {'error': f'At most {max_users} users can be requested at once'}, HTTPStatus.BAD_REQUEST
+        if not scope or not isinstance(scope, list):
+            return {'error': 'scope must be a non-empty list'}, HTTPStatus.BAD_REQUEST
+        if error := self._unknown_scopes(scope):
+            return error, HTTPStatus.BAD_REQUEST
+
+        try:
+            first = Date.fromisoformat(start_date)
+            last = Date.fromisoformat(end_date or start_date)
+        except (TypeError, ValueError):
+            return {'error': "start_date and end_date must be in 'YYYY-MM-DD' format"}, HTTPStatus.BAD_REQUEST
+
+        if last < first or (last - first).days >= max_days:
+            return {'error': f'The date range must be ordered and span at most {max_days} days'}, \
+                HTTPStatus.BAD_REQUEST
+
+        dates = [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+        return self.device_data_retriever.retrieve_data_batch(list(dict.fromkeys(user_ids)), dates, scope, view)
+
+    @traced('service.get_daily_vitals_data_from_wearable_device_api')
+    def get_daily_vitals_data_from_wearable_device_api(self, date, run_id: str = None) -> tuple[Response, HTTPStatus]:
         """
         Get daily vitals data from all the users stored in the database and store it in the database
 
         :param date: str: Date in 'YYYY-MM-DD' format
+        :param run_id: str: Run ID, to resume an interrupted run (defaults to one per date)
         :return: tuple[Response, HTTPStatus]: Operation status and HTTP status code
         """
-        return self.device_data_retriever.get_daily_vitals_data(date)
+        return self.device_data_retriever.get_daily_vitals_data(date, run_id)
+
+    @traced('service.repair_vitals_data')
+    def repair_vitals_data(
+            self, start_date: str = None, end_date: str = None, scope: list[str] = None) \
+            -> tuple[Response | dict, HTTPStatus]:
+        """
+        Fetch again the stored vitals whose last fetch failed or returned data that was not final yet
+
+        :param start_date: str: First date in 'YYYY-MM-DD' format (defaults to REPAIR_LOOKBACK_DAYS days ago)
+        :param end_date: str: Last date in 'YYYY-MM-DD' format (defaults to today)
+        :param scope: list[str]: List of data scopes to check (None checks all the daily scopes)
+        :return: tuple[Response | dict, HTTPStatus]: Repair summary and HTTP status code
+        """
+        lookback_days = int(os.environ.get('REPAIR_LOOKBACK_DAYS', 3))
+        max_days = int(os.environ.get('BATCH_MAX_DAYS', 31))
+
+        if scope is not None and (not scope or not isinstance(scope, list)):
+            return {'error': 'scope must be a non-empty list'}, HTTPStatus.BAD_REQUEST
+        if scope is not None and (error := self._unknown_scopes(scope)):
+            return error, HTTPStatus.BAD_REQUEST
+
+        try:
+            last = Date.fromisoformat(end_date) if end_date else Date.today()
+            first = Date.fromisoformat(start_date) if start_date else last - timedelta(days=lookback_days)
+        except (TypeError, ValueError):
+            return {'error': "start_date and end_date must be in 'YYYY-MM-DD' format"}, HTTPStatus.BAD_REQUEST
+
+        if last < first or (last - first).days >= max_days:
+            return {'error': f'The date range must be ordered and span at most {max_days} days'}, \
+                HTTPStatus.BAD_REQUEST
+
+        dates = [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+        return self.device_data_retriever.repair_vitals_data(dates, scope or list(SCOPE_FINAL_AFTER_HOURS))
@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from functools import wraps
+from flask import Flask, request, g
+from opencensus.common.transports.async_ import AsyncTransport
+from opencensus.trace import base_exporter, execution_context
+from opencensus.trace.samplers import ProbabilitySampler
+from opencensus.trace.span import SpanKind
+from opencensus.trace.status import Status
+from opencensus.trace.propagation.trace_context_http_header_format import TraceContextPropagator
+from opencensus.trace.tracer import Tracer
+from vitals_data_retrieving.data_consumption_tools.Entities.Resilience import observe_mongo_calls
+import inspect
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where finished spans are sent: "file" (JSON lines in TRACING_FILE), "zipkin" (local collector, needs
+# opencensus-ext-zipkin), "azure" (Application Insights) or empty to disable tracing
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', '').lower()
+TRACING_FILE = os.environ.get('TRACING_FILE', 'traces.jsonl')
+TRACING_SAMPLING_RATE = float(os.environ.get('TRACING_SAMPLING_RATE', 1.0))
+
+_propagator = TraceContextPropagator()
+_exporter = None
+
+
+class JsonLinesExporter(base_exporter.Exporter):
+    def __init__(self, file_name: str):
+        """
+        Initialize an exporter appending one JSON line per finished span to a file
+
+        opencensus' FileExporter rewrites the whole file on every export, so it only keeps the last span. Spans are
+        written from a background thread (AsyncTransport), off the request path.
+
+        :param file_name: str: Output file
+        """
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self.transport = AsyncTransport(self)
+
+    def emit(self, span_datas) -> None:
+        """
+        Write a batch of finished spans
+
+        :param span_datas: list[SpanData]: Finished spans
+        """
+        lines = []
+        for span_data in span_datas:
+            lines.append(json.dumps({
+                'trace_id': span_data.context.trace_id if span_data.context else None,
+                'span_id': span_data.span_id,
+                'parent_span_id': span_data.parent_span_id,
+                'name': span_data.name,
+                'start_time': span_data.start_time,
+                'end_time': span_data.end_time,
+                'attributes': dict(span_data.attributes or {}),
+                'status': span_data.status.format_status_json() if span_data.status else None,
+            }, default=str))
+        with self._lock, open(self.file_name, 'a') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def export(self, span_datas) -> None:
+        """
+        Queue finished spans for the background writer
+
+        :param span_datas: list[SpanData]: Finished spans
+        """
+        self.transport.export(span_datas)
+
+
+def _create_exporter():
+    """
+    Create the exporter selected by TRACING_EXPORTER
+
+    :return: Exporter, None when tracing is disabled or the exporter cannot be created
+    """
+    if TRACING_EXPORTER == 'file':
+        return JsonLinesExporter(TRACING_FILE)
+    if TRACING_EXPORTER == 'zipkin':
+        try:
+            from opencensus.ext.zipkin.trace_exporter import ZipkinExporter
+        except ImportError:
+            logger.error("TRACING_EXPORTER=zipkin requires the opencensus-ext-zipkin package, tracing disabled")
+            return None
+        return ZipkinExporter(service_name=os.environ.get('TRACING_SERVICE_NAME', 'vitals-data-consumption'),
+                              host_name=os.environ.get('ZIPKIN_HOST', 'localhost'),
+                              port=int(os.environ.get('ZIPKIN_PORT', 9411)), transport=AsyncTransport)
+    if TRACING_EXPORTER == 'azure':
+        if not os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING'):
+            logger.error("TRACING_EXPORTER=azure requires APPLICATIONINSIGHTS_CONNECTION_STRING, tracing disabled")
+            return None
+        from opencensus.ext.azure.trace_exporter import AzureExporter
+        return AzureExporter(connection_string=os.environ['APPLICATIONINSIGHTS_CONNECTION_STRING'])
+    if TRACING_EXPORTER:
+        logger.error(f"Unknown TRACING_EXPORTER {TRACING_EXPORTER!r}, tracing disabled")
+    return None
+
+
+def tracing_enabled() -> bool:
+    """
+    Check whether spans are being exported
+
+    :return: bool: True when an exporter is configured
+    """
+    return _exporter is not None
+
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """
+    Record a block as a child span of the current span
+
+    Outside a traced request (or in an unsampled one) the block runs untraced. The current span lives in a context
+    variable, so blocks run in worker threads through contextvars.copy_context().run become children of the span
+    that submitted them.
+
+    :param name: str: Span name (e.g., "mongo.find_one")
+    :param attributes: Span attributes
+    :return: Span | None: Span, whose attributes may be completed inside the block
+    """
+    tracer = execution_context.get_opencensus_tracer() if _exporter is not None else None
+    if tracer is None or execution_context.get_current_span() is None:
+        yield None
+        return
+    # Span.__exit__ records the exception raised by the block, if any, as the span status
+    with tracer.span(name) as span:
+        span.add_attribute('thread', threading.current_thread().name)
+        for key, value in attributes.items():
+            span.add_attribute(key, value)
+        yield span
+
+
+# Every MongoDB call is a child span of the request that made it
+observe_mongo_calls(lambda collection_name, operation: trace_span(f"mongo.{operation}", collection=collection_name))
+
+
+def traced(name: str):
+    """
+    Decorator recording every call of a function as a span. Calls of coroutine functions are recorded until the
+    coroutine finishes
+
+    :param name: str: Span name
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if _exporter is None:
+                    return await function(*args, **kwargs)
+                with trace_span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return function(*args, **kwargs)
+            with trace_span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_tracing(app: Flask) -> None:
+    """
+    Record every request served by the application as the root span of a trace (or as a child of the caller span
+    given in the W3C traceparent header), when TRACING_EXPORTER is set
+
+    :param app: Flask: Application
+    """
+    global _exporter
+    _exporter = _create_exporter()
+    if _exporter is None:
+        return
+
+    @app.before_request
+    def start_request_span():
+        headers = {key.lower(): value for key, value in request.headers.items()}
+        tracer = Tracer(span_context=_propagator.from_headers(headers),
+                        sampler=ProbabilitySampler(TRACING_SAMPLING_RATE), exporter=_exporter)
+        span = tracer.start_span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        span.span_kind = SpanKind.SERVER
+        span.add_attribute('http.method', request.method)
+        span.add_attribute('http.route', request.endpoint or 'unknown')
+        span.add_attribute('http.url', request.url)
+        span.add_attribute('thread', threading.current_thread().name)
+        g.request_tracer = tracer
+
+    @app.after_request
+    def record_response_status(response):
+        span = execution_context.get_current_span()
+        if g.get('request_tracer') is not None and span is not None:
+            span.add_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.set_status(Status(2, f"HTTP {response.status_code}"))
+        return response
+
+    @app.teardown_request
+    def finish_request_span(exception=None):
+        tracer = g.pop('request_tracer', None)
+        if tracer is not None:
+            tracer.finish()
+            execution_context.clean()